@@ -0,0 +1,27 @@
+"""add report jobs claim index
+
+Revision ID: 0036_add_report_jobs_claim_index
+Revises: 0035_add_user_touch_events
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+
+
+revision = "0036_add_report_jobs_claim_index"
+down_revision = "0035_add_user_touch_events"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_report_jobs_status_created_at",
+        "report_jobs",
+        ["status", "created_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_report_jobs_status_created_at", table_name="report_jobs")
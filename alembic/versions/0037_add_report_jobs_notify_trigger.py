@@ -0,0 +1,46 @@
+"""add report jobs notify trigger
+
+Revision ID: 0037_add_report_jobs_notify_trigger
+Revises: 0036_add_report_jobs_claim_index
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+
+
+revision = "0037_add_report_jobs_notify_trigger"
+down_revision = "0036_add_report_jobs_claim_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION notify_report_job_pending() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('report_jobs_pending', NEW.id::text);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute("DROP TRIGGER IF EXISTS report_jobs_notify_pending ON report_jobs")
+    op.execute(
+        """
+        CREATE TRIGGER report_jobs_notify_pending
+        AFTER INSERT OR UPDATE OF status ON report_jobs
+        FOR EACH ROW
+        WHEN (NEW.status = 'pending')
+        EXECUTE PROCEDURE notify_report_job_pending()
+        """
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("DROP TRIGGER IF EXISTS report_jobs_notify_pending ON report_jobs")
+    op.execute("DROP FUNCTION IF EXISTS notify_report_job_pending()")
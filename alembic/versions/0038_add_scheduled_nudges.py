@@ -0,0 +1,156 @@
+"""add scheduled nudges
+
+Revision ID: 0038_add_scheduled_nudges
+Revises: 0037_add_report_jobs_notify_trigger
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from datetime import datetime, timedelta, timezone
+import json
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0038_add_scheduled_nudges"
+down_revision = "0037_add_report_jobs_notify_trigger"
+branch_labels = None
+depends_on = None
+
+
+scheduled_nudge_kind_enum = postgresql.ENUM(
+    "resume_nudge",
+    "checkout_value_nudge",
+    name="schedulednudgekind",
+    create_type=False,
+)
+scheduled_nudge_status_enum = postgresql.ENUM(
+    "pending",
+    "sent",
+    "canceled",
+    name="schedulednudgestatus",
+    create_type=False,
+)
+
+_CHECKOUT_VALUE_NUDGE_SCREENS = {"S2", "S4"}
+_BACKFILL_CHUNK_SIZE = 1000
+
+
+def _parse_dt(value):
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def _build_backfill_rows(telegram_user_id, screen_id, data, now):
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            return []
+    if not isinstance(data, dict):
+        return []
+    rows = []
+    critical_at = _parse_dt(data.get("last_critical_step_at"))
+    if critical_at and not data.get("resume_nudge_sent_at"):
+        # Порог задержки проверяет воркер: при раннем сроке он сам перенесёт напоминание.
+        rows.append(
+            {
+                "telegram_user_id": telegram_user_id,
+                "kind": "resume_nudge",
+                "status": "pending",
+                "due_at": critical_at,
+                "target_screen_id": data.get("last_critical_screen_id"),
+                "delay_minutes": None,
+                "attempts": 0,
+                "created_at": now,
+                "updated_at": now,
+            }
+        )
+    if not data.get("checkout_value_nudge_sent_at"):
+        due_at = _parse_dt(data.get("checkout_value_nudge_due_at"))
+        target_screen_id = data.get("checkout_value_nudge_target_screen_id")
+        delay_minutes = data.get("checkout_value_nudge_delay_minutes")
+        if due_at is None and screen_id in _CHECKOUT_VALUE_NUDGE_SCREENS:
+            due_at = now + timedelta(minutes=10)
+            target_screen_id = screen_id
+            delay_minutes = 10
+        if due_at is not None:
+            rows.append(
+                {
+                    "telegram_user_id": telegram_user_id,
+                    "kind": "checkout_value_nudge",
+                    "status": "pending",
+                    "due_at": due_at,
+                    "target_screen_id": target_screen_id,
+                    "delay_minutes": delay_minutes if isinstance(delay_minutes, int) else None,
+                    "attempts": 0,
+                    "created_at": now,
+                    "updated_at": now,
+                }
+            )
+    return rows
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    scheduled_nudge_kind_enum.create(bind, checkfirst=True)
+    scheduled_nudge_status_enum.create(bind, checkfirst=True)
+    scheduled_nudges = op.create_table(
+        "scheduled_nudges",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("telegram_user_id", sa.BigInteger(), nullable=False),
+        sa.Column("kind", scheduled_nudge_kind_enum, nullable=False),
+        sa.Column("status", scheduled_nudge_status_enum, nullable=False),
+        sa.Column("due_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("target_screen_id", sa.String(length=32), nullable=True),
+        sa.Column("delay_minutes", sa.Integer(), nullable=True),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("sent_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("telegram_user_id", "kind", name="uq_scheduled_nudges_user_kind"),
+    )
+    op.create_index(
+        "ix_scheduled_nudges_telegram_user_id",
+        "scheduled_nudges",
+        ["telegram_user_id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_scheduled_nudges_due_at_status",
+        "scheduled_nudges",
+        ["due_at", "status"],
+        unique=False,
+    )
+
+    # Переносим ещё не отправленные напоминания из screen_states, чтобы они не потерялись при деплое.
+    now = datetime.now(timezone.utc)
+    result = bind.execution_options(stream_results=True).execute(
+        sa.text("SELECT telegram_user_id, screen_id, data FROM screen_states")
+    )
+    chunk = []
+    for telegram_user_id, screen_id, data in result:
+        chunk.extend(_build_backfill_rows(telegram_user_id, screen_id, data, now))
+        if len(chunk) >= _BACKFILL_CHUNK_SIZE:
+            op.bulk_insert(scheduled_nudges, chunk)
+            chunk = []
+    if chunk:
+        op.bulk_insert(scheduled_nudges, chunk)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_scheduled_nudges_due_at_status", table_name="scheduled_nudges")
+    op.drop_index("ix_scheduled_nudges_telegram_user_id", table_name="scheduled_nudges")
+    op.drop_table("scheduled_nudges")
+    scheduled_nudge_status_enum.drop(op.get_bind(), checkfirst=True)
+    scheduled_nudge_kind_enum.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,59 @@
+"""add report jobs priority
+
+Revision ID: 0039_add_report_jobs_priority
+Revises: 0038_add_scheduled_nudges
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0039_add_report_jobs_priority"
+down_revision = "0038_add_scheduled_nudges"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "report_jobs",
+        sa.Column("priority", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.add_column(
+        "report_jobs",
+        sa.Column("effective_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.execute(
+        """
+        UPDATE report_jobs
+        SET priority = CASE tariff
+            WHEN 'T1' THEN 1
+            WHEN 'T2' THEN 2
+            WHEN 'T3' THEN 3
+            ELSE 0
+        END
+        """
+    )
+    # Для уже созданных заданий порядок не меняем: бонус приоритета получают только новые.
+    op.execute("UPDATE report_jobs SET effective_at = created_at")
+    op.alter_column("report_jobs", "effective_at", nullable=False)
+    op.drop_index("ix_report_jobs_status_created_at", table_name="report_jobs")
+    op.create_index(
+        "ix_report_jobs_status_effective_at",
+        "report_jobs",
+        ["status", "effective_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_report_jobs_status_effective_at", table_name="report_jobs")
+    op.create_index(
+        "ix_report_jobs_status_created_at",
+        "report_jobs",
+        ["status", "created_at"],
+        unique=False,
+    )
+    op.drop_column("report_jobs", "effective_at")
+    op.drop_column("report_jobs", "priority")
@@ -0,0 +1,49 @@
+"""add report job stages
+
+Revision ID: 0040_add_report_job_stages
+Revises: 0039_add_report_jobs_priority
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0040_add_report_job_stages"
+down_revision = "0039_add_report_jobs_priority"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "report_job_stages",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("job_id", sa.Integer(), nullable=False),
+        sa.Column("stage", sa.String(length=32), nullable=False),
+        sa.Column("attempt", sa.Integer(), nullable=True),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("duration_ms", sa.Integer(), nullable=False),
+        sa.Column("metadata_json", sa.JSON(), nullable=True),
+        sa.ForeignKeyConstraint(["job_id"], ["report_jobs.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_report_job_stages_job_id",
+        "report_job_stages",
+        ["job_id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_report_job_stages_stage_finished_at",
+        "report_job_stages",
+        ["stage", "finished_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_report_job_stages_stage_finished_at", table_name="report_job_stages")
+    op.drop_index("ix_report_job_stages_job_id", table_name="report_job_stages")
+    op.drop_table("report_job_stages")
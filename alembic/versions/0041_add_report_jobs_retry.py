@@ -0,0 +1,30 @@
+"""add report jobs retry
+
+Revision ID: 0041_add_report_jobs_retry
+Revises: 0040_add_report_job_stages
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0041_add_report_jobs_retry"
+down_revision = "0040_add_report_job_stages"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("ALTER TYPE reportjobstatus ADD VALUE IF NOT EXISTS 'dead_letter'")
+    op.add_column(
+        "report_jobs",
+        sa.Column("next_attempt_at", sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    # Значение enum в PostgreSQL удалить нельзя: dead-letter задания возвращаем в failed.
+    op.execute("UPDATE report_jobs SET status = 'failed' WHERE status = 'dead_letter'")
+    op.drop_column("report_jobs", "next_attempt_at")
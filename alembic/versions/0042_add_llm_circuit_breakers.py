@@ -0,0 +1,42 @@
+"""add llm circuit breakers
+
+Revision ID: 0042_add_llm_circuit_breakers
+Revises: 0041_add_report_jobs_retry
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0042_add_llm_circuit_breakers"
+down_revision = "0041_add_report_jobs_retry"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "llm_circuit_breakers",
+        sa.Column("name", sa.String(length=128), nullable=False),
+        sa.Column("scope", sa.String(length=16), nullable=False),
+        sa.Column("state", sa.String(length=16), nullable=False, server_default="closed"),
+        sa.Column("opened_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("open_until", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("probe_until", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("trips", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+    op.create_index(
+        "ix_llm_circuit_breakers_scope",
+        "llm_circuit_breakers",
+        ["scope"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_llm_circuit_breakers_scope", table_name="llm_circuit_breakers")
+    op.drop_table("llm_circuit_breakers")
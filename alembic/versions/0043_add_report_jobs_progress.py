@@ -0,0 +1,26 @@
+"""add report jobs progress
+
+Revision ID: 0043_add_report_jobs_progress
+Revises: 0042_add_llm_circuit_breakers
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0043_add_report_jobs_progress"
+down_revision = "0042_add_llm_circuit_breakers"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "report_jobs",
+        sa.Column("progress_sections", sa.Integer(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("report_jobs", "progress_sections")
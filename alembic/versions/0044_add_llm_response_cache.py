@@ -0,0 +1,38 @@
+"""add llm response cache
+
+Revision ID: 0044_add_llm_response_cache
+Revises: 0043_add_report_jobs_progress
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0044_add_llm_response_cache"
+down_revision = "0043_add_report_jobs_progress"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "llm_response_cache",
+        sa.Column("cache_key", sa.String(length=64), nullable=False),
+        sa.Column("provider", sa.String(length=32), nullable=False),
+        sa.Column("model", sa.String(length=128), nullable=False),
+        sa.Column("text", sa.Text(), nullable=False),
+        sa.Column("hits", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("used_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("cache_key"),
+    )
+    op.create_index("ix_llm_response_cache_used_at", "llm_response_cache", ["used_at"], unique=False)
+    op.create_index("ix_llm_response_cache_expires_at", "llm_response_cache", ["expires_at"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_llm_response_cache_expires_at", table_name="llm_response_cache")
+    op.drop_index("ix_llm_response_cache_used_at", table_name="llm_response_cache")
+    op.drop_table("llm_response_cache")
@@ -0,0 +1,26 @@
+"""add reports prompt version
+
+Revision ID: 0045_add_reports_prompt_version
+Revises: 0044_add_llm_response_cache
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0045_add_reports_prompt_version"
+down_revision = "0044_add_llm_response_cache"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "reports",
+        sa.Column("prompt_version", sa.String(length=64), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("reports", "prompt_version")
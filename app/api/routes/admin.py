@@ -11,11 +11,15 @@ from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, Reques
 from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 from aiogram import Bot
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
-from sqlalchemy import and_, case, func, or_, select, true
+from sqlalchemy import and_, case, event, func, or_, select, true
 from sqlalchemy.exc import OperationalError, TimeoutError as SQLAlchemyTimeoutError
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
+from app.core.llm_key_store import invalidate_llm_key_cache
+from app.core.llm_response_cache import collect_llm_response_cache_metrics
+from app.core.prompt_settings import invalidate_tariff_prompt_cache
+from app.core.report_job_stages import collect_report_job_stage_percentiles
 from app.services.admin_analytics import (
     AnalyticsFilters,
     FinanceAnalyticsFilters,
@@ -30,6 +34,12 @@ from app.services.admin_analytics import (
 from app.services.admin_ids import exclude_admin_telegram_user_ids
 from app.services.admin_ids import parse_admin_ids
 from app.services.order_fulfillment import ensure_report_job_for_paid_order
+from app.services.report_job_queue import (
+    collect_report_job_queue_breakdown,
+    collect_report_job_retry_metrics,
+    redrive_report_jobs,
+)
+from app.services.service_heartbeats import collect_service_heartbeat_instances
 from app.services.smoke_detection import collect_explicit_smoke_order_ids, collect_smoke_order_ids, collect_smoke_user_ids
 from pydantic import BaseModel, Field
 from app.db.models import (
@@ -124,6 +134,11 @@ def _collect_worker_metrics(session: Session) -> dict[str, object]:
         heartbeat_age_seconds = max(int((datetime.now(timezone.utc) - heartbeat_updated_at).total_seconds()), 0)
         metrics["heartbeat_age_seconds"] = heartbeat_age_seconds
         metrics["online"] = heartbeat_updated_at >= stale_after
+    metrics["instances"] = collect_service_heartbeat_instances(
+        session,
+        _WORKER_SERVICE_NAME,
+        stale_after=stale_after,
+    )
 
     rows = session.execute(
         select(ReportJob.status, func.count(ReportJob.id))
@@ -142,6 +157,17 @@ def _collect_worker_metrics(session: Session) -> dict[str, object]:
         for status, count in rows:
             jobs[status.value] = count
 
+    metrics["queue"] = {
+        "by_tariff": collect_report_job_queue_breakdown(session),
+        "priority_step_seconds": settings.report_job_priority_step_seconds,
+        "user_fairness_enabled": settings.report_job_user_fairness_enabled,
+    }
+    metrics["stages"] = collect_report_job_stage_percentiles(session)
+    metrics["retry"] = {
+        **collect_report_job_retry_metrics(session),
+        "max_attempts": settings.report_job_max_attempts,
+    }
+    metrics["llm_response_cache"] = collect_llm_response_cache_metrics(session)
     return metrics
 
 
@@ -1405,6 +1431,26 @@ def admin_ui(request: Request) -> HTMLResponse:
         const heartbeatAgeText = heartbeatAge === null || heartbeatAge === undefined
           ? "нет данных"
           : `${heartbeatAge} сек`;
+        const workerInstances = workerMetrics.instances || [];
+        const workerInstancesText = workerInstances.length
+          ? workerInstances.map((instance) => `${instance.host}:${instance.pid} ${instance.online ? "online" : "offline"}`).join(", ")
+          : "нет данных";
+        const queueByTariff = (workerMetrics.queue || {}).by_tariff || {};
+        const queueRows = Object.keys(queueByTariff).sort().map((tariff) => {
+          const bucket = queueByTariff[tariff] || {};
+          const oldestAge = bucket.oldest_pending_age_seconds;
+          const oldestText = oldestAge === null || oldestAge === undefined ? "—" : `${oldestAge} сек`;
+          return `<div><strong>${tariff}:</strong> pending ${bucket.pending ?? 0} (пользователей ${bucket.pending_users ?? 0}), in_progress ${bucket.in_progress ?? 0}, старейшее ожидание ${oldestText}</div>`;
+        }).join("");
+        const stageMetrics = workerMetrics.stages || {};
+        const stageRows = Object.entries(stageMetrics).map(([stage, bucket]) => {
+          return `<div><strong>${stage}:</strong> p50 ${bucket.p50_ms ?? "—"} мс, p95 ${bucket.p95_ms ?? "—"} мс (n=${bucket.count ?? 0})</div>`;
+        }).join("");
+        const retryMetrics = workerMetrics.retry || {};
+        const deadLetterCount = Number(retryMetrics.dead_letter || 0);
+        const deadLetterAction = deadLetterCount > 0
+          ? `<button class="secondary" onclick="redriveDeadLetterJobs()">Перезапустить dead-letter</button>`
+          : "";
         const offlineWarning = !workerOnline && totalPaidOrders > 0
           ? `<div class="overview-warning-banner">⚠️ Оплаты есть, генерация может быть недоступна</div>`
           : "";
@@ -1418,9 +1464,17 @@ def admin_ui(request: Request) -> HTMLResponse:
               <div><span class="status ${workerStatusClass}">Worker: ${workerStatusText}</span></div>
               <div><strong>Heartbeat age:</strong> ${heartbeatAgeText}</div>
               <div><strong>Последний heartbeat:</strong> ${workerLastSeen}</div>
+              <div><strong>Процессы:</strong> ${workerInstancesText}</div>
               <div><strong>Jobs pending:</strong> ${workerJobs.pending ?? 0}</div>
               <div><strong>Jobs in_progress:</strong> ${workerJobs.in_progress ?? 0}</div>
             </div>
+            ${queueRows ? `<div class="worker-widget-grid">${queueRows}</div>` : ""}
+            <div class="worker-widget-grid">
+              <div><strong>Ждут повтора:</strong> ${retryMetrics.scheduled_retries ?? 0}</div>
+              <div><strong>Dead-letter:</strong> ${deadLetterCount} (после ${retryMetrics.max_attempts ?? "—"} попыток)</div>
+              <div>${deadLetterAction}</div>
+            </div>
+            ${stageRows ? `<div><strong>Этапы заданий за 24 часа</strong></div><div class="worker-widget-grid">${stageRows}</div>` : ""}
           </div>
           <div class="overview-grid">
             ${cards.map((card) => `
@@ -2456,6 +2510,23 @@ def admin_ui(request: Request) -> HTMLResponse:
       }
     }
 
+    async function redriveDeadLetterJobs() {
+      const confirmed = confirm("Вернуть в очередь все задания из dead-letter?");
+      if (!confirmed) {
+        return;
+      }
+      try {
+        const result = await fetchJson("/report-jobs/redrive", {
+          method: "POST",
+          body: JSON.stringify({})
+        });
+        alert(`Перезапущено заданий: ${result.redriven ?? 0}`);
+        await loadOverview();
+      } catch (error) {
+        alert(error.message);
+      }
+    }
+
     function buildReportsQuery() {
       const params = new URLSearchParams();
       const state = tableStates.reports || {};
@@ -4625,6 +4696,11 @@ def _coerce_bool(value: object) -> bool:
     return bool(value)
 
 
+def _invalidate_llm_keys_on_commit(session: Session) -> None:
+    # Кэш ключей сбрасываем после commit, иначе параллельный запрос успеет закэшировать старые данные.
+    event.listen(session, "after_commit", lambda _session: invalidate_llm_key_cache(), once=True)
+
+
 @router.get("/api/llm-keys")
 def admin_llm_keys(limit: int | None = 0, session: Session = Depends(_get_db_session)) -> dict:
     query = select(LLMApiKey).order_by(
@@ -4686,6 +4762,7 @@ async def admin_create_llm_key(
     )
     session.add(record)
     session.flush()
+    _invalidate_llm_keys_on_commit(session)
     return {
         "id": record.id,
         "created_at": record.created_at.isoformat(),
@@ -4721,6 +4798,8 @@ async def admin_bulk_llm_keys(
         session.add(record)
         created += 1
     session.flush()
+    if created:
+        _invalidate_llm_keys_on_commit(session)
     return {"created": created, "lines": len(lines)}
 
 
@@ -4750,6 +4829,7 @@ async def admin_bulk_update_llm_keys(
         for record in records:
             record.priority = None if value is None else str(value)
     session.flush()
+    _invalidate_llm_keys_on_commit(session)
     return {"updated": len(records)}
 
 
@@ -4768,6 +4848,7 @@ async def admin_bulk_delete_llm_keys(
     deleted = len(records)
     for record in records:
         session.delete(record)
+    _invalidate_llm_keys_on_commit(session)
     return {"deleted": deleted}
 
 
@@ -4803,6 +4884,7 @@ async def admin_update_llm_key(
             record.disabled_at = datetime.now(timezone.utc)
         record.is_active = next_state
     session.flush()
+    _invalidate_llm_keys_on_commit(session)
     return {"id": record.id, "updated_at": record.updated_at.isoformat()}
 
 
@@ -4814,6 +4896,7 @@ def admin_delete_llm_key(
     if not record:
         raise HTTPException(status_code=404, detail="LLM key not found")
     session.delete(record)
+    _invalidate_llm_keys_on_commit(session)
     return {"deleted": True}
 
 
@@ -5079,6 +5162,21 @@ async def admin_orders_bulk_delete(
     return {"deleted": deleted}
 
 
+@router.post("/api/report-jobs/redrive")
+async def admin_report_jobs_redrive(
+    request: Request,
+    session: Session = Depends(_get_db_session),
+) -> dict:
+    try:
+        payload = _parse_json_payload(await request.json())
+    except Exception:
+        payload = {}
+    # Без ids перезапускаются все задания из dead-letter; с ids — выбранные failed/dead-letter.
+    job_ids = _parse_ids(payload) if "ids" in payload else None
+    redriven = redrive_report_jobs(session, job_ids=job_ids)
+    return {"redriven": len(redriven), "job_ids": redriven}
+
+
 @router.get("/api/reports")
 def admin_reports(
     limit: int = 50,
@@ -5620,6 +5718,11 @@ async def admin_feedback_bulk_archive(
         updated += 1
     return {"updated": updated}
 
+def _invalidate_prompts_on_commit(session: Session) -> None:
+    # Как и с ключами LLM: кэш промптов сбрасываем только после commit.
+    event.listen(session, "after_commit", lambda _session: invalidate_tariff_prompt_cache(), once=True)
+
+
 @router.get("/api/system-prompts")
 def admin_system_prompts(
     limit: int = 200, session: Session = Depends(_get_db_session)
@@ -5661,6 +5764,7 @@ async def admin_create_system_prompt(
     )
     session.add(prompt)
     session.flush()
+    _invalidate_prompts_on_commit(session)
     return {
         "id": prompt.id,
         "created_at": prompt.created_at.isoformat(),
@@ -5690,6 +5794,7 @@ async def admin_update_system_prompt(
         value = payload.get("content")
         prompt.content = "" if value is None else (value if isinstance(value, str) else str(value))
     session.flush()
+    _invalidate_prompts_on_commit(session)
     return {
         "id": prompt.id,
         "updated_at": prompt.updated_at.isoformat(),
@@ -5704,6 +5809,7 @@ def admin_delete_system_prompt(
     if not prompt:
         raise HTTPException(status_code=404, detail="Prompt not found")
     session.delete(prompt)
+    _invalidate_prompts_on_commit(session)
     return {"deleted": True}
 
 
@@ -5722,6 +5828,8 @@ async def admin_bulk_delete_system_prompts(
     deleted = len(prompts)
     for prompt in prompts:
         session.delete(prompt)
+    if prompts:
+        _invalidate_prompts_on_commit(session)
     return {"deleted": deleted}
 
 
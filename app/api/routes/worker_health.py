@@ -26,6 +26,7 @@ async def report_worker_health() -> dict[str, object]:
             ReportJobStatus.PENDING.value: 0,
             ReportJobStatus.IN_PROGRESS.value: 0,
             ReportJobStatus.FAILED.value: 0,
+            ReportJobStatus.DEAD_LETTER.value: 0,
         },
     }
 
@@ -48,6 +49,7 @@ async def report_worker_health() -> dict[str, object]:
                             ReportJobStatus.PENDING,
                             ReportJobStatus.IN_PROGRESS,
                             ReportJobStatus.FAILED,
+                            ReportJobStatus.DEAD_LETTER,
                         ]
                     )
                 )
@@ -20,6 +20,7 @@ from app.db.models import (
     ScreenTransitionTriggerType,
 )
 from app.db.session import get_session
+from app.services.scheduled_nudges import schedule_state_nudges
 
 
 @dataclass
@@ -34,6 +35,7 @@ class ScreenState:
 class ScreenStateStore:
     def __init__(self) -> None:
         self._states: dict[int, ScreenState] = {}
+        self._logger = logging.getLogger(__name__)
 
     def get_state(self, user_id: int) -> ScreenState:
         if user_id not in self._states:
@@ -153,6 +155,10 @@ class ScreenStateStore:
     def _persist_state(self, user_id: int, state: ScreenState) -> None:
         with get_session() as session:
             record = session.get(ScreenStateRecord, user_id)
+            previous_screen_id = record.screen_id if record else None
+            previous_data = (
+                dict(record.data) if record and isinstance(record.data, dict) else {}
+            )
             if record:
                 record.screen_id = state.screen_id
                 record.message_ids = state.message_ids
@@ -169,6 +175,22 @@ class ScreenStateStore:
                     data=state.data,
                 )
                 session.add(record)
+            try:
+                # Ошибка планирования откатывает только savepoint: состояние экрана сохраняется.
+                with session.begin_nested():
+                    schedule_state_nudges(
+                        session,
+                        telegram_user_id=user_id,
+                        screen_id=state.screen_id,
+                        state_data=state.data,
+                        previous_screen_id=previous_screen_id,
+                        previous_data=previous_data,
+                    )
+            except Exception as exc:
+                self._logger.warning(
+                    "nudge_schedule_failed",
+                    extra={"user_id": user_id, "error": str(exc)},
+                )
             session.flush()
 
 
@@ -38,11 +38,13 @@ from app.bot.screen_images import (
     S4_SCENARIO_STATE_KEY,
 )
 from app.core.config import settings
+from app.core.report_job_progress import report_progress_fraction
 from app.core.report_text_pipeline import build_canonical_report_text
 from app.core.timezone import APP_TIMEZONE, as_app_timezone, format_app_datetime, now_app_timezone
 from app.core.pdf_service import pdf_service
 from app.core.report_document import report_document_builder
 from app.db.models import (
+    REPORT_JOB_FAILED_STATUSES,
     FreeLimit,
     Order,
     OrderFulfillmentStatus,
@@ -377,14 +379,21 @@ async def _run_report_delay(bot: Bot, chat_id: int, user_id: int) -> None:
         with get_session() as session:
             job = _refresh_report_job_state(session, user_id)
             job_status = job.status if job else None
-        if job_status in {ReportJobStatus.COMPLETED, ReportJobStatus.FAILED}:
+            sections_done = job.progress_sections if job else None
+            job_tariff = job.tariff.value if job and job.tariff else None
+        if job_status == ReportJobStatus.COMPLETED or job_status in REPORT_JOB_FAILED_STATUSES:
             return
         frame = frames[tick % len(frames)]
-        raw_progress = ((tick % cycle_seconds) + 1) / cycle_seconds
-        progress = min(max(raw_progress, 0.05), 0.95)
+        if sections_done is not None:
+            # Воркер стримит ответ LLM и пишет в задание число готовых разделов.
+            progress = report_progress_fraction(sections_done, job_tariff)
+        else:
+            raw_progress = ((tick % cycle_seconds) + 1) / cycle_seconds
+            progress = min(max(raw_progress, 0.05), 0.95)
         text = build_report_wait_message(
             frame=frame,
             progress=progress,
+            sections_done=sections_done,
         )
         content = screen_manager.render_screen("S6", user_id, state.data)
         try:
@@ -684,7 +693,7 @@ async def _maybe_run_report_delay(callback: CallbackQuery) -> None:
     if running_task and not running_task.done():
         return
     state_snapshot = screen_manager.update_state(user_id)
-    if state_snapshot.data.get("report_job_status") == ReportJobStatus.FAILED.value:
+    if state_snapshot.data.get("report_job_status") in REPORT_JOB_FAILED_STATUSES:
         return
 
     async def _runner() -> None:
@@ -1242,6 +1251,7 @@ def _requeue_report_job(
 ) -> ReportJob:
     job.status = ReportJobStatus.PENDING
     job.last_error = None
+    job.next_attempt_at = None
     job.lock_token = None
     job.locked_at = None
     session.add(job)
@@ -2655,7 +2665,7 @@ async def handle_callbacks(callback: CallbackQuery, state: FSMContext) -> None:
                 await _ensure_report_delivery(callback, "S7")
                 await _safe_callback_answer(callback)
                 return
-            if job and job.status == ReportJobStatus.FAILED:
+            if job and job.status in REPORT_JOB_FAILED_STATUSES:
                 _requeue_report_job(
                     session, telegram_user_id=callback.from_user.id, job=job
                 )
@@ -9,6 +9,7 @@ from app.bot.router import setup_bot_router
 from app.bot.report_jobs_worker import report_job_worker
 from app.bot.handlers.screens import restore_payment_waiters
 from app.core.config import log_payment_runtime_snapshot, settings
+from app.core.llm_key_store import flush_llm_key_usage
 from app.core.logging import setup_logging
 
 
@@ -32,13 +33,20 @@ async def main() -> None:
         )
 
     logger.info("Starting bot polling")
-    worker_task = asyncio.create_task(report_job_worker.run(bot))
+    worker_task: asyncio.Task | None = None
+    if settings.report_job_worker_embedded:
+        worker_task = asyncio.create_task(report_job_worker.run(bot))
+    else:
+        # Задания обрабатывает отдельный процесс `python -m app.bot.report_worker`.
+        logger.info("report_job_worker_embedded_disabled")
     try:
         await dispatcher.start_polling(bot)
     finally:
-        worker_task.cancel()
-        with contextlib.suppress(asyncio.CancelledError):
-            await worker_task
+        if worker_task is not None:
+            worker_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await worker_task
+        await asyncio.to_thread(flush_llm_key_usage)
 
 
 if __name__ == "__main__":
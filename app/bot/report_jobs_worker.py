@@ -4,88 +4,445 @@ import asyncio
 from collections import Counter
 import logging
 import os
-import random
 import socket
-import uuid
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 
 from aiogram import Bot
-from sqlalchemy import select, update
 
 from app.bot.handlers import screens as screens_handler
 from app.bot.handlers.screen_manager import screen_manager
 from app.core.config import settings
+from app.core.report_job_progress import ReportJobProgress, activate_report_job_progress
+from app.core.report_job_stages import (
+    STAGE_DELIVERY,
+    STAGE_PDF,
+    STAGE_QUEUE,
+    ReportJobStageRecorder,
+    activate_stage_recorder,
+    report_job_stage,
+)
 from app.core.report_service import report_service
 from app.db.models import (
-    Order,
-    OrderStatus,
+    REPORT_JOB_FAILED_STATUSES,
     ReportJob,
     ReportJobStatus,
+    ScheduledNudgeKind,
     ScreenStateRecord,
-    ServiceHeartbeat,
     User,
 )
-from app.db.session import get_session
+from app.db.session import get_engine, get_session
 from app.services.marketing_messaging import send_marketing_message
+from app.services.report_job_queue import (
+    ReportJobLease,
+    ReportJobNotificationListener,
+    claim_report_jobs,
+    release_report_job_lease,
+    renew_report_job_lease,
+    subscribe_report_job_wakeups,
+)
+from app.services.scheduled_nudges import (
+    cancel_nudge,
+    fetch_due_nudges,
+    mark_nudge_sent,
+    parse_state_dt,
+    postpone_nudge,
+    resolve_resume_nudge_delay,
+    resolve_send_skip_retry_delay,
+)
+from app.services.service_heartbeats import (
+    prune_service_heartbeat_instances,
+    remove_service_heartbeat_instance,
+    touch_service_heartbeat,
+)
+
+
+@dataclass
+class WorkerLoop:
+    """Отдельный цикл воркера со своим интервалом, бюджетом времени и backoff после ошибок."""
+
+    name: str
+    handler: Callable[..., Awaitable[None]]
+    interval_seconds: float
+    timeout_seconds: float | None = None
+    wakeup: asyncio.Event | None = None
+    consecutive_failures: int = 0
+
+    def next_delay(self, max_backoff_seconds: float) -> float:
+        if not self.consecutive_failures:
+            return self.interval_seconds
+        backoff = self.interval_seconds * (2 ** self.consecutive_failures)
+        return min(backoff, max(max_backoff_seconds, self.interval_seconds))
 
 
 class ReportJobWorker:
 
-    def __init__(self) -> None:
+    def __init__(self, *, concurrency: int | None = None, nudges_enabled: bool = True) -> None:
         self._logger = logging.getLogger(__name__)
+        self._concurrency_override = concurrency
+        self._nudges_enabled = nudges_enabled
         self._service_name = "report_jobs_worker"
         self._host = socket.gethostname()
         self._pid = os.getpid()
         self._skip_reasons_counter: Counter[str] = Counter()
         self._retry_base_seconds = 60
         self._retry_max_seconds = 60 * 60
+        self._loop_max_backoff_seconds = 5 * 60
+        self._in_flight: dict[int, asyncio.Task[None]] = {}
+        self._wakeup: asyncio.Event | None = None
+        self._job_listener = ReportJobNotificationListener()
+        self._stopping = False
+        self._stop_event: asyncio.Event | None = None
+
+    @property
+    def concurrency(self) -> int:
+        return self._resolve_concurrency()
+
+    @property
+    def in_flight_count(self) -> int:
+        return len(self._in_flight)
+
+    def request_stop(self) -> None:
+        """Мягкая остановка: новые задания не берутся, начатые дорабатываются, циклы выходят."""
+        self._stopping = True
+        self._get_stop_event().set()
+        self._get_wakeup().set()
+
+    async def run_until_stopped(
+        self,
+        bot: Bot,
+        stop_event: asyncio.Event,
+        *,
+        drain_timeout_seconds: float,
+    ) -> None:
+        """Работает до `stop_event`, затем ждёт начатые задания не дольше `drain_timeout_seconds`.
+
+        Не успевшие задания отменяются: аренда снимается, и их сразу подхватывает другой процесс.
+        """
+        run_task = asyncio.create_task(self.run(bot))
+        stop_task = asyncio.create_task(stop_event.wait())
+        try:
+            await asyncio.wait({run_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stop_task.cancel()
+        if run_task.done():
+            run_task.result()
+            return
+        self._logger.info(
+            "report_job_worker_draining",
+            extra={"in_flight": self.in_flight_count, "timeout_seconds": drain_timeout_seconds},
+        )
+        self.request_stop()
+        try:
+            await asyncio.wait_for(asyncio.shield(run_task), timeout=drain_timeout_seconds)
+        except asyncio.TimeoutError:
+            self._logger.warning(
+                "report_job_worker_drain_timeout",
+                extra={"in_flight": self.in_flight_count},
+            )
+            run_task.cancel()
+            await asyncio.gather(run_task, return_exceptions=True)
 
     async def run(self, bot: Bot) -> None:
-        poll_interval = max(settings.report_job_poll_interval_seconds, 1)
-        while True:
+        self._prune_stale_heartbeats()
+        wake_up = self._build_threadsafe_wakeup()
+        unsubscribe = subscribe_report_job_wakeups(wake_up)
+        loops = self._build_loops(wake_up)
+        tasks = [
+            asyncio.create_task(self._run_loop(bot, loop), name=f"{self._service_name}:{loop.name}")
+            for loop in loops
+        ]
+        try:
+            await asyncio.gather(*tasks)
+            # Сюда попадаем только после request_stop: циклы вышли, дожидаемся начатых заданий.
+            await self._drain_in_flight_jobs()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            unsubscribe()
+            self._job_listener.stop()
+            await self._cancel_in_flight_jobs()
+            self._remove_heartbeat()
+
+    def _build_loops(self, wake_up: Callable[[], None]) -> list[WorkerLoop]:
+        async def _process_jobs_cycle(bot: Bot) -> None:
+            if getattr(settings, "report_job_listen_enabled", True):
+                self._job_listener.ensure_started(get_engine, wake_up)
+            await self._process_pending_jobs(bot)
+
+        # Задания отчётов не ограничены бюджетом (их защищает аренда) и будятся сразу при постановке.
+        jobs_loop = WorkerLoop(
+            name="report_jobs",
+            handler=_process_jobs_cycle,
+            interval_seconds=max(settings.report_job_poll_interval_seconds, 1),
+            wakeup=self._get_wakeup(),
+        )
+        if not self._nudges_enabled:
+            return [jobs_loop]
+        sweep_timeout = max(int(getattr(settings, "nudge_sweep_timeout_seconds", 120) or 120), 1)
+        return [
+            jobs_loop,
+            WorkerLoop(
+                name="resume_nudges",
+                handler=self._process_stalled_users,
+                interval_seconds=max(
+                    int(getattr(settings, "resume_nudge_poll_interval_seconds", 60) or 60), 1
+                ),
+                timeout_seconds=sweep_timeout,
+            ),
+            WorkerLoop(
+                name="checkout_value_nudges",
+                handler=self._process_checkout_value_nudges,
+                interval_seconds=max(
+                    int(getattr(settings, "checkout_value_nudge_poll_interval_seconds", 60) or 60), 1
+                ),
+                timeout_seconds=sweep_timeout,
+            ),
+        ]
+
+    async def _run_loop(self, bot: Bot, loop: WorkerLoop) -> None:
+        while not self._stopping:
             try:
-                await self._process_pending_jobs(bot)
-                await self._process_stalled_users(bot)
-                await self._process_checkout_value_nudges(bot)
+                if loop.timeout_seconds is None:
+                    await loop.handler(bot)
+                else:
+                    # Мягкий бюджет: рассылка прекращает брать новые напоминания после дедлайна;
+                    # жёсткий предел срабатывает, только если зависла сама отправка.
+                    deadline = asyncio.get_running_loop().time() + loop.timeout_seconds
+                    await asyncio.wait_for(
+                        loop.handler(bot, deadline=deadline),
+                        timeout=loop.timeout_seconds * 2,
+                    )
+            except asyncio.TimeoutError:
+                loop.consecutive_failures += 1
+                self._logger.warning(
+                    "report_job_worker_loop_timeout",
+                    extra={"loop": loop.name, "timeout_seconds": loop.timeout_seconds},
+                )
             except Exception as exc:
+                loop.consecutive_failures += 1
                 self._logger.warning(
                     "report_job_worker_failed",
-                    extra={"error": str(exc)},
+                    extra={
+                        "loop": loop.name,
+                        "error": str(exc),
+                        "consecutive_failures": loop.consecutive_failures,
+                    },
                     exc_info=True,
                 )
-            await asyncio.sleep(poll_interval)
+            else:
+                loop.consecutive_failures = 0
+            delay = loop.next_delay(self._loop_max_backoff_seconds)
+            if self._stopping:
+                return
+            if loop.wakeup is not None and not loop.consecutive_failures:
+                await self._wait_next_cycle(delay)
+            else:
+                await self._sleep_unless_stopping(delay)
 
     async def _process_pending_jobs(self, bot: Bot) -> None:
         self._update_heartbeat()
-        job_ids = []
-        with get_session() as session:
-            job_ids = (
-                session.execute(
-                    select(ReportJob.id)
-                    .where(
-                        ReportJob.status.in_(
-                            [ReportJobStatus.PENDING, ReportJobStatus.IN_PROGRESS]
-                        )
-                    )
-                    .order_by(ReportJob.created_at.asc())
+        concurrency = self._resolve_concurrency()
+        if concurrency <= 1:
+            if self._in_flight:
+                # Лимит уменьшили на ходу: сначала дорабатывают задания пула.
+                return
+            # Последовательный режим: арендуем по одному заданию, чтобы очередь
+            # не простаивала под истекающими блокировками, пока идёт генерация.
+            handled: set[int] = set()
+            while not self._stopping:
+                leases = self._claim_jobs(limit=1, exclude_job_ids=handled)
+                if not leases:
+                    return
+                handled.add(leases[0].job_id)
+                await self._handle_leased_job(bot, leases[0])
+            return
+
+        if self._stopping:
+            return
+        # Слоты считаются только по заданиям в работе: изменение лимита между циклами
+        # сразу меняет число свободных слотов. Не ждём освобождения слота: свободные
+        # слоты добираются на следующем цикле, который будится завершением задания.
+        free_slots = concurrency - len(self._in_flight)
+        if free_slots <= 0:
+            return
+        leases = self._claim_jobs(limit=free_slots, exclude_job_ids=self._in_flight)
+        for lease in leases:
+            self._in_flight[lease.job_id] = asyncio.create_task(self._run_job_in_slot(bot, lease))
+
+    async def _run_job_in_slot(self, bot: Bot, lease: ReportJobLease) -> None:
+        job_id = lease.job_id
+        try:
+            await self._handle_leased_job(bot, lease)
+        except Exception as exc:
+            self._logger.warning(
+                "report_job_handle_failed",
+                extra={"job_id": job_id, "error": str(exc)},
+                exc_info=True,
+            )
+        finally:
+            self._in_flight.pop(job_id, None)
+            self._get_wakeup().set()
+
+    async def _handle_leased_job(self, bot: Bot, lease: ReportJobLease) -> None:
+        claimed_at = datetime.now(timezone.utc)
+        recorder = ReportJobStageRecorder(lease.job_id)
+        progress = ReportJobProgress(
+            lease.job_id,
+            lease.lock_token,
+            interval_seconds=getattr(settings, "report_job_progress_interval_seconds", 3),
+        )
+        renewal = asyncio.create_task(self._keep_lease_alive(lease))
+        try:
+            with activate_stage_recorder(recorder), activate_report_job_progress(progress):
+                await self._handle_job(bot, lease.job_id, lock_token=lease.lock_token)
+        except asyncio.CancelledError:
+            # Воркер останавливается: отпускаем задание, чтобы его сразу подхватил другой процесс.
+            await self._release_lease(lease)
+            raise
+        finally:
+            renewal.cancel()
+            await asyncio.gather(renewal, return_exceptions=True)
+            await progress.drain()
+            self._flush_stages(recorder, claimed_at=claimed_at)
+
+    def _flush_stages(self, recorder: ReportJobStageRecorder, *, claimed_at: datetime) -> None:
+        try:
+            with get_session() as session:
+                job = session.get(ReportJob, recorder.job_id)
+                if job is None:
+                    return
+                created_at = job.created_at or claimed_at
+                if created_at.tzinfo is None:
+                    created_at = created_at.replace(tzinfo=timezone.utc)
+                recorder.add(
+                    STAGE_QUEUE,
+                    started_at=created_at,
+                    finished_at=claimed_at,
+                    metadata={
+                        "tariff": job.tariff.value if job.tariff else None,
+                        "priority": job.priority,
+                        "status": job.status.value if job.status else None,
+                    },
                 )
-                .scalars()
-                .all()
+                recorder.flush(session)
+        except Exception as exc:
+            self._logger.warning(
+                "report_job_stages_flush_failed",
+                extra={"job_id": recorder.job_id, "error": str(exc)},
             )
-        for job_id in job_ids:
-            claimed = self._claim_job(job_id)
-            if not claimed:
+
+    async def _keep_lease_alive(self, lease: ReportJobLease) -> None:
+        interval = self._resolve_lease_renew_interval()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                renewed = await asyncio.to_thread(self._renew_lease_now, lease)
+            except Exception as exc:
+                self._logger.warning(
+                    "report_job_lease_renew_failed",
+                    extra={"job_id": lease.job_id, "error": str(exc)},
+                )
                 continue
-            await self._handle_job(bot, job_id)
+            if not renewed:
+                self._logger.warning("report_job_lease_lost", extra={"job_id": lease.job_id})
+                return
+
+    def _renew_lease_now(self, lease: ReportJobLease) -> bool:
+        with get_session() as session:
+            return renew_report_job_lease(session, lease)
+
+    async def _release_lease(self, lease: ReportJobLease) -> None:
+        try:
+            await asyncio.to_thread(self._release_lease_now, lease)
+        except Exception as exc:
+            self._logger.warning(
+                "report_job_lease_release_failed",
+                extra={"job_id": lease.job_id, "error": str(exc)},
+            )
+
+    def _release_lease_now(self, lease: ReportJobLease) -> None:
+        with get_session() as session:
+            release_report_job_lease(session, lease)
+
+    def _resolve_lease_renew_interval(self) -> float:
+        lock_timeout = max(settings.report_job_lock_timeout_seconds, 1)
+        renew_seconds = getattr(settings, "report_job_lease_renew_seconds", 60) or 60
+        return max(min(renew_seconds, lock_timeout / 3), 1)
+
+    def _resolve_concurrency(self) -> int:
+        try:
+            if self._concurrency_override is not None:
+                return max(int(self._concurrency_override), 1)
+            return max(int(getattr(settings, "report_job_concurrency", 1) or 1), 1)
+        except (TypeError, ValueError):
+            return 1
+
+    def _get_wakeup(self) -> asyncio.Event:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    def _build_threadsafe_wakeup(self) -> Callable[[], None]:
+        loop = asyncio.get_running_loop()
+        wakeup = self._get_wakeup()
+
+        def _wake_up() -> None:
+            # Коммит задания может произойти в другом потоке (asyncio.to_thread).
+            loop.call_soon_threadsafe(wakeup.set)
 
-    async def _process_stalled_users(self, bot: Bot) -> None:
-        threshold_hours = int(getattr(settings, "resume_nudge_delay_hours", 6) or 6)
-        threshold = timedelta(hours=max(threshold_hours, 1))
+        return _wake_up
+
+    async def _wait_next_cycle(self, poll_interval: float) -> None:
+        wakeup = self._get_wakeup()
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+
+    async def _sleep_unless_stopping(self, delay: float) -> None:
+        try:
+            await asyncio.wait_for(self._get_stop_event().wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def _get_stop_event(self) -> asyncio.Event:
+        if self._stop_event is None:
+            self._stop_event = asyncio.Event()
+        return self._stop_event
+
+    async def _drain_in_flight_jobs(self) -> None:
+        tasks = list(self._in_flight.values())
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _cancel_in_flight_jobs(self) -> None:
+        tasks = list(self._in_flight.values())
+        if not tasks:
+            return
+        self._logger.info("report_job_worker_cancel_in_flight", extra={"jobs": len(tasks)})
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._in_flight.clear()
+
+    async def _process_stalled_users(self, bot: Bot, *, deadline: float | None = None) -> None:
+        threshold = resolve_resume_nudge_delay()
         now = datetime.now(timezone.utc)
 
         with get_session() as session:
-            state_rows = session.execute(select(ScreenStateRecord)).scalars().all()
-            for state_row in state_rows:
+            due_nudges = fetch_due_nudges(session, kind=ScheduledNudgeKind.RESUME, now=now)
+            for due in due_nudges:
+                if self._sweep_deadline_passed(deadline, flow_name="resume_nudge"):
+                    break
+                nudge = due.nudge
+                state_row = due.state_row
+                if state_row is None:
+                    cancel_nudge(nudge, reason="state_missing")
+                    continue
                 state_data: dict | None = None
                 try:
                     state_data = self._get_state_data_or_none(
@@ -93,28 +450,33 @@ class ReportJobWorker:
                         flow_name="resume_nudge",
                     )
                     if state_data is None:
+                        cancel_nudge(nudge, reason="invalid_state_data_type")
                         continue
                     if self._should_skip_by_retry(
                         state_data=state_data,
                         key_prefix="resume_nudge",
                         now=now,
                     ):
+                        postpone_nudge(
+                            nudge,
+                            due_at=self._parse_dt(state_data.get("resume_nudge_next_retry_at")),
+                        )
+                        continue
+                    if state_data.get("resume_nudge_sent_at"):
+                        mark_nudge_sent(nudge, now=now)
                         continue
                     critical_at = self._parse_dt(state_data.get("last_critical_step_at"))
                     if not critical_at:
+                        cancel_nudge(nudge, reason="critical_step_missing")
                         continue
                     if now - critical_at < threshold:
+                        postpone_nudge(nudge, due_at=critical_at + threshold)
                         continue
-                    if state_data.get("resume_nudge_sent_at"):
-                        continue
-
-                    user = session.execute(
-                        select(User).where(User.telegram_user_id == state_row.telegram_user_id)
-                    ).scalar_one_or_none()
-                    if user is None:
+                    if due.user_id is None:
+                        cancel_nudge(nudge, reason="user_missing")
                         continue
-
-                    if self._has_paid_order(session, user.id):
+                    if due.has_paid_order:
+                        cancel_nudge(nudge, reason="paid_order")
                         continue
 
                     deep_link = self._build_resume_deeplink(state_data=state_data)
@@ -127,7 +489,7 @@ class ReportJobWorker:
                     send_result = await send_marketing_message(
                         bot=bot,
                         session=session,
-                        user_id=user.id,
+                        user_id=due.user_id,
                         campaign=resume_campaign,
                         message_text=message_text,
                     )
@@ -136,11 +498,16 @@ class ReportJobWorker:
                             "resume_nudge_send_skipped",
                             extra={
                                 "campaign": resume_campaign,
-                                "user_id": user.id,
+                                "user_id": due.user_id,
                                 "telegram_user_id": state_row.telegram_user_id,
                                 "reason": send_result.reason,
                             },
                         )
+                        postpone_nudge(
+                            nudge,
+                            due_at=now + resolve_send_skip_retry_delay(nudge.attempts or 0),
+                            error=f"send_skipped:{send_result.reason}",
+                        )
                         continue
 
                     sent_at = now.isoformat()
@@ -153,6 +520,7 @@ class ReportJobWorker:
                     )
                     state_row.data = state_data
                     session.add(state_row)
+                    mark_nudge_sent(nudge, now=now)
                     screen_manager.record_transition_event_safe(
                         user_id=state_row.telegram_user_id,
                         from_screen=state_data.get("last_critical_screen_id"),
@@ -174,31 +542,43 @@ class ReportJobWorker:
                     )
                     state_row.data = state_data
                     session.add(state_row)
+                    postpone_nudge(
+                        nudge,
+                        due_at=self._parse_dt(state_data.get("resume_nudge_next_retry_at")),
+                        error=str(exc),
+                    )
                     self._logger.warning(
                         "resume_nudge_process_failed",
                         extra={"telegram_user_id": state_row.telegram_user_id, "error": str(exc)},
                         exc_info=True,
                     )
 
-    async def _process_checkout_value_nudges(self, bot: Bot) -> None:
+    async def _process_checkout_value_nudges(
+        self,
+        bot: Bot,
+        *,
+        deadline: float | None = None,
+    ) -> None:
         now = datetime.now(timezone.utc)
-        target_screens = {"S2", "S4"}
-        min_delay_minutes = max(
-            int(getattr(settings, "checkout_value_nudge_min_delay_minutes", 10) or 10),
-            1,
-        )
-        max_delay_minutes = max(
-            int(getattr(settings, "checkout_value_nudge_max_delay_minutes", 30) or 30),
-            min_delay_minutes,
-        )
         campaign = str(
             getattr(settings, "checkout_value_nudge_campaign", "checkout_value_nudge_v1")
             or "checkout_value_nudge_v1"
         )
 
         with get_session() as session:
-            state_rows = session.execute(select(ScreenStateRecord)).scalars().all()
-            for state_row in state_rows:
+            due_nudges = fetch_due_nudges(
+                session,
+                kind=ScheduledNudgeKind.CHECKOUT_VALUE,
+                now=now,
+            )
+            for due in due_nudges:
+                if self._sweep_deadline_passed(deadline, flow_name="checkout_value_nudge"):
+                    break
+                nudge = due.nudge
+                state_row = due.state_row
+                if state_row is None:
+                    cancel_nudge(nudge, reason="state_missing")
+                    continue
                 state_data: dict | None = None
                 try:
                     state_data = self._get_state_data_or_none(
@@ -206,36 +586,26 @@ class ReportJobWorker:
                         flow_name="checkout_value_nudge",
                     )
                     if state_data is None:
+                        cancel_nudge(nudge, reason="invalid_state_data_type")
                         continue
                     if self._should_skip_by_retry(
                         state_data=state_data,
                         key_prefix="checkout_value_nudge",
                         now=now,
                     ):
+                        postpone_nudge(
+                            nudge,
+                            due_at=self._parse_dt(state_data.get("checkout_value_nudge_next_retry_at")),
+                        )
                         continue
                     if state_data.get("checkout_value_nudge_sent_at"):
+                        mark_nudge_sent(nudge, now=now)
                         continue
-
-                    if state_row.screen_id in target_screens and not state_data.get("checkout_value_nudge_first_seen_at"):
-                        delay_minutes = random.randint(min_delay_minutes, max_delay_minutes)
-                        due_at = now + timedelta(minutes=delay_minutes)
-                        state_data["checkout_value_nudge_first_seen_at"] = now.isoformat()
-                        state_data["checkout_value_nudge_due_at"] = due_at.isoformat()
-                        state_data["checkout_value_nudge_target_screen_id"] = state_row.screen_id
-                        state_data["checkout_value_nudge_delay_minutes"] = delay_minutes
-                        state_row.data = state_data
-                        session.add(state_row)
-
-                    due_at = self._parse_dt(state_data.get("checkout_value_nudge_due_at"))
-                    if not due_at or now < due_at:
-                        continue
-
-                    user = session.execute(
-                        select(User).where(User.telegram_user_id == state_row.telegram_user_id)
-                    ).scalar_one_or_none()
-                    if user is None:
+                    if due.user_id is None:
+                        cancel_nudge(nudge, reason="user_missing")
                         continue
-                    if self._has_paid_order(session, user.id):
+                    if due.has_paid_order:
+                        cancel_nudge(nudge, reason="paid_order")
                         continue
 
                     deep_link = self._build_resume_deeplink(state_data=state_data)
@@ -246,7 +616,7 @@ class ReportJobWorker:
                     send_result = await send_marketing_message(
                         bot=bot,
                         session=session,
-                        user_id=user.id,
+                        user_id=due.user_id,
                         campaign=campaign,
                         message_text=message_text,
                     )
@@ -255,22 +625,30 @@ class ReportJobWorker:
                             "checkout_value_nudge_send_skipped",
                             extra={
                                 "campaign": campaign,
-                                "user_id": user.id,
+                                "user_id": due.user_id,
                                 "telegram_user_id": state_row.telegram_user_id,
                                 "reason": send_result.reason,
                             },
                         )
+                        postpone_nudge(
+                            nudge,
+                            due_at=now + resolve_send_skip_retry_delay(nudge.attempts or 0),
+                            error=f"send_skipped:{send_result.reason}",
+                        )
                         continue
 
                     sent_at = now.isoformat()
                     state_data["checkout_value_nudge_sent_at"] = sent_at
                     state_data["checkout_value_nudge_campaign"] = campaign
+                    state_data.setdefault("checkout_value_nudge_target_screen_id", nudge.target_screen_id)
+                    state_data.setdefault("checkout_value_nudge_delay_minutes", nudge.delay_minutes)
                     state_data = self._clear_processing_errors(
                         state_data=state_data,
                         key_prefix="checkout_value_nudge",
                     )
                     state_row.data = state_data
                     session.add(state_row)
+                    mark_nudge_sent(nudge, now=now)
                     screen_manager.record_transition_event_safe(
                         user_id=state_row.telegram_user_id,
                         from_screen=state_data.get("checkout_value_nudge_target_screen_id"),
@@ -293,12 +671,26 @@ class ReportJobWorker:
                     )
                     state_row.data = state_data
                     session.add(state_row)
+                    postpone_nudge(
+                        nudge,
+                        due_at=self._parse_dt(state_data.get("checkout_value_nudge_next_retry_at")),
+                        error=str(exc),
+                    )
                     self._logger.warning(
                         "checkout_value_nudge_process_failed",
                         extra={"telegram_user_id": state_row.telegram_user_id, "error": str(exc)},
                         exc_info=True,
                     )
 
+    def _sweep_deadline_passed(self, deadline: float | None, *, flow_name: str) -> bool:
+        if self._stopping:
+            return True
+        if deadline is None or asyncio.get_running_loop().time() < deadline:
+            return False
+        # Оставшиеся напоминания остаются созревшими и будут взяты на следующем цикле.
+        self._logger.info("nudge_sweep_budget_exhausted", extra={"flow": flow_name})
+        return True
+
     def _build_resume_deeplink(self, *, state_data: dict) -> str:
         bot_username = str(getattr(settings, "telegram_bot_username", "") or "").strip().lstrip("@")
         order_id = state_data.get("order_id")
@@ -344,25 +736,7 @@ class ReportJobWorker:
 
     @staticmethod
     def _parse_dt(value: object) -> datetime | None:
-        if not isinstance(value, str) or not value:
-            return None
-        try:
-            parsed = datetime.fromisoformat(value)
-        except ValueError:
-            return None
-        if parsed.tzinfo is None:
-            return parsed.replace(tzinfo=timezone.utc)
-        return parsed.astimezone(timezone.utc)
-
-    @staticmethod
-    def _has_paid_order(session, user_id: int) -> bool:
-        paid_order = session.execute(
-            select(Order.id).where(
-                Order.user_id == user_id,
-                Order.status == OrderStatus.PAID,
-            )
-        ).scalar_one_or_none()
-        return paid_order is not None
+        return parse_state_dt(value)
 
     def _get_state_data_or_none(
         self,
@@ -403,52 +777,63 @@ class ReportJobWorker:
         return None
 
     def _update_heartbeat(self) -> None:
-        now = datetime.now(timezone.utc)
         with get_session() as session:
-            heartbeat = session.get(ServiceHeartbeat, self._service_name)
-            if heartbeat:
-                heartbeat.updated_at = now
-                heartbeat.host = self._host
-                heartbeat.pid = self._pid
-                session.add(heartbeat)
-                return
+            touch_service_heartbeat(
+                session,
+                self._service_name,
+                host=self._host,
+                pid=self._pid,
+            )
+
+    def _prune_stale_heartbeats(self) -> None:
+        try:
+            with get_session() as session:
+                prune_service_heartbeat_instances(
+                    session,
+                    self._service_name,
+                    older_than=datetime.now(timezone.utc) - timedelta(days=1),
+                )
+        except Exception as exc:
+            self._logger.warning("report_job_worker_heartbeat_prune_failed", extra={"error": str(exc)})
 
-            session.add(
-                ServiceHeartbeat(
-                    service_name=self._service_name,
-                    updated_at=now,
+    def _remove_heartbeat(self) -> None:
+        # Штатная остановка: строка процесса больше не нужна, общая строка сервиса остаётся.
+        try:
+            with get_session() as session:
+                remove_service_heartbeat_instance(
+                    session,
+                    self._service_name,
                     host=self._host,
                     pid=self._pid,
                 )
-            )
+        except Exception as exc:
+            self._logger.warning("report_job_worker_heartbeat_remove_failed", extra={"error": str(exc)})
 
-    def _claim_job(self, job_id: int) -> bool:
-        lock_timeout = timedelta(seconds=settings.report_job_lock_timeout_seconds)
-        now = datetime.now(timezone.utc)
-        lock_token = uuid.uuid4().hex
+    def _claim_jobs(
+        self,
+        *,
+        limit: int,
+        exclude_job_ids: Iterable[int] = (),
+    ) -> list[ReportJobLease]:
         with get_session() as session:
-            updated = session.execute(
-                update(ReportJob)
-                .where(
-                    ReportJob.id == job_id,
-                    ReportJob.status.in_(
-                        [ReportJobStatus.PENDING, ReportJobStatus.IN_PROGRESS]
-                    ),
-                    (ReportJob.locked_at.is_(None))
-                    | (ReportJob.locked_at < now - lock_timeout),
-                )
-                .values(
-                    status=ReportJobStatus.IN_PROGRESS,
-                    lock_token=lock_token,
-                    locked_at=now,
-                )
+            return claim_report_jobs(
+                session,
+                limit=limit,
+                lock_timeout_seconds=settings.report_job_lock_timeout_seconds,
+                exclude_job_ids=exclude_job_ids,
+                user_fairness=getattr(settings, "report_job_user_fairness_enabled", True),
             )
-            if updated.rowcount:
-                return True
-        return False
 
-    async def _handle_job(self, bot: Bot, job_id: int) -> None:
-        report = await report_service.generate_report_by_job(job_id=job_id)
+    async def _handle_job(
+        self,
+        bot: Bot,
+        job_id: int,
+        lock_token: str | None = None,
+    ) -> None:
+        report = await report_service.generate_report_by_job(
+            job_id=job_id,
+            lock_token=lock_token,
+        )
         job_status: ReportJobStatus | None = None
         chat_id: int | None = None
         telegram_user_id: int | None = None
@@ -459,11 +844,16 @@ class ReportJobWorker:
             job = session.get(ReportJob, job_id)
             if not job:
                 return
+            if lock_token is not None and job.lock_token != lock_token:
+                # Задание перезахвачено другим воркером: доставкой займётся он.
+                self._logger.warning("report_job_lease_lost", extra={"job_id": job_id})
+                return
             user = session.get(User, job.user_id)
             telegram_user_id = user.telegram_user_id if user else None
             chat_id = job.chat_id
             job_status = job.status
-            if job.status in {ReportJobStatus.COMPLETED, ReportJobStatus.FAILED}:
+            if job.status != ReportJobStatus.IN_PROGRESS:
+                # Завершено, упало или отложено до повтора: аренда больше не нужна.
                 job.lock_token = None
                 job.locked_at = None
                 session.add(job)
@@ -493,7 +883,9 @@ class ReportJobWorker:
                     user_id=telegram_user_id,
                 )
                 report_meta = screens_handler._get_report_pdf_meta(report)
-                pdf_bytes = screens_handler._get_report_pdf_bytes(session, report)
+                with report_job_stage(STAGE_PDF) as stage_meta:
+                    pdf_bytes = screens_handler._get_report_pdf_bytes(session, report)
+                    stage_meta["rendered"] = pdf_bytes is not None
 
         if (
             job_status == ReportJobStatus.COMPLETED
@@ -501,15 +893,16 @@ class ReportJobWorker:
             and telegram_user_id
             and chat_id
         ):
-            await screens_handler._send_report_pdf(
-                bot,
-                chat_id,
-                report_meta,
-                pdf_bytes=pdf_bytes,
-                username=None,
-                user_id=telegram_user_id,
-            )
-        elif job_status == ReportJobStatus.FAILED and telegram_user_id and chat_id:
+            with report_job_stage(STAGE_DELIVERY) as stage_meta:
+                stage_meta["delivered"] = await screens_handler._send_report_pdf(
+                    bot,
+                    chat_id,
+                    report_meta,
+                    pdf_bytes=pdf_bytes,
+                    username=None,
+                    user_id=telegram_user_id,
+                )
+        elif job_status in REPORT_JOB_FAILED_STATUSES and telegram_user_id and chat_id:
             await screen_manager.show_screen(
                 bot=bot,
                 chat_id=chat_id,
@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import contextlib
+import logging
+import signal
+from collections.abc import Sequence
+
+from aiogram import Bot
+
+from app.bot.report_jobs_worker import ReportJobWorker
+from app.core.config import settings
+from app.core.llm_key_store import flush_llm_key_usage
+from app.core.llm_router import llm_router
+from app.core.logging import setup_logging
+
+
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.bot.report_worker",
+        description="Отдельный процесс генерации и доставки отчётов (без Telegram polling).",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help="Сколько заданий держать в работе одновременно (по умолчанию REPORT_JOB_CONCURRENCY).",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=None,
+        help="Сколько секунд дорабатывать начатые задания после SIGTERM (по умолчанию REPORT_JOB_DRAIN_TIMEOUT_SECONDS).",
+    )
+    parser.add_argument(
+        "--no-nudges",
+        action="store_true",
+        help="Только задания отчётов: циклы напоминаний оставить другому процессу.",
+    )
+    args = parser.parse_args(argv)
+    if args.concurrency is not None and args.concurrency < 1:
+        parser.error("--concurrency должен быть не меньше 1")
+    return args
+
+
+async def main(argv: Sequence[str] | None = None) -> None:
+    args = parse_args(argv)
+    setup_logging(settings.log_level)
+    logger = logging.getLogger(__name__)
+    if not settings.bot_token:
+        logger.error("bot_token_missing")
+        return
+
+    drain_timeout = args.drain_timeout
+    if drain_timeout is None:
+        drain_timeout = settings.report_job_drain_timeout_seconds
+    worker = ReportJobWorker(concurrency=args.concurrency, nudges_enabled=not args.no_nudges)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(signum, stop_event.set)
+
+    # Собственный Bot: доставка отчётов не делит HTTP-сессию с процессом polling.
+    bot = Bot(token=settings.bot_token)
+    logger.info(
+        "report_worker_started",
+        extra={
+            "concurrency": worker.concurrency,
+            "nudges_enabled": not args.no_nudges,
+            "drain_timeout_seconds": drain_timeout,
+        },
+    )
+    try:
+        await worker.run_until_stopped(
+            bot,
+            stop_event,
+            drain_timeout_seconds=max(drain_timeout, 0),
+        )
+    finally:
+        await llm_router.aclose()
+        # Статистика ключей пишется отложенно: сбрасываем буфер до выхода процесса.
+        await asyncio.to_thread(flush_llm_key_usage)
+        await bot.session.close()
+        logger.info("report_worker_stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
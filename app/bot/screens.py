@@ -214,6 +214,7 @@ def build_report_wait_message(
     frame: str = EMOJI_STEP,
     total_seconds: int | None = None,
     progress: float | None = None,
+    sections_done: int | None = None,
 ) -> str:
     base_text = "Генерируем отчёт… Пожалуйста, подождите."
     if remaining_seconds is None and progress is None:
@@ -231,13 +232,17 @@ def build_report_wait_message(
         percent = int(round(resolved_progress * 100))
         progress_line = f"\nПрогресс: [{progress_bar}] {percent}%"
 
+    sections_line = ""
+    if sections_done is not None:
+        sections_line = f"\nГотово разделов: {sections_done}"
+
     remaining_line = ""
     if remaining_seconds is not None:
         remaining_line = f"\nОсталось: {remaining_seconds} сек."
 
     return _with_screen_prefix(
         "S6",
-        f"{frame} {base_text}{progress_line}{remaining_line}",
+        f"{frame} {base_text}{progress_line}{sections_line}{remaining_line}",
     )
 
 
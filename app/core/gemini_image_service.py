@@ -11,7 +11,12 @@ from typing import Any
 import httpx
 
 from app.core.config import settings
-from app.core.llm_key_store import record_llm_key_usage, resolve_llm_keys
+from app.core.llm_circuit_breaker import (
+    build_key_circuit_breaker,
+    build_provider_circuit_breaker,
+    key_circuit_name,
+)
+from app.core.llm_key_store import LLMKeyItem, record_llm_key_usage, resolve_cached_llm_keys
 
 
 @dataclass(frozen=True)
@@ -42,6 +47,9 @@ class GeminiImageService:
         timeout_seconds = getattr(settings, "llm_timeout_seconds", 30)
         proxy_url = getattr(settings, "llm_proxy_url", None)
         self._client = self._build_httpx_client(timeout_seconds=timeout_seconds, proxy_url=proxy_url)
+        # Те же цепи, что у LLMRouter: мёртвый Gemini или отозванный ключ пропускаются без таймаутов.
+        self._provider_circuit = build_provider_circuit_breaker()
+        self._key_circuit = build_key_circuit_breaker()
 
     def _build_httpx_client(self, *, timeout_seconds: int, proxy_url: str | None) -> httpx.Client:
         timeout = httpx.Timeout(timeout_seconds)
@@ -61,7 +69,7 @@ class GeminiImageService:
                 return httpx.Client(timeout=timeout)
 
     def generate_image(self, prompt: str) -> GeminiImageResult:
-        api_keys = resolve_llm_keys(
+        api_keys = resolve_cached_llm_keys(
             provider="gemini",
             primary_key=settings.gemini_api_key,
             extra_keys=settings.gemini_api_keys,
@@ -87,12 +95,36 @@ class GeminiImageService:
             "generationConfig": {"responseModalities": ["IMAGE", "TEXT"]},
         }
 
+        if not self._provider_circuit.allow("gemini"):
+            raise GeminiImageError("Gemini circuit is open", category="circuit_open")
+        provider_probe = self._provider_circuit.holds_probe("gemini")
+        try:
+            return self._generate_with_keys(api_keys, endpoint, payload, model)
+        finally:
+            if provider_probe:
+                self._provider_circuit.release("gemini")
+
+    def _generate_with_keys(
+        self,
+        api_keys: list[LLMKeyItem],
+        endpoint: str,
+        payload: dict[str, Any],
+        model: str,
+    ) -> GeminiImageResult:
         last_error: GeminiImageError | None = None
         for idx, key_item in enumerate(api_keys, start=1):
+            if not self._key_circuit.allow(key_circuit_name("gemini", key_item)):
+                last_error = GeminiImageError("Gemini key circuit is open", category="circuit_open")
+                self._logger.info(
+                    "gemini_image_key_circuit_open_skip",
+                    extra={"key_index": idx, "keys_total": len(api_keys)},
+                )
+                continue
             headers = {"x-goog-api-key": key_item.key, "Content-Type": "application/json"}
             try:
                 response = self._client.post(endpoint, headers=headers, json=payload)
             except httpx.HTTPError as exc:
+                self._provider_circuit.record_failure("gemini", error=str(exc))
                 record_llm_key_usage(
                     key_item,
                     success=False,
@@ -106,6 +138,7 @@ class GeminiImageService:
                 )
                 continue
 
+            self._record_circuit_status(key_item, response.status_code, response.text)
             if response.status_code != 200:
                 record_llm_key_usage(
                     key_item,
@@ -155,6 +188,17 @@ class GeminiImageService:
             raise last_error
         raise GeminiImageError("Gemini image provider failed", category="unknown")
 
+    def _record_circuit_status(self, key_item: LLMKeyItem, status_code: int, error: str) -> None:
+        key_name = key_circuit_name("gemini", key_item)
+        if status_code >= 500:
+            self._provider_circuit.record_failure("gemini", error=error)
+            return
+        self._provider_circuit.record_success("gemini")
+        if status_code in {401, 403}:
+            self._key_circuit.record_failure(key_name, error=error, trip=True)
+        else:
+            self._key_circuit.record_success(key_name)
+
     def _extract_image(self, data: dict[str, Any]) -> tuple[bytes | None, str]:
         candidates = data.get("candidates") or []
         if not candidates:
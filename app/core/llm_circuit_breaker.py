@@ -0,0 +1,445 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from app.core.config import settings
+from app.core.llm_key_store import LLMKeyItem
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Ошибки, которые говорят о недоступности провайдера целиком, а не о конкретном запросе.
+PROVIDER_FAILURE_CATEGORIES = frozenset({"timeout", "request_error", "server_error"})
+# Ошибки, после которых ключ сразу считается плохим (отозван, нет доступа).
+KEY_FAILURE_CATEGORIES = frozenset({"auth_error"})
+
+
+def key_circuit_name(provider: str, key_item: LLMKeyItem) -> str:
+    fingerprint = hashlib.sha256(key_item.key.encode("utf-8")).hexdigest()[:16]
+    return f"{provider}:{fingerprint}"
+
+
+def _to_epoch(value: datetime | None) -> float:
+    if value is None:
+        return 0.0
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _to_datetime(value: float) -> datetime:
+    return datetime.fromtimestamp(value, tz=timezone.utc)
+
+
+@dataclass
+class _Circuit:
+    state: str = CLOSED
+    open_until: float = 0.0
+    probe_until: float = 0.0
+    # Этот процесс держит единственную пробу в half-open.
+    probing: bool = False
+    # Захват пробы уже идёт в БД: остальные запросы процесса его не дублируют.
+    claiming: bool = False
+    events: deque[tuple[float, bool]] = field(default_factory=deque)
+
+
+class LLMCircuitBreaker:
+    """Circuit breaker для провайдеров и ключей LLM, общий для всех процессов через таблицу `llm_circuit_breakers`.
+
+    - closed: исходы запросов копятся в скользящем окне процесса; при `min_requests` запросах и доле
+      ошибок не ниже `failure_rate` цепь открывается (или сразу — через `trip`).
+    - open: запросы отклоняются без обращения к провайдеру до `open_until`.
+    - half-open: после паузы ровно один процесс забирает пробу (атомарный UPDATE); её успех закрывает
+      цепь, ошибка открывает снова. Проба, не вернувшая результат за `probe_timeout_seconds`, освобождается.
+
+    Переходы пишутся в БД, состояние остальных процессов подтягивается не чаще раза в `sync_seconds`.
+    Если БД недоступна, breaker работает только в памяти процесса.
+
+    В корутинах решение принимает `aallow`: синхронизация и захват пробы идут через `asyncio.to_thread`,
+    а запись переходов из event loop уходит в отдельный поток (один на breaker, чтобы порядок записей
+    совпадал с порядком переходов). Синхронный `allow` обращается к БД сам — для потоков и скриптов.
+    """
+
+    def __init__(
+        self,
+        *,
+        scope: str,
+        enabled: bool = True,
+        window_seconds: float = 60.0,
+        min_requests: int = 5,
+        failure_rate: float = 0.5,
+        open_seconds: float = 30.0,
+        probe_timeout_seconds: float = 60.0,
+        sync_seconds: float = 2.0,
+        clock=time.time,
+    ) -> None:
+        self.scope = scope
+        self.enabled = bool(enabled)
+        self.window_seconds = max(float(window_seconds or 0), 1.0)
+        self.min_requests = max(int(min_requests or 0), 1)
+        self.failure_rate = min(max(float(failure_rate or 0), 0.0), 1.0)
+        self.open_seconds = max(float(open_seconds or 0), 1.0)
+        self.probe_timeout_seconds = max(float(probe_timeout_seconds or 0), 1.0)
+        self.sync_seconds = max(float(sync_seconds or 0), 0.0)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._circuits: dict[str, _Circuit] = {}
+        self._synced_at: float | None = None
+        self._writer: ThreadPoolExecutor | None = None
+
+    def _circuit(self, name: str) -> _Circuit:
+        circuit = self._circuits.get(name)
+        if circuit is None:
+            circuit = _Circuit()
+            self._circuits[name] = circuit
+        return circuit
+
+    def allow(self, name: str) -> bool:
+        """Можно ли отправить запрос; в half-open пропускает только одну пробу на все процессы."""
+        if not self.enabled:
+            return True
+        now = self._clock()
+        self._sync(now)
+        decision = self._local_decision(name, now)
+        if decision is not None:
+            return decision
+        return self._apply_claim(name, now, self._claim_probe(name, now))
+
+    async def aallow(self, name: str) -> bool:
+        """`allow` для корутин: обращения к БД выполняются в пуле потоков, а не в event loop."""
+        if not self.enabled:
+            return True
+        now = self._clock()
+        if self._sync_due(now):
+            await asyncio.to_thread(self._refresh)
+        decision = self._local_decision(name, now)
+        if decision is not None:
+            return decision
+        try:
+            claimed = await asyncio.to_thread(self._claim_probe, name, now)
+        except BaseException:
+            with self._lock:
+                self._circuit(name).claiming = False
+            raise
+        return self._apply_claim(name, now, claimed)
+
+    def _local_decision(self, name: str, now: float) -> bool | None:
+        """Решение по состоянию в памяти; None — пауза истекла и нужно забрать пробу в БД."""
+        with self._lock:
+            circuit = self._circuit(name)
+            if circuit.state == CLOSED:
+                return True
+            if circuit.state == OPEN and now < circuit.open_until:
+                return False
+            if circuit.state == HALF_OPEN and now < circuit.probe_until:
+                return False
+            if circuit.claiming:
+                return False
+            circuit.claiming = True
+        return None
+
+    def _apply_claim(self, name: str, now: float, claimed: bool) -> bool:
+        with self._lock:
+            circuit = self._circuit(name)
+            circuit.claiming = False
+            if claimed:
+                circuit.state = HALF_OPEN
+                circuit.probing = True
+                circuit.probe_until = now + self.probe_timeout_seconds
+                logger.info("llm_circuit_half_open", extra={"circuit": name, "scope": self.scope})
+                return True
+            # Пробу забрал другой процесс: ждём её результата.
+            circuit.state = HALF_OPEN
+            circuit.probing = False
+            circuit.probe_until = max(circuit.probe_until, now + min(self.sync_seconds, 1.0))
+            return False
+
+    def record_success(self, name: str) -> None:
+        if not self.enabled:
+            return
+        now = self._clock()
+        with self._lock:
+            circuit = self._circuit(name)
+            if circuit.state == CLOSED:
+                self._push_event(circuit, now, ok=True)
+                return
+            if not circuit.probing:
+                return
+        self._close(name)
+
+    def record_failure(self, name: str, *, error: str | None = None, trip: bool = False) -> bool:
+        """Учитывает ошибку; возвращает True, если цепь в результате открылась."""
+        if not self.enabled:
+            return False
+        now = self._clock()
+        with self._lock:
+            circuit = self._circuit(name)
+            if circuit.state == CLOSED:
+                self._push_event(circuit, now, ok=False)
+                failures = sum(1 for _, ok in circuit.events if not ok)
+                total = len(circuit.events)
+                if not trip and (total < self.min_requests or failures / total < self.failure_rate):
+                    return False
+            elif not circuit.probing:
+                return False
+        self._open(name, now, error=error)
+        return True
+
+    def release(self, name: str) -> None:
+        """Отдаёт пробу, не получившую результата (запрос отменён), чтобы её забрал следующий запрос."""
+        with self._lock:
+            circuit = self._circuits.get(name)
+            if circuit is None or not circuit.probing:
+                return
+            circuit.probing = False
+            circuit.probe_until = 0.0
+        self._write(name, state=HALF_OPEN, probe_until=0.0)
+
+    def holds_probe(self, name: str) -> bool:
+        with self._lock:
+            circuit = self._circuits.get(name)
+            return circuit is not None and circuit.probing
+
+    def state(self, name: str) -> str:
+        self._sync(self._clock())
+        with self._lock:
+            return self._circuit(name).state
+
+    def snapshot(self) -> dict[str, str]:
+        with self._lock:
+            return {name: circuit.state for name, circuit in self._circuits.items()}
+
+    def _push_event(self, circuit: _Circuit, now: float, *, ok: bool) -> None:
+        circuit.events.append((now, ok))
+        while circuit.events and now - circuit.events[0][0] > self.window_seconds:
+            circuit.events.popleft()
+
+    def _open(self, name: str, now: float, *, error: str | None) -> None:
+        open_until = now + self.open_seconds
+        with self._lock:
+            circuit = self._circuit(name)
+            circuit.state = OPEN
+            circuit.open_until = open_until
+            circuit.probe_until = 0.0
+            circuit.probing = False
+            circuit.events.clear()
+        logger.warning(
+            "llm_circuit_opened",
+            extra={"circuit": name, "scope": self.scope, "open_seconds": self.open_seconds},
+        )
+        self._write(name, state=OPEN, open_until=open_until, opened_at=now, error=error)
+
+    def _close(self, name: str) -> None:
+        with self._lock:
+            circuit = self._circuit(name)
+            circuit.state = CLOSED
+            circuit.open_until = 0.0
+            circuit.probe_until = 0.0
+            circuit.probing = False
+            circuit.events.clear()
+        logger.info("llm_circuit_closed", extra={"circuit": name, "scope": self.scope})
+        self._write(name, state=CLOSED, open_until=0.0, probe_until=0.0)
+
+    def _sync(self, now: float) -> None:
+        if self._sync_due(now):
+            self._refresh()
+
+    def _sync_due(self, now: float) -> bool:
+        with self._lock:
+            if self._synced_at is not None and now - self._synced_at < self.sync_seconds:
+                return False
+            self._synced_at = now
+            return True
+
+    def _refresh(self) -> None:
+        """Подтягивает состояние цепей, изменённое другими процессами."""
+        try:
+            from sqlalchemy import select
+
+            from app.db.models import LLMCircuitBreakerState
+            from app.db.session import get_session_factory
+
+            session = get_session_factory()()
+        except Exception:
+            return
+        try:
+            rows = session.execute(
+                select(LLMCircuitBreakerState).where(LLMCircuitBreakerState.scope == self.scope)
+            ).scalars().all()
+            remote = {
+                row.name: (row.state, _to_epoch(row.open_until), _to_epoch(row.probe_until))
+                for row in rows
+            }
+        except Exception as exc:
+            logger.warning(
+                "llm_circuit_sync_failed",
+                extra={"scope": self.scope, "error": f"{exc.__class__.__name__}: {exc}"},
+            )
+            return
+        finally:
+            session.close()
+        with self._lock:
+            for name, (state, open_until, probe_until) in remote.items():
+                circuit = self._circuit(name)
+                if circuit.probing and state == HALF_OPEN:
+                    continue
+                if state != circuit.state:
+                    circuit.events.clear()
+                circuit.state = state
+                circuit.open_until = open_until
+                circuit.probe_until = probe_until
+                circuit.probing = False
+
+    def _claim_probe(self, name: str, now: float) -> bool:
+        """Атомарно переводит цепь в half-open; True только у одного из конкурирующих процессов."""
+        try:
+            from sqlalchemy import and_, or_, update
+
+            from app.db.models import LLMCircuitBreakerState
+            from app.db.session import get_session_factory
+
+            session = get_session_factory()()
+        except Exception:
+            return True
+        try:
+            now_dt = _to_datetime(now)
+            result = session.execute(
+                update(LLMCircuitBreakerState)
+                .where(
+                    LLMCircuitBreakerState.name == name,
+                    or_(
+                        and_(
+                            LLMCircuitBreakerState.state == OPEN,
+                            LLMCircuitBreakerState.open_until <= now_dt,
+                        ),
+                        and_(
+                            LLMCircuitBreakerState.state == HALF_OPEN,
+                            or_(
+                                LLMCircuitBreakerState.probe_until.is_(None),
+                                LLMCircuitBreakerState.probe_until <= now_dt,
+                            ),
+                        ),
+                    ),
+                )
+                .values(
+                    state=HALF_OPEN,
+                    probe_until=_to_datetime(now + self.probe_timeout_seconds),
+                    updated_at=now_dt,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+            if result.rowcount:
+                return True
+            # Строки может не быть, если цепь открыли, когда БД была недоступна.
+            return session.get(LLMCircuitBreakerState, name) is None
+        except Exception as exc:
+            session.rollback()
+            logger.warning(
+                "llm_circuit_write_failed",
+                extra={"circuit": name, "error": f"{exc.__class__.__name__}: {exc}"},
+            )
+            return True
+        finally:
+            session.close()
+
+    def _write(self, name: str, **values) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write_now(name, **values)
+            return
+        # Переход случился в корутине (record_* из agenerate): запись в БД не должна держать event loop.
+        loop.run_in_executor(self._writer_executor(), lambda: self._write_now(name, **values))
+
+    def _writer_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"llm-circuit-{self.scope}")
+            return self._writer
+
+    def _write_now(
+        self,
+        name: str,
+        *,
+        state: str,
+        open_until: float | None = None,
+        probe_until: float | None = None,
+        opened_at: float | None = None,
+        error: str | None = None,
+    ) -> None:
+        try:
+            from sqlalchemy.exc import IntegrityError
+
+            from app.db.models import LLMCircuitBreakerState
+            from app.db.session import get_session_factory
+
+            session = get_session_factory()()
+        except Exception:
+            return
+        try:
+            for attempt in range(2):
+                record = session.get(LLMCircuitBreakerState, name)
+                if record is None:
+                    record = LLMCircuitBreakerState(name=name, scope=self.scope, trips=0)
+                    session.add(record)
+                record.state = state
+                if open_until is not None:
+                    record.open_until = _to_datetime(open_until) if open_until else None
+                if probe_until is not None:
+                    record.probe_until = _to_datetime(probe_until) if probe_until else None
+                if opened_at is not None:
+                    record.opened_at = _to_datetime(opened_at)
+                    record.trips = (record.trips or 0) + 1
+                    record.last_error = (error or "")[:1000] or None
+                try:
+                    session.commit()
+                    return
+                except IntegrityError:
+                    # Строку одновременно создал другой процесс — повторяем как обновление.
+                    session.rollback()
+                    if attempt:
+                        raise
+        except Exception as exc:
+            session.rollback()
+            logger.warning(
+                "llm_circuit_write_failed",
+                extra={"circuit": name, "error": f"{exc.__class__.__name__}: {exc}"},
+            )
+        finally:
+            session.close()
+
+
+def build_provider_circuit_breaker() -> LLMCircuitBreaker:
+    return LLMCircuitBreaker(
+        scope="provider",
+        enabled=getattr(settings, "llm_circuit_breaker_enabled", True),
+        window_seconds=getattr(settings, "llm_circuit_window_seconds", 60),
+        min_requests=getattr(settings, "llm_circuit_min_requests", 5),
+        failure_rate=getattr(settings, "llm_circuit_failure_rate", 0.5),
+        open_seconds=getattr(settings, "llm_circuit_open_seconds", 30),
+        probe_timeout_seconds=getattr(settings, "llm_circuit_probe_timeout_seconds", 60),
+        sync_seconds=getattr(settings, "llm_circuit_sync_seconds", 2),
+    )
+
+
+def build_key_circuit_breaker() -> LLMCircuitBreaker:
+    # Цепь ключа открывается сразу по ошибке авторизации и держится столько же, сколько прежняя блокировка.
+    return LLMCircuitBreaker(
+        scope="key",
+        enabled=getattr(settings, "llm_circuit_breaker_enabled", True),
+        open_seconds=getattr(settings, "llm_auth_error_block_seconds", 3600),
+        probe_timeout_seconds=getattr(settings, "llm_circuit_probe_timeout_seconds", 60),
+        sync_seconds=getattr(settings, "llm_circuit_sync_seconds", 2),
+    )
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from app.core.config import settings
+from app.core.llm_key_store import LLMKeyItem
+
+logger = logging.getLogger(__name__)
+
+# (отпечаток ключа, модель, версия промпта): cachedContents Gemini привязаны к проекту ключа и модели.
+_EntryKey = tuple[str, str, str]
+CreateCachedContent = Callable[[LLMKeyItem, str, str, int], Awaitable[str]]
+
+
+def prompt_version(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def _key_fingerprint(key_item: LLMKeyItem) -> str:
+    return hashlib.sha256(key_item.key.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class _CachedContent:
+    name: str
+    expires_at: float
+
+
+class GeminiContextCacheRegistry:
+    """Реестр `cachedContents` Gemini для статичного системного промпта тарифа.
+
+    - Кэш создаётся, когда промпт запрошен `min_uses` раз: разовые промпты (повтор после
+      нарушения безопасности) не создают кэш, который больше не понадобится.
+    - За `renew_before_seconds` до истечения создаётся новый кэш; старый доживает свой TTL,
+      так что запросы в полёте не ломаются.
+    - Если создать кэш не удалось (например, промпт короче минимума провайдера), на
+      `failure_backoff_seconds` промпт уходит без кэша — как `systemInstruction`.
+
+    Одновременные запросы могут создать кэш дважды: лишний просто истечёт по TTL.
+    """
+
+    def __init__(
+        self,
+        *,
+        enabled: bool = False,
+        ttl_seconds: int = 3600,
+        renew_before_seconds: int = 300,
+        min_uses: int = 2,
+        failure_backoff_seconds: int = 600,
+        clock=time.time,
+    ) -> None:
+        self.enabled = bool(enabled)
+        self.ttl_seconds = max(int(ttl_seconds or 0), 60)
+        self.renew_before_seconds = min(max(int(renew_before_seconds or 0), 0), self.ttl_seconds // 2)
+        self.min_uses = max(int(min_uses or 0), 1)
+        self.failure_backoff_seconds = max(int(failure_backoff_seconds or 0), 0)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: dict[_EntryKey, _CachedContent] = {}
+        self._uses: dict[_EntryKey, int] = {}
+        self._failed_until: dict[_EntryKey, float] = {}
+
+    @staticmethod
+    def _entry_key(key_item: LLMKeyItem, model: str, prompt: str) -> _EntryKey:
+        return _key_fingerprint(key_item), model, prompt_version(prompt)
+
+    async def aresolve(
+        self,
+        key_item: LLMKeyItem,
+        model: str,
+        prompt: str,
+        create: CreateCachedContent,
+    ) -> str | None:
+        """Имя действующего cachedContent для промпта или None (промпт отправляется целиком)."""
+        if not self.enabled:
+            return None
+        entry_key = self._entry_key(key_item, model, prompt)
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None and now < entry.expires_at - self.renew_before_seconds:
+                return entry.name
+            if now < self._failed_until.get(entry_key, 0.0):
+                return entry.name if entry is not None and now < entry.expires_at else None
+            uses = self._uses.get(entry_key, 0) + 1
+            self._uses[entry_key] = uses
+            if entry is None and uses < self.min_uses:
+                return None
+        try:
+            name = await create(key_item, model, prompt, self.ttl_seconds)
+        except Exception as exc:
+            with self._lock:
+                self._failed_until[entry_key] = now + self.failure_backoff_seconds
+            logger.warning(
+                "llm_context_cache_create_failed",
+                extra={"model": model, "prompt_version": entry_key[2], "error": str(exc)},
+            )
+            return entry.name if entry is not None and now < entry.expires_at else None
+        with self._lock:
+            self._entries[entry_key] = _CachedContent(name=name, expires_at=now + self.ttl_seconds)
+            self._failed_until.pop(entry_key, None)
+        logger.info(
+            "llm_context_cache_created",
+            extra={"model": model, "prompt_version": entry_key[2], "renewed": entry is not None},
+        )
+        return name
+
+    def invalidate(self, key_item: LLMKeyItem, model: str, prompt: str) -> None:
+        """Провайдер не нашёл кэш (удалён или истёк раньше срока): следующий запрос создаст новый."""
+        with self._lock:
+            self._entries.pop(self._entry_key(key_item, model, prompt), None)
+
+    def snapshot(self) -> dict[str, float]:
+        """Версии промптов с действующим кэшем и секунды до истечения (для логов и отладки)."""
+        now = self._clock()
+        with self._lock:
+            return {
+                f"{model}:{version}": round(entry.expires_at - now, 1)
+                for (_fingerprint, model, version), entry in self._entries.items()
+                if entry.expires_at > now
+            }
+
+
+def build_gemini_context_cache_registry() -> GeminiContextCacheRegistry:
+    return GeminiContextCacheRegistry(
+        enabled=getattr(settings, "llm_context_cache_enabled", False),
+        ttl_seconds=getattr(settings, "llm_context_cache_ttl_seconds", 3600),
+        renew_before_seconds=getattr(settings, "llm_context_cache_renew_before_seconds", 300),
+        min_uses=getattr(settings, "llm_context_cache_min_uses", 2),
+    )
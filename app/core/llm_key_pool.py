@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass, field
+
+from app.core.llm_key_store import LLMKeyItem
+
+# Вес нового замера в скользящей (EWMA) латентности ключа.
+_LATENCY_EWMA_ALPHA = 0.3
+_LATENCY_MIN_SAMPLES = 3
+
+
+@dataclass
+class _KeyState:
+    in_flight: int = 0
+    tokens: float | None = None
+    refilled_at: float = 0.0
+    last_acquired_at: float = 0.0
+    latency_ewma: float | None = None
+    latency_samples: int = 0
+    consecutive_failures: int = 0
+    unhealthy_until: float = 0.0
+    unhealthy_reason: str | None = None
+    stats: dict[str, int] = field(default_factory=lambda: {"success": 0, "failure": 0, "saturated": 0})
+
+
+class LLMKeyPool:
+    """Распределяет запросы по ключам одного провайдера.
+
+    - Порядок: сначала здоровые ключи со свободным слотом, среди них — с наименьшим числом
+      запросов в работе, затем давно не использованные; при равенстве сохраняется порядок
+      `resolve_llm_keys` (т.е. `LLMApiKey.priority`).
+    - На ключ действуют лимит одновременных запросов и token bucket на запросы в минуту (0 — без лимита).
+    - Ключ заранее помечается нездоровым после серии ошибок или при устойчиво высокой латентности;
+      такие ключи не пропускаются, а идут в конец очереди.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_in_flight: int = 0,
+        requests_per_minute: int = 0,
+        failure_threshold: int = 3,
+        unhealthy_seconds: float = 60.0,
+        slow_latency_seconds: float = 0.0,
+        clock=time.monotonic,
+    ) -> None:
+        self.max_in_flight = max(int(max_in_flight or 0), 0)
+        self.requests_per_minute = max(int(requests_per_minute or 0), 0)
+        self.failure_threshold = max(int(failure_threshold or 0), 0)
+        self.unhealthy_seconds = max(float(unhealthy_seconds or 0), 0.0)
+        self.slow_latency_seconds = max(float(slow_latency_seconds or 0), 0.0)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._states: dict[tuple[str, str], _KeyState] = {}
+
+    def _state(self, provider: str, key: str) -> _KeyState:
+        state = self._states.get((provider, key))
+        if state is None:
+            state = _KeyState()
+            self._states[(provider, key)] = state
+        return state
+
+    def _refill(self, state: _KeyState, now: float) -> None:
+        if not self.requests_per_minute:
+            return
+        capacity = float(self.requests_per_minute)
+        if state.tokens is None:
+            state.tokens = capacity
+        else:
+            state.tokens = min(capacity, state.tokens + (now - state.refilled_at) * capacity / 60.0)
+        state.refilled_at = now
+
+    def _has_capacity(self, state: _KeyState, now: float) -> bool:
+        self._refill(state, now)
+        if self.max_in_flight and state.in_flight >= self.max_in_flight:
+            return False
+        if self.requests_per_minute and (state.tokens or 0.0) < 1.0:
+            return False
+        return True
+
+    def _is_unhealthy(self, state: _KeyState, now: float) -> bool:
+        return state.unhealthy_until > now
+
+    def order(self, provider: str, keys: list[LLMKeyItem]) -> list[LLMKeyItem]:
+        now = self._clock()
+        with self._lock:
+            ranked = []
+            for index, item in enumerate(keys):
+                state = self._state(provider, item.key)
+                ranked.append(
+                    (
+                        self._is_unhealthy(state, now),
+                        not self._has_capacity(state, now),
+                        state.in_flight,
+                        state.last_acquired_at,
+                        index,
+                        item,
+                    )
+                )
+        ranked.sort(key=lambda row: row[:5])
+        return [row[-1] for row in ranked]
+
+    def has_capacity(self, provider: str, keys: list[LLMKeyItem]) -> bool:
+        now = self._clock()
+        with self._lock:
+            return any(self._has_capacity(self._state(provider, item.key), now) for item in keys)
+
+    def seconds_until_capacity(self, provider: str, keys: list[LLMKeyItem]) -> float:
+        """Оценка ожидания свободного токена; для слотов in-flight — короткий шаг опроса."""
+        if not keys:
+            return 0.0
+        now = self._clock()
+        waits: list[float] = []
+        with self._lock:
+            for item in keys:
+                state = self._state(provider, item.key)
+                if self._has_capacity(state, now):
+                    return 0.0
+                if self.max_in_flight and state.in_flight >= self.max_in_flight:
+                    waits.append(0.05)
+                elif self.requests_per_minute:
+                    waits.append((1.0 - (state.tokens or 0.0)) * 60.0 / self.requests_per_minute)
+        return max(min(waits, default=0.05), 0.01)
+
+    def try_acquire(self, provider: str, key_item: LLMKeyItem) -> bool:
+        now = self._clock()
+        with self._lock:
+            state = self._state(provider, key_item.key)
+            if not self._has_capacity(state, now):
+                state.stats["saturated"] += 1
+                return False
+            state.in_flight += 1
+            state.last_acquired_at = now
+            if self.requests_per_minute:
+                state.tokens = (state.tokens or 0.0) - 1.0
+            return True
+
+    def release(
+        self,
+        provider: str,
+        key_item: LLMKeyItem,
+        *,
+        success: bool,
+        latency_seconds: float | None = None,
+    ) -> str | None:
+        """Освобождает слот и обновляет здоровье ключа; возвращает причину, если ключ стал нездоровым."""
+        now = self._clock()
+        with self._lock:
+            state = self._state(provider, key_item.key)
+            state.in_flight = max(state.in_flight - 1, 0)
+            became_unhealthy: str | None = None
+            if success:
+                state.stats["success"] += 1
+                state.consecutive_failures = 0
+                if latency_seconds is not None:
+                    if state.latency_ewma is None:
+                        state.latency_ewma = latency_seconds
+                    else:
+                        state.latency_ewma += _LATENCY_EWMA_ALPHA * (latency_seconds - state.latency_ewma)
+                    state.latency_samples += 1
+                    if (
+                        self.slow_latency_seconds
+                        and state.latency_samples >= _LATENCY_MIN_SAMPLES
+                        and state.latency_ewma > self.slow_latency_seconds
+                        and not self._is_unhealthy(state, now)
+                    ):
+                        became_unhealthy = "slow"
+            else:
+                state.stats["failure"] += 1
+                state.consecutive_failures += 1
+                if (
+                    self.failure_threshold
+                    and state.consecutive_failures >= self.failure_threshold
+                    and not self._is_unhealthy(state, now)
+                ):
+                    became_unhealthy = "errors"
+            if became_unhealthy:
+                state.unhealthy_until = now + self.unhealthy_seconds
+                state.unhealthy_reason = became_unhealthy
+                # Проверка после паузы начинается с чистого счёта.
+                state.consecutive_failures = 0
+                state.latency_ewma = None
+                state.latency_samples = 0
+            return became_unhealthy
+
+    def cancel(self, provider: str, key_item: LLMKeyItem) -> None:
+        """Освобождает слот прерванного запроса, не влияя на здоровье ключа."""
+        with self._lock:
+            state = self._state(provider, key_item.key)
+            state.in_flight = max(state.in_flight - 1, 0)
+
+    def snapshot(self, provider: str) -> list[dict[str, object]]:
+        now = self._clock()
+        with self._lock:
+            rows: list[dict[str, object]] = []
+            for (state_provider, _key), state in self._states.items():
+                if state_provider != provider:
+                    continue
+                self._refill(state, now)
+                rows.append(
+                    {
+                        "in_flight": state.in_flight,
+                        "tokens": None if state.tokens is None else round(state.tokens, 2),
+                        "latency_ewma": None if state.latency_ewma is None else round(state.latency_ewma, 3),
+                        "healthy": not self._is_unhealthy(state, now),
+                        "unhealthy_reason": state.unhealthy_reason if self._is_unhealthy(state, now) else None,
+                        **state.stats,
+                    }
+                )
+            return rows
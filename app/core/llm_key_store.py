@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+import asyncio
+import atexit
 from dataclasses import dataclass
 from datetime import datetime, timezone
 import logging
+import threading
+import time
 
 
 @dataclass(frozen=True)
@@ -301,6 +305,254 @@ def resolve_llm_keys(
     return resolved_keys
 
 
+class LLMKeyRegistry:
+    """Кэш результата `resolve_llm_keys` в памяти процесса.
+
+    Запись живёт `LLM_KEY_CACHE_TTL_SECONDS` и сбрасывается при смене версии: админские
+    эндпоинты `/api/llm-keys` вызывают `invalidate()` после commit. Другие процессы
+    (бот, воркер отчётов) увидят изменения не позже чем через TTL.
+    """
+
+    def __init__(self, *, ttl_seconds: float | None = None, clock=time.monotonic) -> None:
+        self._ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._version = 0
+        self._entries: dict[tuple[str, str | None, str | None], tuple[int, float, list[LLMKeyItem]]] = {}
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def _ttl(self) -> float:
+        if self._ttl_seconds is not None:
+            return max(float(self._ttl_seconds), 0.0)
+        try:
+            from app.core.config import settings
+
+            return max(float(getattr(settings, "llm_key_cache_ttl_seconds", 30) or 0), 0.0)
+        except Exception:
+            return 0.0
+
+    def resolve(
+        self,
+        *,
+        provider: str,
+        primary_key: str | None,
+        extra_keys: str | None,
+    ) -> list[LLMKeyItem]:
+        cache_key = (provider, primary_key, extra_keys)
+        now = self._clock()
+        with self._lock:
+            version = self._version
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[0] == version and entry[1] > now:
+                return list(entry[2])
+        keys = resolve_llm_keys(provider=provider, primary_key=primary_key, extra_keys=extra_keys)
+        ttl = self._ttl()
+        # Пустой список не кэшируем: ключ могут добавить в любой момент, а без ключей LLM недоступен.
+        if keys and ttl > 0:
+            with self._lock:
+                if self._version == version:
+                    self._entries[cache_key] = (version, now + ttl, list(keys))
+        return keys
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+
+llm_key_registry = LLMKeyRegistry()
+
+
+def resolve_cached_llm_keys(
+    *,
+    provider: str,
+    primary_key: str | None,
+    extra_keys: str | None,
+) -> list[LLMKeyItem]:
+    return llm_key_registry.resolve(provider=provider, primary_key=primary_key, extra_keys=extra_keys)
+
+
+def invalidate_llm_key_cache() -> None:
+    llm_key_registry.invalidate()
+
+
+@dataclass
+class _PendingKeyUsage:
+    success_delta: int = 0
+    failure_delta: int = 0
+    last_used_at: datetime | None = None
+    last_status_code: int | None = None
+    last_success_at: datetime | None = None
+    last_error: str | None = None
+
+    def merge_older(self, older: "_PendingKeyUsage") -> None:
+        """Добавляет более ранние (не записанные из-за ошибки) события; последние значения остаются свежими."""
+        self.success_delta += older.success_delta
+        self.failure_delta += older.failure_delta
+        if self.last_success_at is None:
+            self.last_success_at = older.last_success_at
+        if self.last_used_at is None:
+            self.last_used_at = older.last_used_at
+            self.last_status_code = older.last_status_code
+            self.last_error = older.last_error
+
+
+class LLMKeyUsageBuffer:
+    """Write-behind статистика использования ключей.
+
+    События копятся в памяти и раз в `LLM_KEY_USAGE_FLUSH_SECONDS` пишутся одним UPDATE на ключ
+    с инкрементом счётчиков в SQL (без SELECT и без гонок между процессами). При ошибке записи
+    накопленное возвращается в буфер; при выходе процесса буфер сбрасывается через atexit.
+    """
+
+    def __init__(self, *, flush_interval_seconds: float | None = None) -> None:
+        self._flush_interval_seconds = flush_interval_seconds
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: dict[int, _PendingKeyUsage] = {}
+        self._flusher: threading.Thread | None = None
+        self._stop_event = threading.Event()
+
+    def _interval(self) -> float:
+        if self._flush_interval_seconds is not None:
+            return max(float(self._flush_interval_seconds), 0.0)
+        try:
+            from app.core.config import settings
+
+            return max(float(getattr(settings, "llm_key_usage_flush_seconds", 5) or 0), 0.0)
+        except Exception:
+            return 0.0
+
+    @property
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def record(
+        self,
+        db_id: int,
+        *,
+        success: bool,
+        status_code: int | None = None,
+        error_message: str | None = None,
+        now: datetime | None = None,
+    ) -> None:
+        now = now or datetime.now(timezone.utc)
+        with self._lock:
+            usage = self._pending.setdefault(db_id, _PendingKeyUsage())
+            usage.last_used_at = now
+            usage.last_status_code = status_code
+            if success:
+                usage.success_delta += 1
+                usage.last_success_at = now
+                usage.last_error = None
+            else:
+                usage.failure_delta += 1
+                usage.last_error = error_message
+        interval = self._interval()
+        if interval <= 0:
+            self._flush_now()
+            return
+        self._ensure_flusher(interval)
+
+    def _flush_now(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        # Вызов из корутины (agenerate/astream): запись в БД — в пуле потоков, а не в event loop.
+        loop.run_in_executor(None, self.flush)
+
+    def _ensure_flusher(self, interval: float) -> None:
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._stop_event.clear()
+            self._flusher = threading.Thread(
+                target=self._flush_loop,
+                args=(interval,),
+                name="llm-key-usage-flusher",
+                daemon=True,
+            )
+            self._flusher.start()
+
+    def _flush_loop(self, interval: float) -> None:
+        while not self._stop_event.wait(interval):
+            self.flush()
+
+    def flush(self) -> int:
+        """Пишет накопленное; возвращает число обновлённых ключей."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            try:
+                self._write(batch)
+            except Exception as exc:
+                with self._lock:
+                    for db_id, older in batch.items():
+                        newer = self._pending.get(db_id)
+                        if newer is None:
+                            self._pending[db_id] = older
+                        else:
+                            newer.merge_older(older)
+                logger.warning(
+                    "llm_key_usage_flush_failed",
+                    extra={"keys": len(batch), "error": f"{exc.__class__.__name__}: {exc}"},
+                )
+                return 0
+            return len(batch)
+
+    def _write(self, batch: dict[int, _PendingKeyUsage]) -> None:
+        from app.db.models import LLMApiKey
+        from app.db.session import get_session_factory
+        from sqlalchemy import func, update
+
+        session = get_session_factory()()
+        try:
+            for db_id, usage in batch.items():
+                values: dict[object, object] = {
+                    LLMApiKey.success_count: func.coalesce(LLMApiKey.success_count, 0) + usage.success_delta,
+                    LLMApiKey.failure_count: func.coalesce(LLMApiKey.failure_count, 0) + usage.failure_delta,
+                    LLMApiKey.last_used_at: usage.last_used_at,
+                    LLMApiKey.last_status_code: usage.last_status_code,
+                    LLMApiKey.last_error: usage.last_error,
+                }
+                if usage.last_success_at is not None:
+                    values[LLMApiKey.last_success_at] = usage.last_success_at
+                session.execute(
+                    update(LLMApiKey)
+                    .where(LLMApiKey.id == db_id)
+                    .values(values)
+                    .execution_options(synchronize_session=False)
+                )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def close(self) -> None:
+        self._stop_event.set()
+        self.flush()
+
+
+llm_key_usage_buffer = LLMKeyUsageBuffer()
+atexit.register(llm_key_usage_buffer.close)
+
+
+def flush_llm_key_usage() -> int:
+    return llm_key_usage_buffer.flush()
+
+
 def record_llm_key_usage(
     key_item: LLMKeyItem,
     *,
@@ -310,36 +562,9 @@ def record_llm_key_usage(
 ) -> None:
     if not key_item.db_id:
         return
-
-    try:
-        from app.db.models import LLMApiKey
-        from app.db.session import get_session_factory
-    except Exception:
-        return
-
-    try:
-        session_factory = get_session_factory()
-        session = session_factory()
-    except Exception:
-        return
-
-    try:
-        record = session.get(LLMApiKey, key_item.db_id)
-        if not record:
-            session.close()
-            return
-        now = datetime.now(timezone.utc)
-        record.last_used_at = now
-        record.last_status_code = status_code
-        if success:
-            record.last_success_at = now
-            record.last_error = None
-            record.success_count = (record.success_count or 0) + 1
-        else:
-            record.last_error = error_message
-            record.failure_count = (record.failure_count or 0) + 1
-        session.commit()
-    except Exception:
-        session.rollback()
-    finally:
-        session.close()
+    llm_key_usage_buffer.record(
+        key_item.db_id,
+        success=success,
+        status_code=status_code,
+        error_message=error_message,
+    )
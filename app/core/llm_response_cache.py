@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.llm_router import LLMResponse
+from app.core.report_job_stages import STAGE_LLM
+from app.db.models import LLMResponseCacheEntry, ReportJobStage
+from app.db.session import get_session
+
+logger = logging.getLogger(__name__)
+
+# Меняется при изменении формата ключа: старые записи просто перестают находиться и вытесняются по TTL.
+CACHE_KEY_VERSION = 1
+# Поля facts-pack, которые меняются от вызова к вызову и не влияют на ответ.
+VOLATILE_FACTS_FIELDS = frozenset({"generated_at"})
+
+_PROVIDER_MODEL_SETTINGS = {"gemini": "gemini_model", "openai": "openai_model"}
+
+
+def _normalize_facts_pack(facts_pack: dict[str, Any]) -> dict[str, Any]:
+    return {key: value for key, value in facts_pack.items() if key not in VOLATILE_FACTS_FIELDS}
+
+
+def _models_signature() -> list[str]:
+    signature = []
+    for provider in (settings.llm_primary, settings.llm_fallback):
+        model_setting = _PROVIDER_MODEL_SETTINGS.get(provider or "")
+        model = getattr(settings, model_setting, "") if model_setting else ""
+        signature.append(f"{provider}:{model}")
+    return signature
+
+
+def build_llm_response_cache_key(facts_pack: dict[str, Any], prompt: str) -> str:
+    """Ключ по содержимому: нормализованный facts-pack, хэш итогового промпта и модели провайдеров.
+
+    В промпт уже входит действующая версия тарифного промпта (админка или `.env.prompts`),
+    поэтому её правка сама по себе даёт новый ключ.
+    """
+    payload = {
+        "version": CACHE_KEY_VERSION,
+        "facts_pack": _normalize_facts_pack(facts_pack),
+        "prompt_sha256": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+        "models": _models_signature(),
+    }
+    serialized = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """Кэш ответов LLM в таблице `llm_response_cache`, общий для бота и воркеров.
+
+    Запись живёт `ttl_seconds`; при превышении `max_entries` вытесняются давно не использованные.
+    Ошибки БД только логируются: без кэша генерация идёт как обычно.
+    """
+
+    def __init__(
+        self,
+        *,
+        enabled: bool = False,
+        ttl_seconds: int = 86400,
+        max_entries: int = 1000,
+        clock=time.time,
+    ) -> None:
+        self.enabled = bool(enabled)
+        self.ttl_seconds = max(int(ttl_seconds or 0), 1)
+        self.max_entries = max(int(max_entries or 0), 1)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._stats: Counter[str] = Counter()
+
+    def _now(self) -> datetime:
+        return datetime.fromtimestamp(self._clock(), tz=timezone.utc)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, cache_key: str) -> LLMResponse | None:
+        if not self.enabled:
+            return None
+        now = self._now()
+        try:
+            with get_session() as session:
+                entry = session.get(LLMResponseCacheEntry, cache_key)
+                expires_at = entry.expires_at if entry is not None else None
+                if expires_at is not None and expires_at.tzinfo is None:
+                    expires_at = expires_at.replace(tzinfo=timezone.utc)
+                if entry is None or expires_at is None or expires_at <= now:
+                    self._count("misses")
+                    return None
+                session.execute(
+                    update(LLMResponseCacheEntry)
+                    .where(LLMResponseCacheEntry.cache_key == cache_key)
+                    .values(hits=LLMResponseCacheEntry.hits + 1, used_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+                response = LLMResponse(text=entry.text, provider=entry.provider, model=entry.model)
+        except Exception as exc:
+            self._count("errors")
+            logger.warning("llm_response_cache_read_failed", extra={"error": str(exc)})
+            return None
+        self._count("hits")
+        return response
+
+    def put(self, cache_key: str, response: LLMResponse) -> None:
+        if not self.enabled or not response.text:
+            return
+        now = self._now()
+        try:
+            with get_session() as session:
+                entry = session.get(LLMResponseCacheEntry, cache_key)
+                if entry is None:
+                    entry = LLMResponseCacheEntry(cache_key=cache_key, hits=0, created_at=now)
+                    session.add(entry)
+                entry.provider = response.provider
+                entry.model = response.model
+                entry.text = response.text
+                entry.used_at = now
+                entry.expires_at = now + timedelta(seconds=self.ttl_seconds)
+                session.flush()
+                self._evict(session, now)
+        except IntegrityError:
+            # Тот же ответ параллельно записал другой процесс.
+            return
+        except Exception as exc:
+            self._count("errors")
+            logger.warning("llm_response_cache_write_failed", extra={"error": str(exc)})
+            return
+        self._count("stores")
+
+    def _evict(self, session: Session, now: datetime) -> None:
+        session.execute(
+            delete(LLMResponseCacheEntry)
+            .where(LLMResponseCacheEntry.expires_at <= now)
+            .execution_options(synchronize_session=False)
+        )
+        total = session.execute(select(func.count(LLMResponseCacheEntry.cache_key))).scalar_one()
+        overflow = total - self.max_entries
+        if overflow <= 0:
+            return
+        stale_keys = select(LLMResponseCacheEntry.cache_key).order_by(
+            LLMResponseCacheEntry.used_at.asc()
+        ).limit(overflow)
+        session.execute(
+            delete(LLMResponseCacheEntry)
+            .where(LLMResponseCacheEntry.cache_key.in_(stale_keys.scalar_subquery()))
+            .execution_options(synchronize_session=False)
+        )
+        self._count("evictions")
+
+    def stats(self) -> dict[str, int]:
+        """Счётчики этого процесса: hits, misses, stores, evictions, errors."""
+        with self._lock:
+            return dict(self._stats)
+
+
+def build_llm_response_cache() -> LLMResponseCache:
+    return LLMResponseCache(
+        enabled=getattr(settings, "llm_response_cache_enabled", False),
+        ttl_seconds=getattr(settings, "llm_response_cache_ttl_seconds", 86400),
+        max_entries=getattr(settings, "llm_response_cache_max_entries", 1000),
+    )
+
+
+def collect_llm_response_cache_metrics(
+    session: Session,
+    *,
+    since: datetime | None = None,
+    limit: int = 20000,
+) -> dict[str, Any]:
+    """Размер кэша и попадания/промахи за окно (по умолчанию сутки) по этапам `llm` заданий."""
+    since = since or datetime.now(timezone.utc) - timedelta(hours=24)
+    entries, total_hits = session.execute(
+        select(
+            func.count(LLMResponseCacheEntry.cache_key),
+            func.coalesce(func.sum(LLMResponseCacheEntry.hits), 0),
+        )
+    ).one()
+    rows = session.execute(
+        select(ReportJobStage.metadata_json)
+        .where(ReportJobStage.stage == STAGE_LLM, ReportJobStage.finished_at >= since)
+        .order_by(ReportJobStage.finished_at.desc())
+        .limit(limit)
+    ).scalars()
+    outcomes: Counter[str] = Counter()
+    for metadata in rows:
+        outcome = (metadata or {}).get("cache")
+        if outcome in {"hit", "miss"}:
+            outcomes[outcome] += 1
+    lookups = outcomes["hit"] + outcomes["miss"]
+    return {
+        "enabled": bool(getattr(settings, "llm_response_cache_enabled", False)),
+        "entries": int(entries or 0),
+        "total_hits": int(total_hits or 0),
+        "hits": outcomes["hit"],
+        "misses": outcomes["miss"],
+        "hit_rate": round(outcomes["hit"] / lookups, 3) if lookups else None,
+    }
+
+
+llm_response_cache = build_llm_response_cache()
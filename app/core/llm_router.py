@@ -1,15 +1,30 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
 import time
-from dataclasses import dataclass
-from typing import Any
+from collections import Counter, deque
+from collections.abc import AsyncIterator, Callable
+from contextlib import aclosing
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, NoReturn
 
 import httpx
 
 from app.core.config import settings
-from app.core.llm_key_store import record_llm_key_usage, resolve_llm_keys
+from app.core.llm_context_cache import build_gemini_context_cache_registry, prompt_version
+from app.core.llm_circuit_breaker import (
+    KEY_FAILURE_CATEGORIES,
+    PROVIDER_FAILURE_CATEGORIES,
+    build_key_circuit_breaker,
+    build_provider_circuit_breaker,
+    key_circuit_name,
+)
+from app.core.llm_key_pool import LLMKeyPool
+from app.core.llm_key_store import LLMKeyItem, record_llm_key_usage, resolve_cached_llm_keys
 
 
 @dataclass(frozen=True)
@@ -17,6 +32,16 @@ class LLMResponse:
     text: str
     provider: str
     model: str
+    # При hedging: какой из параллельных запросов победил ("primary" или "hedge").
+    hedge: str | None = None
+
+
+@dataclass(frozen=True)
+class LLMStreamChunk:
+    text: str
+    provider: str
+    model: str
+    hedge: str | None = None
 
 
 class LLMProviderError(RuntimeError):
@@ -42,6 +67,90 @@ class LLMUnavailableError(RuntimeError):
     pass
 
 
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com"
+OPENAI_BASE_URL = "https://api.openai.com"
+
+# Сколько последних латентностей основного провайдера держим для порога hedging.
+_HEDGE_LATENCY_WINDOW = 200
+_HEDGE_MIN_SAMPLES = 20
+
+
+@dataclass(frozen=True)
+class _ProviderCall:
+    """Всё, что нужно для перебора ключей одного провайдера; общее для sync и async пути."""
+
+    provider: str
+    label: str
+    model: str
+    endpoint: str
+    payload: dict[str, Any]
+    api_keys: list[LLMKeyItem]
+    build_headers: Callable[[str], dict[str, str]]
+    fallback_statuses: set[int]
+    extract_text: Callable[[dict[str, Any]], str | None]
+    stream_endpoint: str
+    stream_payload: dict[str, Any]
+    extract_stream_text: Callable[[dict[str, Any]], str | None]
+    # Разрешён ли переход на резервного провайдера после ошибок этого провайдера.
+    fallback: bool
+    # Системный промпт, который можно заменить на cachedContent провайдера (только async путь).
+    context_cache_prompt: str | None = None
+
+
+_STREAM_END = object()
+
+
+class _StreamPump:
+    """Читает стрим в отдельной задаче, чтобы его можно было ждать наперегонки с другим стримом.
+
+    `first` срабатывает на первом фрагменте, на конце стрима или на ошибке до первого фрагмента.
+    """
+
+    def __init__(self, stream: AsyncIterator[LLMStreamChunk]) -> None:
+        self.first = asyncio.Event()
+        self.first_chunk: LLMStreamChunk | None = None
+        self.error: Exception | None = None
+        self._queue: asyncio.Queue[Any] = asyncio.Queue()
+        self._task = asyncio.create_task(self._run(stream))
+
+    async def _run(self, stream: AsyncIterator[LLMStreamChunk]) -> None:
+        try:
+            async with aclosing(stream) as chunks:
+                async for chunk in chunks:
+                    if self.first_chunk is None:
+                        self.first_chunk = chunk
+                    self._queue.put_nowait(chunk)
+                    self.first.set()
+        except Exception as exc:
+            if self.first_chunk is None:
+                self.error = exc
+            self._queue.put_nowait(exc)
+        finally:
+            self._queue.put_nowait(_STREAM_END)
+            self.first.set()
+
+    async def wait_first(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self.first.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def chunks(self) -> AsyncIterator[LLMStreamChunk]:
+        while True:
+            item = await self._queue.get()
+            if item is _STREAM_END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    async def close(self) -> None:
+        if not self._task.done():
+            self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
 class LLMRouter:
     """
     Требования:
@@ -50,6 +159,8 @@ class LLMRouter:
     - Основной провайдер: Gemini. Резервный: OpenAI.
     - При неудаче перебираем ключи по порядку.
     - Прокси используется СТРОГО для LLM (Gemini/OpenAI), если задан LLM_PROXY_URL.
+    - `agenerate` — асинхронный путь с той же ротацией ключей и фолбэком: не занимает поток на время запроса.
+    - `astream` — тот же путь со стримингом (SSE): фолбэк и смена ключа возможны только до первого фрагмента.
     """
 
     def __init__(self) -> None:
@@ -59,19 +170,46 @@ class LLMRouter:
         self._retry_statuses = {429, 500, 502, 503, 504}
 
         timeout_seconds = getattr(settings, "llm_timeout_seconds", 30)
+        self._timeout_seconds = timeout_seconds
         self._auth_error_block_seconds = getattr(settings, "llm_auth_error_block_seconds", 3600)
 
         # Прокси применяется ТОЛЬКО тут (в LLMRouter), т.е. только LLM-трафик уйдет через прокси.
         proxy_url = getattr(settings, "llm_proxy_url", None)
+        self._proxy_url = proxy_url
 
         self._client = self._build_httpx_client(timeout_seconds=timeout_seconds, proxy_url=proxy_url)
+        self._async_client: httpx.AsyncClient | None = None
+        self._async_client_loop: asyncio.AbstractEventLoop | None = None
         self._rate_limit_until: dict[str, float] = {}
+        self._key_pool = LLMKeyPool(
+            max_in_flight=getattr(settings, "llm_key_max_in_flight", 0),
+            requests_per_minute=getattr(settings, "llm_key_requests_per_minute", 0),
+            failure_threshold=getattr(settings, "llm_key_failure_threshold", 3),
+            unhealthy_seconds=getattr(settings, "llm_key_unhealthy_seconds", 60),
+            slow_latency_seconds=getattr(settings, "llm_key_slow_latency_seconds", 0),
+        )
+        # Состояние circuit breaker общее для всех процессов (таблица llm_circuit_breakers).
+        self._provider_circuit = build_provider_circuit_breaker()
+        self._key_circuit = build_key_circuit_breaker()
+        self._primary_latencies: deque[float] = deque(maxlen=_HEDGE_LATENCY_WINDOW)
+        # Для стрима порог hedging считается по времени до первого фрагмента, а не до полного ответа.
+        self._primary_first_chunk_latencies: deque[float] = deque(maxlen=_HEDGE_LATENCY_WINDOW)
+        self._hedge_launches: deque[float] = deque()
+        self._hedge_stats: Counter[str] = Counter()
+        self._context_cache = build_gemini_context_cache_registry()
 
-    def _build_httpx_client(self, *, timeout_seconds: int, proxy_url: str | None) -> httpx.Client:
+    def _build_httpx_client(
+        self,
+        *,
+        timeout_seconds: int,
+        proxy_url: str | None,
+        client_cls: type[httpx.Client] | type[httpx.AsyncClient] = httpx.Client,
+        **client_kwargs: Any,
+    ) -> Any:
         timeout = httpx.Timeout(timeout_seconds)
 
         if not proxy_url:
-            return httpx.Client(timeout=timeout)
+            return client_cls(timeout=timeout, **client_kwargs)
 
         # Совместимость с разными версиями httpx:
         # - часть версий поддерживает proxies={...}
@@ -79,70 +217,404 @@ class LLMRouter:
         proxies = {"http://": proxy_url, "https://": proxy_url}
 
         try:
-            return httpx.Client(timeout=timeout, proxies=proxies)  # type: ignore[arg-type]
+            return client_cls(timeout=timeout, proxies=proxies, **client_kwargs)  # type: ignore[arg-type]
         except TypeError:
             try:
-                return httpx.Client(timeout=timeout, proxy=proxy_url)  # type: ignore[call-arg]
+                return client_cls(timeout=timeout, proxy=proxy_url, **client_kwargs)  # type: ignore[call-arg]
             except TypeError:
                 # Если вдруг версия совсем древняя/нестандартная — работаем без прокси, но логируем.
                 self._logger.warning("llm_proxy_not_supported_by_httpx")
-                return httpx.Client(timeout=timeout)
+                return client_cls(timeout=timeout, **client_kwargs)
             except Exception as exc:
                 self._logger.warning(
                     "llm_proxy_init_failed",
                     extra={"error": str(exc)},
                 )
-                return httpx.Client(timeout=timeout)
+                return client_cls(timeout=timeout, **client_kwargs)
         except Exception as exc:
             self._logger.warning(
                 "llm_proxy_init_failed",
                 extra={"error": str(exc)},
             )
-            return httpx.Client(timeout=timeout)
+            return client_cls(timeout=timeout, **client_kwargs)
+
+    def _build_async_client(self) -> httpx.AsyncClient:
+        max_connections = max(int(getattr(settings, "llm_max_connections", 100) or 100), 1)
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=float(getattr(settings, "llm_keepalive_expiry_seconds", 60) or 60),
+        )
+        http2 = bool(getattr(settings, "llm_http2_enabled", True))
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                # HTTP/2 в httpx требует пакет h2 (httpx[http2]); без него остаёмся на HTTP/1.1 keep-alive.
+                self._logger.info("llm_http2_unavailable")
+                http2 = False
+        return self._build_httpx_client(
+            timeout_seconds=self._timeout_seconds,
+            proxy_url=self._proxy_url,
+            client_cls=httpx.AsyncClient,
+            limits=limits,
+            http2=http2,
+        )
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        # Пул соединений привязан к event loop: в новом loop (тесты, повторный asyncio.run) нужен новый клиент.
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop or self._async_client.is_closed:
+            self._async_client = self._build_async_client()
+            self._async_client_loop = loop
+        return self._async_client
+
+    async def aclose(self) -> None:
+        client = self._async_client
+        self._async_client = None
+        self._async_client_loop = None
+        if client is not None and not client.is_closed:
+            await client.aclose()
 
     def generate(self, facts_pack: dict[str, Any], system_prompt: str) -> LLMResponse:
         # 1) Gemini (primary)
         try:
             return self._call_gemini(facts_pack, system_prompt)
         except LLMProviderError as exc:
-            self._logger.warning(
-                "gemini_failed",
-                extra={
-                    "status_code": exc.status_code,
-                    "retryable": exc.retryable,
-                    "fallback": exc.fallback,
-                    "category": exc.category,
-                },
-            )
-            if not exc.fallback:
-                raise LLMUnavailableError("Gemini provider failed without fallback") from exc
+            self._on_primary_failed(exc)
+
+        # 2) OpenAI (fallback)
+        try:
+            return self._call_openai(facts_pack, system_prompt)
+        except LLMProviderError as exc:
+            self._on_fallback_failed(exc)
+
+    async def agenerate(self, facts_pack: dict[str, Any], system_prompt: str) -> LLMResponse:
+        if getattr(settings, "llm_hedge_enabled", False):
+            return await self._agenerate_hedged(facts_pack, system_prompt)
+        return await self._agenerate_sequential(facts_pack, system_prompt)
+
+    async def astream(self, facts_pack: dict[str, Any], system_prompt: str) -> AsyncIterator[LLMStreamChunk]:
+        """Отдаёт текст по мере генерации; при `LLM_HEDGE_ENABLED` hedging действует до первого фрагмента.
+
+        Обрыв после первого фрагмента не маскируется фолбэком (часть текста уже отдана):
+        поднимается LLMUnavailableError, и вызывающий начинает генерацию заново.
+        """
+        if getattr(settings, "llm_hedge_enabled", False):
+            stream = self._astream_hedged(facts_pack, system_prompt)
+        else:
+            stream = self._astream_sequential(facts_pack, system_prompt)
+        async with aclosing(stream) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+    async def _astream_sequential(
+        self,
+        facts_pack: dict[str, Any],
+        system_prompt: str,
+    ) -> AsyncIterator[LLMStreamChunk]:
+        started = False
+        # 1) Gemini (primary)
+        requested = time.monotonic()
+        try:
+            async with aclosing(self._astream_provider(await self._agemini_call(facts_pack, system_prompt))) as stream:
+                async for chunk in stream:
+                    if not started:
+                        self._primary_first_chunk_latencies.append(time.monotonic() - requested)
+                    started = True
+                    yield chunk
+            return
+        except LLMProviderError as exc:
+            if started:
+                raise LLMUnavailableError("Gemini stream was interrupted") from exc
+            self._on_primary_failed(exc)
+
+        # 2) OpenAI (fallback)
+        try:
+            async with aclosing(self._astream_provider(await self._aopenai_call(facts_pack, system_prompt))) as stream:
+                async for chunk in stream:
+                    started = True
+                    yield chunk
+        except LLMProviderError as exc:
+            if started:
+                raise LLMUnavailableError("OpenAI stream was interrupted") from exc
+            self._on_fallback_failed(exc)
+
+    async def _agenerate_sequential(self, facts_pack: dict[str, Any], system_prompt: str) -> LLMResponse:
+        # 1) Gemini (primary)
+        started = time.monotonic()
+        try:
+            response = await self._acall_gemini(facts_pack, system_prompt)
+            self._primary_latencies.append(time.monotonic() - started)
+            return response
+        except LLMProviderError as exc:
+            self._on_primary_failed(exc)
+
+        # 2) OpenAI (fallback)
+        try:
+            return await self._acall_openai(facts_pack, system_prompt)
+        except LLMProviderError as exc:
+            self._on_fallback_failed(exc)
+
+    async def _agenerate_hedged(self, facts_pack: dict[str, Any], system_prompt: str) -> LLMResponse:
+        """Если основной путь не ответил за порог, параллельно запускает hedge-запрос; побеждает первый успех.
+
+        Основной путь — обычная цепочка Gemini → OpenAI. Hedge уходит в `LLM_HEDGE_TARGET`
+        (резервный провайдер или другой ключ Gemini) и ограничен `LLM_HEDGE_MAX_PER_MINUTE`.
+        """
+        primary = asyncio.create_task(self._agenerate_sequential(facts_pack, system_prompt))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self._hedge_delay_seconds())
+            if done:
+                return primary.result()
+            if not self._acquire_hedge_budget():
+                self._hedge_stats["skipped_budget"] += 1
+                self._logger.info("llm_hedge_skipped_budget")
+                return await primary
+            self._hedge_stats["launched"] += 1
+            hedge = asyncio.create_task(self._acall_hedge(facts_pack, system_prompt))
+            tasks.add(hedge)
+            roles = {primary: "primary", hedge: "hedge"}
+            errors: dict[str, BaseException] = {}
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # При одновременном завершении предпочитаем основной путь.
+                for task in sorted(done, key=lambda item: roles[item] != "primary"):
+                    if task.exception() is not None:
+                        errors[roles[task]] = task.exception()
+                        continue
+                    winner = roles[task]
+                    response = task.result()
+                    self._hedge_stats[f"won_{winner}"] += 1
+                    self._logger.info(
+                        "llm_hedge_won",
+                        extra={"winner": winner, "provider": response.provider, "model": response.model},
+                    )
+                    return replace(response, hedge=winner)
+            hedge_error = errors.get("hedge")
+            if hedge_error is not None:
+                self._logger.warning(
+                    "llm_hedge_failed",
+                    extra={"error": f"{hedge_error.__class__.__name__}: {hedge_error}"},
+                )
+            raise errors.get("primary") or hedge_error  # type: ignore[misc]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _astream_hedged(
+        self,
+        facts_pack: dict[str, Any],
+        system_prompt: str,
+    ) -> AsyncIterator[LLMStreamChunk]:
+        """Стрим с hedging до первого фрагмента: побеждает путь, первым отдавший текст.
+
+        Каждый стрим читается в своей задаче (`_StreamPump`), проигравший отменяется. После первого
+        фрагмента hedging не действует: обрыв победителя поднимает LLMUnavailableError, как без hedging.
+        """
+        primary = _StreamPump(self._astream_sequential(facts_pack, system_prompt))
+        pumps = {"primary": primary}
+        try:
+            delay = self._hedge_delay_seconds(self._primary_first_chunk_latencies)
+            if not await primary.wait_first(delay):
+                if self._acquire_hedge_budget():
+                    self._hedge_stats["launched"] += 1
+                    pumps["hedge"] = _StreamPump(self._astream_hedge(facts_pack, system_prompt))
+                else:
+                    self._hedge_stats["skipped_budget"] += 1
+                    self._logger.info("llm_hedge_skipped_budget")
+            winner = await self._first_started_pump(pumps)
+            pump = pumps[winner]
+            hedge = winner if len(pumps) > 1 else None
+            if hedge:
+                for role in pumps:
+                    if role != winner:
+                        await pumps[role].close()
+            async for chunk in pump.chunks():
+                yield replace(chunk, hedge=hedge) if hedge else chunk
+        finally:
+            for pump in pumps.values():
+                await pump.close()
+
+    async def _first_started_pump(self, pumps: dict[str, "_StreamPump"]) -> str:
+        """Роль стрима, первым отдавшего фрагмент; при одновременном старте предпочитаем основной путь."""
+        candidates = dict(pumps)
+        errors: dict[str, BaseException] = {}
+        while True:
+            for role in sorted(candidates, key=lambda item: item != "primary"):
+                pump = candidates[role]
+                if not pump.first.is_set():
+                    continue
+                if pump.error is None:
+                    if len(pumps) > 1:
+                        self._hedge_stats[f"won_{role}"] += 1
+                        chunk = pump.first_chunk
+                        self._logger.info(
+                            "llm_hedge_won",
+                            extra={
+                                "winner": role,
+                                "provider": chunk.provider if chunk else None,
+                                "model": chunk.model if chunk else None,
+                                "stream": True,
+                            },
+                        )
+                    return role
+                errors[role] = pump.error
+                del candidates[role]
+            if not candidates:
+                hedge_error = errors.get("hedge")
+                if hedge_error is not None:
+                    self._logger.warning(
+                        "llm_hedge_failed",
+                        extra={"error": f"{hedge_error.__class__.__name__}: {hedge_error}", "stream": True},
+                    )
+                raise errors.get("primary") or hedge_error  # type: ignore[misc]
+            waiters = [asyncio.create_task(pump.first.wait()) for pump in candidates.values()]
+            try:
+                await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
 
+    async def _astream_hedge(
+        self,
+        facts_pack: dict[str, Any],
+        system_prompt: str,
+    ) -> AsyncIterator[LLMStreamChunk]:
+        target = str(getattr(settings, "llm_hedge_target", "openai") or "openai").strip().lower()
+        call = None
+        if target == "gemini":
+            call = await self._agemini_call(facts_pack, system_prompt)
+            if len(call.api_keys) > 1:
+                call = replace(call, api_keys=call.api_keys[1:] + call.api_keys[:1])
+            else:
+                call = None
+        if call is None:
+            call = await self._aopenai_call(facts_pack, system_prompt)
+        started = False
+        try:
+            async with aclosing(self._astream_provider(call)) as stream:
+                async for chunk in stream:
+                    started = True
+                    yield chunk
+        except LLMProviderError as exc:
+            if started:
+                raise LLMUnavailableError("Hedge stream was interrupted") from exc
+            raise
+
+    async def _acall_hedge(self, facts_pack: dict[str, Any], system_prompt: str) -> LLMResponse:
+        target = str(getattr(settings, "llm_hedge_target", "openai") or "openai").strip().lower()
+        if target == "gemini":
+            call = await self._agemini_call(facts_pack, system_prompt)
+            if len(call.api_keys) > 1:
+                # Второй ключ Gemini первым: основной путь уже ждёт ответа на первом.
+                return await self._acall_provider(
+                    replace(call, api_keys=call.api_keys[1:] + call.api_keys[:1])
+                )
+        return await self._acall_openai(facts_pack, system_prompt)
+
+    def _hedge_delay_seconds(self, latencies: deque[float] | None = None) -> float:
+        """Порог hedging: заданный перцентиль латентности успешных ответов основного провайдера."""
+        min_delay = max(float(getattr(settings, "llm_hedge_min_delay_seconds", 2) or 0), 0.0)
+        samples = sorted(self._primary_latencies if latencies is None else latencies)
+        if len(samples) < _HEDGE_MIN_SAMPLES:
+            return max(float(getattr(settings, "llm_hedge_default_delay_seconds", 20) or 0), min_delay)
+        percentile = min(max(int(getattr(settings, "llm_hedge_percentile", 95) or 95), 1), 100)
+        rank = max(-(-percentile * len(samples) // 100), 1)
+        return max(samples[rank - 1], min_delay)
+
+    def _acquire_hedge_budget(self) -> bool:
+        limit = int(getattr(settings, "llm_hedge_max_per_minute", 0) or 0)
+        now = time.monotonic()
+        while self._hedge_launches and now - self._hedge_launches[0] >= 60:
+            self._hedge_launches.popleft()
+        if len(self._hedge_launches) >= limit:
+            return False
+        self._hedge_launches.append(now)
+        return True
+
+    def hedge_stats(self) -> dict[str, int]:
+        return dict(self._hedge_stats)
+
+    def _on_primary_failed(self, exc: LLMProviderError) -> None:
+        self._logger.warning(
+            "gemini_failed",
+            extra={
+                "status_code": exc.status_code,
+                "retryable": exc.retryable,
+                "fallback": exc.fallback,
+                "category": exc.category,
+            },
+        )
+        if not exc.fallback:
+            raise LLMUnavailableError("Gemini provider failed without fallback") from exc
         self._logger.warning(
             "llm_fallback",
             extra={"provider": "gemini", "fallback_provider": "openai"},
         )
 
-        # 2) OpenAI (fallback)
-        try:
-            return self._call_openai(facts_pack, system_prompt)
-        except LLMProviderError as exc:
-            self._logger.warning(
-                "openai_failed",
-                extra={
-                    "status_code": exc.status_code,
-                    "retryable": exc.retryable,
-                    "fallback": exc.fallback,
-                    "category": exc.category,
-                },
-            )
-            raise LLMUnavailableError("Both Gemini and OpenAI providers are unavailable") from exc
+    def _on_fallback_failed(self, exc: LLMProviderError) -> NoReturn:
+        self._logger.warning(
+            "openai_failed",
+            extra={
+                "status_code": exc.status_code,
+                "retryable": exc.retryable,
+                "fallback": exc.fallback,
+                "category": exc.category,
+            },
+        )
+        raise LLMUnavailableError("Both Gemini and OpenAI providers are unavailable") from exc
 
     def _call_gemini(self, facts_pack: dict[str, Any], system_prompt: str) -> LLMResponse:
-        api_keys = resolve_llm_keys(
+        return self._call_provider(self._gemini_call(facts_pack, system_prompt))
+
+    def _call_openai(self, facts_pack: dict[str, Any], system_prompt: str) -> LLMResponse:
+        return self._call_provider(self._openai_call(facts_pack, system_prompt))
+
+    async def _acall_gemini(self, facts_pack: dict[str, Any], system_prompt: str) -> LLMResponse:
+        return await self._acall_provider(await self._agemini_call(facts_pack, system_prompt))
+
+    async def _acall_openai(self, facts_pack: dict[str, Any], system_prompt: str) -> LLMResponse:
+        return await self._acall_provider(await self._aopenai_call(facts_pack, system_prompt))
+
+    async def _agemini_call(self, facts_pack: dict[str, Any], system_prompt: str) -> _ProviderCall:
+        # Промах кэша ключей — запросы к БД (и commit env-ключей): не блокируем event loop бота.
+        api_keys = await asyncio.to_thread(self._gemini_keys)
+        return self._gemini_call(facts_pack, system_prompt, api_keys=api_keys)
+
+    async def _aopenai_call(self, facts_pack: dict[str, Any], system_prompt: str) -> _ProviderCall:
+        api_keys = await asyncio.to_thread(self._openai_keys)
+        return self._openai_call(facts_pack, system_prompt, api_keys=api_keys)
+
+    @staticmethod
+    def _gemini_keys() -> list[LLMKeyItem]:
+        return resolve_cached_llm_keys(
             provider="gemini",
             primary_key=settings.gemini_api_key,
             extra_keys=settings.gemini_api_keys,
         )
+
+    @staticmethod
+    def _openai_keys() -> list[LLMKeyItem]:
+        return resolve_cached_llm_keys(
+            provider="openai",
+            primary_key=settings.openai_api_key,
+            extra_keys=settings.openai_api_keys,
+        )
+
+    def _gemini_call(
+        self,
+        facts_pack: dict[str, Any],
+        system_prompt: str,
+        *,
+        api_keys: list[LLMKeyItem] | None = None,
+    ) -> _ProviderCall:
+        if api_keys is None:
+            api_keys = self._gemini_keys()
         if not api_keys:
             raise LLMProviderError(
                 "Gemini API key is missing",
@@ -151,106 +623,46 @@ class LLMRouter:
                 category="missing_api_key",
             )
 
-        endpoint = (
-            "https://generativelanguage.googleapis.com/v1beta/models/"
-            f"{settings.gemini_model}:generateContent"
-        )
+        # Статичный промпт тарифа — в systemInstruction (его можно кэшировать), facts-pack — в contents.
         payload = {
+            "systemInstruction": {"parts": [{"text": system_prompt}]},
             "contents": [
                 {
                     "role": "user",
-                    "parts": [{"text": self._build_prompt(system_prompt, facts_pack)}],
+                    "parts": [{"text": f"Данные (facts-pack):\n{self._serialize_facts_pack(facts_pack)}"}],
                 }
-            ]
+            ],
         }
-
-        # Если Gemini отвечает этими статусами — разумно фолбэкнуть на OpenAI
-        gemini_fallback_statuses = {400, 401, 403, 404, 429, 500, 502, 503, 504}
-
-        last_error: LLMProviderError | None = None
-        for idx, key_item in enumerate(api_keys, start=1):
-            if self._is_rate_limited(key_item.key):
-                self._logger.info(
-                    "gemini_key_rate_limited_skip",
-                    extra={"key_index": idx, "keys_total": len(api_keys)},
-                )
-                if idx < len(api_keys):
-                    continue
-                raise LLMProviderError(
-                    "Gemini key is rate limited",
-                    status_code=429,
-                    retryable=True,
-                    fallback=True,
-                    category="rate_limited",
-                )
-            headers = {
-                # НЕ передаём ключ в URL, чтобы он не попадал в httpx-логи
-                "x-goog-api-key": key_item.key,
-                "Content-Type": "application/json",
-            }
-
-            try:
-                data = self._post_json(
-                    endpoint,
-                    headers=headers,
-                    json_payload=payload,
-                    max_retries=2,
-                    fallback_statuses=gemini_fallback_statuses,
-                )
-                text = self._extract_gemini_text(data)
-                if not text:
-                    raise LLMProviderError(
-                        "Gemini response is empty",
-                        retryable=False,
-                        fallback=True,
-                        category="empty_response",
-                    )
-                record_llm_key_usage(key_item, success=True, status_code=200)
-                return LLMResponse(text=text, provider="gemini", model=settings.gemini_model)
-
-            except LLMProviderError as exc:
-                last_error = exc
-                self._mark_rate_limit(key_item.key, exc)
-                record_llm_key_usage(
-                    key_item,
-                    success=False,
-                    status_code=exc.status_code,
-                    error_message=str(exc),
-                )
-                self._logger.warning(
-                    "gemini_key_failed",
-                    extra={
-                        "status_code": exc.status_code,
-                        "retryable": exc.retryable,
-                        "fallback": exc.fallback,
-                        "category": exc.category,
-                        "key_index": idx,
-                        "keys_total": len(api_keys),
-                    },
-                )
-
-                # Требование: fallback допускается только после исчерпания всех ключей основного провайдера.
-                # Поэтому при любой ошибке пытаемся следующий ключ, если он есть.
-                if idx < len(api_keys):
-                    continue
-
-                raise
-
-        if last_error:
-            raise last_error
-        raise LLMProviderError(
-            "Gemini provider failed",
-            retryable=False,
+        return _ProviderCall(
+            provider="gemini",
+            label="Gemini",
+            model=settings.gemini_model,
+            endpoint=f"{self._gemini_base_url()}/v1beta/models/{settings.gemini_model}:generateContent",
+            payload=payload,
+            api_keys=api_keys,
+            # НЕ передаём ключ в URL, чтобы он не попадал в httpx-логи
+            build_headers=lambda key: {"x-goog-api-key": key, "Content-Type": "application/json"},
+            # Если Gemini отвечает этими статусами — разумно фолбэкнуть на OpenAI
+            fallback_statuses={400, 401, 403, 404, 429, 500, 502, 503, 504},
+            extract_text=self._extract_gemini_text,
+            stream_endpoint=(
+                f"{self._gemini_base_url()}/v1beta/models/{settings.gemini_model}:streamGenerateContent?alt=sse"
+            ),
+            stream_payload=payload,
+            extract_stream_text=self._extract_gemini_text,
             fallback=True,
-            category="unknown",
+            context_cache_prompt=system_prompt if self._context_cache.enabled else None,
         )
 
-    def _call_openai(self, facts_pack: dict[str, Any], system_prompt: str) -> LLMResponse:
-        api_keys = resolve_llm_keys(
-            provider="openai",
-            primary_key=settings.openai_api_key,
-            extra_keys=settings.openai_api_keys,
-        )
+    def _openai_call(
+        self,
+        facts_pack: dict[str, Any],
+        system_prompt: str,
+        *,
+        api_keys: list[LLMKeyItem] | None = None,
+    ) -> _ProviderCall:
+        if api_keys is None:
+            api_keys = self._openai_keys()
         if not api_keys:
             raise LLMProviderError(
                 "OpenAI API key is missing",
@@ -259,89 +671,510 @@ class LLMRouter:
                 category="missing_api_key",
             )
 
-        endpoint = "https://api.openai.com/v1/chat/completions"
+        # Неизменный системный промпт идёт первым: OpenAI кэширует общий префикс запросов автоматически.
         payload = {
             "model": settings.openai_model,
             "messages": [
                 {"role": "system", "content": system_prompt},
-                {"role": "user", "content": json.dumps(facts_pack, ensure_ascii=False)},
+                {"role": "user", "content": self._serialize_facts_pack(facts_pack)},
             ],
         }
+        if self._context_cache.enabled:
+            # Запросы с одним промптом тарифа попадают на один узел кэша.
+            payload["prompt_cache_key"] = f"report-{prompt_version(system_prompt)}"
+        return _ProviderCall(
+            provider="openai",
+            label="OpenAI",
+            model=settings.openai_model,
+            endpoint=f"{self._openai_base_url()}/v1/chat/completions",
+            payload=payload,
+            api_keys=api_keys,
+            build_headers=lambda key: {"Authorization": f"Bearer {key}", "Content-Type": "application/json"},
+            fallback_statuses={401, 403, 404, 429, 500, 502, 503, 504},
+            extract_text=self._extract_openai_text,
+            stream_endpoint=f"{self._openai_base_url()}/v1/chat/completions",
+            stream_payload={**payload, "stream": True},
+            extract_stream_text=self._extract_openai_stream_text,
+            fallback=False,
+        )
+
+    def _call_provider(self, call: _ProviderCall) -> LLMResponse:
+        last_error: LLMProviderError | None = None
+        provider_probe = self._check_provider_circuit(call)
+        try:
+            api_keys = self._key_pool.order(call.provider, call.api_keys)
+            keys_total = len(api_keys)
+            for idx, key_item in enumerate(api_keys, start=1):
+                if self._skip_rate_limited_key(call, key_item, idx):
+                    continue
+                if self._skip_open_circuit_key(call, key_item, idx):
+                    continue
+                if self._skip_saturated_key(call, key_item, idx):
+                    continue
+                started = time.monotonic()
+                try:
+                    data = self._post_json(
+                        call.endpoint,
+                        headers=call.build_headers(key_item.key),
+                        json_payload=call.payload,
+                        max_retries=2,
+                        fallback_statuses=call.fallback_statuses,
+                    )
+                    response = self._complete_key_call(call, key_item, data)
+                    self._release_key(call, key_item, success=True, started=started)
+                    return response
+                except LLMProviderError as exc:
+                    self._release_key(call, key_item, success=False, started=started, error=exc)
+                    last_error = exc
+                    self._record_key_failure(call, key_item, exc, idx)
+                    # Требование: fallback допускается только после исчерпания всех ключей провайдера.
+                    # Поэтому при любой ошибке пытаемся следующий ключ, если он есть.
+                    if idx < keys_total:
+                        continue
+                    raise
+                except BaseException:
+                    self._release_key(call, key_item, success=None, started=None)
+                    raise
+            raise self._provider_exhausted_error(call, last_error)
+        finally:
+            if provider_probe:
+                self._provider_circuit.release(call.provider)
 
-        openai_fallback_statuses = {401, 403, 404, 429, 500, 502, 503, 504}
+    async def _acall_provider(self, call: _ProviderCall) -> LLMResponse:
+        last_error: LLMProviderError | None = None
+        provider_probe = await self._acheck_provider_circuit(call)
+        try:
+            await self._await_key_capacity(call)
+            api_keys = self._key_pool.order(call.provider, call.api_keys)
+            keys_total = len(api_keys)
+            for idx, key_item in enumerate(api_keys, start=1):
+                if self._skip_rate_limited_key(call, key_item, idx):
+                    continue
+                if await self._askip_open_circuit_key(call, key_item, idx):
+                    continue
+                if self._skip_saturated_key(call, key_item, idx):
+                    continue
+                started = time.monotonic()
+                try:
+                    data = await self._apost_json(
+                        call.endpoint,
+                        headers=call.build_headers(key_item.key),
+                        json_payload=await self._key_payload(call, key_item, call.payload),
+                        max_retries=2,
+                        fallback_statuses=call.fallback_statuses,
+                    )
+                    response = self._complete_key_call(call, key_item, data)
+                    self._release_key(call, key_item, success=True, started=started)
+                    return response
+                except LLMProviderError as exc:
+                    self._release_key(call, key_item, success=False, started=started, error=exc)
+                    self._invalidate_context_cache(call, key_item, exc)
+                    last_error = exc
+                    self._record_key_failure(call, key_item, exc, idx)
+                    if idx < keys_total:
+                        continue
+                    raise
+                except BaseException:
+                    # Отмена (hedging, остановка воркера) не считается ошибкой ключа, но слот освобождаем.
+                    self._release_key(call, key_item, success=None, started=None)
+                    raise
+            raise self._provider_exhausted_error(call, last_error)
+        finally:
+            # Проба half-open, не давшая результата (отмена, все ключи пропущены), достаётся следующему запросу.
+            if provider_probe:
+                self._provider_circuit.release(call.provider)
 
+    async def _astream_provider(self, call: _ProviderCall) -> AsyncIterator[LLMStreamChunk]:
         last_error: LLMProviderError | None = None
-        for idx, key_item in enumerate(api_keys, start=1):
-            if self._is_rate_limited(key_item.key):
-                self._logger.info(
-                    "openai_key_rate_limited_skip",
-                    extra={"key_index": idx, "keys_total": len(api_keys)},
-                )
-                if idx < len(api_keys):
+        provider_probe = await self._acheck_provider_circuit(call)
+        try:
+            await self._await_key_capacity(call)
+            api_keys = self._key_pool.order(call.provider, call.api_keys)
+            keys_total = len(api_keys)
+            for idx, key_item in enumerate(api_keys, start=1):
+                if self._skip_rate_limited_key(call, key_item, idx):
+                    continue
+                if await self._askip_open_circuit_key(call, key_item, idx):
+                    continue
+                if self._skip_saturated_key(call, key_item, idx):
                     continue
+                started = time.monotonic()
+                yielded = False
+                try:
+                    async with aclosing(self._astream_key(call, key_item)) as stream:
+                        async for text in stream:
+                            yielded = True
+                            yield LLMStreamChunk(text=text, provider=call.provider, model=call.model)
+                    if not yielded:
+                        raise LLMProviderError(
+                            f"{call.label} response is empty",
+                            retryable=False,
+                            fallback=call.fallback,
+                            category="empty_response",
+                        )
+                    record_llm_key_usage(key_item, success=True, status_code=200)
+                    self._release_key(call, key_item, success=True, started=started)
+                    return
+                except LLMProviderError as exc:
+                    self._release_key(call, key_item, success=False, started=started, error=exc)
+                    self._invalidate_context_cache(call, key_item, exc)
+                    last_error = exc
+                    self._record_key_failure(call, key_item, exc, idx)
+                    if not yielded and idx < keys_total:
+                        continue
+                    raise
+                except BaseException:
+                    # Потребитель прервал стрим (отмена, досрочная остановка): ключ не виноват.
+                    self._release_key(call, key_item, success=None, started=None)
+                    raise
+            raise self._provider_exhausted_error(call, last_error)
+        finally:
+            if provider_probe:
+                self._provider_circuit.release(call.provider)
+
+    async def _astream_key(self, call: _ProviderCall, key_item: LLMKeyItem) -> AsyncIterator[str]:
+        """SSE-стрим одного ключа; повторы на том же ключе — только до начала тела ответа."""
+        client = self._get_async_client()
+        idle_seconds = float(getattr(settings, "llm_stream_idle_timeout_seconds", 0) or 0)
+        # Между фрагментами ждём не дольше idle-таймаута: зависший стрим обрывается рано.
+        timeout = httpx.Timeout(self._timeout_seconds, read=idle_seconds or self._timeout_seconds)
+        payload = await self._key_payload(call, key_item, call.stream_payload)
+        attempts = 0
+        max_retries = 2
+        while True:
+            retry_delay: float | None = None
+            yielded = False
+            try:
+                async with client.stream(
+                    "POST",
+                    call.stream_endpoint,
+                    json=payload,
+                    headers=call.build_headers(key_item.key),
+                    timeout=timeout,
+                ) as resp:
+                    if resp.status_code in self._retry_statuses and attempts < max_retries:
+                        attempts += 1
+                        retry_delay = self._backoff_delay(attempts, retry_after=self._retry_after_seconds(resp))
+                    elif not 200 <= resp.status_code < 300:
+                        await resp.aread()
+                        self._parse_response(resp, fallback_statuses=call.fallback_statuses)
+                    else:
+                        async for data in self._iter_sse_events(resp):
+                            text = call.extract_stream_text(data)
+                            if text:
+                                yielded = True
+                                yield text
+                        return
+            except httpx.RequestError as exc:
+                if yielded:
+                    raise self._stream_interrupted_error(exc) from exc
+                attempts += 1
+                if attempts > max_retries:
+                    raise self._request_error(exc) from exc
+                retry_delay = self._backoff_delay(attempts)
+            await asyncio.sleep(retry_delay or 0)
+
+    async def _key_payload(
+        self,
+        call: _ProviderCall,
+        key_item: LLMKeyItem,
+        payload: dict[str, Any],
+    ) -> dict[str, Any]:
+        """Payload для ключа: системный промпт заменяется на cachedContent, если кэш для ключа есть."""
+        if call.context_cache_prompt is None:
+            return payload
+        cached_name = await self._context_cache.aresolve(
+            key_item,
+            call.model,
+            call.context_cache_prompt,
+            self._create_gemini_cached_content,
+        )
+        if cached_name is None:
+            return payload
+        cached_payload = {key: value for key, value in payload.items() if key != "systemInstruction"}
+        cached_payload["cachedContent"] = cached_name
+        return cached_payload
+
+    async def _create_gemini_cached_content(self, key_item: LLMKeyItem, model: str, prompt: str, ttl_seconds: int) -> str:
+        data = await self._apost_json(
+            f"{self._gemini_base_url()}/v1beta/cachedContents",
+            headers={"x-goog-api-key": key_item.key, "Content-Type": "application/json"},
+            json_payload={
+                "model": f"models/{model}",
+                "systemInstruction": {"parts": [{"text": prompt}]},
+                "ttl": f"{ttl_seconds}s",
+            },
+            max_retries=0,
+            fallback_statuses=set(),
+        )
+        name = data.get("name")
+        if not name:
+            raise LLMProviderError(
+                "Gemini cachedContents response has no name",
+                retryable=False,
+                fallback=False,
+                category="bad_response",
+            )
+        return name
+
+    def _invalidate_context_cache(self, call: _ProviderCall, key_item: LLMKeyItem, exc: LLMProviderError) -> None:
+        # 400/403/404 на запросе с cachedContent чаще всего значит, что кэш удалён или истёк раньше срока.
+        if call.context_cache_prompt is not None and exc.status_code in {400, 403, 404}:
+            self._context_cache.invalidate(key_item, call.model, call.context_cache_prompt)
+
+    @staticmethod
+    async def _iter_sse_events(resp: httpx.Response) -> AsyncIterator[dict[str, Any]]:
+        data_lines: list[str] = []
+
+        def _decode(raw: str) -> dict[str, Any] | None:
+            try:
+                data = json.loads(raw)
+            except ValueError:
+                return None
+            if not isinstance(data, dict):
+                return None
+            error = data.get("error")
+            if error:
+                message = error.get("message") if isinstance(error, dict) else error
                 raise LLMProviderError(
-                    "OpenAI key is rate limited",
-                    status_code=429,
+                    f"LLM stream returned error: {message}",
                     retryable=True,
-                    fallback=False,
-                    category="rate_limited",
+                    fallback=True,
+                    category="server_error",
                 )
-            headers = {
-                "Authorization": f"Bearer {key_item.key}",
-                "Content-Type": "application/json",
-            }
+            return data
 
-            try:
-                data = self._post_json(
-                    endpoint,
-                    headers=headers,
-                    json_payload=payload,
-                    max_retries=2,
-                    fallback_statuses=openai_fallback_statuses,
-                )
-                text = self._extract_openai_text(data)
-                if not text:
-                    raise LLMProviderError(
-                        "OpenAI response is empty",
-                        retryable=False,
-                        fallback=False,
-                        category="empty_response",
-                    )
-                record_llm_key_usage(key_item, success=True, status_code=200)
-                return LLMResponse(text=text, provider="openai", model=settings.openai_model)
-
-            except LLMProviderError as exc:
-                last_error = exc
-                self._mark_rate_limit(key_item.key, exc)
-                record_llm_key_usage(
-                    key_item,
-                    success=False,
-                    status_code=exc.status_code,
-                    error_message=str(exc),
-                )
-                self._logger.warning(
-                    "openai_key_failed",
-                    extra={
-                        "status_code": exc.status_code,
-                        "retryable": exc.retryable,
-                        "fallback": exc.fallback,
-                        "category": exc.category,
-                        "key_index": idx,
-                        "keys_total": len(api_keys),
-                    },
-                )
+        async for line in resp.aiter_lines():
+            if line.startswith("data:"):
+                data_lines.append(line[5:].strip())
+                continue
+            if line.strip() or not data_lines:
+                continue
+            raw, data_lines = "\n".join(data_lines), []
+            if raw == "[DONE]":
+                return
+            data = _decode(raw)
+            if data is not None:
+                yield data
+        if data_lines and data_lines != ["[DONE]"]:
+            data = _decode("\n".join(data_lines))
+            if data is not None:
+                yield data
 
-                # Для fallback-провайдера также перебираем все ключи до финального отказа.
-                if idx < len(api_keys):
-                    continue
-                raise
+    @staticmethod
+    def _stream_interrupted_error(exc: httpx.RequestError) -> LLMProviderError:
+        category = "timeout" if isinstance(exc, httpx.TimeoutException) else "request_error"
+        return LLMProviderError(
+            f"LLM stream interrupted: {exc.__class__.__name__}: {exc}",
+            retryable=True,
+            fallback=True,
+            category=category,
+        )
 
-        if last_error:
-            raise last_error
+    async def _await_key_capacity(self, call: _ProviderCall) -> None:
+        """При всплеске ждёт свободный слот/токен у любого ключа, но не дольше LLM_KEY_ACQUIRE_TIMEOUT_SECONDS."""
+        timeout = max(float(getattr(settings, "llm_key_acquire_timeout_seconds", 0) or 0), 0.0)
+        deadline = time.monotonic() + timeout
+        waited = False
+        while not self._key_pool.has_capacity(call.provider, call.api_keys):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            waited = True
+            await asyncio.sleep(min(self._key_pool.seconds_until_capacity(call.provider, call.api_keys), remaining))
+        if waited:
+            self._logger.info(f"{call.provider}_key_pool_waited", extra={"keys_total": len(call.api_keys)})
+
+    def _skip_saturated_key(self, call: _ProviderCall, key_item: LLMKeyItem, idx: int) -> bool:
+        if self._key_pool.try_acquire(call.provider, key_item):
+            return False
+        # Цепь ключа уже пропустила этот вызов: если он держит пробу half-open, отдаём её, иначе
+        # ключ до probe_until пропускали бы все запросы.
+        key_name = key_circuit_name(call.provider, key_item)
+        if self._key_circuit.holds_probe(key_name):
+            self._key_circuit.release(key_name)
+        keys_total = len(call.api_keys)
+        self._logger.info(
+            f"{call.provider}_key_saturated_skip",
+            extra={"key_index": idx, "keys_total": keys_total},
+        )
+        if idx < keys_total:
+            return True
+        raise LLMProviderError(
+            f"{call.label} keys are saturated",
+            status_code=429,
+            retryable=True,
+            fallback=call.fallback,
+            category="saturated",
+        )
+
+    def _release_key(
+        self,
+        call: _ProviderCall,
+        key_item: LLMKeyItem,
+        *,
+        success: bool | None,
+        started: float | None,
+        error: LLMProviderError | None = None,
+    ) -> None:
+        latency = time.monotonic() - started if started is not None else None
+        if success is None:
+            self._key_pool.cancel(call.provider, key_item)
+            return
+        self._record_circuit_outcome(call, key_item, error)
+        reason = self._key_pool.release(call.provider, key_item, success=success, latency_seconds=latency)
+        if reason:
+            self._logger.warning(
+                f"{call.provider}_key_marked_unhealthy",
+                extra={"reason": reason, "unhealthy_seconds": self._key_pool.unhealthy_seconds},
+            )
+
+    def key_pool_snapshot(self, provider: str) -> list[dict[str, object]]:
+        return self._key_pool.snapshot(provider)
+
+    def _check_provider_circuit(self, call: _ProviderCall) -> bool:
+        """Отклоняет вызов открытого провайдера без сетевого запроса; True — этот вызов держит пробу half-open."""
+        return self._provider_circuit_decision(call, self._provider_circuit.allow(call.provider))
+
+    async def _acheck_provider_circuit(self, call: _ProviderCall) -> bool:
+        return self._provider_circuit_decision(call, await self._provider_circuit.aallow(call.provider))
+
+    def _provider_circuit_decision(self, call: _ProviderCall, allowed: bool) -> bool:
+        if allowed:
+            return self._provider_circuit.holds_probe(call.provider)
+        self._logger.info(f"{call.provider}_circuit_open_skip")
+        raise LLMProviderError(
+            f"{call.label} circuit is open",
+            retryable=True,
+            fallback=call.fallback,
+            category="circuit_open",
+        )
+
+    def _skip_open_circuit_key(self, call: _ProviderCall, key_item: LLMKeyItem, idx: int) -> bool:
+        allowed = self._key_circuit.allow(key_circuit_name(call.provider, key_item))
+        return self._key_circuit_skip(call, idx, allowed)
+
+    async def _askip_open_circuit_key(self, call: _ProviderCall, key_item: LLMKeyItem, idx: int) -> bool:
+        allowed = await self._key_circuit.aallow(key_circuit_name(call.provider, key_item))
+        return self._key_circuit_skip(call, idx, allowed)
+
+    def _key_circuit_skip(self, call: _ProviderCall, idx: int, allowed: bool) -> bool:
+        if allowed:
+            return False
+        keys_total = len(call.api_keys)
+        self._logger.info(
+            f"{call.provider}_key_circuit_open_skip",
+            extra={"key_index": idx, "keys_total": keys_total},
+        )
+        if idx < keys_total:
+            return True
         raise LLMProviderError(
-            "OpenAI provider failed",
+            f"{call.label} key circuit is open",
             retryable=False,
-            fallback=False,
+            fallback=call.fallback,
+            category="circuit_open",
+        )
+
+    def _record_circuit_outcome(
+        self,
+        call: _ProviderCall,
+        key_item: LLMKeyItem,
+        error: LLMProviderError | None,
+    ) -> None:
+        key_name = key_circuit_name(call.provider, key_item)
+        if error is None:
+            self._provider_circuit.record_success(call.provider)
+            self._key_circuit.record_success(key_name)
+            return
+        if error.category in PROVIDER_FAILURE_CATEGORIES:
+            # Таймаут или 5xx ничего не говорит о ключе: его цепь не трогаем.
+            self._provider_circuit.record_failure(call.provider, error=str(error))
+            return
+        # Провайдер ответил (4xx, пустой ответ) — он доступен.
+        self._provider_circuit.record_success(call.provider)
+        if error.category in KEY_FAILURE_CATEGORIES:
+            self._key_circuit.record_failure(key_name, error=str(error), trip=True)
+        else:
+            self._key_circuit.record_success(key_name)
+
+    def circuit_snapshot(self) -> dict[str, dict[str, str]]:
+        return {
+            "provider": self._provider_circuit.snapshot(),
+            "key": self._key_circuit.snapshot(),
+        }
+
+    def _skip_rate_limited_key(self, call: _ProviderCall, key_item: LLMKeyItem, idx: int) -> bool:
+        if not self._is_rate_limited(key_item.key):
+            return False
+        keys_total = len(call.api_keys)
+        self._logger.info(
+            f"{call.provider}_key_rate_limited_skip",
+            extra={"key_index": idx, "keys_total": keys_total},
+        )
+        if idx < keys_total:
+            return True
+        raise LLMProviderError(
+            f"{call.label} key is rate limited",
+            status_code=429,
+            retryable=True,
+            fallback=call.fallback,
+            category="rate_limited",
+        )
+
+    def _complete_key_call(
+        self,
+        call: _ProviderCall,
+        key_item: LLMKeyItem,
+        data: dict[str, Any],
+    ) -> LLMResponse:
+        text = call.extract_text(data)
+        if not text:
+            raise LLMProviderError(
+                f"{call.label} response is empty",
+                retryable=False,
+                fallback=call.fallback,
+                category="empty_response",
+            )
+        record_llm_key_usage(key_item, success=True, status_code=200)
+        return LLMResponse(text=text, provider=call.provider, model=call.model)
+
+    def _record_key_failure(
+        self,
+        call: _ProviderCall,
+        key_item: LLMKeyItem,
+        exc: LLMProviderError,
+        idx: int,
+    ) -> None:
+        self._mark_rate_limit(key_item.key, exc)
+        record_llm_key_usage(
+            key_item,
+            success=False,
+            status_code=exc.status_code,
+            error_message=str(exc),
+        )
+        self._logger.warning(
+            f"{call.provider}_key_failed",
+            extra={
+                "status_code": exc.status_code,
+                "retryable": exc.retryable,
+                "fallback": exc.fallback,
+                "category": exc.category,
+                "key_index": idx,
+                "keys_total": len(call.api_keys),
+            },
+        )
+
+    @staticmethod
+    def _provider_exhausted_error(
+        call: _ProviderCall,
+        last_error: LLMProviderError | None,
+    ) -> LLMProviderError:
+        if last_error:
+            return last_error
+        return LLMProviderError(
+            f"{call.label} provider failed",
+            retryable=False,
+            fallback=call.fallback,
             category="unknown",
         )
 
@@ -359,79 +1192,133 @@ class LLMRouter:
         while True:
             try:
                 resp = self._client.post(url, json=json_payload, headers=headers)
-            except httpx.TimeoutException as exc:
+            except httpx.RequestError as exc:
                 attempts += 1
                 if attempts <= max_retries:
                     self._sleep_backoff(attempts)
                     continue
-                raise LLMProviderError(
-                    "LLM request timed out",
-                    retryable=True,
-                    fallback=True,
-                    category="timeout",
-                ) from exc
+                raise self._request_error(exc) from exc
+
+            if resp.status_code in self._retry_statuses and attempts < max_retries:
+                attempts += 1
+                self._sleep_backoff(attempts, retry_after=self._retry_after_seconds(resp))
+                continue
+            return self._parse_response(resp, fallback_statuses=fallback_statuses)
+
+    async def _apost_json(
+        self,
+        url: str,
+        *,
+        headers: dict[str, str] | None,
+        json_payload: dict[str, Any],
+        max_retries: int,
+        fallback_statuses: set[int],
+    ) -> dict[str, Any]:
+        client = self._get_async_client()
+        attempts = 0
+
+        while True:
+            try:
+                resp = await client.post(url, json=json_payload, headers=headers)
             except httpx.RequestError as exc:
                 attempts += 1
                 if attempts <= max_retries:
-                    self._sleep_backoff(attempts)
+                    await asyncio.sleep(self._backoff_delay(attempts))
                     continue
-                raise LLMProviderError(
-                    f"LLM request failed: {exc.__class__.__name__}: {exc}",
-                    retryable=True,
-                    fallback=True,
-                    category="request_error",
-                ) from exc
-
-            status = resp.status_code
+                raise self._request_error(exc) from exc
 
-            if 200 <= status < 300:
-                try:
-                    return resp.json()
-                except ValueError as exc:
-                    raise LLMProviderError(
-                        "LLM provider returned non-JSON response",
-                        status_code=status,
-                        retryable=False,
-                        fallback=True,
-                        category="bad_response",
-                    ) from exc
-
-            if status in self._retry_statuses and attempts < max_retries:
+            if resp.status_code in self._retry_statuses and attempts < max_retries:
                 attempts += 1
-                self._sleep_backoff(attempts, retry_after=self._retry_after_seconds(resp))
+                await asyncio.sleep(
+                    self._backoff_delay(attempts, retry_after=self._retry_after_seconds(resp))
+                )
                 continue
+            return self._parse_response(resp, fallback_statuses=fallback_statuses)
 
-            retry_after = self._retry_after_seconds(resp)
-            raise LLMProviderError(
-                self._format_error_message(status, resp),
-                status_code=status,
-                retryable=status in self._retry_statuses or status >= 500,
-                fallback=status in fallback_statuses or status >= 500,
-                category=self._status_category(status),
-                retry_after=retry_after,
+    @staticmethod
+    def _request_error(exc: httpx.RequestError) -> LLMProviderError:
+        if isinstance(exc, httpx.TimeoutException):
+            return LLMProviderError(
+                "LLM request timed out",
+                retryable=True,
+                fallback=True,
+                category="timeout",
             )
+        return LLMProviderError(
+            f"LLM request failed: {exc.__class__.__name__}: {exc}",
+            retryable=True,
+            fallback=True,
+            category="request_error",
+        )
+
+    def _parse_response(self, resp: httpx.Response, *, fallback_statuses: set[int]) -> dict[str, Any]:
+        status = resp.status_code
+
+        if 200 <= status < 300:
+            try:
+                return resp.json()
+            except ValueError as exc:
+                raise LLMProviderError(
+                    "LLM provider returned non-JSON response",
+                    status_code=status,
+                    retryable=False,
+                    fallback=True,
+                    category="bad_response",
+                ) from exc
+
+        raise LLMProviderError(
+            self._format_error_message(status, resp),
+            status_code=status,
+            retryable=status in self._retry_statuses or status >= 500,
+            fallback=status in fallback_statuses or status >= 500,
+            category=self._status_category(status),
+            retry_after=self._retry_after_seconds(resp),
+        )
 
     @staticmethod
     def _retry_after_seconds(resp: httpx.Response) -> float | None:
         val = resp.headers.get("retry-after")
         if not val:
             return None
+        val = val.strip()
         try:
-            return float(val.strip())
+            return float(val)
         except ValueError:
+            pass
+        # Retry-After может прийти и HTTP-датой (RFC 9110).
+        try:
+            retry_at = parsedate_to_datetime(val)
+        except (TypeError, ValueError):
             return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
 
     @staticmethod
-    def _sleep_backoff(attempt: int, *, retry_after: float | None = None) -> None:
+    def _backoff_delay(attempt: int, *, retry_after: float | None = None) -> float:
         if retry_after is not None:
-            time.sleep(max(0.2, retry_after))
-            return
-        time.sleep(0.3 * attempt)
+            return max(0.2, retry_after)
+        return 0.3 * attempt
+
+    @classmethod
+    def _sleep_backoff(cls, attempt: int, *, retry_after: float | None = None) -> None:
+        time.sleep(cls._backoff_delay(attempt, retry_after=retry_after))
+
+    @staticmethod
+    def _gemini_base_url() -> str:
+        # Переопределяется, например, на локальную заглушку провайдеров (scripts/llm_stub_server.py).
+        return (getattr(settings, "llm_gemini_base_url", None) or GEMINI_BASE_URL).rstrip("/")
+
+    @staticmethod
+    def _openai_base_url() -> str:
+        return (getattr(settings, "llm_openai_base_url", None) or OPENAI_BASE_URL).rstrip("/")
 
     @staticmethod
-    def _build_prompt(system_prompt: str, facts_pack: dict[str, Any]) -> str:
-        payload = json.dumps(facts_pack, ensure_ascii=False, indent=2)
-        return f"{system_prompt}\n\nДанные (facts-pack):\n{payload}"
+    def _serialize_facts_pack(facts_pack: dict[str, Any]) -> str:
+        # Компактный JSON: отступы и пробелы — это лишние токены в каждом запросе.
+        if getattr(settings, "llm_facts_pack_compact_json", True):
+            return json.dumps(facts_pack, ensure_ascii=False, separators=(",", ":"))
+        return json.dumps(facts_pack, ensure_ascii=False, indent=2)
 
     @staticmethod
     def _status_category(status: int) -> str:
@@ -516,4 +1403,12 @@ class LLMRouter:
         message = choices[0].get("message") or {}
         return message.get("content")
 
+    @staticmethod
+    def _extract_openai_stream_text(data: dict[str, Any]) -> str | None:
+        choices = data.get("choices") or []
+        if not choices:
+            return None
+        delta = choices[0].get("delta") or {}
+        return delta.get("content")
+
 llm_router = LLMRouter()
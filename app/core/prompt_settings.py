@@ -1,10 +1,15 @@
 from __future__ import annotations
 
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
 from pathlib import Path
 
 from dotenv import dotenv_values
-from sqlalchemy import select
+from sqlalchemy import func, select
 
+from app.core.config import settings
 from app.db.models import SystemPrompt, Tariff
 from app.db.session import get_session_factory
 
@@ -71,10 +76,144 @@ def _load_admin_prompt_overrides() -> dict[str, str]:
         session.close()
 
 
+def _load_admin_prompt_stamp() -> tuple[int, int | None, str | None] | None:
+    """Дешёвая отметка состояния `system_prompts`: число строк, max(id), max(updated_at)."""
+    try:
+        session_factory = get_session_factory()
+    except RuntimeError:
+        return None
+    session = session_factory()
+    try:
+        count, max_id, max_updated_at = session.execute(
+            select(func.count(SystemPrompt.id), func.max(SystemPrompt.id), func.max(SystemPrompt.updated_at))
+        ).one()
+        return int(count or 0), max_id, str(max_updated_at) if max_updated_at is not None else None
+    except Exception:
+        return None
+    finally:
+        session.close()
+
+
+def _prompts_file_mtime() -> float | None:
+    try:
+        return PROMPTS_ENV_PATH.stat().st_mtime
+    except OSError:
+        return None
+
+
+@dataclass(frozen=True)
+class ResolvedTariffPrompt:
+    content: str
+    # "<источник>:<sha256 текста>": admin, file или default; одинаковый текст — одинаковая версия.
+    version: str
+
+
+def _resolved(content: str, source: str) -> ResolvedTariffPrompt:
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:12]
+    return ResolvedTariffPrompt(content=content, version=f"{source}:{digest}")
+
+
+@dataclass
+class _PromptSnapshot:
+    prompts: dict[Tariff, ResolvedTariffPrompt]
+    admin_stamp: tuple[int, int | None, str | None] | None
+    file_mtime: float | None
+    checked_at: float
+    generation: int
+
+
+class TariffPromptRegistry:
+    """Кэш промптов тарифов в памяти процесса.
+
+    Админские эндпоинты `/api/system-prompts` вызывают `invalidate()` после commit. Остальные
+    процессы раз в `PROMPT_CACHE_TTL_SECONDS` сверяют отметку таблицы (count/max(id)/max(updated_at))
+    и перечитывают промпты только при её изменении; `.env.prompts` — по mtime файла.
+    """
+
+    def __init__(self, *, ttl_seconds: float | None = None, clock=time.monotonic) -> None:
+        self._ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._snapshot: _PromptSnapshot | None = None
+
+    def _ttl(self) -> float:
+        if self._ttl_seconds is not None:
+            return max(float(self._ttl_seconds), 0.0)
+        return max(float(getattr(settings, "prompt_cache_ttl_seconds", 30) or 0), 0.0)
+
+    def resolve(self, tariff: Tariff) -> ResolvedTariffPrompt:
+        now = self._clock()
+        file_mtime = _prompts_file_mtime()
+        with self._lock:
+            snapshot = self._snapshot
+            generation = self._generation
+        if (
+            snapshot is not None
+            and snapshot.generation == generation
+            and snapshot.file_mtime == file_mtime
+            and now - snapshot.checked_at < self._ttl()
+        ):
+            return snapshot.prompts[tariff]
+        admin_stamp = _load_admin_prompt_stamp()
+        if (
+            snapshot is not None
+            and snapshot.generation == generation
+            and snapshot.file_mtime == file_mtime
+            and snapshot.admin_stamp == admin_stamp
+        ):
+            with self._lock:
+                if self._snapshot is snapshot:
+                    snapshot.checked_at = now
+            return snapshot.prompts[tariff]
+        snapshot = _PromptSnapshot(
+            prompts=self._load_prompts(admin_stamp),
+            admin_stamp=admin_stamp,
+            file_mtime=file_mtime,
+            checked_at=now,
+            generation=generation,
+        )
+        with self._lock:
+            # Пока читали, промпты могли поменять: такой снимок не сохраняем.
+            if self._generation == generation:
+                self._snapshot = snapshot
+        return snapshot.prompts[tariff]
+
+    @staticmethod
+    def _load_prompts(admin_stamp: tuple[int, int | None, str | None] | None) -> dict[Tariff, ResolvedTariffPrompt]:
+        admin_overrides = _load_admin_prompt_overrides() if admin_stamp and admin_stamp[0] else {}
+        prompts: dict[Tariff, ResolvedTariffPrompt] = {}
+        if admin_overrides:
+            for tariff in Tariff:
+                content = admin_overrides.get(f"PROMPT_{tariff.value}")
+                prompts[tariff] = (
+                    _resolved(content, "admin") if content else _resolved(DEFAULT_TARIFF_PROMPTS[tariff], "default")
+                )
+            return prompts
+        file_overrides = _load_prompt_overrides()
+        for tariff in Tariff:
+            content = file_overrides.get(f"PROMPT_{tariff.value}")
+            prompts[tariff] = (
+                _resolved(content, "file") if content else _resolved(DEFAULT_TARIFF_PROMPTS[tariff], "default")
+            )
+        return prompts
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+
+
+tariff_prompt_registry = TariffPromptRegistry()
+
+
+def resolve_versioned_tariff_prompt(tariff: Tariff) -> ResolvedTariffPrompt:
+    return tariff_prompt_registry.resolve(tariff)
+
+
 def resolve_tariff_prompt(tariff: Tariff) -> str:
-    key = f"PROMPT_{tariff.value}"
-    admin_overrides = _load_admin_prompt_overrides()
-    if admin_overrides:
-        return admin_overrides.get(key) or DEFAULT_TARIFF_PROMPTS[tariff]
-    file_overrides = _load_prompt_overrides()
-    return file_overrides.get(key) or DEFAULT_TARIFF_PROMPTS[tariff]
+    return resolve_versioned_tariff_prompt(tariff).content
+
+
+def invalidate_tariff_prompt_cache() -> None:
+    tariff_prompt_registry.invalidate()
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Iterator, Mapping
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.db.models import (
+    Order,
+    OrderStatus,
+    QuestionnaireResponse,
+    QuestionnaireStatus,
+    Report,
+    ReportJob,
+    ScreenStateRecord,
+    Tariff,
+    User,
+    UserProfile,
+)
+
+_current_scope: ContextVar["ReportJobScope | None"] = ContextVar(
+    "report_job_scope",
+    default=None,
+)
+
+
+@dataclass(frozen=True)
+class ReportJobOrderSnapshot:
+    """Поля оплаченного заказа, по которым проверяется право сохранить отчёт."""
+
+    id: int
+    user_id: int
+    tariff: Tariff
+    status: OrderStatus
+    amount: float
+
+
+@dataclass(frozen=True)
+class ReportJobContext:
+    """Всё, что нужно генерации и сохранению отчёта по заданию, снятое при старте задания."""
+
+    job_id: int
+    lock_token: str | None
+    user_id: int
+    tariff: Tariff
+    order_id: int | None
+    # None, если пользователя уже нет.
+    telegram_user_id: int | None
+    has_profile: bool
+    questionnaire_status: QuestionnaireStatus | None
+    order: ReportJobOrderSnapshot | None
+    screen_state: Mapping[str, Any]
+
+    def report_state(self) -> dict[str, Any]:
+        """Состояние для генерации: тариф и заказ берутся из задания, а не из экрана."""
+        state = dict(self.screen_state)
+        state["selected_tariff"] = self.tariff.value
+        if self.order_id is not None:
+            state["order_id"] = str(self.order_id)
+        else:
+            state.pop("order_id", None)
+        return state
+
+
+@dataclass
+class LoadedReportJob:
+    job: ReportJob
+    existing_report: Report | None
+    context: ReportJobContext
+
+
+@dataclass
+class ReportJobScope:
+    """Контекст задания на время генерации и результат сохранения отчёта в той же транзакции."""
+
+    context: ReportJobContext
+    report: Report | None = None
+    job_completed: bool = False
+
+
+def load_report_job_context(
+    session: Session,
+    job_id: int,
+    *,
+    lock_token: str | None = None,
+) -> LoadedReportJob | None:
+    """Задание, пользователь, профиль, заказ, отчёт по заказу, экран и статус анкеты — одним запросом."""
+    latest_questionnaire_status = (
+        select(QuestionnaireResponse.status)
+        .where(QuestionnaireResponse.user_id == ReportJob.user_id)
+        .order_by(QuestionnaireResponse.updated_at.desc(), QuestionnaireResponse.id.desc())
+        .limit(1)
+        .correlate(ReportJob)
+        .scalar_subquery()
+    )
+    row = session.execute(
+        select(
+            ReportJob,
+            User.telegram_user_id,
+            UserProfile.user_id,
+            Order,
+            Report,
+            ScreenStateRecord.data,
+            latest_questionnaire_status,
+        )
+        .outerjoin(User, User.id == ReportJob.user_id)
+        .outerjoin(UserProfile, UserProfile.user_id == ReportJob.user_id)
+        .outerjoin(Order, Order.id == ReportJob.order_id)
+        # Отчёт по заказу уникален (ux_reports_order_id_not_null), так что строк не больше одной.
+        .outerjoin(Report, Report.order_id == ReportJob.order_id)
+        .outerjoin(ScreenStateRecord, ScreenStateRecord.telegram_user_id == User.telegram_user_id)
+        .where(ReportJob.id == job_id)
+    ).first()
+    if row is None:
+        return None
+    job, telegram_user_id, profile_user_id, order, existing_report, state_data, questionnaire_status = row
+    order_snapshot = None
+    if order is not None:
+        order_snapshot = ReportJobOrderSnapshot(
+            id=order.id,
+            user_id=order.user_id,
+            tariff=order.tariff,
+            status=order.status,
+            amount=float(order.amount or 0),
+        )
+    context = ReportJobContext(
+        job_id=job.id,
+        lock_token=lock_token,
+        user_id=job.user_id,
+        tariff=job.tariff,
+        order_id=job.order_id,
+        telegram_user_id=telegram_user_id,
+        has_profile=profile_user_id is not None,
+        questionnaire_status=questionnaire_status,
+        order=order_snapshot,
+        screen_state=MappingProxyType(dict(state_data or {})),
+    )
+    return LoadedReportJob(job=job, existing_report=existing_report, context=context)
+
+
+@contextmanager
+def activate_report_job_scope(context: ReportJobContext) -> Iterator[ReportJobScope]:
+    scope = ReportJobScope(context=context)
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+
+def current_report_job_scope() -> ReportJobScope | None:
+    return _current_scope.get()
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from sqlalchemy import update
+
+from app.db.models import ReportJob
+from app.db.session import get_session
+
+logger = logging.getLogger(__name__)
+
+# Сколько разделов ждём по тарифу (по REPORT_FRAMEWORK_TEMPLATE в report_service).
+REPORT_SECTIONS_BY_TARIFF = {"T0": 6, "T1": 6, "T2": 7, "T3": 10}
+_TITLE_MAX_CHARS = 72
+
+_current_progress: ContextVar["ReportJobProgress | None"] = ContextVar(
+    "report_job_progress",
+    default=None,
+)
+
+
+def is_section_title(line: str) -> bool:
+    stripped = (line or "").strip()
+    if not stripped or len(stripped) > _TITLE_MAX_CHARS:
+        return False
+    if stripped.startswith("#"):
+        return True
+    return stripped.endswith(":") and not stripped.startswith(("-", "*", "•"))
+
+
+def report_progress_fraction(sections_done: int, tariff: str | None) -> float:
+    expected = REPORT_SECTIONS_BY_TARIFF.get(tariff or "", REPORT_SECTIONS_BY_TARIFF["T1"])
+    # 100% показывает только завершённое задание.
+    return min(max(sections_done / expected, 0.05), 0.95)
+
+
+class ReportJobProgress:
+    """Считает разделы в стриме LLM и пишет их число в `report_jobs.progress_sections`.
+
+    Раздел считается готовым, когда в стриме начался следующий заголовок. Запись в БД —
+    не чаще раза в `interval_seconds` и только при изменении; экран S6 читает значение из задания.
+
+    В event loop запись уходит в пул потоков фоновой задачей и стрим её не ждёт. Пока запись
+    идёт, промежуточные значения не копятся: следующей пишется только последнее.
+    """
+
+    def __init__(
+        self,
+        job_id: int,
+        lock_token: str | None = None,
+        *,
+        interval_seconds: float = 3.0,
+        clock=time.monotonic,
+    ) -> None:
+        self.job_id = job_id
+        self.lock_token = lock_token
+        self.interval_seconds = max(float(interval_seconds or 0), 0.0)
+        self._clock = clock
+        self._line = ""
+        self._titles = 0
+        self._written: int | None = None
+        self._written_at: float | None = None
+        self._pending: int | None = None
+        self._writer: asyncio.Task[None] | None = None
+
+    @property
+    def sections_done(self) -> int:
+        return max(self._titles - 1, 0)
+
+    def start_attempt(self) -> None:
+        """Новая попытка генерации начинает отсчёт заново."""
+        self._line = ""
+        self._titles = 0
+        self._write(0)
+
+    def feed(self, text: str) -> None:
+        lines = (self._line + text).split("\n")
+        self._line = lines.pop()
+        changed = False
+        for line in lines:
+            if is_section_title(line):
+                self._titles += 1
+                changed = True
+        if not changed or self.sections_done == self._written:
+            return
+        now = self._clock()
+        if self._written_at is not None and now - self._written_at < self.interval_seconds:
+            return
+        self._write(self.sections_done)
+
+    def finish(self) -> None:
+        if is_section_title(self._line):
+            self._titles += 1
+        self._line = ""
+        # Последний раздел закончился вместе со стримом.
+        done = self._titles
+        if done != self._written:
+            self._write(done)
+
+    async def drain(self) -> None:
+        """Дожидается фоновой записи, чтобы последнее значение попало в БД до конца задания."""
+        if self._writer is not None:
+            await asyncio.gather(self._writer, return_exceptions=True)
+
+    def _write(self, sections: int) -> None:
+        self._written = sections
+        self._written_at = self._clock()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._store(sections)
+            return
+        self._pending = sections
+        if self._writer is None or self._writer.done():
+            self._writer = loop.create_task(self._write_pending())
+
+    async def _write_pending(self) -> None:
+        while self._pending is not None:
+            sections, self._pending = self._pending, None
+            await asyncio.to_thread(self._store, sections)
+
+    def _store(self, sections: int) -> None:
+        statement = update(ReportJob).where(ReportJob.id == self.job_id)
+        if self.lock_token is not None:
+            statement = statement.where(ReportJob.lock_token == self.lock_token)
+        try:
+            with get_session() as session:
+                session.execute(
+                    statement.values(progress_sections=sections).execution_options(
+                        synchronize_session=False
+                    )
+                )
+        except Exception as exc:
+            logger.warning(
+                "report_job_progress_write_failed",
+                extra={"job_id": self.job_id, "error": str(exc)},
+            )
+
+
+@contextmanager
+def activate_report_job_progress(progress: ReportJobProgress) -> Iterator[ReportJobProgress]:
+    token = _current_progress.set(progress)
+    try:
+        yield progress
+    finally:
+        _current_progress.reset(token)
+
+
+def current_report_job_progress() -> ReportJobProgress | None:
+    return _current_progress.get()
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import logging
+import random
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.core.llm_router import LLMUnavailableError
+from app.db.models import ReportJob, ReportJobStatus
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ReportJobFailure:
+    reason: str
+    transient: bool
+
+
+def classify_report_job_failure(exc: BaseException) -> ReportJobFailure:
+    """Временные сбои (провайдеры LLM, соединение с БД, таймауты) повторяем, остальные — нет."""
+    if isinstance(exc, LLMUnavailableError):
+        return ReportJobFailure(reason="llm_unavailable", transient=True)
+    if isinstance(exc, (OperationalError, InterfaceError, PoolTimeoutError)) or (
+        isinstance(exc, DBAPIError) and exc.connection_invalidated
+    ):
+        return ReportJobFailure(reason=f"db_unavailable: {exc.__class__.__name__}", transient=True)
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return ReportJobFailure(reason=f"network_error: {exc.__class__.__name__}", transient=True)
+    return ReportJobFailure(reason=str(exc) or exc.__class__.__name__, transient=False)
+
+
+def compute_report_job_retry_delay(
+    attempt: int,
+    *,
+    base_seconds: float,
+    max_seconds: float,
+    rng: Callable[[], float] = random.random,
+) -> float:
+    """Экспоненциальная задержка от номера попытки с jitter: половина фиксирована, половина случайна.
+
+    Jitter разводит по времени задания, упавшие вместе во время одного сбоя провайдера.
+    """
+    base_seconds = max(base_seconds, 1)
+    delay = min(max(max_seconds, base_seconds), base_seconds * 2 ** max(attempt - 1, 0))
+    return delay / 2 + rng() * delay / 2
+
+
+def apply_report_job_failure(
+    job: ReportJob,
+    failure: ReportJobFailure,
+    *,
+    max_attempts: int,
+    retry_base_seconds: float,
+    retry_max_seconds: float,
+    now: datetime | None = None,
+) -> ReportJobStatus:
+    """Переводит задание после ошибки: повтор с backoff, dead-letter после исчерпания попыток или FAILED.
+
+    При повторе блокировку снимаем сразу, а lock_token оставляем: по нему воркер узнаёт своё
+    задание и не показывает пользователю экран ошибки, пока задание ждёт следующей попытки.
+    """
+    now = now or datetime.now(timezone.utc)
+    attempts = job.attempts or 0
+    job.last_error = failure.reason
+    job.next_attempt_at = None
+    if not failure.transient:
+        job.status = ReportJobStatus.FAILED
+    elif attempts >= max_attempts:
+        job.status = ReportJobStatus.DEAD_LETTER
+        logger.warning(
+            "report_job_dead_lettered",
+            extra={"job_id": job.id, "attempts": attempts, "reason": failure.reason},
+        )
+    else:
+        delay = compute_report_job_retry_delay(
+            attempts,
+            base_seconds=retry_base_seconds,
+            max_seconds=retry_max_seconds,
+        )
+        job.status = ReportJobStatus.PENDING
+        job.next_attempt_at = now + timedelta(seconds=delay)
+        job.locked_at = None
+        logger.info(
+            "report_job_retry_scheduled",
+            extra={
+                "job_id": job.id,
+                "attempts": attempts,
+                "delay_seconds": round(delay, 1),
+                "reason": failure.reason,
+            },
+        )
+    return job.status
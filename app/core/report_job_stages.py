@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Any, Iterator
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.db.models import ReportJobStage
+
+logger = logging.getLogger(__name__)
+
+STAGE_QUEUE = "queue"
+STAGE_LLM = "llm"
+STAGE_SAFETY = "safety"
+STAGE_PERSIST = "persist"
+STAGE_PDF = "pdf"
+STAGE_DELIVERY = "delivery"
+REPORT_JOB_STAGES = (
+    STAGE_QUEUE,
+    STAGE_LLM,
+    STAGE_SAFETY,
+    STAGE_PERSIST,
+    STAGE_PDF,
+    STAGE_DELIVERY,
+)
+
+_current_recorder: ContextVar["ReportJobStageRecorder | None"] = ContextVar(
+    "report_job_stage_recorder",
+    default=None,
+)
+
+
+class ReportJobStageRecorder:
+    """Копит тайминги этапов одного задания в памяти и пишет их одной пачкой в конце обработки."""
+
+    def __init__(self, job_id: int) -> None:
+        self.job_id = job_id
+        self._stages: list[dict[str, Any]] = []
+
+    @property
+    def stages(self) -> list[dict[str, Any]]:
+        return list(self._stages)
+
+    def add(
+        self,
+        stage: str,
+        *,
+        started_at: datetime,
+        finished_at: datetime,
+        duration_ms: int | None = None,
+        attempt: int | None = None,
+        metadata: dict[str, Any] | None = None,
+    ) -> None:
+        if duration_ms is None:
+            duration_ms = int((finished_at - started_at).total_seconds() * 1000)
+        self._stages.append(
+            {
+                "stage": stage,
+                "attempt": attempt,
+                "started_at": started_at,
+                "finished_at": finished_at,
+                "duration_ms": max(duration_ms, 0),
+                "metadata_json": metadata or None,
+            }
+        )
+
+    def flush(self, session: Session) -> int:
+        stages, self._stages = self._stages, []
+        session.add_all(ReportJobStage(job_id=self.job_id, **stage) for stage in stages)
+        return len(stages)
+
+
+@contextmanager
+def activate_stage_recorder(recorder: ReportJobStageRecorder) -> Iterator[ReportJobStageRecorder]:
+    token = _current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current_recorder.reset(token)
+
+
+@contextmanager
+def report_job_stage(
+    stage: str,
+    *,
+    attempt: int | None = None,
+    **metadata: Any,
+) -> Iterator[dict[str, Any]]:
+    """Замеряет этап текущего задания; вне задания (например, генерация без ReportJob) — no-op.
+
+    Возвращает словарь метаданных, который можно дополнить внутри блока (провайдер, вердикт и т. п.).
+    """
+    recorder = _current_recorder.get()
+    started_at = datetime.now(timezone.utc)
+    started = time.monotonic()
+    try:
+        yield metadata
+    except BaseException as exc:
+        metadata.setdefault("error", exc.__class__.__name__)
+        raise
+    finally:
+        if recorder is not None:
+            recorder.add(
+                stage,
+                started_at=started_at,
+                finished_at=datetime.now(timezone.utc),
+                duration_ms=int((time.monotonic() - started) * 1000),
+                attempt=attempt,
+                metadata=metadata,
+            )
+
+
+def collect_report_job_stage_percentiles(
+    session: Session,
+    *,
+    since: datetime | None = None,
+    limit: int = 20000,
+) -> dict[str, dict[str, int | None]]:
+    """p50/p95 длительности по этапам за окно (по умолчанию последние сутки)."""
+    since = since or datetime.now(timezone.utc) - timedelta(hours=24)
+    rows = session.execute(
+        select(ReportJobStage.stage, ReportJobStage.duration_ms)
+        .where(ReportJobStage.finished_at >= since)
+        .order_by(ReportJobStage.finished_at.desc())
+        .limit(limit)
+    ).all()
+    durations: dict[str, list[int]] = defaultdict(list)
+    for stage, duration_ms in rows:
+        if duration_ms is not None:
+            durations[stage].append(duration_ms)
+    return {
+        stage: {
+            "count": len(values),
+            "p50_ms": _percentile(values, 50),
+            "p95_ms": _percentile(values, 95),
+        }
+        for stage, values in sorted(
+            durations.items(),
+            key=lambda item: _stage_sort_key(item[0]),
+        )
+    }
+
+
+def _stage_sort_key(stage: str) -> tuple[int, str]:
+    try:
+        return REPORT_JOB_STAGES.index(stage), stage
+    except ValueError:
+        return len(REPORT_JOB_STAGES), stage
+
+
+def _percentile(values: list[int], percentile: int) -> int | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Nearest-rank: без интерполяции, значение всегда реально наблюдалось.
+    rank = max(int(-(-percentile * len(ordered) // 100)), 1)
+    return ordered[rank - 1]
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Any, Sequence
+
+from app.core.report_job_progress import is_section_title
+from app.core.report_safety import SafetyMatch
+
+# Точечная правка выгодна, пока фрагменты — малая часть отчёта; дальше дешевле перегенерировать.
+REPAIR_MAX_TEXT_SHARE = 0.5
+_MARKER_RE = re.compile(r"^\[\[(\d+)\]\][ \t]*$", re.MULTILINE)
+
+
+@dataclass(frozen=True)
+class ReportRepairFragment:
+    start: int
+    end: int
+    heading: str | None
+    text: str
+    rules: tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class ReportRepairPlan:
+    """Фрагменты отчёта с нарушениями: что отправить на переписку и куда вставить ответ."""
+
+    text: str
+    fragments: tuple[ReportRepairFragment, ...]
+
+    def facts_pack(self) -> dict[str, Any]:
+        return {
+            "task": "report_fragment_repair",
+            "fragments": [
+                {
+                    "id": index,
+                    "section": fragment.heading,
+                    "violations": list(fragment.rules),
+                    "text": fragment.text,
+                }
+                for index, fragment in enumerate(self.fragments, start=1)
+            ],
+        }
+
+    def apply(self, answer: str) -> str | None:
+        """Текст с заменёнными фрагментами или None, если ответ не разобрать по маркерам [[N]]."""
+        replacements = parse_repair_answer(answer)
+        if replacements is None or set(replacements) != set(range(1, len(self.fragments) + 1)):
+            return None
+        text = self.text
+        # С конца, чтобы спаны ещё не заменённых фрагментов не сдвигались.
+        for index in range(len(self.fragments), 0, -1):
+            fragment = self.fragments[index - 1]
+            text = text[: fragment.start] + replacements[index] + text[fragment.end :]
+        return text
+
+
+def parse_repair_answer(answer: str) -> dict[int, str] | None:
+    markers = list(_MARKER_RE.finditer(answer or ""))
+    if not markers:
+        return None
+    replacements: dict[int, str] = {}
+    for position, marker in enumerate(markers):
+        end = markers[position + 1].start() if position + 1 < len(markers) else len(answer)
+        fragment_text = answer[marker.end() : end].strip()
+        fragment_id = int(marker.group(1))
+        if not fragment_text or fragment_id in replacements:
+            return None
+        replacements[fragment_id] = fragment_text
+    return replacements
+
+
+def _split_blocks(text: str) -> list[tuple[int, int, str | None]]:
+    """Абзацы (подряд идущие непустые строки) со спанами и ближайшим заголовком раздела выше.
+
+    Строка-заголовок — отдельный блок, и сама себе раздел не задаёт.
+    """
+    blocks: list[tuple[int, int, str | None]] = []
+    heading: str | None = None
+    block_start: int | None = None
+    block_end = 0
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        content = line.rstrip("\r\n")
+        line_end = offset + len(content)
+        title = is_section_title(content)
+        if not content.strip() or title:
+            if block_start is not None:
+                blocks.append((block_start, block_end, heading))
+                block_start = None
+            if title:
+                blocks.append((offset, line_end, heading))
+                heading = content.strip()
+        else:
+            if block_start is None:
+                block_start = offset
+            block_end = line_end
+        offset += len(line)
+    if block_start is not None:
+        blocks.append((block_start, block_end, heading))
+    return blocks
+
+
+def build_repair_plan(
+    text: str,
+    matches: Sequence[SafetyMatch],
+    *,
+    max_fragments: int,
+) -> ReportRepairPlan | None:
+    """План точечной правки или None, если нарушения не локализуются в нескольких абзацах."""
+    if not text or not matches or max_fragments <= 0:
+        return None
+    rules_by_block: dict[tuple[int, int, str | None], list[str]] = {}
+    blocks = _split_blocks(text)
+    for match in matches:
+        block = next((item for item in blocks if item[0] <= match.start < item[1]), None)
+        if block is None:
+            return None
+        rules = rules_by_block.setdefault(block, [])
+        if match.rule not in rules:
+            rules.append(match.rule)
+    if len(rules_by_block) > max_fragments:
+        return None
+    fragments = tuple(
+        ReportRepairFragment(start=start, end=end, heading=heading, text=text[start:end], rules=tuple(rules))
+        for (start, end, heading), rules in sorted(rules_by_block.items(), key=lambda item: item[0][0])
+    )
+    if sum(len(fragment.text) for fragment in fragments) > len(text) * REPAIR_MAX_TEXT_SHARE:
+        return None
+    return ReportRepairPlan(text=text, fragments=fragments)
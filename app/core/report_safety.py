@@ -2,9 +2,10 @@ from __future__ import annotations
 
 import re
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Iterator
 
 
+# Все правила срабатывают только с начала слова: на этом построен общий проход CompiledSafetyScanner.
 FORBIDDEN_WORDS = [
     "нумерология",
     "предназначение",
@@ -39,6 +40,17 @@ RED_ZONE_PATTERNS = {
     "self_harm": r"\b(суицид|самоповрежд|самоубийств)\w*\b",
 }
 
+CATEGORY_FORBIDDEN_WORD = "forbidden_word"
+CATEGORY_FORBIDDEN_PATTERN = "forbidden_pattern"
+CATEGORY_RED_ZONE = "red_zone"
+
+# Сколько совпадений со спанами сохраняем в safety_flags на одну попытку.
+SAFETY_MATCHES_PAYLOAD_LIMIT = 50
+
+# Сколько уже проверенного текста стрима держим для совпадений на стыке фрагментов.
+STREAM_SCAN_OVERLAP_CHARS = 64
+_NON_WORD_RE = re.compile(r"\W")
+
 SAFE_REFUSAL_TEXT = (
     "Я не могу обсуждать темы, связанные с медициной, финансами, "
     "самоповреждениями, азартными играми или другими запрещёнными зонами. "
@@ -47,11 +59,21 @@ SAFE_REFUSAL_TEXT = (
 )
 
 
+@dataclass(frozen=True)
+class SafetyMatch:
+    category: str
+    rule: str
+    start: int
+    end: int
+    text: str
+
+
 @dataclass(frozen=True)
 class SafetyEvaluation:
     forbidden_words: list[str]
     forbidden_patterns: list[str]
     red_zones: list[str]
+    matches: tuple[SafetyMatch, ...] = ()
 
     @property
     def is_safe(self) -> bool:
@@ -62,41 +84,115 @@ class SafetyEvaluation:
         )
 
 
+def _non_capturing(pattern: str) -> str:
+    """Тот же паттерн, но группы `(...)` заменены на `(?:...)`: в общем выражении захват не нужен."""
+    parts: list[str] = []
+    escaped = in_class = False
+    for index, char in enumerate(pattern):
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif in_class:
+            in_class = char != "]"
+        elif char == "[":
+            in_class = True
+        elif char == "(" and not pattern.startswith("?", index + 1):
+            parts.append("(?:")
+            continue
+        parts.append(char)
+    return "".join(parts)
+
+
+class CompiledSafetyScanner:
+    """Все правила в одном регулярном выражении: один проход по тексту вместо прохода на правило.
+
+    Общее выражение — альтернатива правил с условием «здесь начинается слово». Группы захвата из
+    правил (красные зоны) в нём заменяются на `(?:...)`: захват общему выражению не нужен, спаны
+    даёт `match` правила. Оно находит самую левую позицию,
+    где срабатывает хоть одно правило; какие именно правила сработали и их спаны, уточняет якорный
+    `match` каждого правила в этой позиции. Следующий поиск идёт со следующего символа, так что
+    находятся все позиции, что и при поиске по каждому правилу отдельно («прогноз» попадает и в
+    слова, и в паттерны).
+    """
+
+    def __init__(self, rules: list[tuple[str, str, str]]) -> None:
+        self._rules = [
+            (category, name, re.compile(pattern, re.IGNORECASE))
+            for category, name, pattern in rules
+        ]
+        self._combined = re.compile(
+            r"(?<!\w)(?=\w)(?:" + "|".join(f"(?:{_non_capturing(pattern)})" for _, _, pattern in rules) + ")",
+            re.IGNORECASE,
+        )
+
+    def finditer(self, text: str) -> Iterator[SafetyMatch]:
+        position = 0
+        while True:
+            found = self._combined.search(text, position)
+            if found is None:
+                return
+            start = found.start()
+            for category, name, regex in self._rules:
+                match = regex.match(text, start)
+                if match is not None:
+                    yield SafetyMatch(category, name, start, match.end(), match.group())
+            position = start + 1
+
+
 class ReportSafety:
     def __init__(self) -> None:
-        self._word_regexes = {
-            word: re.compile(rf"\b{re.escape(word)}\b", re.IGNORECASE)
+        word_rules = [
+            (CATEGORY_FORBIDDEN_WORD, word, rf"\b{re.escape(word)}\b")
             for word in FORBIDDEN_WORDS
-        }
-        self._pattern_regexes = {
-            name: re.compile(pattern, re.IGNORECASE)
+        ]
+        pattern_rules = [
+            (CATEGORY_FORBIDDEN_PATTERN, name, pattern)
             for name, pattern in GUARANTEE_PATTERNS.items()
-        }
-        self._red_zone_regexes = {
-            name: re.compile(pattern, re.IGNORECASE)
+        ]
+        red_zone_rules = [
+            (CATEGORY_RED_ZONE, name, pattern)
             for name, pattern in RED_ZONE_PATTERNS.items()
-        }
+        ]
+        self._scanner = CompiledSafetyScanner(word_rules + pattern_rules + red_zone_rules)
+        self._hard_scanner = CompiledSafetyScanner(red_zone_rules + word_rules)
+
+    def scan(self, text: str) -> list[SafetyMatch]:
+        """Все совпадения правил в порядке позиции в тексте."""
+        return list(self._scanner.finditer(text))
 
     def evaluate(self, text: str) -> SafetyEvaluation:
-        forbidden_words = [
-            word for word, regex in self._word_regexes.items() if regex.search(text)
-        ]
-        forbidden_patterns = [
-            name
-            for name, regex in self._pattern_regexes.items()
-            if regex.search(text)
-        ]
-        red_zones = [
-            name
-            for name, regex in self._red_zone_regexes.items()
-            if regex.search(text)
-        ]
+        matches = self.scan(text)
+        found = {(match.category, match.rule) for match in matches}
         return SafetyEvaluation(
-            forbidden_words=forbidden_words,
-            forbidden_patterns=forbidden_patterns,
-            red_zones=red_zones,
+            forbidden_words=[
+                word for word in FORBIDDEN_WORDS if (CATEGORY_FORBIDDEN_WORD, word) in found
+            ],
+            forbidden_patterns=[
+                name for name in GUARANTEE_PATTERNS if (CATEGORY_FORBIDDEN_PATTERN, name) in found
+            ],
+            red_zones=[
+                name for name in RED_ZONE_PATTERNS if (CATEGORY_RED_ZONE, name) in found
+            ],
+            matches=tuple(matches),
         )
 
+    def find_hard_violation(self, text: str) -> str | None:
+        """Первое жёсткое нарушение (красная зона или запрещённое слово): имя зоны или слово."""
+        found = {match.rule for match in self._hard_scanner.finditer(text)}
+        if not found:
+            return None
+        for name in RED_ZONE_PATTERNS:
+            if name in found:
+                return name
+        for word in FORBIDDEN_WORDS:
+            if word in found:
+                return word
+        return None
+
+    def stream_scanner(self) -> "StreamSafetyScanner":
+        return StreamSafetyScanner(self)
+
     def build_retry_prompt(self, base_prompt: str, evaluation: SafetyEvaluation) -> str:
         issues: list[str] = []
         if evaluation.forbidden_words:
@@ -121,6 +217,21 @@ class ReportSafety:
             f"{issues_block}"
         )
 
+    @staticmethod
+    def build_repair_prompt() -> str:
+        # Промпт статичен (нарушения — в данных по фрагментам), чтобы его кэшировал провайдер.
+        return (
+            "Ты редактор аналитического отчёта. В данных — фрагменты отчёта, нарушившие "
+            "контент-политику: у каждого есть id, раздел (section) и найденные нарушения (violations).\n"
+            "Перепиши каждый фрагмент так, чтобы:\n"
+            "- смысл, стиль, объём и Markdown-разметка сохранились;\n"
+            f"- не было запрещённых слов ({', '.join(FORBIDDEN_WORDS)});\n"
+            "- не было гарантий, обещаний, процентов, прогнозов и предсказаний;\n"
+            "- не упоминались медицина, финансы, азартные игры и другие красные зоны.\n"
+            "Верни только переписанные фрагменты в исходном порядке. Перед каждым фрагментом — "
+            "отдельная строка-маркер вида [[id]], без других пояснений."
+        )
+
     @staticmethod
     def build_flags(
         *,
@@ -146,6 +257,16 @@ class ReportSafety:
             "forbidden_patterns": evaluation.forbidden_patterns,
             "red_zones": evaluation.red_zones,
             "safe": evaluation.is_safe,
+            "matches": [
+                {
+                    "category": match.category,
+                    "rule": match.rule,
+                    "start": match.start,
+                    "end": match.end,
+                    "text": match.text,
+                }
+                for match in evaluation.matches[:SAFETY_MATCHES_PAYLOAD_LIMIT]
+            ],
         }
 
     @staticmethod
@@ -153,4 +274,47 @@ class ReportSafety:
         return SAFE_REFUSAL_TEXT
 
 
+class StreamSafetyScanner:
+    """Проверяет стрим LLM на жёсткие нарушения скользящим окном, не дожидаясь полного текста.
+
+    Сканируется только текст до последней границы слова (незаконченное слово может оказаться
+    безопасным: «карма» → «карман»), плюс хвост уже проверенного текста для совпадений на стыке.
+    """
+
+    def __init__(self, safety: ReportSafety) -> None:
+        self._safety = safety
+        self._context = ""
+        self._pending = ""
+        self.violation: str | None = None
+
+    def feed(self, text: str) -> str | None:
+        if self.violation is not None:
+            return self.violation
+        self._pending += text
+        boundary = self._last_boundary(self._pending)
+        if boundary <= 0:
+            return None
+        window = self._context + self._pending[:boundary]
+        self._pending = self._pending[boundary:]
+        self.violation = self._safety.find_hard_violation(window)
+        self._context = self._trim_context(window)
+        return self.violation
+
+    @staticmethod
+    def _last_boundary(text: str) -> int:
+        for index in range(len(text) - 1, -1, -1):
+            if _NON_WORD_RE.match(text, index):
+                return index + 1
+        return 0
+
+    @staticmethod
+    def _trim_context(window: str) -> str:
+        tail = window[-STREAM_SCAN_OVERLAP_CHARS:]
+        if len(tail) < len(window):
+            # Хвост не должен начинаться с обрывка слова, иначе \b сработает внутри слова.
+            match = _NON_WORD_RE.search(tail)
+            tail = tail[match.start():] if match else ""
+        return tail
+
+
 report_safety = ReportSafety()
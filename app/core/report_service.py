@@ -2,32 +2,46 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import time
+from contextlib import aclosing
 from datetime import datetime, timezone
 from typing import Any
 
 from app.core.config import settings
+from app.core.llm_response_cache import build_llm_response_cache_key, llm_response_cache
 from app.core.llm_router import LLMResponse, LLMUnavailableError, llm_router
 from app.core.monitoring import send_monitoring_event
-from app.core.prompt_settings import resolve_tariff_prompt
-from app.core.report_safety import report_safety
+from app.core.prompt_settings import resolve_versioned_tariff_prompt
+from app.core.report_job_context import (
+    ReportJobOrderSnapshot,
+    ReportJobScope,
+    activate_report_job_scope,
+    current_report_job_scope,
+    load_report_job_context,
+)
+from app.core.report_job_progress import current_report_job_progress
+from app.core.report_job_retry import (
+    ReportJobFailure,
+    apply_report_job_failure,
+    classify_report_job_failure,
+)
+from app.core.report_job_stages import STAGE_LLM, STAGE_PERSIST, STAGE_SAFETY, report_job_stage
+from app.core.report_repair import ReportRepairPlan, build_repair_plan
+from app.core.report_safety import SafetyEvaluation, report_safety
 from app.core.report_text_pipeline import build_canonical_report_text
 from app.db.models import (
     Order,
     OrderFulfillmentStatus,
     OrderStatus,
-    QuestionnaireResponse,
     QuestionnaireStatus,
     Report,
     ReportJob,
     ReportJobStatus,
     ReportModel,
-    ScreenStateRecord,
     Tariff,
-    User,
-    UserProfile,
 )
 from app.db.session import get_session
-from sqlalchemy import select
+from sqlalchemy import func, select, update
 from sqlalchemy.exc import IntegrityError
 
 
@@ -57,18 +71,53 @@ class ReportService:
     async def generate_report(self, *, user_id: int, state: dict[str, Any]) -> LLMResponse | None:
         facts_pack = self._build_facts_pack(user_id=user_id, state=state)
         base_prompt = self._build_system_prompt(state)
+        prompt_version = self._prompt_version(state)
+        job_scope = current_report_job_scope()
+        if job_scope is not None and job_scope.context.user_id != user_id:
+            job_scope = None
         prompt = base_prompt
         attempts = 0
         safety_history: list[dict[str, Any]] = []
         last_response: LLMResponse | None = None
         evaluation = None
+        cache_key: str | None = None
+        cache_hit = False
+        repaired_response: LLMResponse | None = None
+        # Точечная правка — не больше одного вызова LLM за отчёт, даже если её ответ не разобрался.
+        repair_used = False
 
         while True:
-            try:
-                response = await asyncio.to_thread(llm_router.generate, facts_pack, prompt)
-            except LLMUnavailableError:
-                self._logger.warning("llm_unavailable", extra={"user_id": user_id})
-                return None
+            repaired = repaired_response is not None
+            if repaired:
+                # Текст после точечной правки фрагментов: сразу на повторную проверку.
+                response, stream_violation = repaired_response, None
+                repaired_response = None
+            else:
+                try:
+                    with report_job_stage(STAGE_LLM, attempt=attempts + 1) as stage_meta:
+                        stage_meta["prompt_version"] = prompt_version
+                        cached_response = None
+                        if llm_response_cache.enabled:
+                            cache_key = build_llm_response_cache_key(facts_pack, prompt)
+                            # Кэш читается синхронной сессией: в event loop бота её не выполняем.
+                            cached_response = await asyncio.to_thread(llm_response_cache.get, cache_key)
+                            stage_meta["cache"] = "hit" if cached_response else "miss"
+                        cache_hit = cached_response is not None
+                        if cached_response is not None:
+                            response, stream_violation = cached_response, None
+                        else:
+                            response, stream_violation = await self._generate_llm_response(
+                                facts_pack,
+                                prompt,
+                                stage_meta,
+                            )
+                        stage_meta.update(provider=response.provider, model=response.model)
+                        if response.hedge:
+                            stage_meta["hedge_winner"] = response.hedge
+                except LLMUnavailableError:
+                    # Пробрасываем дальше: задание классифицирует сбой как временный и повторит позже.
+                    self._logger.warning("llm_unavailable", extra={"user_id": user_id})
+                    raise
 
             if not settings.report_safety_enabled:
                 safety_flags = report_safety.build_flags(
@@ -78,16 +127,29 @@ class ReportService:
                     model=response.model,
                 )
                 safety_flags["filtering_disabled"] = True
+                await self._store_cached_response(cache_key, response, cache_hit=cache_hit)
                 self._persist_report(
                     user_id=user_id,
                     state=state,
                     response=response,
                     safety_flags=safety_flags,
+                    prompt_version=prompt_version,
+                    job_scope=job_scope,
                 )
                 return response
 
-            evaluation = report_safety.evaluate(response.text)
-            safety_history.append(report_safety.evaluation_payload(evaluation))
+            with report_job_stage(STAGE_SAFETY, attempt=attempts + 1) as stage_meta:
+                evaluation = report_safety.evaluate(response.text)
+                stage_meta["is_safe"] = evaluation.is_safe
+                if stream_violation:
+                    stage_meta["stream_aborted"] = stream_violation
+            safety_payload = report_safety.evaluation_payload(evaluation)
+            if stream_violation:
+                # Стрим оборван на жёстком нарушении: оценка относится к части текста.
+                safety_payload["stream_aborted"] = stream_violation
+            if repaired:
+                safety_payload["repaired"] = True
+            safety_history.append(safety_payload)
             last_response = response
 
             if evaluation.is_safe:
@@ -97,7 +159,17 @@ class ReportService:
                 break
 
             attempts += 1
-            prompt = report_safety.build_retry_prompt(base_prompt, evaluation)
+            plan = None if repair_used or stream_violation else self._repair_plan(response, evaluation)
+            if plan is not None:
+                repair_used = True
+                repaired_response = await self._repair_response(response, plan, attempt=attempts + 1)
+                if repaired_response is None:
+                    # Неразобранная правка уже потратила попытку: перегенерация идёт следующей.
+                    if attempts >= 2:
+                        break
+                    attempts += 1
+            if repaired_response is None:
+                prompt = report_safety.build_retry_prompt(base_prompt, evaluation)
 
         if last_response and evaluation and evaluation.is_safe:
             safety_flags = report_safety.build_flags(
@@ -106,11 +178,14 @@ class ReportService:
                 provider=last_response.provider,
                 model=last_response.model,
             )
+            await self._store_cached_response(cache_key, last_response, cache_hit=cache_hit)
             self._persist_report(
                 user_id=user_id,
                 state=state,
                 response=last_response,
                 safety_flags=safety_flags,
+                prompt_version=prompt_version,
+                job_scope=job_scope,
             )
             return last_response
 
@@ -134,6 +209,7 @@ class ReportService:
                     response=safe_response,
                     safety_flags=safety_flags,
                     force_store=True,
+                    job_scope=job_scope,
                 )
                 return safe_response
             self._logger.info(
@@ -158,126 +234,196 @@ class ReportService:
                 response=fallback_response,
                 safety_flags=safety_flags,
                 force_store=True,
+                job_scope=job_scope,
             )
             return fallback_response
         return None
 
-    async def generate_report_by_job(self, *, job_id: int) -> Report | None:
-        user_id: int | None = None
-        state_data: dict[str, Any] = {}
+    @staticmethod
+    def _repair_plan(response: LLMResponse, evaluation: SafetyEvaluation) -> ReportRepairPlan | None:
+        """План точечной правки; None — нужна полная перегенерация."""
+        if not getattr(settings, "report_safety_repair_enabled", True) or evaluation.red_zones:
+            return None
+        return build_repair_plan(
+            response.text,
+            evaluation.matches,
+            max_fragments=getattr(settings, "report_safety_repair_max_fragments", 3),
+        )
+
+    async def _repair_response(
+        self,
+        response: LLMResponse,
+        plan: ReportRepairPlan,
+        *,
+        attempt: int,
+    ) -> LLMResponse | None:
+        """Переписывает только абзацы с нарушениями; None — ответ не разобрался, нужна перегенерация."""
+        with report_job_stage(STAGE_LLM, attempt=attempt) as stage_meta:
+            stage_meta["repair_fragments"] = len(plan.fragments)
+            # LLMUnavailableError пробрасывается, как и при полной генерации.
+            repair = await llm_router.agenerate(plan.facts_pack(), report_safety.build_repair_prompt())
+            stage_meta.update(provider=repair.provider, model=repair.model)
+            text = plan.apply(repair.text)
+            stage_meta["repaired"] = text is not None
+        if text is None:
+            self._logger.info(
+                "report_safety_repair_unparsed",
+                extra={"fragments": len(plan.fragments), "provider": repair.provider},
+            )
+            return None
+        # Основная часть текста — от исходной модели, её и указываем в отчёте.
+        return LLMResponse(text=text, provider=response.provider, model=response.model)
+
+    @staticmethod
+    async def _store_cached_response(cache_key: str | None, response: LLMResponse, *, cache_hit: bool) -> None:
+        # В кэш попадают только ответы, прошедшие проверку: иначе повтор снова упрётся в тот же текст.
+        if cache_key is None or cache_hit:
+            return
+        await asyncio.to_thread(llm_response_cache.put, cache_key, response)
+
+    async def _generate_llm_response(
+        self,
+        facts_pack: dict[str, Any],
+        prompt: str,
+        stage_meta: dict[str, Any],
+    ) -> tuple[LLMResponse, str | None]:
+        """Ответ LLM и жёсткое нарушение, на котором стрим был оборван досрочно (иначе None)."""
+        if not getattr(settings, "llm_streaming_enabled", True):
+            return await llm_router.agenerate(facts_pack, prompt), None
+        # Стрим собираем целиком (полная проверка безопасности — по финальному тексту), а по пути
+        # отдаём число готовых разделов экрану ожидания S6.
+        progress = current_report_job_progress()
+        if progress is not None:
+            progress.start_attempt()
+        scanner = None
+        if settings.report_safety_enabled and getattr(settings, "report_safety_stream_abort_enabled", True):
+            scanner = report_safety.stream_scanner()
+        started = time.monotonic()
+        parts: list[str] = []
+        provider = model = ""
+        violation: str | None = None
+        async with aclosing(llm_router.astream(facts_pack, prompt)) as stream:
+            async for chunk in stream:
+                if not parts:
+                    stage_meta["first_chunk_ms"] = int((time.monotonic() - started) * 1000)
+                    if chunk.hedge:
+                        stage_meta["hedge_winner"] = chunk.hedge
+                parts.append(chunk.text)
+                provider, model = chunk.provider, chunk.model
+                if scanner is not None:
+                    violation = scanner.feed(chunk.text)
+                    if violation:
+                        # Выход из aclosing закрывает стрим: запрос к провайдеру отменяется.
+                        break
+                if progress is not None:
+                    progress.feed(chunk.text)
+        stage_meta["streamed"] = True
+        if violation:
+            stage_meta["stream_aborted"] = violation
+            self._logger.info(
+                "report_stream_safety_abort",
+                extra={"violation": violation, "chars": sum(len(part) for part in parts)},
+            )
+        elif progress is not None:
+            progress.finish()
+        return LLMResponse(text="".join(parts), provider=provider, model=model), violation
+
+    async def generate_report_by_job(
+        self,
+        *,
+        job_id: int,
+        lock_token: str | None = None,
+    ) -> Report | None:
         with get_session() as session:
-            job = session.get(ReportJob, job_id)
-            if not job:
+            loaded = load_report_job_context(session, job_id, lock_token=lock_token)
+            if loaded is None:
                 self._logger.warning("report_job_missing", extra={"job_id": job_id})
                 return None
-            if job.order_id:
-                existing_report = (
-                    session.execute(
-                        select(Report).where(Report.order_id == job.order_id).limit(1)
-                    )
-                    .scalars()
-                    .first()
-                )
-                if existing_report:
-                    job.status = ReportJobStatus.COMPLETED
-                    job.last_error = None
-                    session.add(job)
-                    session.expunge(existing_report)
-                    return existing_report
-            user = session.get(User, job.user_id)
-            if not user:
+            job, context = loaded.job, loaded.context
+            if self._is_lease_lost(job, lock_token):
+                return None
+            if loaded.existing_report is not None:
+                job.status = ReportJobStatus.COMPLETED
+                job.last_error = None
+                session.add(job)
+                session.expunge(loaded.existing_report)
+                return loaded.existing_report
+            if context.telegram_user_id is None:
                 job.status = ReportJobStatus.FAILED
                 job.last_error = "user_missing"
                 session.add(job)
                 return None
-            user_id = user.id
-            telegram_user_id = user.telegram_user_id
-            profile = session.execute(
-                select(UserProfile).where(UserProfile.user_id == user.id).limit(1)
-            ).scalar_one_or_none()
-            if not profile:
+            if not context.has_profile:
                 job.status = ReportJobStatus.FAILED
                 job.last_error = "profile_missing"
                 session.add(job)
                 return None
-            if job.tariff in {Tariff.T2, Tariff.T3}:
-                latest_questionnaire = (
-                    session.execute(
-                        select(QuestionnaireResponse)
-                        .where(QuestionnaireResponse.user_id == user.id)
-                        .order_by(QuestionnaireResponse.updated_at.desc(), QuestionnaireResponse.id.desc())
-                        .limit(1)
-                    )
-                    .scalars()
-                    .first()
-                )
-                if (
-                    not latest_questionnaire
-                    or latest_questionnaire.status != QuestionnaireStatus.COMPLETED
-                ):
-                    job.status = ReportJobStatus.FAILED
-                    job.last_error = "questionnaire_incomplete"
-                    session.add(job)
-                    return None
-            if job.tariff in PAID_TARIFFS:
-                order = session.get(Order, job.order_id) if job.order_id else None
-                expected_amount = settings.tariff_prices_rub.get(job.tariff.value)
+            if (
+                context.tariff in {Tariff.T2, Tariff.T3}
+                and context.questionnaire_status != QuestionnaireStatus.COMPLETED
+            ):
+                job.status = ReportJobStatus.FAILED
+                job.last_error = "questionnaire_incomplete"
+                session.add(job)
+                return None
+            if context.tariff in PAID_TARIFFS:
+                order = context.order
+                expected_amount = settings.tariff_prices_rub.get(context.tariff.value)
                 if not order or order.status != OrderStatus.PAID:
                     job.status = ReportJobStatus.FAILED
                     job.last_error = "paid_order_missing"
                     session.add(job)
                     return None
-                if expected_amount is not None and float(order.amount or 0) != float(expected_amount):
+                if expected_amount is not None and order.amount != float(expected_amount):
                     job.status = ReportJobStatus.FAILED
                     job.last_error = "paid_order_amount_mismatch"
                     session.add(job)
                     return None
-            state_record = session.get(ScreenStateRecord, telegram_user_id)
-            state_data = dict(state_record.data or {}) if state_record else {}
-            state_data["selected_tariff"] = job.tariff.value
-            if job.order_id is not None:
-                state_data["order_id"] = str(job.order_id)
-            else:
-                state_data.pop("order_id", None)
-            if not state_data:
-                job.status = ReportJobStatus.FAILED
-                job.last_error = "state_missing"
-                session.add(job)
-                return None
+            state_data = context.report_state()
             job.status = ReportJobStatus.IN_PROGRESS
             job.attempts = (job.attempts or 0) + 1
             job.last_error = None
+            job.progress_sections = None
             session.add(job)
             session.flush()
 
         try:
-            if user_id is None:
-                raise RuntimeError("report_job_user_id_missing")
-            response = await self.generate_report(user_id=user_id, state=state_data)
+            # Сохранение отчёта берёт заказ из контекста и в той же транзакции завершает задание.
+            with activate_report_job_scope(context) as job_scope:
+                response = await self.generate_report(user_id=context.user_id, state=state_data)
         except Exception as exc:
+            failure = classify_report_job_failure(exc)
+            if isinstance(exc, ReportPersistenceBlockedError):
+                failure = ReportJobFailure(reason=exc.reason, transient=False)
             with get_session() as session:
                 job = session.get(ReportJob, job_id)
-                if job:
-                    job.status = ReportJobStatus.FAILED
-                    if isinstance(exc, ReportPersistenceBlockedError):
-                        job.last_error = exc.reason
-                    else:
-                        job.last_error = str(exc)
+                if job and not self._is_lease_lost(job, lock_token):
+                    apply_report_job_failure(
+                        job,
+                        failure,
+                        max_attempts=settings.report_job_max_attempts,
+                        retry_base_seconds=settings.report_job_retry_base_seconds,
+                        retry_max_seconds=settings.report_job_retry_max_seconds,
+                    )
                     session.add(job)
             return None
 
         if not response:
             with get_session() as session:
                 job = session.get(ReportJob, job_id)
-                if job:
+                if job and not self._is_lease_lost(job, lock_token):
                     job.status = ReportJobStatus.FAILED
                     job.last_error = "report_generation_failed"
                     session.add(job)
             return None
 
+        if job_scope.job_completed and job_scope.report is not None:
+            return job_scope.report
+
+        # Отчёт сохранён не через контекст задания (или отчёт по заказу уже был): ищем его.
         with get_session() as session:
             job = session.get(ReportJob, job_id)
-            if not job:
+            if not job or self._is_lease_lost(job, lock_token):
                 return None
             report = None
             should_lookup_by_order = job.order_id is not None and job.tariff in PAID_TARIFFS
@@ -319,16 +465,33 @@ class ReportService:
             session.expunge(report)
             return report
 
-    def _build_system_prompt(self, state: dict[str, Any]) -> str:
+    def _is_lease_lost(self, job: ReportJob, lock_token: str | None) -> bool:
+        # Задание могли перезахватить после истечения блокировки: чужие переходы статуса не трогаем.
+        if lock_token is None or job.lock_token == lock_token:
+            return False
+        self._logger.warning(
+            "report_job_lease_lost",
+            extra={"job_id": job.id, "status": job.status.value if job.status else None},
+        )
+        return True
+
+    @staticmethod
+    def _prompt_tariff(state: dict[str, Any]) -> Tariff:
         tariff_value = state.get("selected_tariff")
-        tariff_label = None
         if tariff_value:
             try:
-                tariff_label = Tariff(tariff_value)
+                return Tariff(tariff_value)
             except ValueError:
-                tariff_label = None
-        tariff_label = tariff_label or Tariff.T1
-        base_prompt = resolve_tariff_prompt(tariff_label)
+                pass
+        return Tariff.T1
+
+    def _prompt_version(self, state: dict[str, Any]) -> str:
+        # Берётся из того же кэша промптов, что и _build_system_prompt, — без лишнего обращения к БД.
+        return resolve_versioned_tariff_prompt(self._prompt_tariff(state)).version
+
+    def _build_system_prompt(self, state: dict[str, Any]) -> str:
+        tariff_label = self._prompt_tariff(state)
+        base_prompt = resolve_versioned_tariff_prompt(tariff_label).content
         return (
             f"{base_prompt}\n\n"
             f"Текущий тариф: {tariff_label.value}.\n"
@@ -345,6 +508,8 @@ class ReportService:
         response: LLMResponse,
         safety_flags: dict[str, Any],
         force_store: bool = False,
+        prompt_version: str | None = None,
+        job_scope: ReportJobScope | None = None,
     ) -> None:
         tariff_value = state.get("selected_tariff")
         if not tariff_value:
@@ -360,9 +525,11 @@ class ReportService:
             return
 
         order_id = None
-        with get_session() as session:
+        with report_job_stage(STAGE_PERSIST), get_session() as session:
             if tariff in PAID_TARIFFS:
-                order_id = self._resolve_paid_order_id(session, state, user_id)
+                # Заказ задания уже прочитан при старте: повторно в БД за ним не ходим.
+                preloaded_order = job_scope.context.order if job_scope is not None else None
+                order_id = self._resolve_paid_order_id(session, state, user_id, order=preloaded_order)
                 if not order_id:
                     if force_store:
                         self._register_paid_force_store_block(
@@ -377,7 +544,8 @@ class ReportService:
                     if force_store:
                         raise ReportPersistenceBlockedError("paid_force_store_invalid_order")
                     return
-                if order_id and self._order_has_report(session, order_id):
+                # Под заданием отчёт по заказу проверен при загрузке контекста, гонку ловит уникальный индекс.
+                if job_scope is None and self._order_has_report(session, order_id):
                     self._logger.info(
                         "report_already_exists_for_order",
                         extra={"user_id": user_id, "order_id": order_id},
@@ -393,6 +561,7 @@ class ReportService:
                     tariff=tariff.value,
                 ),
                 model_used=self._map_model(response.provider),
+                prompt_version=prompt_version,
                 safety_flags=safety_flags,
             )
             session.add(report)
@@ -412,15 +581,41 @@ class ReportService:
                 )
                 return
             if order_id:
-                order = session.get(Order, order_id)
-                if order:
-                    consumed_at = datetime.now(timezone.utc)
-                    order.fulfillment_status = OrderFulfillmentStatus.COMPLETED
-                    order.fulfilled_at = consumed_at
-                    if not order.consumed_at:
-                        order.consumed_at = consumed_at
-                    order.fulfilled_report_id = report.id
-                    session.add(order)
+                consumed_at = datetime.now(timezone.utc)
+                session.execute(
+                    update(Order)
+                    .where(Order.id == order_id)
+                    .values(
+                        fulfillment_status=OrderFulfillmentStatus.COMPLETED,
+                        fulfilled_at=consumed_at,
+                        consumed_at=func.coalesce(Order.consumed_at, consumed_at),
+                        fulfilled_report_id=report.id,
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+            if job_scope is not None:
+                job_scope.job_completed = self._complete_scoped_job(session, job_scope)
+                session.expunge(report)
+                job_scope.report = report
+
+    def _complete_scoped_job(self, session, job_scope: ReportJobScope) -> bool:
+        """Завершает задание в транзакции отчёта; False — задание перезахвачено другим воркером."""
+        context = job_scope.context
+        statement = update(ReportJob).where(ReportJob.id == context.job_id)
+        if context.lock_token is not None:
+            statement = statement.where(ReportJob.lock_token == context.lock_token)
+        result = session.execute(
+            statement.values(status=ReportJobStatus.COMPLETED, last_error=None).execution_options(
+                synchronize_session=False
+            )
+        )
+        if result.rowcount:
+            return True
+        self._logger.warning(
+            "report_job_lease_lost",
+            extra={"job_id": context.job_id, "stage": STAGE_PERSIST},
+        )
+        return False
 
     def _register_paid_force_store_block(
         self,
@@ -446,12 +641,20 @@ class ReportService:
             )
         )
 
-    def _resolve_paid_order_id(self, session, state: dict[str, Any], user_id: int) -> int | None:
+    def _resolve_paid_order_id(
+        self,
+        session,
+        state: dict[str, Any],
+        user_id: int,
+        *,
+        order: Order | ReportJobOrderSnapshot | None = None,
+    ) -> int | None:
         order_id = state.get("order_id")
         if not order_id:
             self._logger.warning("report_order_missing", extra={"user_id": user_id})
             return None
-        order = session.get(Order, int(order_id))
+        if order is None or order.id != int(order_id):
+            order = session.get(Order, int(order_id))
         if not order or order.status != OrderStatus.PAID:
             self._logger.warning(
                 "report_order_not_paid",
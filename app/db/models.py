@@ -1,5 +1,5 @@
 import enum
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from typing import Any
 
 from sqlalchemy import (
@@ -14,6 +14,7 @@ from sqlalchemy import (
     Numeric,
     String,
     Text,
+    UniqueConstraint,
     text,
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
@@ -70,6 +71,28 @@ class ReportJobStatus(enum.StrEnum):
     IN_PROGRESS = "in_progress"
     FAILED = "failed"
     COMPLETED = "completed"
+    DEAD_LETTER = "dead_letter"
+
+
+# Статусы, в которых задание остановилось с ошибкой и ждёт ручного перезапуска.
+REPORT_JOB_FAILED_STATUSES = frozenset({ReportJobStatus.FAILED, ReportJobStatus.DEAD_LETTER})
+
+
+class ScheduledNudgeKind(enum.StrEnum):
+    RESUME = "resume_nudge"
+    CHECKOUT_VALUE = "checkout_value_nudge"
+
+
+class ScheduledNudgeStatus(enum.StrEnum):
+    PENDING = "pending"
+    SENT = "sent"
+    CANCELED = "canceled"
+
+
+class LLMCircuitState(enum.StrEnum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
 
 
 class FeedbackStatus(enum.StrEnum):
@@ -373,6 +396,8 @@ class Report(Base):
     model_used: Mapped[ReportModel | None] = mapped_column(
         Enum(ReportModel, values_callable=_enum_values, name="reportmodel")
     )
+    # Версия промпта тарифа ("admin:<sha>", "file:<sha>", "default:<sha>"); у шаблонных ответов пусто.
+    prompt_version: Mapped[str | None] = mapped_column(String(64), nullable=True)
     safety_flags: Mapped[dict | None] = mapped_column(JSON)
 
     user: Mapped[User] = relationship(back_populates="reports")
@@ -382,8 +407,44 @@ class Report(Base):
     )
 
 
+REPORT_JOB_TARIFF_PRIORITY: dict[Tariff, int] = {
+    Tariff.T0: 0,
+    Tariff.T1: 1,
+    Tariff.T2: 2,
+    Tariff.T3: 3,
+}
+
+
+def report_job_priority(tariff: Tariff | str | None) -> int:
+    try:
+        return REPORT_JOB_TARIFF_PRIORITY[Tariff(tariff)]
+    except (KeyError, ValueError):
+        return 0
+
+
+def _default_report_job_priority(context) -> int:
+    return report_job_priority(context.get_current_parameters().get("tariff"))
+
+
+def _default_report_job_effective_at(context) -> datetime:
+    # Платные задания встают в очередь «раньше» на priority * шаг: бесплатные не голодают,
+    # потому что опережение ограничено, а их собственное ожидание растёт.
+    from app.core.config import settings
+
+    params = context.get_current_parameters()
+    created_at = params.get("created_at") or datetime.now(timezone.utc)
+    priority = params.get("priority")
+    if priority is None:
+        priority = report_job_priority(params.get("tariff"))
+    step_seconds = max(int(settings.report_job_priority_step_seconds or 0), 0)
+    return created_at - timedelta(seconds=priority * step_seconds)
+
+
 class ReportJob(Base):
     __tablename__ = "report_jobs"
+    __table_args__ = (
+        Index("ix_report_jobs_status_effective_at", "status", "effective_at"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(
@@ -400,7 +461,14 @@ class ReportJob(Base):
         index=True,
     )
     attempts: Mapped[int] = mapped_column(Integer, default=0)
+    priority: Mapped[int] = mapped_column(Integer, default=_default_report_job_priority)
+    effective_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=_default_report_job_effective_at
+    )
     last_error: Mapped[str | None] = mapped_column(Text)
+    next_attempt_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+    # Сколько разделов отчёта уже пришло из стрима LLM (для экрана ожидания S6).
+    progress_sections: Mapped[int | None] = mapped_column(Integer)
     chat_id: Mapped[int | None] = mapped_column(BigInteger)
     lock_token: Mapped[str | None] = mapped_column(String(64), index=True)
     locked_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
@@ -416,6 +484,24 @@ class ReportJob(Base):
     user: Mapped[User] = relationship(back_populates="report_jobs")
 
 
+class ReportJobStage(Base):
+    __tablename__ = "report_job_stages"
+    __table_args__ = (
+        Index("ix_report_job_stages_stage_finished_at", "stage", "finished_at"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    job_id: Mapped[int] = mapped_column(
+        ForeignKey("report_jobs.id", ondelete="CASCADE"), index=True
+    )
+    stage: Mapped[str] = mapped_column(String(32))
+    attempt: Mapped[int | None] = mapped_column(Integer)
+    started_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    finished_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    duration_ms: Mapped[int] = mapped_column(Integer)
+    metadata_json: Mapped[dict[str, Any] | None] = mapped_column(JSON, nullable=True)
+
+
 class ServiceHeartbeat(Base):
     __tablename__ = "service_heartbeats"
 
@@ -591,6 +677,46 @@ class LLMApiKey(Base):
     )
 
 
+class LLMCircuitBreakerState(Base):
+    __tablename__ = "llm_circuit_breakers"
+
+    # provider ("gemini") или провайдер + отпечаток ключа ("gemini:ab12…"); сам ключ не хранится.
+    name: Mapped[str] = mapped_column(String(128), primary_key=True)
+    scope: Mapped[str] = mapped_column(String(16), index=True)
+    state: Mapped[str] = mapped_column(String(16), default=LLMCircuitState.CLOSED.value)
+    opened_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+    open_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+    probe_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+    trips: Mapped[int] = mapped_column(Integer, default=0)
+    last_error: Mapped[str | None] = mapped_column(Text)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+
+
+class LLMResponseCacheEntry(Base):
+    __tablename__ = "llm_response_cache"
+
+    # sha256 от нормализованного facts-pack, хэша промпта и моделей (см. app/core/llm_response_cache.py).
+    cache_key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    provider: Mapped[str] = mapped_column(String(32))
+    model: Mapped[str] = mapped_column(String(128))
+    text: Mapped[str] = mapped_column(Text)
+    hits: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+    )
+    used_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        index=True,
+    )
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
+
+
 class ScreenStateRecord(Base):
     __tablename__ = "screen_states"
 
@@ -607,6 +733,38 @@ class ScreenStateRecord(Base):
     )
 
 
+class ScheduledNudge(Base):
+    __tablename__ = "scheduled_nudges"
+    __table_args__ = (
+        UniqueConstraint("telegram_user_id", "kind", name="uq_scheduled_nudges_user_kind"),
+        Index("ix_scheduled_nudges_due_at_status", "due_at", "status"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    telegram_user_id: Mapped[int] = mapped_column(BigInteger, index=True)
+    kind: Mapped[ScheduledNudgeKind] = mapped_column(
+        Enum(ScheduledNudgeKind, values_callable=_enum_values, name="schedulednudgekind")
+    )
+    status: Mapped[ScheduledNudgeStatus] = mapped_column(
+        Enum(ScheduledNudgeStatus, values_callable=_enum_values, name="schedulednudgestatus"),
+        default=ScheduledNudgeStatus.PENDING,
+    )
+    due_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    target_screen_id: Mapped[str | None] = mapped_column(String(32))
+    delay_minutes: Mapped[int | None] = mapped_column(Integer)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    last_error: Mapped[str | None] = mapped_column(Text)
+    sent_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=lambda: datetime.now(timezone.utc)
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+
+
 class ScreenTransitionEvent(Base):
     __tablename__ = "screen_transition_events"
 
@@ -0,0 +1,366 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.core.llm_router import GEMINI_BASE_URL, OPENAI_BASE_URL, LLMRouter
+
+logger = logging.getLogger(__name__)
+
+STUB_MODES = ("canned", "record", "replay")
+_TARIFF_RE = re.compile(r"Текущий тариф: (T[0-3])")
+# В промпт попадает facts-pack с меткой времени: без неё одинаковые запросы дают один ключ фикстуры.
+_VOLATILE_RE = re.compile(r'\\?"generated_at\\?":\s*\\?"[^"\\]*\\?"')
+
+_DISCLAIMERS = (
+    "## Дисклеймеры\n"
+    "- Все выводы носят аналитический и описательный характер.\n"
+    "- Ответственность за решения остаётся за пользователем.\n"
+)
+_BASE_SECTIONS = (
+    "## Витрина структуры\nКороткое описание личных предрасположенностей и ценностей.\n",
+    "## Краткое резюме\n- Склонность к системному мышлению.\n- Интерес к обучению.\n- Внимание к деталям.\n",
+    "## Сильные стороны\nНавыки планирования и поведенческие паттерны, которые помогают в работе.\n",
+    "## Зоны роста\nРабочие гипотезы о том, какие навыки стоит развивать.\n",
+    "## Ориентиры по сферам\nВарианты сценариев для работы, обучения и отдыха.\n",
+)
+_MONEY_SECTION = "## Фокус на деньги\nДва сценария с логикой, навыками и способом проверки за 2–4 недели.\n"
+_PLAN_SECTIONS = (
+    "## План на месяц\nНеделя 1–4: небольшие шаги и наблюдение за результатом.\n",
+    "## План на год\nПо месяцам: короткие циклы проверки рабочих гипотез.\n",
+    "## Энергия и отношения\nПоведенческие паттерны в общении и способы бережно восстанавливать силы.\n",
+)
+
+# Разделы по тарифу совпадают с ожиданиями экрана S6 (REPORT_SECTIONS_BY_TARIFF).
+CANNED_REPORTS = {
+    "T0": "".join(_BASE_SECTIONS) + _DISCLAIMERS,
+    "T1": "".join(_BASE_SECTIONS) + _DISCLAIMERS,
+    "T2": "".join(_BASE_SECTIONS) + _MONEY_SECTION + _DISCLAIMERS,
+    "T3": "".join(_BASE_SECTIONS) + _MONEY_SECTION + "".join(_PLAN_SECTIONS) + _DISCLAIMERS,
+}
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = os.getenv(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        return default
+
+
+@dataclass
+class LLMStubConfig:
+    """Поведение заглушки; из окружения читается через `from_env` (переменные `LLM_STUB_*`)."""
+
+    mode: str = "canned"
+    # Латентность до ответа: логнормальное распределение с медианой latency_seconds и разбросом latency_sigma.
+    latency_seconds: float = 0.0
+    latency_sigma: float = 0.0
+    latency_max_seconds: float = 120.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after_seconds: int = 5
+    stream_chunk_chars: int = 80
+    stream_chunk_delay_seconds: float = 0.0
+    fixtures_dir: Path = field(default_factory=lambda: Path("tests/fixtures/llm_stub"))
+    gemini_upstream_url: str = GEMINI_BASE_URL
+    openai_upstream_url: str = OPENAI_BASE_URL
+    seed: int | None = None
+
+    def __post_init__(self) -> None:
+        if self.mode not in STUB_MODES:
+            raise ValueError(f"Unknown LLM stub mode: {self.mode}")
+        self.fixtures_dir = Path(self.fixtures_dir)
+
+    @classmethod
+    def from_env(cls) -> "LLMStubConfig":
+        seed = os.getenv("LLM_STUB_SEED")
+        return cls(
+            mode=os.getenv("LLM_STUB_MODE", "canned"),
+            latency_seconds=_env_float("LLM_STUB_LATENCY_SECONDS", 0.0),
+            latency_sigma=_env_float("LLM_STUB_LATENCY_SIGMA", 0.0),
+            latency_max_seconds=_env_float("LLM_STUB_LATENCY_MAX_SECONDS", 120.0),
+            error_rate=_env_float("LLM_STUB_ERROR_RATE", 0.0),
+            rate_limit_rate=_env_float("LLM_STUB_RATE_LIMIT_RATE", 0.0),
+            retry_after_seconds=int(_env_float("LLM_STUB_RETRY_AFTER_SECONDS", 5)),
+            stream_chunk_chars=int(_env_float("LLM_STUB_STREAM_CHUNK_CHARS", 80)),
+            stream_chunk_delay_seconds=_env_float("LLM_STUB_STREAM_CHUNK_DELAY_SECONDS", 0.0),
+            fixtures_dir=Path(os.getenv("LLM_STUB_FIXTURES_DIR", "tests/fixtures/llm_stub")),
+            gemini_upstream_url=os.getenv("LLM_STUB_GEMINI_UPSTREAM_URL", GEMINI_BASE_URL),
+            openai_upstream_url=os.getenv("LLM_STUB_OPENAI_UPSTREAM_URL", OPENAI_BASE_URL),
+            seed=int(seed) if seed else None,
+        )
+
+
+def fixture_key(provider: str, payload: dict[str, Any]) -> str:
+    body = {key: value for key, value in payload.items() if key != "stream"}
+    serialized = json.dumps({"provider": provider, "body": body}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(_VOLATILE_RE.sub("", serialized).encode("utf-8")).hexdigest()
+
+
+class LLMStubServer:
+    """Локальная замена Gemini/OpenAI для нагрузочных прогонов конвейера отчётов.
+
+    Отвечает в форматах `generateContent`/`streamGenerateContent` (в т.ч. с `cachedContents`) и
+    `chat/completions` (в т.ч. `stream=true`), добавляет латентность, 5xx и 429 с `Retry-After`.
+    Тексты берутся из заготовок T0–T3 (`canned`), из записанных фикстур (`replay`) или
+    запрашиваются у настоящего провайдера и сохраняются (`record`).
+    """
+
+    def __init__(
+        self,
+        config: LLMStubConfig | None = None,
+        *,
+        upstream_client_factory: Callable[[], httpx.AsyncClient] | None = None,
+        sleep: Callable[[float], Any] = asyncio.sleep,
+    ) -> None:
+        self.config = config or LLMStubConfig()
+        self._rng = random.Random(self.config.seed)
+        self._sleep = sleep
+        self._upstream_client_factory = upstream_client_factory or (
+            lambda: httpx.AsyncClient(timeout=httpx.Timeout(120.0))
+        )
+        self._stats: Counter[str] = Counter()
+        self._fixtures: dict[str, str] = {}
+        # cachedContents Gemini: имя -> systemInstruction, как у провайдера (без TTL).
+        self._cached_contents: dict[str, dict[str, Any]] = {}
+        if self.config.mode == "replay":
+            self._load_fixtures()
+
+    def stats(self) -> dict[str, int]:
+        return dict(self._stats)
+
+    def _load_fixtures(self) -> None:
+        if not self.config.fixtures_dir.exists():
+            return
+        for path in sorted(self.config.fixtures_dir.glob("*.json")):
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                logger.warning("llm_stub_fixture_invalid", extra={"path": str(path)})
+                continue
+            if data.get("key") and data.get("text"):
+                self._fixtures[data["key"]] = data["text"]
+
+    def _save_fixture(self, key: str, provider: str, model: str, text: str) -> None:
+        self.config.fixtures_dir.mkdir(parents=True, exist_ok=True)
+        path = self.config.fixtures_dir / f"{provider}-{key[:16]}.json"
+        data = {"key": key, "provider": provider, "model": model, "text": text, "recorded_at": int(time.time())}
+        path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        self._fixtures[key] = text
+
+    def _latency(self) -> float:
+        median = self.config.latency_seconds
+        if median <= 0:
+            return 0.0
+        if self.config.latency_sigma <= 0:
+            return median
+        value = self._rng.lognormvariate(math.log(median), self.config.latency_sigma)
+        return min(value, self.config.latency_max_seconds)
+
+    def _injected_failure(self) -> JSONResponse | None:
+        roll = self._rng.random()
+        if roll < self.config.rate_limit_rate:
+            self._stats["rate_limited"] += 1
+            return JSONResponse(
+                {"error": {"code": 429, "message": "Resource has been exhausted (stub)", "status": "RESOURCE_EXHAUSTED"}},
+                status_code=429,
+                headers={"Retry-After": str(self.config.retry_after_seconds)},
+            )
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            self._stats["server_errors"] += 1
+            return JSONResponse(
+                {"error": {"code": 503, "message": "The model is overloaded (stub)", "status": "UNAVAILABLE"}},
+                status_code=503,
+            )
+        return None
+
+    @staticmethod
+    def _canned_text(payload: dict[str, Any]) -> str:
+        match = _TARIFF_RE.search(json.dumps(payload, ensure_ascii=False))
+        return CANNED_REPORTS[match.group(1) if match else "T1"]
+
+    async def _resolve_text(
+        self,
+        provider: str,
+        model: str,
+        payload: dict[str, Any],
+        headers: dict[str, str],
+    ) -> str:
+        if self.config.mode == "canned":
+            return self._canned_text(payload)
+        key = fixture_key(provider, payload)
+        if self.config.mode == "replay":
+            text = self._fixtures.get(key)
+            if text is None:
+                # Без фикстуры прогон не останавливаем: отвечаем заготовкой и считаем промах.
+                self._stats["replay_misses"] += 1
+                return self._canned_text(payload)
+            self._stats["replay_hits"] += 1
+            return text
+        text = await self._fetch_upstream(provider, model, payload, headers)
+        self._save_fixture(key, provider, model, text)
+        self._stats["recorded"] += 1
+        return text
+
+    async def _fetch_upstream(
+        self,
+        provider: str,
+        model: str,
+        payload: dict[str, Any],
+        headers: dict[str, str],
+    ) -> str:
+        # Запись всегда идёт через обычный (не потоковый) запрос: в фикстуре хранится только итоговый текст.
+        body = {key: value for key, value in payload.items() if key != "stream"}
+        if provider == "gemini":
+            url = f"{self.config.gemini_upstream_url.rstrip('/')}/v1beta/models/{model}:generateContent"
+            extract = LLMRouter._extract_gemini_text
+        else:
+            url = f"{self.config.openai_upstream_url.rstrip('/')}/v1/chat/completions"
+            extract = LLMRouter._extract_openai_text
+        async with self._upstream_client_factory() as client:
+            resp = await client.post(url, json=body, headers=headers)
+        resp.raise_for_status()
+        text = extract(resp.json())
+        if not text:
+            raise ValueError(f"{provider} upstream returned empty text")
+        return text
+
+    def _chunks(self, text: str) -> list[str]:
+        size = max(self.config.stream_chunk_chars, 1)
+        return [text[idx : idx + size] for idx in range(0, len(text), size)] or [""]
+
+    async def _sse(self, events: list[dict[str, Any]], *, done_marker: bool) -> AsyncIterator[str]:
+        for idx, event in enumerate(events):
+            if idx and self.config.stream_chunk_delay_seconds > 0:
+                await self._sleep(self.config.stream_chunk_delay_seconds)
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        if done_marker:
+            yield "data: [DONE]\n\n"
+
+    async def handle_cached_contents(self, request: Request) -> Any:
+        payload = await request.json()
+        name = f"cachedContents/stub-{len(self._cached_contents) + 1}"
+        self._cached_contents[name] = payload.get("systemInstruction") or {}
+        self._stats["cached_contents_created"] += 1
+        ttl_seconds = float(str(payload.get("ttl") or "3600s").rstrip("s") or 3600)
+        expire_time = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + ttl_seconds))
+        return JSONResponse({"name": name, "model": payload.get("model"), "expireTime": expire_time})
+
+    async def handle_gemini(self, request: Request, model_action: str) -> Any:
+        model, _, action = model_action.partition(":")
+        payload = await request.json()
+        cached_name = payload.pop("cachedContent", None)
+        if cached_name is not None:
+            if cached_name not in self._cached_contents:
+                return JSONResponse(
+                    {"error": {"code": 404, "message": f"{cached_name} not found", "status": "NOT_FOUND"}},
+                    status_code=404,
+                )
+            # Для заготовок и ключа фикстуры запрос выглядит так же, как без кэша.
+            payload["systemInstruction"] = self._cached_contents[cached_name]
+            self._stats["cached_content_requests"] += 1
+        headers = {"x-goog-api-key": request.headers.get("x-goog-api-key", "")}
+        return await self._respond(
+            provider="gemini",
+            model=model,
+            payload=payload,
+            headers=headers,
+            stream=action == "streamGenerateContent",
+        )
+
+    async def handle_openai(self, request: Request) -> Any:
+        payload = await request.json()
+        headers = {"Authorization": request.headers.get("authorization", "")}
+        return await self._respond(
+            provider="openai",
+            model=str(payload.get("model") or ""),
+            payload=payload,
+            headers=headers,
+            stream=bool(payload.get("stream")),
+        )
+
+    async def _respond(
+        self,
+        *,
+        provider: str,
+        model: str,
+        payload: dict[str, Any],
+        headers: dict[str, str],
+        stream: bool,
+    ) -> Any:
+        self._stats[f"{provider}_requests"] += 1
+        latency = self._latency()
+        if latency > 0:
+            await self._sleep(latency)
+        failure = self._injected_failure()
+        if failure is not None:
+            return failure
+        try:
+            text = await self._resolve_text(provider, model, payload, headers)
+        except (httpx.HTTPError, ValueError) as exc:
+            self._stats["upstream_errors"] += 1
+            logger.warning("llm_stub_upstream_failed", extra={"provider": provider, "error": str(exc)})
+            return JSONResponse({"error": {"code": 502, "message": f"Upstream failed: {exc}"}}, status_code=502)
+        if provider == "gemini":
+            if stream:
+                events = [_gemini_body(chunk) for chunk in self._chunks(text)]
+                return StreamingResponse(self._sse(events, done_marker=False), media_type="text/event-stream")
+            return JSONResponse(_gemini_body(text))
+        if stream:
+            events = [
+                {"object": "chat.completion.chunk", "model": model, "choices": [{"index": 0, "delta": {"content": chunk}}]}
+                for chunk in self._chunks(text)
+            ]
+            return StreamingResponse(self._sse(events, done_marker=True), media_type="text/event-stream")
+        return JSONResponse(
+            {
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            }
+        )
+
+
+def _gemini_body(text: str) -> dict[str, Any]:
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}]}
+
+
+def create_llm_stub_app(server: LLMStubServer | None = None) -> FastAPI:
+    server = server or LLMStubServer(LLMStubConfig.from_env())
+    application = FastAPI(title="LLM provider stub")
+
+    @application.post("/v1beta/cachedContents")
+    async def gemini_cached_contents(request: Request) -> Any:
+        return await server.handle_cached_contents(request)
+
+    @application.post("/v1beta/models/{model_action:path}")
+    async def gemini_generate(model_action: str, request: Request) -> Any:
+        return await server.handle_gemini(request, model_action)
+
+    @application.post("/v1/chat/completions")
+    async def openai_chat_completions(request: Request) -> Any:
+        return await server.handle_openai(request)
+
+    @application.get("/stats")
+    async def stub_stats() -> dict[str, int]:
+        return server.stats()
+
+    return application
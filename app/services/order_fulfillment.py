@@ -5,7 +5,16 @@ import logging
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from app.db.models import Order, OrderStatus, ReportJob, ReportJobStatus, ScreenStateRecord, Tariff, User
+from app.db.models import (
+    REPORT_JOB_FAILED_STATUSES,
+    Order,
+    OrderStatus,
+    ReportJob,
+    ReportJobStatus,
+    ScreenStateRecord,
+    Tariff,
+    User,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -69,9 +78,10 @@ def ensure_report_job_for_paid_order(
         .scalars()
         .first()
     )
-    if last_job and last_job.status == ReportJobStatus.FAILED:
+    if last_job and last_job.status in REPORT_JOB_FAILED_STATUSES:
         last_job.status = ReportJobStatus.PENDING
         last_job.last_error = None
+        last_job.next_attempt_at = None
         last_job.lock_token = None
         last_job.locked_at = None
         last_job.attempts = 0
@@ -0,0 +1,419 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event, func, or_, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, aliased
+
+from app.db.models import REPORT_JOB_FAILED_STATUSES, ReportJob, ReportJobStatus
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_REPORT_JOB_STATUSES = (ReportJobStatus.PENDING, ReportJobStatus.IN_PROGRESS)
+REPORT_JOB_NOTIFY_CHANNEL = "report_jobs_pending"
+
+_SESSION_ENQUEUED_FLAG = "report_job_enqueued"
+_wakeup_callbacks: list[Callable[[], None]] = []
+_wakeup_callbacks_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class ReportJobLease:
+    job_id: int
+    lock_token: str
+
+
+def claim_report_jobs(
+    session: Session,
+    *,
+    limit: int,
+    lock_timeout_seconds: int,
+    exclude_job_ids: Iterable[int] = (),
+    now: datetime | None = None,
+    user_fairness: bool = True,
+) -> list[ReportJobLease]:
+    """Атомарно арендует до `limit` заданий: PENDING или IN_PROGRESS с истёкшей блокировкой.
+
+    Задания, отложенные до `next_attempt_at` (повтор после временной ошибки), ждут своего времени.
+
+    Порядок — по `effective_at` (время постановки минус бонус приоритета тарифа). При `user_fairness`
+    одному пользователю выдаётся не больше одного задания, пока его предыдущее задание в работе.
+    """
+    if limit <= 0:
+        return []
+    now = now or datetime.now(timezone.utc)
+    lock_token = uuid.uuid4().hex
+    lock_cutoff = now - timedelta(seconds=lock_timeout_seconds)
+    excluded = list(exclude_job_ids)
+    filters = [
+        ReportJob.status.in_(ACTIVE_REPORT_JOB_STATUSES),
+        or_(
+            ReportJob.locked_at.is_(None),
+            ReportJob.locked_at < lock_cutoff,
+        ),
+        or_(
+            ReportJob.next_attempt_at.is_(None),
+            ReportJob.next_attempt_at <= now,
+        ),
+    ]
+    if excluded:
+        filters.append(ReportJob.id.not_in(excluded))
+    queue_order = (ReportJob.effective_at.asc(), ReportJob.id.asc())
+    if user_fairness:
+        filters.append(~_user_has_live_job(lock_cutoff))
+        ranked = (
+            select(
+                ReportJob.id,
+                func.row_number()
+                .over(partition_by=ReportJob.user_id, order_by=queue_order)
+                .label("user_rank"),
+            )
+            .where(*filters)
+            .subquery()
+        )
+        candidates = select(ReportJob.id).where(
+            ReportJob.id.in_(select(ranked.c.id).where(ranked.c.user_rank == 1)),
+            *filters,
+        )
+    else:
+        candidates = select(ReportJob.id).where(*filters)
+    candidates = candidates.order_by(*queue_order).limit(limit)
+    values = {
+        "status": ReportJobStatus.IN_PROGRESS,
+        "lock_token": lock_token,
+        "locked_at": now,
+    }
+
+    if session.get_bind().dialect.name == "postgresql":
+        rows = session.execute(_build_postgres_claim_statement(candidates, values)).all()
+        rows = sorted(rows, key=lambda row: (row.effective_at, row.id))
+        job_ids = [row.id for row in rows]
+    else:
+        # SQLite (тесты/локальный запуск): писатель один, поэтому достаточно условного UPDATE
+        # по списку кандидатов с повторной проверкой блокировки и чтения своего токена.
+        candidate_ids = session.execute(candidates).scalars().all()
+        if not candidate_ids:
+            return []
+        session.execute(
+            update(ReportJob)
+            .where(ReportJob.id.in_(candidate_ids), *filters)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        job_ids = (
+            session.execute(
+                select(ReportJob.id)
+                .where(ReportJob.lock_token == lock_token)
+                .order_by(*queue_order)
+            )
+            .scalars()
+            .all()
+        )
+
+    if job_ids:
+        logger.info(
+            "report_jobs_claimed",
+            extra={"job_ids": job_ids, "limit": limit},
+        )
+    return [ReportJobLease(job_id=job_id, lock_token=lock_token) for job_id in job_ids]
+
+
+def _user_has_live_job(lock_cutoff: datetime):
+    other = aliased(ReportJob)
+    return (
+        select(other.id)
+        .where(
+            other.user_id == ReportJob.user_id,
+            other.id != ReportJob.id,
+            other.status == ReportJobStatus.IN_PROGRESS,
+            other.locked_at >= lock_cutoff,
+        )
+        .exists()
+    )
+
+
+def _build_postgres_claim_statement(candidates, values: dict):
+    # Один UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED) RETURNING:
+    # параллельные воркеры пропускают строки, уже захваченные соседом, вместо ожидания.
+    return (
+        update(ReportJob)
+        .where(ReportJob.id.in_(candidates.with_for_update(skip_locked=True).scalar_subquery()))
+        .values(**values)
+        .returning(ReportJob.id, ReportJob.effective_at)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def collect_report_job_queue_breakdown(
+    session: Session,
+    *,
+    now: datetime | None = None,
+) -> dict[str, dict[str, object]]:
+    """Разбивка активной очереди по тарифам: сколько ждёт, сколько в работе и возраст самого старого."""
+    now = now or datetime.now(timezone.utc)
+    rows = session.execute(
+        select(
+            ReportJob.tariff,
+            ReportJob.status,
+            func.count(ReportJob.id),
+            func.min(ReportJob.created_at),
+            func.count(func.distinct(ReportJob.user_id)),
+        )
+        .where(ReportJob.status.in_(ACTIVE_REPORT_JOB_STATUSES))
+        .group_by(ReportJob.tariff, ReportJob.status)
+    ).all()
+    by_tariff: dict[str, dict[str, object]] = {}
+    for tariff, status, count, oldest_created_at, users in rows:
+        bucket = by_tariff.setdefault(
+            tariff.value,
+            {
+                ReportJobStatus.PENDING.value: 0,
+                ReportJobStatus.IN_PROGRESS.value: 0,
+                "pending_users": 0,
+                "oldest_pending_age_seconds": None,
+            },
+        )
+        bucket[status.value] = count
+        if status == ReportJobStatus.PENDING:
+            bucket["pending_users"] = users
+            if oldest_created_at is not None:
+                if oldest_created_at.tzinfo is None:
+                    oldest_created_at = oldest_created_at.replace(tzinfo=timezone.utc)
+                bucket["oldest_pending_age_seconds"] = max(
+                    int((now - oldest_created_at).total_seconds()), 0
+                )
+    return by_tariff
+
+
+def redrive_report_jobs(
+    session: Session,
+    *,
+    job_ids: Iterable[int] | None = None,
+    limit: int = 500,
+) -> list[int]:
+    """Возвращает в очередь упавшие задания: выбранные FAILED/DEAD_LETTER или все из dead-letter.
+
+    Счётчик попыток обнуляется, поэтому перезапущенное задание снова получает полный бюджет повторов.
+    """
+    query = select(ReportJob)
+    if job_ids is None:
+        query = query.where(ReportJob.status == ReportJobStatus.DEAD_LETTER)
+    else:
+        ids = list(job_ids)
+        if not ids:
+            return []
+        query = query.where(
+            ReportJob.id.in_(ids),
+            ReportJob.status.in_(REPORT_JOB_FAILED_STATUSES),
+        )
+    jobs = session.execute(query.order_by(ReportJob.id.asc()).limit(limit)).scalars().all()
+    for job in jobs:
+        job.status = ReportJobStatus.PENDING
+        job.attempts = 0
+        job.last_error = None
+        job.next_attempt_at = None
+        job.lock_token = None
+        job.locked_at = None
+        session.add(job)
+    redriven = [job.id for job in jobs]
+    if redriven:
+        logger.info("report_jobs_redriven", extra={"job_ids": redriven})
+    return redriven
+
+
+def collect_report_job_retry_metrics(
+    session: Session,
+    *,
+    now: datetime | None = None,
+) -> dict[str, int]:
+    """Сколько заданий ждёт автоматического повтора и сколько лежит в dead-letter."""
+    now = now or datetime.now(timezone.utc)
+    scheduled = session.execute(
+        select(func.count(ReportJob.id)).where(
+            ReportJob.status == ReportJobStatus.PENDING,
+            ReportJob.next_attempt_at > now,
+        )
+    ).scalar_one()
+    dead_letter = session.execute(
+        select(func.count(ReportJob.id)).where(ReportJob.status == ReportJobStatus.DEAD_LETTER)
+    ).scalar_one()
+    return {"scheduled_retries": scheduled, "dead_letter": dead_letter}
+
+
+def renew_report_job_lease(
+    session: Session,
+    lease: ReportJobLease,
+    *,
+    now: datetime | None = None,
+) -> bool:
+    """Продлевает аренду: обновляет locked_at, пока задание держит наш lock_token."""
+    now = now or datetime.now(timezone.utc)
+    result = session.execute(
+        update(ReportJob)
+        .where(
+            ReportJob.id == lease.job_id,
+            ReportJob.lock_token == lease.lock_token,
+            ReportJob.status == ReportJobStatus.IN_PROGRESS,
+        )
+        .values(locked_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    return bool(result.rowcount)
+
+
+def release_report_job_lease(session: Session, lease: ReportJobLease) -> bool:
+    """Снимает блокировку, чтобы задание можно было сразу перезахватить (например, при остановке воркера)."""
+    result = session.execute(
+        update(ReportJob)
+        .where(
+            ReportJob.id == lease.job_id,
+            ReportJob.lock_token == lease.lock_token,
+        )
+        .values(lock_token=None, locked_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    return bool(result.rowcount)
+
+
+def subscribe_report_job_wakeups(callback: Callable[[], None]) -> Callable[[], None]:
+    """Регистрирует колбэк, который вызывается после коммита нового/перезапущенного задания в этом процессе."""
+    with _wakeup_callbacks_lock:
+        _wakeup_callbacks.append(callback)
+
+    def _unsubscribe() -> None:
+        with _wakeup_callbacks_lock:
+            if callback in _wakeup_callbacks:
+                _wakeup_callbacks.remove(callback)
+
+    return _unsubscribe
+
+
+def notify_report_job_enqueued() -> None:
+    with _wakeup_callbacks_lock:
+        callbacks = list(_wakeup_callbacks)
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as exc:
+            logger.warning("report_job_wakeup_callback_failed", extra={"error": str(exc)})
+
+
+def _has_pending_report_jobs(objects: Iterable[object]) -> bool:
+    return any(
+        isinstance(obj, ReportJob) and obj.status == ReportJobStatus.PENDING
+        for obj in objects
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _track_enqueued_report_jobs(session: Session, _flush_context) -> None:
+    if _has_pending_report_jobs(session.new) or _has_pending_report_jobs(session.dirty):
+        session.info[_SESSION_ENQUEUED_FLAG] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_up_after_commit(session: Session) -> None:
+    if session.info.pop(_SESSION_ENQUEUED_FLAG, False):
+        notify_report_job_enqueued()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_enqueued_after_rollback(session: Session) -> None:
+    session.info.pop(_SESSION_ENQUEUED_FLAG, None)
+
+
+class ReportJobNotificationListener:
+    """LISTEN на канал PostgreSQL: будит воркер, когда задание создаёт другой процесс (API/webhook).
+
+    NOTIFY отправляет триггер из миграции 0037 при вставке задания или возврате его в pending.
+    Для SQLite и при любых ошибках подключения слушатель выключается, и воркер работает по poll.
+    """
+
+    def __init__(self, *, retry_seconds: float = 60.0) -> None:
+        self._connection = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._callback: Callable[[], None] | None = None
+        self._retry_seconds = retry_seconds
+        self._next_attempt_at = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self._connection is not None
+
+    def ensure_started(
+        self,
+        engine_factory: Callable[[], Engine],
+        callback: Callable[[], None],
+    ) -> bool:
+        if self._connection is not None:
+            return True
+        now = time.monotonic()
+        if now < self._next_attempt_at:
+            return False
+        self._next_attempt_at = now + self._retry_seconds
+        connection = None
+        try:
+            engine = engine_factory()
+            if engine.dialect.name != "postgresql":
+                self._next_attempt_at = float("inf")
+                return False
+            cargs, cparams = engine.dialect.create_connect_args(engine.url)
+            connection = engine.dialect.loaded_dbapi.connect(*cargs, **cparams)
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {REPORT_JOB_NOTIFY_CHANNEL}")
+            loop = asyncio.get_running_loop()
+            loop.add_reader(connection.fileno(), self._on_readable)
+        except Exception as exc:
+            logger.warning("report_job_listener_start_failed", extra={"error": str(exc)})
+            if connection is not None:
+                # LISTEN или add_reader не прошли: соединение никому не передано, закрываем его здесь.
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+            return False
+        self._connection = connection
+        self._loop = loop
+        self._callback = callback
+        logger.info("report_job_listener_started", extra={"channel": REPORT_JOB_NOTIFY_CHANNEL})
+        return True
+
+    def _on_readable(self) -> None:
+        connection = self._connection
+        if connection is None:
+            return
+        try:
+            connection.poll()
+        except Exception as exc:
+            logger.warning("report_job_listener_poll_failed", extra={"error": str(exc)})
+            self.stop()
+            return
+        if not connection.notifies:
+            return
+        connection.notifies.clear()
+        if self._callback is not None:
+            self._callback()
+
+    def stop(self) -> None:
+        connection = self._connection
+        self._connection = None
+        if connection is None:
+            return
+        if self._loop is not None:
+            try:
+                self._loop.remove_reader(connection.fileno())
+            except Exception:
+                pass
+        try:
+            connection.close()
+        except Exception:
+            pass
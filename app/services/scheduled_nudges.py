@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import logging
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.models import (
+    Order,
+    OrderStatus,
+    ScheduledNudge,
+    ScheduledNudgeKind,
+    ScheduledNudgeStatus,
+    ScreenStateRecord,
+    User,
+)
+
+logger = logging.getLogger(__name__)
+
+CHECKOUT_VALUE_NUDGE_SCREENS = frozenset({"S2", "S4"})
+DUE_NUDGES_BATCH_SIZE = 200
+# Первая пауза после отказа отправки; дальше удваивается до NUDGE_SEND_SKIP_RETRY_MAX_SECONDS.
+NUDGE_SEND_SKIP_RETRY_BASE_SECONDS = 60
+
+
+@dataclass(frozen=True)
+class DueNudge:
+    nudge: ScheduledNudge
+    state_row: ScreenStateRecord | None
+    user_id: int | None
+    has_paid_order: bool
+
+
+def resolve_resume_nudge_delay() -> timedelta:
+    threshold_hours = int(getattr(settings, "resume_nudge_delay_hours", 6) or 6)
+    return timedelta(hours=max(threshold_hours, 1))
+
+
+def resolve_checkout_value_nudge_delay_minutes() -> int:
+    min_delay_minutes = max(
+        int(getattr(settings, "checkout_value_nudge_min_delay_minutes", 10) or 10),
+        1,
+    )
+    max_delay_minutes = max(
+        int(getattr(settings, "checkout_value_nudge_max_delay_minutes", 30) or 30),
+        min_delay_minutes,
+    )
+    return random.randint(min_delay_minutes, max_delay_minutes)
+
+
+def resolve_send_skip_retry_delay(attempts: int) -> timedelta:
+    """Пауза перед повтором напоминания, которое не удалось отправить (нет согласия, ошибка Telegram)."""
+    max_seconds = max(
+        int(getattr(settings, "nudge_send_skip_retry_max_seconds", 3600) or 3600),
+        NUDGE_SEND_SKIP_RETRY_BASE_SECONDS,
+    )
+    seconds = NUDGE_SEND_SKIP_RETRY_BASE_SECONDS * 2 ** min(max(attempts, 0), 16)
+    return timedelta(seconds=min(seconds, max_seconds))
+
+
+def schedule_nudge(
+    session: Session,
+    *,
+    telegram_user_id: int,
+    kind: ScheduledNudgeKind,
+    due_at: datetime,
+    target_screen_id: str | None = None,
+    delay_minutes: int | None = None,
+    reschedule: bool = True,
+) -> ScheduledNudge:
+    """Создаёт напоминание или переносит срок ещё не отправленного (если `reschedule`).
+
+    Отправленное или отменённое напоминание снова становится ожидающим: вызывающий уже проверил по
+    состоянию экрана, что в текущем проходе сценария оно не отправлялось (например, после `clear_state`).
+    """
+    nudge = session.execute(
+        select(ScheduledNudge).where(
+            ScheduledNudge.telegram_user_id == telegram_user_id,
+            ScheduledNudge.kind == kind,
+        )
+    ).scalar_one_or_none()
+    if nudge is None:
+        nudge = ScheduledNudge(
+            telegram_user_id=telegram_user_id,
+            kind=kind,
+            status=ScheduledNudgeStatus.PENDING,
+            due_at=due_at,
+            target_screen_id=target_screen_id,
+            delay_minutes=delay_minutes,
+            attempts=0,
+        )
+        session.add(nudge)
+        return nudge
+    if nudge.status != ScheduledNudgeStatus.PENDING:
+        nudge.status = ScheduledNudgeStatus.PENDING
+        nudge.attempts = 0
+        nudge.last_error = None
+        nudge.sent_at = None
+    elif not reschedule:
+        return nudge
+    nudge.due_at = due_at
+    nudge.target_screen_id = target_screen_id
+    nudge.delay_minutes = delay_minutes
+    session.add(nudge)
+    return nudge
+
+
+def schedule_state_nudges(
+    session: Session,
+    *,
+    telegram_user_id: int,
+    screen_id: str | None,
+    state_data: dict[str, Any],
+    previous_screen_id: str | None,
+    previous_data: dict[str, Any],
+    now: datetime | None = None,
+) -> None:
+    """Планирует напоминания по изменению состояния экрана.
+
+    Resume — при новой отметке `last_critical_step_at`, checkout value — при первом входе на S2/S4.
+    Воркер затем читает только созревшие строки `scheduled_nudges`, а не всю таблицу screen_states.
+    """
+    now = now or datetime.now(timezone.utc)
+    critical_step_at = state_data.get("last_critical_step_at")
+    if (
+        critical_step_at
+        and critical_step_at != previous_data.get("last_critical_step_at")
+        and not state_data.get("resume_nudge_sent_at")
+    ):
+        critical_at = parse_state_dt(critical_step_at)
+        if critical_at:
+            schedule_nudge(
+                session,
+                telegram_user_id=telegram_user_id,
+                kind=ScheduledNudgeKind.RESUME,
+                due_at=critical_at + resolve_resume_nudge_delay(),
+                target_screen_id=state_data.get("last_critical_screen_id"),
+            )
+
+    if (
+        screen_id in CHECKOUT_VALUE_NUDGE_SCREENS
+        and screen_id != previous_screen_id
+        and not state_data.get("checkout_value_nudge_first_seen_at")
+        and not state_data.get("checkout_value_nudge_sent_at")
+    ):
+        delay_minutes = resolve_checkout_value_nudge_delay_minutes()
+        schedule_nudge(
+            session,
+            telegram_user_id=telegram_user_id,
+            kind=ScheduledNudgeKind.CHECKOUT_VALUE,
+            due_at=now + timedelta(minutes=delay_minutes),
+            target_screen_id=screen_id,
+            delay_minutes=delay_minutes,
+            reschedule=False,
+        )
+
+
+def fetch_due_nudges(
+    session: Session,
+    *,
+    kind: ScheduledNudgeKind,
+    now: datetime,
+    limit: int = DUE_NUDGES_BATCH_SIZE,
+) -> list[DueNudge]:
+    """Одним запросом выбирает созревшие напоминания вместе с состоянием, пользователем и признаком оплаты."""
+    has_paid_order = (
+        select(Order.id)
+        .where(Order.user_id == User.id, Order.status == OrderStatus.PAID)
+        .exists()
+        .label("has_paid_order")
+    )
+    statement = (
+        select(ScheduledNudge, ScreenStateRecord, User.id, has_paid_order)
+        .outerjoin(
+            ScreenStateRecord,
+            ScreenStateRecord.telegram_user_id == ScheduledNudge.telegram_user_id,
+        )
+        .outerjoin(User, User.telegram_user_id == ScheduledNudge.telegram_user_id)
+        .where(
+            ScheduledNudge.kind == kind,
+            ScheduledNudge.status == ScheduledNudgeStatus.PENDING,
+            ScheduledNudge.due_at <= now,
+        )
+        .order_by(ScheduledNudge.due_at.asc(), ScheduledNudge.id.asc())
+        .limit(limit)
+    )
+    if session.get_bind().dialect.name == "postgresql":
+        # Несколько процессов воркера не отправят одно напоминание дважды.
+        statement = statement.with_for_update(skip_locked=True, of=ScheduledNudge)
+    rows = session.execute(statement).all()
+    return [
+        DueNudge(
+            nudge=nudge,
+            state_row=state_row,
+            user_id=user_id,
+            has_paid_order=bool(paid),
+        )
+        for nudge, state_row, user_id, paid in rows
+    ]
+
+
+def mark_nudge_sent(nudge: ScheduledNudge, *, now: datetime) -> None:
+    nudge.status = ScheduledNudgeStatus.SENT
+    nudge.sent_at = now
+    nudge.last_error = None
+
+
+def cancel_nudge(nudge: ScheduledNudge, *, reason: str) -> None:
+    nudge.status = ScheduledNudgeStatus.CANCELED
+    nudge.last_error = reason
+
+
+def postpone_nudge(
+    nudge: ScheduledNudge,
+    *,
+    due_at: datetime,
+    error: str | None = None,
+) -> None:
+    nudge.due_at = due_at
+    if error is not None:
+        nudge.attempts = (nudge.attempts or 0) + 1
+        nudge.last_error = error
+
+
+def parse_state_dt(value: object) -> datetime | None:
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from app.db.models import ServiceHeartbeat
+
+_INSTANCE_SEPARATOR = "@"
+_SERVICE_NAME_MAX_LENGTH = 64
+
+
+def heartbeat_instance_name(service_name: str, *, host: str | None, pid: int | None) -> str:
+    """Имя строки heartbeat конкретного процесса: `<service>@<host>:<pid>` в пределах 64 символов."""
+    suffix = f":{pid}" if pid is not None else ""
+    prefix = f"{service_name}{_INSTANCE_SEPARATOR}"
+    host_budget = max(_SERVICE_NAME_MAX_LENGTH - len(prefix) - len(suffix), 0)
+    return f"{prefix}{(host or 'unknown')[:host_budget]}{suffix}"
+
+
+def touch_service_heartbeat(
+    session: Session,
+    service_name: str,
+    *,
+    host: str | None,
+    pid: int | None,
+    now: datetime | None = None,
+) -> None:
+    """Обновляет общую строку сервиса (последний живой процесс) и строку текущего процесса."""
+    now = now or datetime.now(timezone.utc)
+    for name in (service_name, heartbeat_instance_name(service_name, host=host, pid=pid)):
+        heartbeat = session.get(ServiceHeartbeat, name)
+        if heartbeat is None:
+            heartbeat = ServiceHeartbeat(service_name=name)
+        heartbeat.updated_at = now
+        heartbeat.host = host
+        heartbeat.pid = pid
+        session.add(heartbeat)
+
+
+def remove_service_heartbeat_instance(
+    session: Session,
+    service_name: str,
+    *,
+    host: str | None,
+    pid: int | None,
+) -> None:
+    session.execute(
+        delete(ServiceHeartbeat).where(
+            ServiceHeartbeat.service_name
+            == heartbeat_instance_name(service_name, host=host, pid=pid)
+        )
+    )
+
+
+def prune_service_heartbeat_instances(
+    session: Session,
+    service_name: str,
+    *,
+    older_than: datetime,
+) -> int:
+    """Удаляет строки процессов, которые давно не отмечались (упали без штатной остановки)."""
+    result = session.execute(
+        delete(ServiceHeartbeat).where(
+            ServiceHeartbeat.service_name.startswith(f"{service_name}{_INSTANCE_SEPARATOR}"),
+            ServiceHeartbeat.updated_at < older_than,
+        )
+    )
+    return int(result.rowcount or 0)
+
+
+def collect_service_heartbeat_instances(
+    session: Session,
+    service_name: str,
+    *,
+    stale_after: datetime,
+) -> list[dict[str, object]]:
+    rows = session.execute(
+        select(ServiceHeartbeat)
+        .where(ServiceHeartbeat.service_name.startswith(f"{service_name}{_INSTANCE_SEPARATOR}"))
+        .order_by(ServiceHeartbeat.updated_at.desc())
+    ).scalars().all()
+    instances: list[dict[str, object]] = []
+    for row in rows:
+        updated_at = row.updated_at
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+        instances.append(
+            {
+                "host": row.host,
+                "pid": row.pid,
+                "last_seen_at": updated_at.isoformat(),
+                "online": updated_at >= stale_after,
+            }
+        )
+    return instances
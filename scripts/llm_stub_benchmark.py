@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Прогон LLMRouter под нагрузкой: N запросов с заданной параллельностью, латентность и ошибки.
+
+Запускается против заглушки (LLM_GEMINI_BASE_URL/LLM_OPENAI_BASE_URL -> scripts/llm_stub_server.py),
+чтобы настраивать ретраи, пул ключей и circuit breaker без расхода квоты.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+from collections import Counter
+from contextlib import aclosing
+from pathlib import Path
+import sys
+import time
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from app.core.llm_router import LLMUnavailableError, llm_router
+from app.core.report_service import ReportService
+
+TARIFFS = ("T0", "T1", "T2", "T3")
+
+
+def _percentile(values: list[float], percentile: int) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(-(-percentile * len(ordered) // 100)), 1)
+    return ordered[rank - 1]
+
+
+async def _one_request(service: ReportService, idx: int, *, stream: bool) -> tuple[str, float]:
+    tariff = TARIFFS[idx % len(TARIFFS)]
+    state = {"selected_tariff": tariff, "profile": {"name": f"Bench {idx}", "birth_date": "01.01.1990"}}
+    facts_pack = service._build_facts_pack(user_id=idx, state=state)
+    prompt = service._build_system_prompt(state)
+    started = time.monotonic()
+    try:
+        if stream:
+            async with aclosing(llm_router.astream(facts_pack, prompt)) as chunks:
+                async for chunk in chunks:
+                    provider = chunk.provider
+        else:
+            provider = (await llm_router.agenerate(facts_pack, prompt)).provider
+    except LLMUnavailableError:
+        provider = "unavailable"
+    return provider, time.monotonic() - started
+
+
+async def _run(total: int, concurrency: int, *, stream: bool) -> None:
+    service = ReportService()
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def _bounded(idx: int) -> tuple[str, float]:
+        async with semaphore:
+            return await _one_request(service, idx, stream=stream)
+
+    started = time.monotonic()
+    results = await asyncio.gather(*(_bounded(idx) for idx in range(total)))
+    elapsed = time.monotonic() - started
+    await llm_router.aclose()
+
+    providers = Counter(provider for provider, _ in results)
+    latencies = [latency for provider, latency in results if provider != "unavailable"]
+    print(f"[llm_bench] requests={total} concurrency={concurrency} stream={stream}", flush=True)
+    print(f"[llm_bench] elapsed_seconds={elapsed:.2f} throughput_rps={total / elapsed:.2f}", flush=True)
+    print(f"[llm_bench] providers={dict(providers)}", flush=True)
+    for percentile in (50, 95, 99):
+        value = _percentile(latencies, percentile)
+        print(f"[llm_bench] p{percentile}_seconds={value:.3f}" if value is not None else f"[llm_bench] p{percentile}_seconds=-")
+    print(f"[llm_bench] hedge_stats={llm_router.hedge_stats()}", flush=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--no-stream", action="store_true", help="agenerate вместо astream")
+    args = parser.parse_args()
+    asyncio.run(_run(args.requests, args.concurrency, stream=not args.no_stream))
+
+
+if __name__ == "__main__":
+    main()
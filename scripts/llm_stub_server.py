@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""Локальная заглушка Gemini/OpenAI для нагрузочных прогонов (поведение — через LLM_STUB_*)."""
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import sys
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+import uvicorn
+
+from app.services.llm_stub_server import create_llm_stub_app
+
+
+def main() -> None:
+    host = os.getenv("LLM_STUB_HOST", "127.0.0.1")
+    port = int(os.getenv("LLM_STUB_PORT", "8090"))
+    print(f"[llm_stub] listening on http://{host}:{port}", flush=True)
+    uvicorn.run(create_llm_stub_app(), host=host, port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
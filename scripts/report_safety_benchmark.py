@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Сравнение проверки безопасности отчёта: проход на каждое правило против одного общего прохода.
+
+Тексты берутся из последних отчётов T3 в БД (--from-db), из файлов .txt/.md (--reports-dir)
+или собираются из заготовки T3 заглушки LLM до --target-kb. Результаты обеих реализаций
+сверяются: расхождение — ошибка, а не «ускорение».
+"""
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+import re
+import sys
+import time
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from app.core.report_safety import (
+    FORBIDDEN_WORDS,
+    GUARANTEE_PATTERNS,
+    RED_ZONE_PATTERNS,
+    report_safety,
+)
+
+# Нарушения, которые подмешиваются в синтетические тексты, чтобы сканеру было что находить.
+INJECTED_VIOLATIONS = (
+    "Прогноз на год не даём.",
+    "Это точно сработает.",
+    "Лечение здесь не обсуждается.",
+)
+
+
+class PerRuleSafety:
+    """Прежняя реализация evaluate: каждое правило — отдельный проход по тексту."""
+
+    def __init__(self) -> None:
+        self._words = {word: re.compile(rf"\b{re.escape(word)}\b", re.IGNORECASE) for word in FORBIDDEN_WORDS}
+        self._patterns = {name: re.compile(pattern, re.IGNORECASE) for name, pattern in GUARANTEE_PATTERNS.items()}
+        self._red_zones = {name: re.compile(pattern, re.IGNORECASE) for name, pattern in RED_ZONE_PATTERNS.items()}
+
+    def evaluate(self, text: str) -> tuple[list[str], list[str], list[str]]:
+        return (
+            [word for word, regex in self._words.items() if regex.search(text)],
+            [name for name, regex in self._patterns.items() if regex.search(text)],
+            [name for name, regex in self._red_zones.items() if regex.search(text)],
+        )
+
+
+def _synthetic_reports(count: int, target_kb: int) -> list[str]:
+    from app.services.llm_stub_server import CANNED_REPORTS
+
+    base = CANNED_REPORTS["T3"]
+    repeats = max(target_kb * 1024 // max(len(base.encode("utf-8")), 1), 1)
+    reports = []
+    for idx in range(count):
+        parts = [base] * repeats
+        if idx % 2:
+            parts.insert(idx % len(parts), INJECTED_VIOLATIONS[idx % len(INJECTED_VIOLATIONS)])
+        reports.append("\n\n".join(parts))
+    return reports
+
+
+def _reports_from_dir(path: Path) -> list[str]:
+    files = sorted([*path.glob("*.txt"), *path.glob("*.md")])
+    return [item.read_text(encoding="utf-8") for item in files]
+
+
+def _reports_from_db(limit: int) -> list[str]:
+    from sqlalchemy import select
+
+    from app.db.models import Report, Tariff
+    from app.db.session import get_session
+
+    with get_session() as session:
+        return list(
+            session.execute(
+                select(Report.report_text)
+                .where(Report.tariff == Tariff.T3)
+                .order_by(Report.created_at.desc())
+                .limit(limit)
+            ).scalars()
+        )
+
+
+def _measure(evaluate, reports: list[str], rounds: int) -> tuple[float, list]:
+    results = []
+    started = time.perf_counter()
+    for _ in range(rounds):
+        results = [evaluate(text) for text in reports]
+    return time.perf_counter() - started, results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--from-db", type=int, default=0, help="взять N последних отчётов T3 из БД")
+    parser.add_argument("--reports-dir", type=Path, default=None)
+    parser.add_argument("--reports", type=int, default=20, help="число синтетических отчётов")
+    parser.add_argument("--target-kb", type=int, default=20, help="размер синтетического отчёта")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.from_db:
+        reports = _reports_from_db(args.from_db)
+    elif args.reports_dir:
+        reports = _reports_from_dir(args.reports_dir)
+    else:
+        reports = _synthetic_reports(args.reports, args.target_kb)
+    if not reports:
+        print("[safety_bench] no reports", flush=True)
+        sys.exit(1)
+
+    legacy = PerRuleSafety()
+    legacy_seconds, legacy_results = _measure(legacy.evaluate, reports, args.rounds)
+    compiled_seconds, compiled_results = _measure(report_safety.evaluate, reports, args.rounds)
+    mismatches = sum(
+        1
+        for expected, evaluation in zip(legacy_results, compiled_results)
+        if expected != (evaluation.forbidden_words, evaluation.forbidden_patterns, evaluation.red_zones)
+    )
+
+    total_kb = sum(len(text.encode("utf-8")) for text in reports) / 1024
+    evaluations = len(reports) * args.rounds
+    print(f"[safety_bench] reports={len(reports)} avg_kb={total_kb / len(reports):.1f} rounds={args.rounds}", flush=True)
+    print(f"[safety_bench] per_rule_ms={legacy_seconds * 1000 / evaluations:.3f}", flush=True)
+    print(f"[safety_bench] compiled_ms={compiled_seconds * 1000 / evaluations:.3f}", flush=True)
+    print(f"[safety_bench] speedup={legacy_seconds / max(compiled_seconds, 1e-9):.2f}x", flush=True)
+    print(f"[safety_bench] mismatches={mismatches}", flush=True)
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -963,6 +963,8 @@ class AdminAnalyticsRoutesTests(unittest.TestCase):
         self.assertTrue(payload["worker"]["online"])
         self.assertEqual(payload["worker"]["jobs"]["pending"], 1)
         self.assertEqual(payload["worker"]["jobs"]["in_progress"], 1)
+        self.assertEqual(payload["worker"]["queue"]["by_tariff"]["T1"]["pending"], 1)
+        self.assertEqual(payload["worker"]["queue"]["by_tariff"]["T1"]["in_progress"], 1)
 
     def test_transitions_summary_contract(self) -> None:
         self._seed_events()
@@ -1784,6 +1786,44 @@ class AdminAnalyticsRoutesTests(unittest.TestCase):
             self.assertIsNone(second_jobs[0].locked_at)
             self.assertEqual(second_jobs[0].chat_id, 700707)
 
+    def test_admin_report_jobs_redrive_requeues_dead_letter_jobs(self) -> None:
+        with self.SessionLocal() as session:
+            session.add(User(id=108, telegram_user_id=700708))
+            session.add_all(
+                [
+                    ReportJob(
+                        id=301,
+                        user_id=108,
+                        tariff=Tariff.T1,
+                        status=ReportJobStatus.DEAD_LETTER,
+                        attempts=5,
+                        last_error="llm_unavailable",
+                        next_attempt_at=datetime.now(timezone.utc),
+                    ),
+                    ReportJob(
+                        id=302,
+                        user_id=108,
+                        tariff=Tariff.T1,
+                        status=ReportJobStatus.FAILED,
+                        attempts=1,
+                        last_error="profile_missing",
+                    ),
+                ]
+            )
+            session.commit()
+
+        response = self.client.post("/admin/api/report-jobs/redrive", json={})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"redriven": 1, "job_ids": [301]})
+
+        with self.SessionLocal() as session:
+            dead_letter_job = session.get(ReportJob, 301)
+            self.assertEqual(dead_letter_job.status, ReportJobStatus.PENDING)
+            self.assertEqual(dead_letter_job.attempts, 0)
+            self.assertIsNone(dead_letter_job.last_error)
+            self.assertIsNone(dead_letter_job.next_attempt_at)
+            self.assertEqual(session.get(ReportJob, 302).status, ReportJobStatus.FAILED)
+
     def test_admin_order_status_paid_marks_manual_source_without_payment_confirmation(self) -> None:
         with self.SessionLocal() as session:
             user = User(id=104, telegram_user_id=700704)
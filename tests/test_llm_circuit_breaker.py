@@ -0,0 +1,205 @@
+import asyncio
+import threading
+import unittest
+from unittest.mock import patch
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core import llm_router as llm_router_module
+from app.core.llm_circuit_breaker import LLMCircuitBreaker, key_circuit_name
+from app.core.llm_key_store import LLMKeyItem
+from app.core.llm_router import LLMRouter
+from app.db import session as db_session_module
+from app.db.base import Base
+from app.db.models import LLMCircuitBreakerState
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1_800_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class LLMCircuitBreakerTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+        self._patch = patch.object(db_session_module, "get_session_factory", return_value=self.SessionLocal)
+        self._patch.start()
+        self.clock = _Clock()
+
+    def tearDown(self) -> None:
+        self._patch.stop()
+        Base.metadata.drop_all(self.engine)
+        self.engine.dispose()
+
+    def _breaker(self) -> LLMCircuitBreaker:
+        # Отдельный экземпляр — как отдельный процесс: общая у них только таблица.
+        return LLMCircuitBreaker(
+            scope="provider",
+            min_requests=4,
+            failure_rate=0.5,
+            open_seconds=30,
+            probe_timeout_seconds=60,
+            sync_seconds=0,
+            clock=self.clock,
+        )
+
+    def test_failure_rate_opens_circuit_for_every_process(self) -> None:
+        bot, worker = self._breaker(), self._breaker()
+        bot.record_success("gemini")
+        bot.record_success("gemini")
+        self.assertFalse(bot.record_failure("gemini", error="timeout"))
+        self.assertTrue(bot.record_failure("gemini", error="timeout"))
+
+        self.assertFalse(bot.allow("gemini"))
+        self.assertFalse(worker.allow("gemini"))
+        with self.SessionLocal() as session:
+            record = session.get(LLMCircuitBreakerState, "gemini")
+            self.assertEqual((record.state, record.trips, record.last_error), ("open", 1, "timeout"))
+
+    def test_half_open_allows_single_probe_across_processes(self) -> None:
+        bot, worker = self._breaker(), self._breaker()
+        bot.record_failure("gemini", trip=True)
+        self.clock.now += 31
+
+        self.assertTrue(worker.allow("gemini"))
+        self.assertFalse(bot.allow("gemini"))
+        self.assertFalse(worker.allow("gemini"))
+
+        worker.record_success("gemini")
+        self.assertTrue(bot.allow("gemini"))
+        self.assertEqual(bot.state("gemini"), "closed")
+
+    def test_failed_probe_reopens_and_abandoned_probe_is_reclaimed(self) -> None:
+        bot, worker = self._breaker(), self._breaker()
+        bot.record_failure("gemini", trip=True)
+        self.clock.now += 31
+        self.assertTrue(bot.allow("gemini"))
+        self.assertTrue(bot.record_failure("gemini", error="503"))
+        self.assertFalse(worker.allow("gemini"))
+
+        self.clock.now += 31
+        self.assertTrue(bot.allow("gemini"))
+        # Проба не вернулась (процесс упал): после probe_timeout её забирает другой процесс.
+        self.clock.now += 61
+        self.assertTrue(worker.allow("gemini"))
+
+    def test_async_allow_claims_probe_once_off_event_loop(self) -> None:
+        bot, worker = self._breaker(), self._breaker()
+        bot.record_failure("gemini", trip=True)
+        self.clock.now += 31
+        claim_threads: list[int] = []
+        claim_probe = worker._claim_probe
+
+        def _claim(name: str, now: float) -> bool:
+            claim_threads.append(threading.get_ident())
+            return claim_probe(name, now)
+
+        async def _scenario() -> list[bool]:
+            with patch.object(worker, "_claim_probe", side_effect=_claim):
+                allowed = await asyncio.gather(worker.aallow("gemini"), worker.aallow("gemini"))
+            # Из корутины закрытие цепи пишется потоком breaker.
+            worker.record_success("gemini")
+            return list(allowed)
+
+        self.assertEqual(sorted(asyncio.run(_scenario())), [False, True])
+        self.assertEqual(len(claim_threads), 1)
+        self.assertNotEqual(claim_threads[0], threading.get_ident())
+        worker._writer.shutdown(wait=True)
+        self.assertEqual(bot.state("gemini"), "closed")
+
+
+class LLMRouterCircuitTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.router = LLMRouter()
+        self.router._provider_circuit = LLMCircuitBreaker(scope="provider", sync_seconds=3600)
+        self.router._key_circuit = LLMCircuitBreaker(scope="key", open_seconds=3600, sync_seconds=3600)
+        self.hosts: list[str] = []
+        self.used_keys: list[str | None] = []
+
+        def _resolve_keys(*, provider: str, primary_key, extra_keys):
+            return [LLMKeyItem(key=f"{provider}-key-{idx}", provider=provider) for idx in (1, 2)]
+
+        self._patches = [
+            patch.object(llm_router_module, "resolve_cached_llm_keys", side_effect=_resolve_keys),
+            patch.object(llm_router_module, "record_llm_key_usage"),
+            patch.object(db_session_module, "get_session_factory", side_effect=RuntimeError("no db")),
+        ]
+        for item in self._patches:
+            item.start()
+
+    async def asyncTearDown(self) -> None:
+        await self.router.aclose()
+
+    def tearDown(self) -> None:
+        for item in reversed(self._patches):
+            item.stop()
+
+    def _use_handler(self, handler) -> None:
+        def _recording(request: httpx.Request) -> httpx.Response:
+            self.hosts.append(request.url.host)
+            self.used_keys.append(request.headers.get("x-goog-api-key"))
+            return handler(request)
+
+        self.router._build_async_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(_recording))
+
+    async def test_open_provider_circuit_falls_back_without_request(self) -> None:
+        self._use_handler(lambda request: httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]}))
+        self.router._provider_circuit.record_failure("gemini", trip=True)
+
+        response = await self.router.agenerate({"user_id": 1}, "prompt")
+
+        self.assertEqual(response.provider, "openai")
+        self.assertEqual(self.hosts, ["api.openai.com"])
+
+    async def test_auth_error_opens_key_circuit_and_key_is_skipped(self) -> None:
+        def _handler(request: httpx.Request) -> httpx.Response:
+            if request.headers.get("x-goog-api-key") == "gemini-key-1":
+                return httpx.Response(401, json={"error": {"message": "revoked"}})
+            return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": "ok"}]}}]})
+
+        self._use_handler(_handler)
+        await self.router.agenerate({"user_id": 1}, "prompt")
+        self.router._rate_limit_until.clear()
+        self.used_keys.clear()
+
+        for idx in range(3):
+            await self.router.agenerate({"user_id": idx}, "prompt")
+
+        self.assertEqual(self.used_keys, ["gemini-key-2"] * 3)
+        self.assertEqual(sorted(self.router.circuit_snapshot()["key"].values()), ["closed", "open"])
+
+    async def test_saturated_half_open_key_releases_its_probe(self) -> None:
+        self._use_handler(lambda request: httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": "ok"}]}}]}))
+        clock = _Clock()
+        self.router._key_circuit = LLMCircuitBreaker(scope="key", open_seconds=30, sync_seconds=3600, clock=clock)
+        first_key = key_circuit_name("gemini", LLMKeyItem(key="gemini-key-1", provider="gemini"))
+        self.router._key_circuit.record_failure(first_key, trip=True)
+        clock.now += 31
+        try_acquire = self.router._key_pool.try_acquire
+
+        def _saturated_first_key(provider: str, key_item: LLMKeyItem) -> bool:
+            return key_item.key != "gemini-key-1" and try_acquire(provider, key_item)
+
+        with patch.object(self.router._key_pool, "try_acquire", side_effect=_saturated_first_key):
+            await self.router.agenerate({"user_id": 1}, "prompt")
+
+        self.assertEqual(self.used_keys, ["gemini-key-2"])
+        self.assertFalse(self.router._key_circuit.holds_probe(first_key))
+        # Проба свободна: следующий запрос сразу забирает её, а не ждёт probe_until.
+        self.assertTrue(self.router._key_circuit.allow(first_key))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import json
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+from app.core import llm_router as llm_router_module
+from app.core.llm_circuit_breaker import LLMCircuitBreaker
+from app.core.llm_context_cache import GeminiContextCacheRegistry
+from app.core.llm_key_store import LLMKeyItem
+from app.core.llm_router import LLMRouter
+from app.db import session as db_session_module
+from app.services.llm_stub_server import CANNED_REPORTS, LLMStubConfig, LLMStubServer, create_llm_stub_app
+
+KEY = LLMKeyItem(key="gemini-key", provider="gemini")
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1_800_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class GeminiContextCacheRegistryTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.clock = _Clock()
+        self.created: list[str] = []
+        self.registry = GeminiContextCacheRegistry(
+            enabled=True,
+            ttl_seconds=600,
+            renew_before_seconds=60,
+            min_uses=2,
+            failure_backoff_seconds=300,
+            clock=self.clock,
+        )
+
+    async def _create(self, key_item, model, prompt, ttl_seconds) -> str:
+        name = f"cachedContents/{len(self.created) + 1}"
+        self.created.append(name)
+        return name
+
+    async def test_cache_is_created_on_repeat_and_renewed_before_expiry(self) -> None:
+        first = await self.registry.aresolve(KEY, "flash", "prompt", self._create)
+        second = await self.registry.aresolve(KEY, "flash", "prompt", self._create)
+        self.clock.now += 500
+        reused = await self.registry.aresolve(KEY, "flash", "prompt", self._create)
+        self.clock.now += 50
+        renewed = await self.registry.aresolve(KEY, "flash", "prompt", self._create)
+
+        self.assertIsNone(first)
+        self.assertEqual((second, reused, renewed), ("cachedContents/1", "cachedContents/1", "cachedContents/2"))
+
+    async def test_failed_creation_backs_off(self) -> None:
+        async def _fail(key_item, model, prompt, ttl_seconds) -> str:
+            self.created.append("attempt")
+            raise RuntimeError("prompt is too short for caching")
+
+        for _ in range(4):
+            self.assertIsNone(await self.registry.aresolve(KEY, "flash", "prompt", _fail))
+        self.clock.now += 301
+        await self.registry.aresolve(KEY, "flash", "prompt", _fail)
+
+        self.assertEqual(len(self.created), 2)
+
+
+class LLMRouterContextCacheTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.router = LLMRouter()
+        self.router._provider_circuit = LLMCircuitBreaker(scope="provider", enabled=False)
+        self.router._key_circuit = LLMCircuitBreaker(scope="key", enabled=False)
+        self.router._context_cache = GeminiContextCacheRegistry(enabled=True, min_uses=2)
+        self.requests: list[tuple[str, dict]] = []
+
+        def _resolve_keys(*, provider: str, primary_key, extra_keys):
+            return [LLMKeyItem(key=f"{provider}-key", provider=provider)]
+
+        self._patches = [
+            patch.object(llm_router_module, "resolve_cached_llm_keys", side_effect=_resolve_keys),
+            patch.object(llm_router_module, "record_llm_key_usage"),
+            patch.object(db_session_module, "get_session_factory", side_effect=RuntimeError("no db")),
+            patch.object(llm_router_module.settings, "llm_gemini_base_url", "http://stub"),
+            patch.object(llm_router_module.settings, "llm_openai_base_url", "http://stub"),
+        ]
+        for item in self._patches:
+            item.start()
+        self._use_stub(LLMStubServer(LLMStubConfig()))
+
+    async def asyncTearDown(self) -> None:
+        await self.router.aclose()
+
+    def tearDown(self) -> None:
+        for item in reversed(self._patches):
+            item.stop()
+
+    def _use_stub(self, server: LLMStubServer) -> None:
+        self.server = server
+        transport = httpx.ASGITransport(app=create_llm_stub_app(server))
+
+        async def _record(request: httpx.Request) -> None:
+            self.requests.append((request.url.path, json.loads(request.content or b"{}")))
+
+        self.router._build_async_client = lambda: httpx.AsyncClient(
+            transport=transport,
+            event_hooks={"request": [_record]},
+        )
+
+    async def test_repeated_prompt_is_sent_as_cached_content(self) -> None:
+        for _ in range(3):
+            response = await self.router.agenerate({"user_id": 1, "tariff": "T3"}, "Текущий тариф: T3.")
+
+        generate_payloads = [payload for path, payload in self.requests if path.endswith(":generateContent")]
+        self.assertEqual(response.text, CANNED_REPORTS["T3"])
+        self.assertIn("systemInstruction", generate_payloads[0])
+        self.assertEqual(generate_payloads[0]["contents"][0]["parts"][0]["text"], 'Данные (facts-pack):\n{"user_id":1,"tariff":"T3"}')
+        self.assertEqual([payload.get("cachedContent") for payload in generate_payloads[1:]], ["cachedContents/stub-1"] * 2)
+        self.assertNotIn("systemInstruction", generate_payloads[2])
+        self.assertEqual(self.server.stats()["cached_contents_created"], 1)
+
+    async def test_lost_cached_content_is_recreated(self) -> None:
+        for _ in range(2):
+            await self.router.agenerate({"user_id": 1}, "Текущий тариф: T1.")
+        # Провайдер «потерял» кэш: запрос уходит в фолбэк, а следующий создаёт кэш заново.
+        self._use_stub(LLMStubServer(LLMStubConfig()))
+        await self.router.aclose()
+
+        fallback = await self.router.agenerate({"user_id": 1}, "Текущий тариф: T1.")
+        recovered = await self.router.agenerate({"user_id": 1}, "Текущий тариф: T1.")
+
+        self.assertEqual(fallback.provider, "openai")
+        self.assertEqual(recovered.provider, "gemini")
+        self.assertEqual(self.server.stats()["cached_contents_created"], 1)
+
+    async def test_openai_payload_is_compact_and_keyed_by_prompt(self) -> None:
+        call = self.router._openai_call({"user_id": 1, "profile": {"name": "A"}}, "prompt")
+
+        self.assertEqual(call.payload["messages"][0], {"role": "system", "content": "prompt"})
+        self.assertEqual(call.payload["messages"][1]["content"], '{"user_id":1,"profile":{"name":"A"}}')
+        self.assertTrue(call.payload["prompt_cache_key"].startswith("report-"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+from app.core import llm_router as llm_router_module
+from app.core.llm_key_pool import LLMKeyPool
+from app.core.llm_key_store import LLMKeyItem
+from app.core.llm_router import LLMRouter
+
+KEYS = [LLMKeyItem(key="key-1"), LLMKeyItem(key="key-2"), LLMKeyItem(key="key-3")]
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class LLMKeyPoolTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = _Clock()
+
+    def _keys(self, pool: LLMKeyPool) -> list[str]:
+        return [item.key for item in pool.order("gemini", KEYS)]
+
+    def test_order_prefers_least_in_flight_then_least_recently_used(self) -> None:
+        pool = LLMKeyPool(clock=self.clock)
+        self.assertEqual(self._keys(pool), ["key-1", "key-2", "key-3"])
+
+        self.assertTrue(pool.try_acquire("gemini", KEYS[0]))
+        self.clock.now += 1
+        self.assertTrue(pool.try_acquire("gemini", KEYS[1]))
+        self.assertEqual(self._keys(pool)[0], "key-3")
+
+        pool.release("gemini", KEYS[0], success=True, latency_seconds=1.0)
+        pool.release("gemini", KEYS[1], success=True, latency_seconds=1.0)
+        # Все свободны: первым идёт ключ, который дольше всех не использовался.
+        self.assertEqual(self._keys(pool), ["key-3", "key-1", "key-2"])
+
+    def test_in_flight_limit_and_token_bucket(self) -> None:
+        pool = LLMKeyPool(max_in_flight=1, requests_per_minute=2, clock=self.clock)
+        key = KEYS[0]
+
+        self.assertTrue(pool.try_acquire("gemini", key))
+        self.assertFalse(pool.try_acquire("gemini", key))
+        pool.release("gemini", key, success=True)
+        self.assertTrue(pool.try_acquire("gemini", key))
+        pool.release("gemini", key, success=True)
+        # Оба токена израсходованы, пополнение — 2 в минуту.
+        self.assertFalse(pool.try_acquire("gemini", key))
+        self.assertAlmostEqual(pool.seconds_until_capacity("gemini", [key]), 30.0)
+        self.clock.now += 30
+        self.assertTrue(pool.try_acquire("gemini", key))
+
+    def test_errors_and_latency_mark_key_unhealthy_for_cooldown(self) -> None:
+        pool = LLMKeyPool(failure_threshold=2, unhealthy_seconds=60, slow_latency_seconds=5, clock=self.clock)
+
+        for _ in range(2):
+            pool.try_acquire("gemini", KEYS[0])
+            reason = pool.release("gemini", KEYS[0], success=False)
+        self.assertEqual(reason, "errors")
+        for _ in range(3):
+            pool.try_acquire("gemini", KEYS[1])
+            reason = pool.release("gemini", KEYS[1], success=True, latency_seconds=10.0)
+        self.assertEqual(reason, "slow")
+
+        self.assertEqual(self._keys(pool), ["key-3", "key-1", "key-2"])
+        self.clock.now += 61
+        self.assertEqual(self._keys(pool)[:2], ["key-3", "key-1"])
+        self.assertTrue(all(row["healthy"] for row in pool.snapshot("gemini")))
+
+
+class LLMRouterKeyPoolTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.router = LLMRouter()
+        self.used_keys: list[str] = []
+
+        def _resolve_keys(*, provider: str, primary_key, extra_keys):
+            return [LLMKeyItem(key=f"{provider}-key-{idx}", provider=provider) for idx in (1, 2, 3)]
+
+        self._patches = [
+            patch.object(llm_router_module, "resolve_cached_llm_keys", side_effect=_resolve_keys),
+            patch.object(llm_router_module, "record_llm_key_usage"),
+        ]
+        for item in self._patches:
+            item.start()
+
+        def _handler(request: httpx.Request) -> httpx.Response:
+            self.used_keys.append(request.headers.get("x-goog-api-key"))
+            return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": "ok"}]}}]})
+
+        self.router._build_async_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(_handler))
+
+    async def asyncTearDown(self) -> None:
+        await self.router.aclose()
+
+    def tearDown(self) -> None:
+        for item in reversed(self._patches):
+            item.stop()
+
+    async def test_sequential_requests_are_spread_across_keys(self) -> None:
+        for idx in range(6):
+            await self.router.agenerate({"user_id": idx}, "prompt")
+
+        self.assertEqual(
+            self.used_keys,
+            ["gemini-key-1", "gemini-key-2", "gemini-key-3"] * 2,
+        )
+        self.assertEqual([row["in_flight"] for row in self.router.key_pool_snapshot("gemini")], [0, 0, 0])
+
+    async def test_saturated_provider_falls_back_after_acquire_timeout(self) -> None:
+        self.router._key_pool.max_in_flight = 1
+        for item in self.router._gemini_call({}, "prompt").api_keys:
+            self.router._key_pool.try_acquire("gemini", item)
+
+        def _handler(request: httpx.Request) -> httpx.Response:
+            self.used_keys.append(request.url.host)
+            return httpx.Response(200, json={"choices": [{"message": {"content": "Резерв"}}]})
+
+        self.router._build_async_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(_handler))
+        with patch.object(llm_router_module.settings, "llm_key_acquire_timeout_seconds", 0.05):
+            response = await self.router.agenerate({"user_id": 1}, "prompt")
+
+        self.assertEqual(response.provider, "openai")
+        self.assertEqual(self.used_keys, ["api.openai.com"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.api.routes import admin as admin_routes
+from app.core import llm_key_store as llm_key_store_module
+from app.core.llm_key_store import LLMKeyItem, LLMKeyRegistry
+from app.db.base import Base
+from app.main import create_app
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class LLMKeyRegistryTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = _Clock()
+        self.registry = LLMKeyRegistry(ttl_seconds=30, clock=self.clock)
+        self.calls: list[str] = []
+        self.keys = [LLMKeyItem(key="key-1", db_id=1, provider="gemini")]
+
+        def _resolve(*, provider: str, primary_key, extra_keys):
+            self.calls.append(provider)
+            return list(self.keys)
+
+        self._patch = patch.object(llm_key_store_module, "resolve_llm_keys", side_effect=_resolve)
+        self._patch.start()
+
+    def tearDown(self) -> None:
+        self._patch.stop()
+
+    def _resolve(self, provider: str = "gemini") -> list[LLMKeyItem]:
+        return self.registry.resolve(provider=provider, primary_key="env-key", extra_keys=None)
+
+    def test_resolution_is_cached_per_provider_until_ttl(self) -> None:
+        self.assertEqual(self._resolve(), self.keys)
+        self.assertEqual(self._resolve(), self.keys)
+        self._resolve("openai")
+        self.assertEqual(self.calls, ["gemini", "openai"])
+
+        self.clock.now += 31
+        self._resolve()
+        self.assertEqual(self.calls, ["gemini", "openai", "gemini"])
+
+    def test_invalidate_bumps_version_and_drops_entries(self) -> None:
+        self._resolve()
+        version = self.registry.version
+
+        self.registry.invalidate()
+        self.keys = [LLMKeyItem(key="key-2", db_id=2, provider="gemini")]
+
+        self.assertEqual(self.registry.version, version + 1)
+        self.assertEqual([item.key for item in self._resolve()], ["key-2"])
+        self.assertEqual(len(self.calls), 2)
+
+    def test_empty_resolution_is_not_cached(self) -> None:
+        self.keys = []
+        self._resolve()
+        self._resolve()
+        self.assertEqual(len(self.calls), 2)
+
+
+class AdminLLMKeysInvalidationTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(self.engine)
+        self.SessionLocal = sessionmaker(bind=self.engine)
+        self.app = create_app()
+
+        def override_db_session():
+            session = self.SessionLocal()
+            try:
+                yield session
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+        self.app.dependency_overrides[admin_routes._get_db_session] = override_db_session
+        self.client = TestClient(self.app)
+
+    def tearDown(self) -> None:
+        self.app.dependency_overrides.clear()
+        Base.metadata.drop_all(self.engine)
+        self.engine.dispose()
+
+    def test_key_mutations_invalidate_registry(self) -> None:
+        registry = llm_key_store_module.llm_key_registry
+        version = registry.version
+
+        created = self.client.post("/admin/api/llm-keys", json={"provider": "gemini", "key": "k1"})
+        self.assertEqual(created.status_code, 200)
+        key_id = created.json()["id"]
+        self.assertEqual(registry.version, version + 1)
+
+        self.client.patch(f"/admin/api/llm-keys/{key_id}", json={"is_active": False})
+        self.client.post("/admin/api/llm-keys/bulk-update", json={"ids": [key_id], "priority": 5})
+        self.client.delete(f"/admin/api/llm-keys/{key_id}")
+        self.assertEqual(registry.version, version + 4)
+
+        self.client.get("/admin/api/llm-keys")
+        self.assertEqual(registry.version, version + 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
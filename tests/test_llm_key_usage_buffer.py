@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core.llm_key_store import LLMKeyUsageBuffer
+from app.db import session as db_session_module
+from app.db.base import Base
+from app.db.models import LLMApiKey
+
+
+class LLMKeyUsageBufferTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+        with self.SessionLocal() as session:
+            session.add(LLMApiKey(id=1, provider="gemini", key="k1", success_count=10, failure_count=2))
+            session.add(LLMApiKey(id=2, provider="gemini", key="k2"))
+            session.commit()
+        self._patch = patch.object(db_session_module, "get_session_factory", return_value=self.SessionLocal)
+        self._patch.start()
+        self.buffer = LLMKeyUsageBuffer(flush_interval_seconds=60)
+        self.base_time = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+    def tearDown(self) -> None:
+        self.buffer.close()
+        self._patch.stop()
+        Base.metadata.drop_all(self.engine)
+        self.engine.dispose()
+
+    def _key(self, key_id: int) -> LLMApiKey:
+        with self.SessionLocal() as session:
+            record = session.get(LLMApiKey, key_id)
+            session.expunge(record)
+            return record
+
+    def test_events_are_buffered_and_flushed_in_one_update_per_key(self) -> None:
+        self.buffer.record(1, success=False, status_code=429, error_message="rate", now=self.base_time)
+        self.buffer.record(1, success=True, status_code=200, now=self.base_time + timedelta(seconds=1))
+        self.buffer.record(2, success=False, status_code=500, error_message="down", now=self.base_time)
+
+        self.assertEqual(self._key(1).success_count, 10)
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.buffer.pending_count, 0)
+
+        first = self._key(1)
+        self.assertEqual((first.success_count, first.failure_count), (11, 3))
+        self.assertEqual(first.last_status_code, 200)
+        self.assertIsNone(first.last_error)
+        self.assertEqual(first.last_success_at.replace(tzinfo=timezone.utc), self.base_time + timedelta(seconds=1))
+        second = self._key(2)
+        self.assertEqual((second.success_count, second.failure_count), (0, 1))
+        self.assertEqual(second.last_error, "down")
+        self.assertIsNone(second.last_success_at)
+
+    def test_failed_flush_keeps_counts_for_next_attempt(self) -> None:
+        self.buffer.record(1, success=True, status_code=200, now=self.base_time)
+        with patch.object(db_session_module, "get_session_factory", side_effect=RuntimeError("db down")):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.buffer.record(1, success=False, status_code=503, error_message="busy", now=self.base_time)
+
+        self.assertEqual(self.buffer.flush(), 1)
+        record = self._key(1)
+        self.assertEqual((record.success_count, record.failure_count), (11, 3))
+        self.assertEqual(record.last_error, "busy")
+        self.assertIsNotNone(record.last_success_at)
+
+    def test_close_flushes_pending_usage(self) -> None:
+        self.buffer.record(2, success=True, status_code=200)
+        self.buffer.close()
+        self.assertEqual(self._key(2).success_count, 1)
+
+    def test_zero_interval_writes_through(self) -> None:
+        buffer = LLMKeyUsageBuffer(flush_interval_seconds=0)
+        buffer.record(2, success=True, status_code=200)
+        self.assertEqual(buffer.pending_count, 0)
+        self.assertEqual(self._key(2).success_count, 1)
+
+    def test_zero_interval_flush_leaves_event_loop(self) -> None:
+        buffer = LLMKeyUsageBuffer(flush_interval_seconds=0)
+        flush_threads: list[int] = []
+        original_flush = buffer.flush
+
+        def _flush() -> int:
+            flush_threads.append(threading.get_ident())
+            return original_flush()
+
+        buffer.flush = _flush
+
+        async def _record() -> None:
+            buffer.record(2, success=True, status_code=200)
+            while not flush_threads:
+                await asyncio.sleep(0.01)
+
+        asyncio.run(_record())
+        self.assertNotIn(threading.get_ident(), flush_threads)
+        self.assertEqual(self._key(2).success_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
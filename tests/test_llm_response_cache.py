@@ -0,0 +1,156 @@
+import threading
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core import llm_response_cache as llm_response_cache_module
+from app.core import report_service as report_service_module
+from app.core.llm_response_cache import (
+    LLMResponseCache,
+    build_llm_response_cache_key,
+    collect_llm_response_cache_metrics,
+)
+from app.core.llm_router import LLMResponse
+from app.db.base import Base
+from app.db.models import LLMResponseCacheEntry, ReportJobStage
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1_800_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class LLMResponseCacheTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+
+        @contextmanager
+        def _test_get_session():
+            session = self.SessionLocal()
+            try:
+                yield session
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+        self._patch = patch.object(llm_response_cache_module, "get_session", new=_test_get_session)
+        self._patch.start()
+        self.clock = _Clock()
+        self.cache = LLMResponseCache(enabled=True, ttl_seconds=60, max_entries=2, clock=self.clock)
+
+    def tearDown(self) -> None:
+        self._patch.stop()
+        Base.metadata.drop_all(self.engine)
+        self.engine.dispose()
+
+    def test_key_ignores_volatile_fields_and_tracks_prompt(self) -> None:
+        first = build_llm_response_cache_key({"user_id": 1, "generated_at": "a"}, "prompt")
+        second = build_llm_response_cache_key({"user_id": 1, "generated_at": "b"}, "prompt")
+        other_prompt = build_llm_response_cache_key({"user_id": 1, "generated_at": "a"}, "prompt v2")
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other_prompt)
+
+    def test_hit_until_ttl_expires(self) -> None:
+        self.cache.put("k1", LLMResponse(text="отчёт", provider="gemini", model="flash"))
+
+        cached = self.cache.get("k1")
+        self.clock.now += 61
+
+        self.assertEqual((cached.text, cached.provider), ("отчёт", "gemini"))
+        self.assertIsNone(self.cache.get("k1"))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_least_recently_used_entry_is_evicted(self) -> None:
+        for key in ("k1", "k2"):
+            self.cache.put(key, LLMResponse(text=key, provider="gemini", model="flash"))
+            self.clock.now += 1
+        self.cache.get("k1")
+        self.clock.now += 1
+
+        self.cache.put("k3", LLMResponse(text="k3", provider="gemini", model="flash"))
+
+        with self.SessionLocal() as session:
+            keys = sorted(entry.cache_key for entry in session.query(LLMResponseCacheEntry).all())
+        self.assertEqual(keys, ["k1", "k3"])
+
+    def test_metrics_count_hits_and_misses_from_llm_stages(self) -> None:
+        self.cache.put("k1", LLMResponse(text="отчёт", provider="gemini", model="flash"))
+        self.cache.get("k1")
+        now = datetime.now(timezone.utc)
+        with self.SessionLocal() as session:
+            for outcome in ("hit", "miss", "miss"):
+                session.add(
+                    ReportJobStage(
+                        job_id=1,
+                        stage="llm",
+                        started_at=now,
+                        finished_at=now,
+                        duration_ms=1,
+                        metadata_json={"cache": outcome},
+                    )
+                )
+            session.commit()
+            metrics = collect_llm_response_cache_metrics(session)
+
+        self.assertEqual((metrics["entries"], metrics["total_hits"]), (1, 1))
+        self.assertEqual((metrics["hits"], metrics["misses"]), (1, 2))
+
+
+class ReportServiceResponseCacheTests(unittest.IsolatedAsyncioTestCase):
+    async def test_cached_response_skips_provider_and_safe_response_is_stored(self) -> None:
+        cache = LLMResponseCache(enabled=True)
+        cached = LLMResponse(text="Спокойный текст", provider="gemini", model="flash")
+        service = report_service_module.ReportService()
+        agenerate = AsyncMock()
+        cache_threads: list[int] = []
+        cached_results = [None, cached]
+
+        def _get(cache_key: str) -> LLMResponse | None:
+            cache_threads.append(threading.get_ident())
+            return cached_results.pop(0)
+
+        def _put(cache_key: str, response: LLMResponse) -> None:
+            cache_threads.append(threading.get_ident())
+
+        with patch.object(report_service_module, "llm_response_cache", new=cache), patch.object(
+            cache, "get", side_effect=_get
+        ), patch.object(cache, "put", side_effect=_put) as put, patch.object(
+            report_service_module.llm_router, "agenerate", new=agenerate
+        ), patch.object(report_service_module.settings, "llm_streaming_enabled", False), patch.object(
+            report_service_module.settings, "report_safety_enabled", True
+        ), patch.object(service, "_build_system_prompt", return_value="prompt"), patch.object(
+            service, "_persist_report"
+        ):
+            agenerate.return_value = cached
+            await service.generate_report(user_id=1, state={"selected_tariff": "T1"})
+            second = await service.generate_report(user_id=1, state={"selected_tariff": "T1"})
+
+        self.assertEqual(second.text, "Спокойный текст")
+        self.assertEqual(agenerate.await_count, 1)
+        put.assert_called_once()
+        # Синхронная сессия кэша не выполняется в потоке event loop.
+        self.assertEqual(len(cache_threads), 3)
+        self.assertNotIn(threading.get_ident(), cache_threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from unittest.mock import AsyncMock, patch
+
+import httpx
+
+from app.core import llm_router as llm_router_module
+from app.core.llm_key_store import LLMKeyItem
+from app.core.llm_router import LLMRouter, LLMUnavailableError
+
+
+def _gemini_ok(text: str) -> dict:
+    return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+
+def _openai_ok(text: str) -> dict:
+    return {"choices": [{"message": {"content": text}}]}
+
+
+class LLMRouterAsyncTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.router = LLMRouter()
+        self.requests: list[httpx.Request] = []
+        self.usage: list[tuple[str, bool]] = []
+
+        def _resolve_keys(*, provider: str, primary_key, extra_keys):
+            return [
+                LLMKeyItem(key=f"{provider}-key-1", provider=provider),
+                LLMKeyItem(key=f"{provider}-key-2", provider=provider),
+            ]
+
+        def _record_usage(key_item, *, success, status_code=None, error_message=None):
+            self.usage.append((key_item.key, success))
+
+        self._patches = [
+            patch.object(llm_router_module, "resolve_cached_llm_keys", side_effect=_resolve_keys),
+            patch.object(llm_router_module, "record_llm_key_usage", side_effect=_record_usage),
+        ]
+        for item in self._patches:
+            item.start()
+
+    async def asyncTearDown(self) -> None:
+        await self.router.aclose()
+
+    def tearDown(self) -> None:
+        for item in reversed(self._patches):
+            item.stop()
+
+    def _use_transport(self, handler) -> None:
+        def _recording_handler(request: httpx.Request) -> httpx.Response:
+            self.requests.append(request)
+            return handler(request)
+
+        self.router._build_async_client = lambda: httpx.AsyncClient(
+            transport=httpx.MockTransport(_recording_handler)
+        )
+
+    async def test_agenerate_rotates_gemini_keys_before_fallback(self) -> None:
+        def _handler(request: httpx.Request) -> httpx.Response:
+            if request.headers.get("x-goog-api-key") == "gemini-key-1":
+                return httpx.Response(401, json={"error": {"message": "bad key"}})
+            return httpx.Response(200, json=_gemini_ok("Отчёт"))
+
+        self._use_transport(_handler)
+
+        response = await self.router.agenerate({"user_id": 1}, "prompt")
+
+        self.assertEqual((response.provider, response.text), ("gemini", "Отчёт"))
+        self.assertEqual(self.usage, [("gemini-key-1", False), ("gemini-key-2", True)])
+        self.assertTrue(self.router._is_rate_limited("gemini-key-1"))
+
+    async def test_agenerate_falls_back_to_openai_with_async_retry_after_backoff(self) -> None:
+        def _handler(request: httpx.Request) -> httpx.Response:
+            if request.url.host == "api.openai.com":
+                return httpx.Response(200, json=_openai_ok("Резерв"))
+            return httpx.Response(503, headers={"Retry-After": "2"})
+
+        self._use_transport(_handler)
+
+        with patch.object(llm_router_module.asyncio, "sleep", new=AsyncMock()) as sleep_mock:
+            response = await self.router.agenerate({"user_id": 1}, "prompt")
+
+        self.assertEqual((response.provider, response.text), ("openai", "Резерв"))
+        gemini_requests = [r for r in self.requests if r.url.host != "api.openai.com"]
+        # По 3 попытки (1 + 2 повтора) на каждый из двух ключей Gemini.
+        self.assertEqual(len(gemini_requests), 6)
+        self.assertEqual([call.args[0] for call in sleep_mock.await_args_list], [2.0] * 4)
+
+    async def test_agenerate_raises_unavailable_when_both_providers_fail(self) -> None:
+        self._use_transport(lambda request: httpx.Response(500, json={"error": {"message": "down"}}))
+
+        with patch.object(llm_router_module.asyncio, "sleep", new=AsyncMock()), self.assertRaises(
+            LLMUnavailableError
+        ):
+            await self.router.agenerate({"user_id": 1}, "prompt")
+
+        self.assertEqual([success for _key, success in self.usage], [False] * 4)
+
+    async def test_concurrent_generations_share_one_client_without_worker_threads(self) -> None:
+        threads: set[int] = set()
+        clients: list[httpx.AsyncClient] = []
+
+        def _ok(request: httpx.Request) -> httpx.Response:
+            threads.add(threading.get_ident())
+            return httpx.Response(200, json=_gemini_ok("ok"))
+
+        def _build_client() -> httpx.AsyncClient:
+            clients.append(httpx.AsyncClient(transport=httpx.MockTransport(_ok)))
+            return clients[-1]
+
+        self.router._build_async_client = _build_client
+
+        results = await asyncio.gather(
+            *(self.router.agenerate({"user_id": idx}, "prompt") for idx in range(20))
+        )
+
+        self.assertEqual(len(results), 20)
+        self.assertEqual(len(clients), 1)
+        self.assertEqual(threads, {threading.get_ident()})
+
+    def test_retry_after_accepts_http_date(self) -> None:
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+        resp = httpx.Response(429, headers={"Retry-After": format_datetime(retry_at, usegmt=True)})
+
+        delay = LLMRouter._retry_after_seconds(resp)
+
+        self.assertIsNotNone(delay)
+        self.assertGreater(delay, 25)
+        self.assertLessEqual(delay, 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
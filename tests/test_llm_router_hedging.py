@@ -0,0 +1,170 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+from app.core import llm_router as llm_router_module
+from app.core.llm_key_store import LLMKeyItem
+from app.core.llm_router import LLMRouter
+
+
+def _gemini_ok(text: str) -> dict:
+    return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+
+def _openai_ok(text: str) -> dict:
+    return {"choices": [{"message": {"content": text}}]}
+
+
+class LLMRouterHedgingTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.router = LLMRouter()
+        self.hosts: list[str] = []
+        self.cancelled: list[str] = []
+
+        def _resolve_keys(*, provider: str, primary_key, extra_keys):
+            return [
+                LLMKeyItem(key=f"{provider}-key-1", provider=provider),
+                LLMKeyItem(key=f"{provider}-key-2", provider=provider),
+            ]
+
+        self._patches = [
+            patch.object(llm_router_module, "resolve_cached_llm_keys", side_effect=_resolve_keys),
+            patch.object(llm_router_module, "record_llm_key_usage"),
+            patch.object(llm_router_module.settings, "llm_hedge_enabled", True),
+            patch.object(llm_router_module.settings, "llm_hedge_target", "openai"),
+            patch.object(llm_router_module.settings, "llm_hedge_default_delay_seconds", 0.05),
+            patch.object(llm_router_module.settings, "llm_hedge_min_delay_seconds", 0.0),
+            patch.object(llm_router_module.settings, "llm_hedge_max_per_minute", 6),
+        ]
+        for item in self._patches:
+            item.start()
+
+    async def asyncTearDown(self) -> None:
+        await self.router.aclose()
+
+    def tearDown(self) -> None:
+        for item in reversed(self._patches):
+            item.stop()
+
+    def _use_delays(self, *, gemini: float, openai: float) -> None:
+        async def _handler(request: httpx.Request) -> httpx.Response:
+            host = request.url.host
+            self.hosts.append(host)
+            is_openai = host == "api.openai.com"
+            try:
+                await asyncio.sleep(openai if is_openai else gemini)
+            except asyncio.CancelledError:
+                self.cancelled.append(host)
+                raise
+            if is_openai:
+                return httpx.Response(200, json=_openai_ok("Резерв"))
+            return httpx.Response(200, json=_gemini_ok("Основной"))
+
+        self.router._build_async_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(_handler))
+
+    async def test_slow_primary_is_hedged_and_loser_is_cancelled(self) -> None:
+        self._use_delays(gemini=5, openai=0.01)
+
+        response = await self.router.agenerate({"user_id": 1}, "prompt")
+
+        self.assertEqual((response.provider, response.text, response.hedge), ("openai", "Резерв", "hedge"))
+        self.assertEqual(self.cancelled, ["generativelanguage.googleapis.com"])
+        self.assertEqual(self.router.hedge_stats(), {"launched": 1, "won_hedge": 1})
+
+    async def test_fast_primary_does_not_launch_hedge(self) -> None:
+        self._use_delays(gemini=0, openai=0)
+
+        response = await self.router.agenerate({"user_id": 1}, "prompt")
+
+        self.assertEqual((response.provider, response.hedge), ("gemini", None))
+        self.assertNotIn("api.openai.com", self.hosts)
+        self.assertEqual(self.router.hedge_stats(), {})
+
+    async def test_hedge_budget_caps_launches_per_minute(self) -> None:
+        self._use_delays(gemini=0.15, openai=5)
+
+        with patch.object(llm_router_module.settings, "llm_hedge_max_per_minute", 1):
+            first = await self.router.agenerate({"user_id": 1}, "prompt")
+            second = await self.router.agenerate({"user_id": 2}, "prompt")
+
+        self.assertEqual((first.provider, first.hedge), ("gemini", "primary"))
+        self.assertEqual((second.provider, second.hedge), ("gemini", None))
+        self.assertEqual(self.hosts.count("api.openai.com"), 1)
+        self.assertEqual(
+            self.router.hedge_stats(),
+            {"launched": 1, "won_primary": 1, "skipped_budget": 1},
+        )
+
+    async def test_gemini_hedge_target_uses_second_key(self) -> None:
+        keys: list[str] = []
+
+        async def _handler(request: httpx.Request) -> httpx.Response:
+            key = request.headers.get("x-goog-api-key")
+            keys.append(key)
+            await asyncio.sleep(5 if key == "gemini-key-1" else 0)
+            return httpx.Response(200, json=_gemini_ok(key))
+
+        self.router._build_async_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(_handler))
+
+        with patch.object(llm_router_module.settings, "llm_hedge_target", "gemini"):
+            response = await self.router.agenerate({"user_id": 1}, "prompt")
+
+        self.assertEqual((response.text, response.hedge), ("gemini-key-2", "hedge"))
+        self.assertEqual(keys, ["gemini-key-1", "gemini-key-2"])
+
+    def _use_stream_delays(self, *, gemini: float, openai: float) -> None:
+        async def _handler(request: httpx.Request) -> httpx.Response:
+            host = request.url.host
+            self.hosts.append(host)
+            is_openai = host == "api.openai.com"
+            try:
+                await asyncio.sleep(openai if is_openai else gemini)
+            except asyncio.CancelledError:
+                self.cancelled.append(host)
+                raise
+            if is_openai:
+                events = [{"choices": [{"delta": {"content": text}}]} for text in ("Резерв", " дальше")]
+            else:
+                events = [_gemini_ok(text) for text in ("Основной", " дальше")]
+            body = "".join(f"data: {json.dumps(event, ensure_ascii=False)}\n\n" for event in events)
+            return httpx.Response(200, content=body.encode("utf-8"))
+
+        self.router._build_async_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(_handler))
+
+    async def test_slow_stream_start_is_hedged_until_first_chunk(self) -> None:
+        self._use_stream_delays(gemini=5, openai=0.01)
+
+        chunks = [chunk async for chunk in self.router.astream({"user_id": 1}, "prompt")]
+
+        self.assertEqual("".join(chunk.text for chunk in chunks), "Резерв дальше")
+        self.assertEqual({(chunk.provider, chunk.hedge) for chunk in chunks}, {("openai", "hedge")})
+        self.assertEqual(self.cancelled, ["generativelanguage.googleapis.com"])
+        self.assertEqual(self.router.hedge_stats(), {"launched": 1, "won_hedge": 1})
+
+    async def test_fast_stream_start_does_not_launch_hedge(self) -> None:
+        self._use_stream_delays(gemini=0, openai=0)
+
+        chunks = [chunk async for chunk in self.router.astream({"user_id": 1}, "prompt")]
+
+        self.assertEqual("".join(chunk.text for chunk in chunks), "Основной дальше")
+        self.assertEqual({(chunk.provider, chunk.hedge) for chunk in chunks}, {("gemini", None)})
+        self.assertNotIn("api.openai.com", self.hosts)
+        self.assertEqual(self.router.hedge_stats(), {})
+        self.assertEqual(len(self.router._primary_first_chunk_latencies), 1)
+
+    def test_hedge_delay_uses_latency_percentile_after_warmup(self) -> None:
+        self.router._primary_latencies.extend(float(value) for value in range(1, 11))
+        self.assertEqual(self.router._hedge_delay_seconds(), 0.05)
+
+        self.router._primary_latencies.extend(float(value) for value in range(11, 101))
+        with patch.object(llm_router_module.settings, "llm_hedge_percentile", 90):
+            self.assertEqual(self.router._hedge_delay_seconds(), 90.0)
+        with patch.object(llm_router_module.settings, "llm_hedge_min_delay_seconds", 120.0):
+            self.assertEqual(self.router._hedge_delay_seconds(), 120.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import json
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import httpx
+
+from app.core import llm_router as llm_router_module
+from app.core.llm_key_store import LLMKeyItem
+from app.core.llm_router import LLMRouter, LLMUnavailableError
+
+
+def _sse(*events: dict | str) -> bytes:
+    lines = []
+    for event in events:
+        payload = event if isinstance(event, str) else json.dumps(event, ensure_ascii=False)
+        lines.append(f"data: {payload}\n\n")
+    return "".join(lines).encode("utf-8")
+
+
+def _gemini_chunk(text: str) -> dict:
+    return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+
+def _openai_chunk(text: str) -> dict:
+    return {"choices": [{"delta": {"content": text}}]}
+
+
+class LLMRouterStreamingTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.router = LLMRouter()
+        self.requests: list[httpx.Request] = []
+
+        def _resolve_keys(*, provider: str, primary_key, extra_keys):
+            return [
+                LLMKeyItem(key=f"{provider}-key-1", provider=provider),
+                LLMKeyItem(key=f"{provider}-key-2", provider=provider),
+            ]
+
+        self._patches = [
+            patch.object(llm_router_module, "resolve_cached_llm_keys", side_effect=_resolve_keys),
+            patch.object(llm_router_module, "record_llm_key_usage"),
+            patch.object(llm_router_module.asyncio, "sleep", new=AsyncMock()),
+        ]
+        for item in self._patches:
+            item.start()
+
+    async def asyncTearDown(self) -> None:
+        await self.router.aclose()
+
+    def tearDown(self) -> None:
+        for item in reversed(self._patches):
+            item.stop()
+
+    def _use_transport(self, handler) -> None:
+        def _recording_handler(request: httpx.Request) -> httpx.Response:
+            self.requests.append(request)
+            return handler(request)
+
+        self.router._build_async_client = lambda: httpx.AsyncClient(
+            transport=httpx.MockTransport(_recording_handler)
+        )
+
+    async def _collect(self) -> list:
+        return [chunk async for chunk in self.router.astream({"user_id": 1}, "prompt")]
+
+    async def test_gemini_sse_chunks_are_yielded_in_order(self) -> None:
+        self._use_transport(
+            lambda request: httpx.Response(
+                200,
+                content=_sse(_gemini_chunk("## Резюме\n"), _gemini_chunk("Текст"), _gemini_chunk("")),
+            )
+        )
+
+        chunks = await self._collect()
+
+        self.assertEqual([chunk.text for chunk in chunks], ["## Резюме\n", "Текст"])
+        self.assertEqual({chunk.provider for chunk in chunks}, {"gemini"})
+        self.assertIn(":streamGenerateContent", self.requests[0].url.path)
+        self.assertEqual(self.requests[0].url.params.get("alt"), "sse")
+
+    async def test_falls_back_to_openai_stream_before_first_chunk(self) -> None:
+        def _handler(request: httpx.Request) -> httpx.Response:
+            if request.url.host == "api.openai.com":
+                return httpx.Response(200, content=_sse(_openai_chunk("Резерв"), "[DONE]"))
+            return httpx.Response(503, json={"error": {"message": "down"}})
+
+        self._use_transport(_handler)
+
+        chunks = await self._collect()
+
+        self.assertEqual([(chunk.provider, chunk.text) for chunk in chunks], [("openai", "Резерв")])
+        openai_request = self.requests[-1]
+        self.assertTrue(json.loads(openai_request.content)["stream"])
+
+    async def test_interrupted_stream_raises_unavailable_without_fallback(self) -> None:
+        async def _broken_body():
+            yield _sse(_gemini_chunk("Начало"))
+            raise httpx.ReadError("connection reset")
+
+        def _handler(request: httpx.Request) -> httpx.Response:
+            if request.url.host == "api.openai.com":
+                raise AssertionError("fallback must not start after the first chunk")
+            return httpx.Response(200, content=_broken_body())
+
+        self._use_transport(_handler)
+        received: list[str] = []
+
+        with self.assertRaises(LLMUnavailableError):
+            async for chunk in self.router.astream({"user_id": 1}, "prompt"):
+                received.append(chunk.text)
+
+        self.assertEqual(received, ["Начало"])
+        self.assertEqual([row["in_flight"] for row in self.router.key_pool_snapshot("gemini")], [0, 0])
+
+    async def test_consumer_can_stop_stream_early(self) -> None:
+        self._use_transport(
+            lambda request: httpx.Response(200, content=_sse(_gemini_chunk("a"), _gemini_chunk("b")))
+        )
+
+        stream = self.router.astream({"user_id": 1}, "prompt")
+        first = await stream.__anext__()
+        await stream.aclose()
+
+        self.assertEqual(first.text, "a")
+        self.assertEqual([row["in_flight"] for row in self.router.key_pool_snapshot("gemini")], [0, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
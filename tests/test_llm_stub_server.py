@@ -0,0 +1,137 @@
+import json
+import tempfile
+import threading
+import unittest
+from contextlib import aclosing
+from pathlib import Path
+from unittest.mock import patch
+
+import httpx
+
+from app.core import llm_router as llm_router_module
+from app.core.llm_circuit_breaker import LLMCircuitBreaker
+from app.core.llm_key_store import LLMKeyItem
+from app.core.llm_router import LLMRouter
+from app.db import session as db_session_module
+from app.services.llm_stub_server import (
+    CANNED_REPORTS,
+    LLMStubConfig,
+    LLMStubServer,
+    create_llm_stub_app,
+    fixture_key,
+)
+
+
+async def _no_sleep(_seconds: float) -> None:
+    return None
+
+
+class LLMStubServerTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.router = LLMRouter()
+        self.router._provider_circuit = LLMCircuitBreaker(scope="provider", enabled=False)
+        self.router._key_circuit = LLMCircuitBreaker(scope="key", enabled=False)
+        self.key_threads: list[int] = []
+
+        def _resolve_keys(*, provider: str, primary_key, extra_keys):
+            self.key_threads.append(threading.get_ident())
+            return [LLMKeyItem(key=f"{provider}-key", provider=provider)]
+
+        self._patches = [
+            patch.object(llm_router_module, "resolve_cached_llm_keys", side_effect=_resolve_keys),
+            patch.object(llm_router_module, "record_llm_key_usage"),
+            patch.object(db_session_module, "get_session_factory", side_effect=RuntimeError("no db")),
+            patch.object(llm_router_module.settings, "llm_gemini_base_url", "http://stub"),
+            patch.object(llm_router_module.settings, "llm_openai_base_url", "http://stub"),
+        ]
+        for item in self._patches:
+            item.start()
+
+    async def asyncTearDown(self) -> None:
+        await self.router.aclose()
+
+    def tearDown(self) -> None:
+        for item in reversed(self._patches):
+            item.stop()
+
+    def _use_stub(self, config: LLMStubConfig, **kwargs) -> LLMStubServer:
+        server = LLMStubServer(config, sleep=_no_sleep, **kwargs)
+        app = create_llm_stub_app(server)
+        self.router._build_async_client = lambda: httpx.AsyncClient(transport=httpx.ASGITransport(app=app))
+        return server
+
+    async def test_canned_report_matches_tariff_in_prompt(self) -> None:
+        self._use_stub(LLMStubConfig())
+
+        response = await self.router.agenerate({"user_id": 1}, "Текущий тариф: T3.")
+
+        self.assertEqual(response.provider, "gemini")
+        self.assertEqual(response.text, CANNED_REPORTS["T3"])
+
+    async def test_key_resolution_runs_off_event_loop(self) -> None:
+        self._use_stub(LLMStubConfig())
+
+        await self.router.agenerate({"user_id": 1}, "Текущий тариф: T1.")
+        async with aclosing(self.router.astream({"user_id": 1}, "Текущий тариф: T1.")) as stream:
+            [chunk async for chunk in stream]
+
+        self.assertEqual(len(self.key_threads), 2)
+        self.assertNotIn(threading.get_ident(), self.key_threads)
+
+    async def test_stream_is_split_into_sse_chunks(self) -> None:
+        self._use_stub(LLMStubConfig(stream_chunk_chars=50))
+
+        async with aclosing(self.router.astream({"user_id": 1}, "Текущий тариф: T2.")) as stream:
+            chunks = [chunk.text async for chunk in stream]
+
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(chunks), CANNED_REPORTS["T2"])
+
+    async def test_rate_limit_returns_retry_after(self) -> None:
+        server = LLMStubServer(LLMStubConfig(rate_limit_rate=1.0, retry_after_seconds=7), sleep=_no_sleep)
+        transport = httpx.ASGITransport(app=create_llm_stub_app(server))
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://stub") as client:
+            resp = await client.post("/v1/chat/completions", json={"model": "m", "messages": []})
+
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers["retry-after"], "7")
+        self.assertEqual(server.stats()["rate_limited"], 1)
+
+    async def test_record_then_replay_serves_captured_text(self) -> None:
+        upstream_calls: list[str] = []
+
+        def _upstream(request: httpx.Request) -> httpx.Response:
+            upstream_calls.append(str(request.url))
+            return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": "Записанный отчёт"}]}}]})
+
+        facts_pack = {"user_id": 1, "generated_at": "2026-01-01T00:00:00+00:00"}
+        with tempfile.TemporaryDirectory() as fixtures_dir:
+            self._use_stub(
+                LLMStubConfig(mode="record", fixtures_dir=Path(fixtures_dir)),
+                upstream_client_factory=lambda: httpx.AsyncClient(transport=httpx.MockTransport(_upstream)),
+            )
+            recorded = await self.router.agenerate(facts_pack, "prompt")
+
+            await self.router.aclose()
+            replay = self._use_stub(LLMStubConfig(mode="replay", fixtures_dir=Path(fixtures_dir)))
+            replayed = await self.router.agenerate({**facts_pack, "generated_at": "later"}, "prompt")
+            fixtures = [json.loads(path.read_text(encoding="utf-8")) for path in Path(fixtures_dir).glob("*.json")]
+
+        self.assertEqual(recorded.text, "Записанный отчёт")
+        self.assertEqual(replayed.text, "Записанный отчёт")
+        self.assertEqual(len(upstream_calls), 1)
+        self.assertIn(":generateContent", upstream_calls[0])
+        self.assertEqual(replay.stats()["replay_hits"], 1)
+        self.assertEqual(fixtures[0]["provider"], "gemini")
+
+    def test_fixture_key_ignores_stream_flag(self) -> None:
+        payload = {"model": "m", "messages": [{"role": "user", "content": '{"generated_at": "a"}'}]}
+        self.assertEqual(
+            fixture_key("openai", payload),
+            fixture_key("openai", {**payload, "stream": True}),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
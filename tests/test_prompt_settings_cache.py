@@ -0,0 +1,89 @@
+import unittest
+from unittest.mock import patch
+
+from app.core import prompt_settings
+from app.core.prompt_settings import DEFAULT_TARIFF_PROMPTS, TariffPromptRegistry
+from app.db.models import Tariff
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TariffPromptRegistryTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = _Clock()
+        self.registry = TariffPromptRegistry(ttl_seconds=30, clock=self.clock)
+        self.stamp = (1, 1, "2026-10-16 00:00:00")
+        self.overrides = {"PROMPT_T1": "Промпт T1 из админки"}
+        self.file_mtime = None
+        self.loads = 0
+
+        def _load_admin() -> dict[str, str]:
+            self.loads += 1
+            return dict(self.overrides)
+
+        self._patches = [
+            patch.object(prompt_settings, "_load_admin_prompt_stamp", side_effect=lambda: self.stamp),
+            patch.object(prompt_settings, "_load_admin_prompt_overrides", side_effect=_load_admin),
+            patch.object(prompt_settings, "_load_prompt_overrides", return_value={"PROMPT_T2": "Промпт T2 из файла"}),
+            patch.object(prompt_settings, "_prompts_file_mtime", side_effect=lambda: self.file_mtime),
+        ]
+        for item in self._patches:
+            item.start()
+
+    def tearDown(self) -> None:
+        for item in reversed(self._patches):
+            item.stop()
+
+    def test_admin_prompt_is_cached_and_versioned(self) -> None:
+        first = self.registry.resolve(Tariff.T1)
+        second = self.registry.resolve(Tariff.T1)
+        default = self.registry.resolve(Tariff.T3)
+
+        self.assertEqual(first.content, "Промпт T1 из админки")
+        self.assertTrue(first.version.startswith("admin:"))
+        self.assertEqual(second, first)
+        self.assertEqual(default.content, DEFAULT_TARIFF_PROMPTS[Tariff.T3])
+        self.assertTrue(default.version.startswith("default:"))
+        self.assertEqual(self.loads, 1)
+
+    def test_prompts_reload_only_when_table_stamp_changes(self) -> None:
+        before = self.registry.resolve(Tariff.T1)
+        self.clock.now += 31
+        self.registry.resolve(Tariff.T1)
+        self.assertEqual(self.loads, 1)
+
+        self.overrides["PROMPT_T1"] = "Новый промпт T1"
+        self.stamp = (1, 1, "2026-10-16 00:05:00")
+        self.clock.now += 31
+        after = self.registry.resolve(Tariff.T1)
+
+        self.assertEqual(self.loads, 2)
+        self.assertNotEqual(after.version, before.version)
+
+    def test_invalidate_and_file_mtime_force_reload(self) -> None:
+        self.registry.resolve(Tariff.T1)
+        self.registry.invalidate()
+        self.registry.resolve(Tariff.T1)
+        self.file_mtime = 123.0
+        self.registry.resolve(Tariff.T1)
+
+        self.assertEqual(self.loads, 3)
+
+    def test_file_prompts_are_used_without_admin_rows(self) -> None:
+        self.stamp = (0, None, None)
+
+        resolved = self.registry.resolve(Tariff.T2)
+
+        self.assertEqual(resolved.content, "Промпт T2 из файла")
+        self.assertTrue(resolved.version.startswith("file:"))
+        self.assertEqual(self.loads, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,191 @@
+import unittest
+from contextlib import contextmanager
+from unittest.mock import AsyncMock, patch
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core import report_service as report_service_module
+from app.core.llm_router import LLMResponse
+from app.core.report_job_context import load_report_job_context
+from app.db.base import Base
+from app.db.models import (
+    Order,
+    OrderFulfillmentStatus,
+    OrderStatus,
+    PaymentProvider,
+    QuestionnaireResponse,
+    QuestionnaireStatus,
+    ReportJob,
+    ReportJobStatus,
+    ScreenStateRecord,
+    Tariff,
+    User,
+    UserProfile,
+)
+
+
+class ReportJobContextTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+
+        @contextmanager
+        def _test_get_session():
+            session = self.SessionLocal()
+            try:
+                yield session
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+        self._old_get_session = report_service_module.get_session
+        report_service_module.get_session = _test_get_session
+
+        with self.SessionLocal() as session:
+            session.add(User(id=1, telegram_user_id=303, telegram_username="ctx"))
+            session.add(
+                UserProfile(
+                    user_id=1,
+                    name="Ctx",
+                    gender="x",
+                    birth_date="01.01.2000",
+                    birth_time="00.00",
+                    birth_place_city="City",
+                    birth_place_region="Region",
+                    birth_place_country="Country",
+                )
+            )
+            session.add(
+                QuestionnaireResponse(
+                    user_id=1,
+                    questionnaire_version="v1",
+                    status=QuestionnaireStatus.COMPLETED,
+                    answers={"q1": "a"},
+                )
+            )
+            session.add(
+                ScreenStateRecord(
+                    telegram_user_id=303,
+                    data={"selected_tariff": Tariff.T0.value, "profile": {"name": "Ctx"}},
+                )
+            )
+            session.add(
+                Order(
+                    id=5,
+                    user_id=1,
+                    tariff=Tariff.T1,
+                    amount=560,
+                    currency="RUB",
+                    provider=PaymentProvider.PRODAMUS,
+                    status=OrderStatus.PAID,
+                    fulfillment_status=OrderFulfillmentStatus.PENDING,
+                )
+            )
+            session.add(
+                ReportJob(
+                    id=1,
+                    user_id=1,
+                    order_id=5,
+                    tariff=Tariff.T1,
+                    status=ReportJobStatus.PENDING,
+                    attempts=0,
+                    chat_id=303,
+                    lock_token="mine",
+                )
+            )
+            session.commit()
+
+        self.statements: list[str] = []
+        event.listen(self.engine, "before_cursor_execute", self._record_statement)
+
+    def tearDown(self) -> None:
+        event.remove(self.engine, "before_cursor_execute", self._record_statement)
+        report_service_module.get_session = self._old_get_session
+        Base.metadata.drop_all(self.engine)
+        self.engine.dispose()
+
+    def _record_statement(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        self.statements.append(statement)
+
+    def test_context_is_loaded_in_one_query(self) -> None:
+        with self.SessionLocal() as session:
+            loaded = load_report_job_context(session, 1, lock_token="mine")
+
+        self.assertEqual(len(self.statements), 1)
+        context = loaded.context
+        self.assertIsNone(loaded.existing_report)
+        self.assertEqual((context.user_id, context.telegram_user_id, context.tariff), (1, 303, Tariff.T1))
+        self.assertTrue(context.has_profile)
+        self.assertEqual(context.questionnaire_status, QuestionnaireStatus.COMPLETED)
+        self.assertEqual((context.order.id, context.order.status, context.order.amount), (5, OrderStatus.PAID, 560.0))
+        self.assertEqual(
+            context.report_state(),
+            {"selected_tariff": "T1", "profile": {"name": "Ctx"}, "order_id": "5"},
+        )
+        with self.assertRaises(TypeError):
+            context.screen_state["order_id"] = "1"
+
+    async def test_report_order_and_job_are_finalized_in_persist_transaction(self) -> None:
+        service = report_service_module.report_service
+        with patch.object(report_service_module.settings, "llm_streaming_enabled", False), patch.object(
+            report_service_module.settings, "report_safety_enabled", False
+        ), patch.object(
+            report_service_module.llm_router,
+            "agenerate",
+            new=AsyncMock(return_value=LLMResponse(text="Готовый отчёт", provider="gemini", model="flash")),
+        ), patch.object(service, "_build_system_prompt", return_value="prompt"), patch.object(
+            service, "_prompt_version", return_value="default:test"
+        ):
+            report = await service.generate_report_by_job(job_id=1, lock_token="mine")
+
+        self.assertEqual(report.report_text, "Готовый отчёт")
+        selects = [statement for statement in self.statements if statement.lstrip().upper().startswith("SELECT")]
+        # Контекст задания — единственное чтение: заказ и задание повторно не перечитываются.
+        self.assertEqual(len(selects), 1)
+        with self.SessionLocal() as session:
+            job = session.get(ReportJob, 1)
+            order = session.get(Order, 5)
+            self.assertEqual(job.status, ReportJobStatus.COMPLETED)
+            self.assertEqual(order.fulfillment_status, OrderFulfillmentStatus.COMPLETED)
+            self.assertEqual(order.fulfilled_report_id, report.id)
+            self.assertIsNotNone(order.consumed_at)
+
+    async def test_job_reclaimed_during_generation_is_left_to_new_owner(self) -> None:
+        service = report_service_module.report_service
+
+        async def _generate_and_lose_lease(*, user_id, state):
+            with self.SessionLocal() as session:
+                session.get(ReportJob, 1).lock_token = "other"
+                session.commit()
+            return await report_service_module.ReportService.generate_report(service, user_id=user_id, state=state)
+
+        with patch.object(report_service_module.settings, "llm_streaming_enabled", False), patch.object(
+            report_service_module.settings, "report_safety_enabled", False
+        ), patch.object(
+            report_service_module.llm_router,
+            "agenerate",
+            new=AsyncMock(return_value=LLMResponse(text="Отчёт", provider="gemini", model="flash")),
+        ), patch.object(service, "_build_system_prompt", return_value="prompt"), patch.object(
+            service, "_prompt_version", return_value="default:test"
+        ), patch.object(service, "generate_report", new=_generate_and_lose_lease):
+            report = await service.generate_report_by_job(job_id=1, lock_token="mine")
+
+        self.assertIsNone(report)
+        with self.SessionLocal() as session:
+            job = session.get(ReportJob, 1)
+            self.assertEqual(job.status, ReportJobStatus.IN_PROGRESS)
+            self.assertEqual(job.lock_token, "other")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+import asyncio
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.bot import report_jobs_worker as report_jobs_worker_module
+from app.core import report_service as report_service_module
+from app.db.base import Base
+from app.db.models import ReportJob, ReportJobStatus, Tariff, User
+from app.services.report_job_queue import ReportJobLease
+
+
+class ReportJobLeaseTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+
+        @contextmanager
+        def _test_get_session():
+            session = self.SessionLocal()
+            try:
+                yield session
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+        self._old_worker_get_session = report_jobs_worker_module.get_session
+        self._old_service_get_session = report_service_module.get_session
+        report_jobs_worker_module.get_session = _test_get_session
+        report_service_module.get_session = _test_get_session
+
+        self.locked_at = datetime.now(timezone.utc) - timedelta(minutes=5)
+        with self.SessionLocal() as session:
+            session.add(User(id=1, telegram_user_id=50001, telegram_username="lease"))
+            session.add(
+                ReportJob(
+                    id=1,
+                    user_id=1,
+                    order_id=None,
+                    tariff=Tariff.T0,
+                    status=ReportJobStatus.IN_PROGRESS,
+                    attempts=0,
+                    chat_id=50001,
+                    lock_token="mine",
+                    locked_at=self.locked_at,
+                )
+            )
+            session.commit()
+
+    def tearDown(self) -> None:
+        report_jobs_worker_module.get_session = self._old_worker_get_session
+        report_service_module.get_session = self._old_service_get_session
+        Base.metadata.drop_all(self.engine)
+        self.engine.dispose()
+
+    def _job(self) -> ReportJob:
+        with self.SessionLocal() as session:
+            job = session.get(ReportJob, 1)
+            session.expunge(job)
+            return job
+
+    async def test_lease_is_renewed_while_job_is_handled(self) -> None:
+        worker = report_jobs_worker_module.ReportJobWorker()
+        release = asyncio.Event()
+
+        async def _slow_handle(_bot, _job_id: int, lock_token: str | None = None) -> None:
+            await release.wait()
+
+        with patch.object(worker, "_handle_job", new=_slow_handle), patch.object(
+            worker,
+            "_resolve_lease_renew_interval",
+            return_value=0.01,
+        ):
+            task = asyncio.create_task(
+                worker._handle_leased_job(AsyncMock(), ReportJobLease(job_id=1, lock_token="mine"))
+            )
+            await asyncio.sleep(0.05)
+            release.set()
+            await task
+
+        renewed_at = self._job().locked_at.replace(tzinfo=timezone.utc)
+        self.assertGreater(renewed_at, self.locked_at)
+
+    async def test_cancelled_job_releases_lease(self) -> None:
+        worker = report_jobs_worker_module.ReportJobWorker()
+
+        async def _hanging_handle(_bot, _job_id: int, lock_token: str | None = None) -> None:
+            await asyncio.Event().wait()
+
+        with patch.object(worker, "_handle_job", new=_hanging_handle):
+            task = asyncio.create_task(
+                worker._handle_leased_job(AsyncMock(), ReportJobLease(job_id=1, lock_token="mine"))
+            )
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        job = self._job()
+        self.assertIsNone(job.lock_token)
+        self.assertIsNone(job.locked_at)
+        self.assertEqual(job.status, ReportJobStatus.IN_PROGRESS)
+
+    async def test_service_does_not_touch_job_reclaimed_by_other_worker(self) -> None:
+        with patch.object(
+            report_service_module.report_service,
+            "generate_report",
+            new=AsyncMock(return_value=None),
+        ) as mocked:
+            result = await report_service_module.report_service.generate_report_by_job(
+                job_id=1,
+                lock_token="stale",
+            )
+
+        self.assertIsNone(result)
+        mocked.assert_not_awaited()
+        job = self._job()
+        self.assertEqual(job.status, ReportJobStatus.IN_PROGRESS)
+        self.assertEqual(job.lock_token, "mine")
+
+    async def test_worker_skips_delivery_when_lease_lost(self) -> None:
+        worker = report_jobs_worker_module.ReportJobWorker()
+        bot = AsyncMock()
+
+        with patch.object(
+            report_jobs_worker_module.report_service,
+            "generate_report_by_job",
+            new=AsyncMock(return_value=None),
+        ), patch.object(
+            report_jobs_worker_module.screen_manager,
+            "show_screen",
+            new=AsyncMock(),
+        ) as show_screen:
+            await worker._handle_job(bot, 1, lock_token="stale")
+
+        show_screen.assert_not_awaited()
+        self.assertEqual(self._job().lock_token, "mine")
+
+
+if __name__ == "__main__":
+    unittest.main()
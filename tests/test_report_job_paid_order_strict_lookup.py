@@ -140,12 +140,18 @@ class ReportJobPaidOrderStrictLookupTests(unittest.IsolatedAsyncioTestCase):
 
     async def test_generate_report_by_job_marks_controlled_failure_and_emits_metric_when_fallback_has_invalid_order(self) -> None:
         with patch.object(
+            report_service_module.settings,
+            "llm_streaming_enabled",
+            False,
+        ), patch.object(
             report_service_module.llm_router,
-            "generate",
-            return_value=LLMResponse(
-                text="нумерология и прогноз",
-                provider="gemini",
-                model="flash",
+            "agenerate",
+            new=AsyncMock(
+                return_value=LLMResponse(
+                    text="нумерология и прогноз",
+                    provider="gemini",
+                    model="flash",
+                )
             ),
         ), patch.object(
             report_service_module.report_service,
@@ -0,0 +1,116 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+from app.bot.screens import build_report_wait_message
+from app.core import report_job_progress
+from app.core import report_service as report_service_module
+from app.core.llm_router import LLMStreamChunk
+from app.core.report_job_progress import ReportJobProgress, report_progress_fraction
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class ReportJobProgressTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = _Clock()
+        self.progress = ReportJobProgress(job_id=1, interval_seconds=3, clock=self.clock)
+        self.writes: list[int] = []
+        self._patch = patch.object(
+            ReportJobProgress,
+            "_write",
+            autospec=True,
+            side_effect=lambda instance, sections: self._record(instance, sections),
+        )
+        self._patch.start()
+
+    def tearDown(self) -> None:
+        self._patch.stop()
+
+    def _record(self, instance: ReportJobProgress, sections: int) -> None:
+        instance._written = sections
+        instance._written_at = self.clock()
+        self.writes.append(sections)
+
+    def test_sections_are_counted_across_chunk_boundaries_and_throttled(self) -> None:
+        self.progress.start_attempt()
+        self.clock.now += 3
+        self.progress.feed("## Рез")
+        self.progress.feed("юме\nТекст\n## Сильные стороны\n")
+        self.assertEqual(self.progress.sections_done, 1)
+
+        self.progress.feed("Абзац\nЗоны роста:\n")
+        self.assertEqual(self.progress.sections_done, 2)
+        self.assertEqual(self.writes, [0, 1])
+
+        self.clock.now += 3
+        self.progress.feed("- пункт:\n## Ориентиры\n")
+        self.progress.finish()
+        self.assertEqual(self.writes, [0, 1, 3, 4])
+
+    def test_fraction_depends_on_tariff_and_never_reaches_full(self) -> None:
+        self.assertAlmostEqual(report_progress_fraction(3, "T1"), 0.5)
+        self.assertAlmostEqual(report_progress_fraction(5, "T3"), 0.5)
+        self.assertEqual(report_progress_fraction(20, "T2"), 0.95)
+
+    def test_wait_message_shows_sections_done(self) -> None:
+        text = build_report_wait_message(frame="✨", progress=0.5, sections_done=3)
+
+        self.assertIn("50%", text)
+        self.assertIn("Готово разделов: 3", text)
+
+
+class ReportServiceStreamingTests(unittest.IsolatedAsyncioTestCase):
+    async def test_stream_is_accumulated_and_progress_is_fed(self) -> None:
+        async def _astream(facts_pack, prompt):
+            for text in ("## Резюме\nТекст\n", "## Итог\n", "Конец"):
+                yield LLMStreamChunk(text=text, provider="gemini", model="flash")
+
+        service = report_service_module.ReportService()
+        progress = ReportJobProgress(job_id=1)
+        stage_meta: dict = {}
+        with patch.object(report_service_module.llm_router, "astream", new=_astream), patch.object(
+            ReportJobProgress, "_write"
+        ), report_job_progress.activate_report_job_progress(progress):
+            response, violation = await service._generate_llm_response({}, "prompt", stage_meta)
+
+        self.assertIsNone(violation)
+        self.assertEqual(response.text, "## Резюме\nТекст\n## Итог\nКонец")
+        self.assertEqual((response.provider, response.model), ("gemini", "flash"))
+        self.assertTrue(stage_meta["streamed"])
+        self.assertIn("first_chunk_ms", stage_meta)
+        self.assertEqual(progress.sections_done, 1)
+
+
+class ReportJobProgressBackgroundWriteTests(unittest.IsolatedAsyncioTestCase):
+    async def test_write_leaves_event_loop_and_keeps_only_latest_value(self) -> None:
+        progress = ReportJobProgress(job_id=1, interval_seconds=0)
+        stored: list[tuple[int, int]] = []
+        release = threading.Event()
+
+        def _slow_store(sections: int) -> None:
+            release.wait(timeout=5)
+            stored.append((sections, threading.get_ident()))
+
+        with patch.object(progress, "_store", side_effect=_slow_store):
+            progress.start_attempt()
+            # Пока первая запись висит, стрим идёт дальше без ожидания.
+            progress.feed("## Резюме\nТекст\n## Сильные стороны\n")
+            progress.feed("Абзац\n## Зоны роста\n")
+            progress.finish()
+            self.assertEqual(stored, [])
+            release.set()
+            await progress.drain()
+
+        self.assertEqual([sections for sections, _ in stored], [0, 3])
+        self.assertNotIn(threading.get_ident(), {thread for _, thread in stored})
+
+
+if __name__ == "__main__":
+    unittest.main()
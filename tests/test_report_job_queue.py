@@ -0,0 +1,328 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.db.base import Base
+from app.db.models import ReportJob, ReportJobStatus, Tariff, User
+from app.core.config import settings as report_job_queue_settings
+from app.services import report_job_queue
+
+
+class ReportJobQueueClaimTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+        self.now = datetime.now(timezone.utc)
+        with self.SessionLocal() as session:
+            for user_id in range(1, 6):
+                session.add(
+                    User(id=user_id, telegram_user_id=40000 + user_id, telegram_username=f"queue{user_id}")
+                )
+            session.add_all(
+                [
+                    self._job(1, ReportJobStatus.PENDING, created_minutes_ago=5),
+                    self._job(2, ReportJobStatus.PENDING, created_minutes_ago=4),
+                    self._job(
+                        3,
+                        ReportJobStatus.IN_PROGRESS,
+                        created_minutes_ago=10,
+                        locked_at=self.now - timedelta(seconds=30),
+                    ),
+                    self._job(
+                        4,
+                        ReportJobStatus.IN_PROGRESS,
+                        created_minutes_ago=20,
+                        locked_at=self.now - timedelta(hours=1),
+                    ),
+                    self._job(5, ReportJobStatus.COMPLETED, created_minutes_ago=30),
+                ]
+            )
+            session.commit()
+
+    def tearDown(self) -> None:
+        Base.metadata.drop_all(self.engine)
+        self.engine.dispose()
+
+    def _job(
+        self,
+        job_id: int,
+        status: ReportJobStatus,
+        *,
+        created_minutes_ago: int,
+        locked_at: datetime | None = None,
+        user_id: int | None = None,
+        tariff: Tariff = Tariff.T0,
+    ) -> ReportJob:
+        return ReportJob(
+            id=job_id,
+            user_id=user_id or job_id,
+            order_id=None,
+            tariff=tariff,
+            status=status,
+            attempts=0,
+            chat_id=40001,
+            lock_token="old" if locked_at else None,
+            locked_at=locked_at,
+            created_at=self.now - timedelta(minutes=created_minutes_ago),
+        )
+
+    def test_claims_oldest_available_jobs_up_to_limit(self) -> None:
+        with self.SessionLocal() as session:
+            leases = report_job_queue.claim_report_jobs(
+                session,
+                limit=2,
+                lock_timeout_seconds=600,
+                now=self.now,
+            )
+            session.commit()
+
+        self.assertEqual([lease.job_id for lease in leases], [4, 1])
+        self.assertEqual(len({lease.lock_token for lease in leases}), 1)
+        with self.SessionLocal() as session:
+            claimed = session.execute(
+                select(ReportJob).where(ReportJob.id.in_([1, 4])).order_by(ReportJob.id)
+            ).scalars().all()
+            for job in claimed:
+                self.assertEqual(job.status, ReportJobStatus.IN_PROGRESS)
+                self.assertEqual(job.lock_token, leases[0].lock_token)
+            self.assertEqual(session.get(ReportJob, 3).lock_token, "old")
+
+    def test_second_claim_skips_leased_and_excluded_jobs(self) -> None:
+        with self.SessionLocal() as session:
+            first = report_job_queue.claim_report_jobs(
+                session, limit=1, lock_timeout_seconds=600, now=self.now
+            )
+            second = report_job_queue.claim_report_jobs(
+                session,
+                limit=5,
+                lock_timeout_seconds=600,
+                exclude_job_ids=[1],
+                now=self.now,
+            )
+            session.commit()
+
+        self.assertEqual([lease.job_id for lease in first], [4])
+        self.assertEqual([lease.job_id for lease in second], [2])
+
+    def test_paid_jobs_jump_ahead_within_priority_step(self) -> None:
+        with self.SessionLocal() as session:
+            session.add(User(id=6, telegram_user_id=40006, telegram_username="paid"))
+            session.add(User(id=7, telegram_user_id=40007, telegram_username="late"))
+            session.add(self._job(6, ReportJobStatus.PENDING, created_minutes_ago=1, tariff=Tariff.T3))
+            session.add(self._job(7, ReportJobStatus.PENDING, created_minutes_ago=0, tariff=Tariff.T1))
+            session.commit()
+
+        with patch.object(report_job_queue_settings, "report_job_priority_step_seconds", 300), self.SessionLocal() as session:
+            leases = report_job_queue.claim_report_jobs(
+                session,
+                limit=5,
+                lock_timeout_seconds=600,
+                exclude_job_ids=[4],
+                now=self.now,
+            )
+            session.commit()
+
+        # T3 (опережение 15 минут) обгоняет бесплатные задания возрастом 4–5 минут,
+        # T1 (опережение 5 минут) — только задание 2, поставленное менее 5 минут назад.
+        self.assertEqual([lease.job_id for lease in leases], [6, 1, 7, 2])
+
+    def test_user_gets_one_job_while_previous_is_in_progress(self) -> None:
+        with self.SessionLocal() as session:
+            session.add(self._job(6, ReportJobStatus.PENDING, created_minutes_ago=50, user_id=1))
+            session.add(self._job(7, ReportJobStatus.PENDING, created_minutes_ago=40, user_id=3))
+            session.commit()
+
+            leases = report_job_queue.claim_report_jobs(
+                session,
+                limit=5,
+                lock_timeout_seconds=600,
+                now=self.now,
+            )
+            session.commit()
+
+        # Пользователь 1 получает только самое раннее задание, пользователь 3 ждёт своё задание 3.
+        self.assertEqual([lease.job_id for lease in leases], [6, 4, 2])
+
+        with self.SessionLocal() as session:
+            unfair = report_job_queue.claim_report_jobs(
+                session,
+                limit=5,
+                lock_timeout_seconds=600,
+                now=self.now,
+                user_fairness=False,
+            )
+        self.assertEqual([lease.job_id for lease in unfair], [7, 1])
+
+    def test_queue_breakdown_groups_active_jobs_by_tariff(self) -> None:
+        with self.SessionLocal() as session:
+            session.add(self._job(6, ReportJobStatus.PENDING, created_minutes_ago=2, user_id=2, tariff=Tariff.T2))
+            session.commit()
+            breakdown = report_job_queue.collect_report_job_queue_breakdown(session, now=self.now)
+
+        self.assertEqual(breakdown["T0"]["pending"], 2)
+        self.assertEqual(breakdown["T0"]["in_progress"], 2)
+        self.assertEqual(breakdown["T0"]["pending_users"], 2)
+        self.assertEqual(breakdown["T0"]["oldest_pending_age_seconds"], 300)
+        self.assertEqual(breakdown["T2"]["pending"], 1)
+        self.assertNotIn("T1", breakdown)
+
+    def test_zero_limit_claims_nothing(self) -> None:
+        with self.SessionLocal() as session:
+            self.assertEqual(
+                report_job_queue.claim_report_jobs(session, limit=0, lock_timeout_seconds=600),
+                [],
+            )
+
+    def test_postgres_statement_uses_skip_locked_and_returning(self) -> None:
+        candidates = select(ReportJob.id).where(ReportJob.status == ReportJobStatus.PENDING).limit(3)
+        statement = report_job_queue._build_postgres_claim_statement(
+            candidates,
+            {"status": ReportJobStatus.IN_PROGRESS, "lock_token": "t", "locked_at": self.now},
+        )
+        compiled = str(statement.compile(dialect=postgresql.dialect()))
+
+        self.assertIn("FOR UPDATE SKIP LOCKED", compiled)
+        self.assertIn("RETURNING report_jobs.id", compiled)
+
+    def test_renew_extends_lock_only_for_current_token(self) -> None:
+        later = self.now + timedelta(minutes=5)
+        with self.SessionLocal() as session:
+            renewed = report_job_queue.renew_report_job_lease(
+                session, report_job_queue.ReportJobLease(job_id=3, lock_token="old"), now=later
+            )
+            stale = report_job_queue.renew_report_job_lease(
+                session, report_job_queue.ReportJobLease(job_id=4, lock_token="other"), now=later
+            )
+            session.commit()
+
+        self.assertTrue(renewed)
+        self.assertFalse(stale)
+        with self.SessionLocal() as session:
+            self.assertEqual(
+                session.get(ReportJob, 3).locked_at.replace(tzinfo=timezone.utc), later
+            )
+            self.assertEqual(
+                session.get(ReportJob, 4).locked_at.replace(tzinfo=timezone.utc),
+                self.now - timedelta(hours=1),
+            )
+
+    def test_released_job_is_claimable_immediately(self) -> None:
+        with self.SessionLocal() as session:
+            released = report_job_queue.release_report_job_lease(
+                session, report_job_queue.ReportJobLease(job_id=3, lock_token="old")
+            )
+            leases = report_job_queue.claim_report_jobs(
+                session,
+                limit=5,
+                lock_timeout_seconds=600,
+                exclude_job_ids=[1, 2, 4],
+                now=self.now,
+            )
+            session.commit()
+
+        self.assertTrue(released)
+        self.assertEqual([lease.job_id for lease in leases], [3])
+
+
+class ReportJobQueueWakeupTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+        with self.SessionLocal() as session:
+            session.add(User(id=1, telegram_user_id=40002, telegram_username="wakeup"))
+            session.commit()
+        self.calls: list[str] = []
+        self.unsubscribe = report_job_queue.subscribe_report_job_wakeups(
+            lambda: self.calls.append("wake")
+        )
+
+    def tearDown(self) -> None:
+        self.unsubscribe()
+        Base.metadata.drop_all(self.engine)
+        self.engine.dispose()
+
+    def _pending_job(self, job_id: int) -> ReportJob:
+        return ReportJob(
+            id=job_id,
+            user_id=1,
+            order_id=None,
+            tariff=Tariff.T0,
+            status=ReportJobStatus.PENDING,
+            attempts=0,
+            chat_id=40002,
+        )
+
+    def test_commit_of_new_pending_job_wakes_subscribers(self) -> None:
+        with self.SessionLocal() as session:
+            session.add(self._pending_job(1))
+            session.flush()
+            self.assertEqual(self.calls, [])
+            session.commit()
+
+        self.assertEqual(self.calls, ["wake"])
+
+    def test_requeue_to_pending_wakes_subscribers(self) -> None:
+        with self.SessionLocal() as session:
+            job = self._pending_job(1)
+            job.status = ReportJobStatus.FAILED
+            session.add(job)
+            session.commit()
+        self.assertEqual(self.calls, [])
+
+        with self.SessionLocal() as session:
+            job = session.get(ReportJob, 1)
+            job.status = ReportJobStatus.PENDING
+            session.commit()
+
+        self.assertEqual(self.calls, ["wake"])
+
+    def test_rolled_back_job_does_not_wake_subscribers(self) -> None:
+        with self.SessionLocal() as session:
+            session.add(self._pending_job(1))
+            session.flush()
+            session.rollback()
+            session.commit()
+
+        self.assertEqual(self.calls, [])
+
+    def test_listener_stays_disabled_for_non_postgres_engine(self) -> None:
+        listener = report_job_queue.ReportJobNotificationListener()
+
+        started = listener.ensure_started(lambda: self.engine, lambda: None)
+
+        self.assertFalse(started)
+        self.assertFalse(listener.active)
+
+    def test_listener_closes_connection_when_listen_fails(self) -> None:
+        connection = MagicMock()
+        connection.cursor.return_value.__enter__.return_value.execute.side_effect = RuntimeError("no LISTEN")
+        engine = MagicMock()
+        engine.dialect.name = "postgresql"
+        engine.dialect.create_connect_args.return_value = ([], {})
+        engine.dialect.loaded_dbapi.connect.return_value = connection
+        listener = report_job_queue.ReportJobNotificationListener()
+
+        started = listener.ensure_started(lambda: engine, lambda: None)
+
+        self.assertFalse(started)
+        self.assertFalse(listener.active)
+        connection.close.assert_called_once_with()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,232 @@
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.bot import report_jobs_worker as report_jobs_worker_module
+from app.core import report_service as report_service_module
+from app.core.llm_router import LLMUnavailableError
+from app.core.report_job_retry import (
+    classify_report_job_failure,
+    compute_report_job_retry_delay,
+)
+from app.db.base import Base
+from app.db.models import ReportJob, ReportJobStatus, ScreenStateRecord, Tariff, User, UserProfile
+from app.services.report_job_queue import (
+    claim_report_jobs,
+    collect_report_job_retry_metrics,
+    redrive_report_jobs,
+)
+
+
+class ReportJobRetryTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+
+        @contextmanager
+        def _test_get_session():
+            session = self.SessionLocal()
+            try:
+                yield session
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+        self._old_service_get_session = report_service_module.get_session
+        self._old_worker_get_session = report_jobs_worker_module.get_session
+        report_service_module.get_session = _test_get_session
+        report_jobs_worker_module.get_session = _test_get_session
+
+        with self.SessionLocal() as session:
+            session.add(User(id=1, telegram_user_id=90001, telegram_username="retry"))
+            session.add(
+                UserProfile(
+                    user_id=1,
+                    name="Name",
+                    birth_date="01.01.2000",
+                    birth_place_city="City",
+                    birth_place_country="Country",
+                )
+            )
+            session.add(
+                ScreenStateRecord(
+                    telegram_user_id=90001,
+                    data={"selected_tariff": Tariff.T0.value},
+                )
+            )
+            session.add(
+                ReportJob(
+                    id=1,
+                    user_id=1,
+                    order_id=None,
+                    tariff=Tariff.T0,
+                    status=ReportJobStatus.IN_PROGRESS,
+                    attempts=0,
+                    chat_id=90001,
+                    lock_token="token",
+                    locked_at=datetime.now(timezone.utc),
+                )
+            )
+            session.commit()
+
+    def tearDown(self) -> None:
+        report_service_module.get_session = self._old_service_get_session
+        report_jobs_worker_module.get_session = self._old_worker_get_session
+        Base.metadata.drop_all(self.engine)
+        self.engine.dispose()
+
+    def _job(self, job_id: int = 1) -> ReportJob:
+        with self.SessionLocal() as session:
+            job = session.get(ReportJob, job_id)
+            session.expunge(job)
+            return job
+
+    async def _generate_with(self, side_effect: Exception) -> None:
+        with patch.object(
+            report_service_module.report_service,
+            "generate_report",
+            new=AsyncMock(side_effect=side_effect),
+        ):
+            result = await report_service_module.report_service.generate_report_by_job(
+                job_id=1,
+                lock_token="token",
+            )
+        self.assertIsNone(result)
+
+    def test_classification_separates_transient_and_permanent_errors(self) -> None:
+        self.assertTrue(classify_report_job_failure(LLMUnavailableError("down")).transient)
+        self.assertEqual(classify_report_job_failure(LLMUnavailableError("down")).reason, "llm_unavailable")
+        db_error = OperationalError("SELECT 1", {}, Exception("connection reset"))
+        self.assertTrue(classify_report_job_failure(db_error).transient)
+        self.assertTrue(classify_report_job_failure(TimeoutError()).transient)
+        failure = classify_report_job_failure(ValueError("bad prompt"))
+        self.assertFalse(failure.transient)
+        self.assertEqual(failure.reason, "bad prompt")
+
+    def test_retry_delay_grows_exponentially_with_jitter_and_cap(self) -> None:
+        delays = [
+            compute_report_job_retry_delay(attempt, base_seconds=30, max_seconds=900, rng=lambda: 1.0)
+            for attempt in (1, 2, 3, 10)
+        ]
+        self.assertEqual(delays, [30, 60, 120, 900])
+        self.assertEqual(
+            compute_report_job_retry_delay(2, base_seconds=30, max_seconds=900, rng=lambda: 0.0),
+            30,
+        )
+
+    async def test_transient_failure_reschedules_job_with_backoff(self) -> None:
+        before = datetime.now(timezone.utc)
+        with patch.object(report_service_module.settings, "report_job_retry_base_seconds", 60):
+            await self._generate_with(LLMUnavailableError("down"))
+
+        job = self._job()
+        self.assertEqual(job.status, ReportJobStatus.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.last_error, "llm_unavailable")
+        self.assertIsNone(job.locked_at)
+        next_attempt_at = job.next_attempt_at.replace(tzinfo=timezone.utc)
+        self.assertGreaterEqual(next_attempt_at, before + timedelta(seconds=30))
+        self.assertLessEqual(next_attempt_at, datetime.now(timezone.utc) + timedelta(seconds=60))
+
+        with self.SessionLocal() as session:
+            self.assertEqual(claim_report_jobs(session, limit=5, lock_timeout_seconds=600), [])
+            self.assertEqual(collect_report_job_retry_metrics(session)["scheduled_retries"], 1)
+            leases = claim_report_jobs(
+                session,
+                limit=5,
+                lock_timeout_seconds=600,
+                now=datetime.now(timezone.utc) + timedelta(minutes=2),
+            )
+        self.assertEqual([lease.job_id for lease in leases], [1])
+
+    async def test_exhausted_transient_failures_go_to_dead_letter(self) -> None:
+        with self.SessionLocal() as session:
+            session.get(ReportJob, 1).attempts = 2
+            session.commit()
+
+        with patch.object(report_service_module.settings, "report_job_max_attempts", 3):
+            await self._generate_with(LLMUnavailableError("down"))
+
+        job = self._job()
+        self.assertEqual(job.status, ReportJobStatus.DEAD_LETTER)
+        self.assertEqual(job.attempts, 3)
+        self.assertIsNone(job.next_attempt_at)
+
+    async def test_permanent_failure_is_not_retried(self) -> None:
+        await self._generate_with(ValueError("bad prompt"))
+
+        job = self._job()
+        self.assertEqual(job.status, ReportJobStatus.FAILED)
+        self.assertEqual(job.last_error, "bad prompt")
+        self.assertIsNone(job.next_attempt_at)
+
+    async def test_worker_keeps_user_waiting_while_retry_is_scheduled(self) -> None:
+        worker = report_jobs_worker_module.ReportJobWorker()
+        screen_manager = MagicMock()
+        screen_manager.show_screen = AsyncMock()
+        with patch.object(report_service_module.settings, "report_job_retry_base_seconds", 60), patch.object(
+            report_service_module.report_service,
+            "generate_report",
+            new=AsyncMock(side_effect=LLMUnavailableError("down")),
+        ), patch.object(report_jobs_worker_module, "screen_manager", screen_manager):
+            await worker._handle_job(AsyncMock(), 1, lock_token="token")
+
+        screen_manager.show_screen.assert_not_awaited()
+        screen_manager.update_state.assert_called_once_with(
+            90001,
+            report_job_id="1",
+            report_job_status=ReportJobStatus.PENDING.value,
+        )
+        job = self._job()
+        self.assertEqual(job.status, ReportJobStatus.PENDING)
+        self.assertIsNone(job.lock_token)
+
+    def test_redrive_resets_dead_letter_jobs_and_selected_failed_jobs(self) -> None:
+        with self.SessionLocal() as session:
+            for job_id, status in (
+                (2, ReportJobStatus.DEAD_LETTER),
+                (3, ReportJobStatus.DEAD_LETTER),
+                (4, ReportJobStatus.FAILED),
+                (5, ReportJobStatus.COMPLETED),
+            ):
+                session.add(
+                    ReportJob(
+                        id=job_id,
+                        user_id=1,
+                        tariff=Tariff.T0,
+                        status=status,
+                        attempts=5,
+                        last_error="llm_unavailable",
+                    )
+                )
+            session.commit()
+
+            self.assertEqual(collect_report_job_retry_metrics(session)["dead_letter"], 2)
+            self.assertEqual(redrive_report_jobs(session), [2, 3])
+            self.assertEqual(redrive_report_jobs(session, job_ids=[4, 5]), [4])
+            session.commit()
+
+        for job_id in (2, 3, 4):
+            job = self._job(job_id)
+            self.assertEqual(job.status, ReportJobStatus.PENDING)
+            self.assertEqual(job.attempts, 0)
+            self.assertIsNone(job.last_error)
+        self.assertEqual(self._job(5).status, ReportJobStatus.COMPLETED)
+
+
+if __name__ == "__main__":
+    unittest.main()
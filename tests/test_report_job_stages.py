@@ -0,0 +1,181 @@
+import asyncio
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, patch
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.bot import report_jobs_worker as report_jobs_worker_module
+from app.core import report_job_stages
+from app.core import report_service as report_service_module
+from app.core.llm_router import LLMResponse
+from app.db.base import Base
+from app.db.models import ReportJob, ReportJobStage, ReportJobStatus, Tariff, User
+from app.services.report_job_queue import ReportJobLease
+
+
+class ReportJobStagesTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+
+        @contextmanager
+        def _test_get_session():
+            session = self.SessionLocal()
+            try:
+                yield session
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+        self._old_get_session = report_jobs_worker_module.get_session
+        report_jobs_worker_module.get_session = _test_get_session
+
+        self.created_at = datetime.now(timezone.utc) - timedelta(seconds=30)
+        with self.SessionLocal() as session:
+            session.add(User(id=1, telegram_user_id=60001, telegram_username="stages"))
+            session.add(
+                ReportJob(
+                    id=1,
+                    user_id=1,
+                    order_id=None,
+                    tariff=Tariff.T2,
+                    status=ReportJobStatus.IN_PROGRESS,
+                    attempts=0,
+                    chat_id=60001,
+                    lock_token="token",
+                    locked_at=datetime.now(timezone.utc),
+                    created_at=self.created_at,
+                )
+            )
+            session.commit()
+
+    def tearDown(self) -> None:
+        report_jobs_worker_module.get_session = self._old_get_session
+        Base.metadata.drop_all(self.engine)
+        self.engine.dispose()
+
+    def _stages(self) -> list[ReportJobStage]:
+        with self.SessionLocal() as session:
+            stages = session.execute(select(ReportJobStage).order_by(ReportJobStage.id)).scalars().all()
+            for stage in stages:
+                session.expunge(stage)
+            return stages
+
+    async def test_stage_outside_of_job_is_noop(self) -> None:
+        with report_job_stages.report_job_stage(report_job_stages.STAGE_LLM) as stage_meta:
+            stage_meta["provider"] = "gemini"
+
+        self.assertEqual(self._stages(), [])
+
+    async def test_worker_persists_queue_and_nested_stages_in_one_batch(self) -> None:
+        worker = report_jobs_worker_module.ReportJobWorker()
+
+        def _blocking_llm_call() -> None:
+            with report_job_stages.report_job_stage(
+                report_job_stages.STAGE_LLM,
+                attempt=1,
+            ) as stage_meta:
+                stage_meta["provider"] = "gemini"
+
+        async def _handle(_bot, _job_id: int, lock_token: str | None = None) -> None:
+            await asyncio.to_thread(_blocking_llm_call)
+            with report_job_stages.report_job_stage(report_job_stages.STAGE_DELIVERY):
+                pass
+
+        with patch.object(worker, "_handle_job", new=_handle):
+            await worker._handle_leased_job(AsyncMock(), ReportJobLease(job_id=1, lock_token="token"))
+
+        stages = {stage.stage: stage for stage in self._stages()}
+        self.assertEqual(set(stages), {"llm", "delivery", "queue"})
+        self.assertEqual(stages["llm"].attempt, 1)
+        self.assertEqual(stages["llm"].metadata_json, {"provider": "gemini"})
+        self.assertEqual(stages["queue"].metadata_json["tariff"], "T2")
+        self.assertGreaterEqual(stages["queue"].duration_ms, 30000)
+
+    async def test_generate_report_records_llm_and_safety_attempts(self) -> None:
+        recorder = report_job_stages.ReportJobStageRecorder(job_id=1)
+        responses = [
+            LLMResponse(text="Гарантирую успех", provider="gemini", model="m"),
+            LLMResponse(text="Спокойный текст", provider="gemini", model="m"),
+        ]
+        service = report_service_module.ReportService()
+
+        with patch.object(
+            report_service_module.llm_router,
+            "agenerate",
+            new=AsyncMock(side_effect=responses),
+        ), patch.object(
+            report_service_module.settings,
+            "report_safety_enabled",
+            True,
+        ), patch.object(
+            report_service_module.settings,
+            "llm_streaming_enabled",
+            False,
+        ), patch.object(service, "_build_facts_pack", return_value={}), patch.object(
+            service,
+            "_build_system_prompt",
+            return_value="prompt",
+        ), patch.object(service, "_persist_report"):
+            with report_job_stages.activate_stage_recorder(recorder):
+                await service.generate_report(user_id=1, state={"selected_tariff": "T1"})
+
+        recorded = [(stage["stage"], stage["attempt"]) for stage in recorder.stages]
+        self.assertEqual(recorded[:2], [("llm", 1), ("safety", 1)])
+        self.assertIn(("llm", 2), recorded)
+        self.assertFalse(recorder.stages[1]["metadata_json"]["is_safe"])
+
+    def test_percentiles_use_nearest_rank_per_stage(self) -> None:
+        now = datetime.now(timezone.utc)
+        with self.SessionLocal() as session:
+            for duration_ms in range(1, 101):
+                session.add(
+                    ReportJobStage(
+                        job_id=1,
+                        stage="llm",
+                        started_at=now,
+                        finished_at=now,
+                        duration_ms=duration_ms * 10,
+                    )
+                )
+            session.add(
+                ReportJobStage(
+                    job_id=1,
+                    stage="queue",
+                    started_at=now,
+                    finished_at=now,
+                    duration_ms=7,
+                )
+            )
+            session.add(
+                ReportJobStage(
+                    job_id=1,
+                    stage="pdf",
+                    started_at=now - timedelta(days=3),
+                    finished_at=now - timedelta(days=3),
+                    duration_ms=5,
+                )
+            )
+            session.commit()
+
+            percentiles = report_job_stages.collect_report_job_stage_percentiles(session)
+
+        self.assertEqual(list(percentiles), ["queue", "llm"])
+        self.assertEqual(percentiles["llm"], {"count": 100, "p50_ms": 500, "p95_ms": 950})
+        self.assertEqual(percentiles["queue"], {"count": 1, "p50_ms": 7, "p95_ms": 7})
+
+
+if __name__ == "__main__":
+    unittest.main()
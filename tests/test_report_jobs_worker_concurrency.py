@@ -0,0 +1,187 @@
+import asyncio
+import threading
+import unittest
+from contextlib import contextmanager
+from unittest.mock import AsyncMock, patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.bot import report_jobs_worker as report_jobs_worker_module
+from app.db.base import Base
+from app.db.models import ReportJob, ReportJobStatus, Tariff, User
+
+
+class ReportJobsWorkerConcurrencyTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+
+        @contextmanager
+        def _test_get_session():
+            session = self.SessionLocal()
+            try:
+                yield session
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+        self._old_get_session = report_jobs_worker_module.get_session
+        report_jobs_worker_module.get_session = _test_get_session
+
+        with self.SessionLocal() as session:
+            for job_id in (1, 2, 3):
+                session.add(
+                    User(id=job_id, telegram_user_id=30000 + job_id, telegram_username=f"pool{job_id}")
+                )
+                session.add(
+                    ReportJob(
+                        id=job_id,
+                        user_id=job_id,
+                        order_id=None,
+                        tariff=Tariff.T0,
+                        status=ReportJobStatus.PENDING,
+                        attempts=0,
+                        chat_id=30001,
+                    )
+                )
+            session.commit()
+
+    def tearDown(self) -> None:
+        report_jobs_worker_module.get_session = self._old_get_session
+        Base.metadata.drop_all(self.engine)
+        self.engine.dispose()
+
+    async def test_pool_keeps_up_to_concurrency_jobs_in_flight(self) -> None:
+        worker = report_jobs_worker_module.ReportJobWorker()
+        started: list[int] = []
+        release = asyncio.Event()
+
+        async def _slow_handle(_bot, job_id: int, lock_token: str | None = None) -> None:
+            started.append(job_id)
+            await release.wait()
+
+        with patch.object(report_jobs_worker_module.settings, "report_job_concurrency", 2), patch.object(
+            worker,
+            "_handle_job",
+            new=_slow_handle,
+        ):
+            await worker._process_pending_jobs(bot=AsyncMock())
+            await asyncio.sleep(0)
+
+            self.assertEqual(sorted(started), [1, 2])
+            self.assertEqual(sorted(worker._in_flight), [1, 2])
+
+            release.set()
+            await asyncio.gather(*list(worker._in_flight.values()))
+            self.assertEqual(worker._in_flight, {})
+
+            await worker._process_pending_jobs(bot=AsyncMock())
+            await asyncio.sleep(0)
+            self.assertEqual(sorted(started), [1, 2, 3])
+            await asyncio.gather(*list(worker._in_flight.values()))
+
+    async def test_failed_job_releases_slot_and_does_not_break_cycle(self) -> None:
+        worker = report_jobs_worker_module.ReportJobWorker()
+
+        with patch.object(report_jobs_worker_module.settings, "report_job_concurrency", 3), patch.object(
+            worker,
+            "_handle_job",
+            new=AsyncMock(side_effect=RuntimeError("boom")),
+        ):
+            await worker._process_pending_jobs(bot=AsyncMock())
+            await asyncio.gather(*list(worker._in_flight.values()))
+
+        self.assertEqual(worker._in_flight, {})
+        self.assertEqual(worker.in_flight_count, 0)
+
+    async def test_concurrency_change_between_cycles_uses_new_limit(self) -> None:
+        worker = report_jobs_worker_module.ReportJobWorker()
+        started: list[int] = []
+        release = asyncio.Event()
+
+        async def _slow_handle(_bot, job_id: int, lock_token: str | None = None) -> None:
+            started.append(job_id)
+            await release.wait()
+
+        with patch.object(worker, "_handle_job", new=_slow_handle):
+            with patch.object(report_jobs_worker_module.settings, "report_job_concurrency", 2):
+                await worker._process_pending_jobs(bot=AsyncMock())
+            with patch.object(report_jobs_worker_module.settings, "report_job_concurrency", 3):
+                # Прежний семафор на 2 слота подвешивал бы цикл на acquire.
+                await asyncio.wait_for(worker._process_pending_jobs(bot=AsyncMock()), timeout=1)
+            await asyncio.sleep(0)
+
+            self.assertEqual(sorted(started), [1, 2, 3])
+            release.set()
+            await asyncio.gather(*list(worker._in_flight.values()))
+
+    async def test_run_cancellation_cancels_in_flight_jobs(self) -> None:
+        worker = report_jobs_worker_module.ReportJobWorker()
+        cancelled: list[int] = []
+
+        async def _hanging_handle(_bot, job_id: int, lock_token: str | None = None) -> None:
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.append(job_id)
+                raise
+
+        with patch.object(report_jobs_worker_module.settings, "report_job_concurrency", 3), patch.object(
+            worker,
+            "_handle_job",
+            new=_hanging_handle,
+        ), patch.object(worker, "_process_stalled_users", new=AsyncMock()), patch.object(
+            worker,
+            "_process_checkout_value_nudges",
+            new=AsyncMock(),
+        ):
+            run_task = asyncio.create_task(worker.run(AsyncMock()))
+            for _ in range(5):
+                await asyncio.sleep(0)
+            self.assertEqual(len(worker._in_flight), 3)
+
+            run_task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await run_task
+
+        self.assertEqual(sorted(cancelled), [1, 2, 3])
+        self.assertEqual(worker._in_flight, {})
+
+    async def test_lease_renew_and_release_run_off_event_loop(self) -> None:
+        worker = report_jobs_worker_module.ReportJobWorker()
+        lease = report_jobs_worker_module.ReportJobLease(job_id=1, lock_token="token")
+        threads: dict[str, int] = {}
+
+        def _renew(_session, _lease) -> bool:
+            threads["renew"] = threading.get_ident()
+            return False
+
+        def _release(_session, _lease) -> bool:
+            threads["release"] = threading.get_ident()
+            return True
+
+        with patch.object(report_jobs_worker_module, "renew_report_job_lease", new=_renew), patch.object(
+            report_jobs_worker_module,
+            "release_report_job_lease",
+            new=_release,
+        ), patch.object(worker, "_resolve_lease_renew_interval", return_value=0):
+            # Аренда потеряна: продление завершается после первой попытки.
+            await asyncio.wait_for(worker._keep_lease_alive(lease), timeout=5)
+            await worker._release_lease(lease)
+
+        self.assertEqual(set(threads), {"renew", "release"})
+        self.assertNotIn(threading.get_ident(), threads.values())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -71,7 +71,7 @@ class ReportJobsWorkerHeartbeatTests(unittest.IsolatedAsyncioTestCase):
             )
             session.commit()
 
-        with patch.object(worker, "_claim_job", return_value=True), patch.object(
+        with patch.object(
             worker,
             "_handle_job",
             new=AsyncMock(side_effect=[RuntimeError("boom"), None]),
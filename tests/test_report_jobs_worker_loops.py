@@ -0,0 +1,96 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from app.bot import report_jobs_worker as report_jobs_worker_module
+from app.services.report_job_queue import notify_report_job_enqueued
+
+
+class ReportJobsWorkerLoopsTests(unittest.IsolatedAsyncioTestCase):
+    async def test_hanging_nudge_sweep_does_not_block_report_jobs(self) -> None:
+        worker = report_jobs_worker_module.ReportJobWorker()
+        job_cycles = asyncio.Queue()
+
+        async def _count_job_cycle(_bot) -> None:
+            job_cycles.put_nowait(True)
+
+        async def _hanging_sweep(_bot, *, deadline=None) -> None:
+            await asyncio.Event().wait()
+
+        with patch.object(report_jobs_worker_module.settings, "report_job_poll_interval_seconds", 3600), patch.object(
+            report_jobs_worker_module.settings,
+            "report_job_listen_enabled",
+            False,
+        ), patch.object(worker, "_process_pending_jobs", new=_count_job_cycle), patch.object(
+            worker,
+            "_process_stalled_users",
+            new=_hanging_sweep,
+        ), patch.object(worker, "_process_checkout_value_nudges", new=_hanging_sweep):
+            run_task = asyncio.create_task(worker.run(AsyncMock()))
+            await asyncio.wait_for(job_cycles.get(), timeout=1)
+
+            notify_report_job_enqueued()
+            await asyncio.wait_for(job_cycles.get(), timeout=1)
+
+            run_task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await run_task
+
+    async def test_failing_loop_backs_off_without_stopping_others(self) -> None:
+        worker = report_jobs_worker_module.ReportJobWorker()
+        job_cycles = asyncio.Queue()
+        failing_calls: list[float] = []
+
+        async def _count_job_cycle(_bot) -> None:
+            job_cycles.put_nowait(True)
+
+        async def _failing_sweep(_bot, *, deadline=None) -> None:
+            failing_calls.append(asyncio.get_running_loop().time())
+            raise RuntimeError("sweep boom")
+
+        loop = report_jobs_worker_module.WorkerLoop(
+            name="failing",
+            handler=_failing_sweep,
+            interval_seconds=0.01,
+            timeout_seconds=1,
+        )
+        with patch.object(report_jobs_worker_module.settings, "report_job_poll_interval_seconds", 3600), patch.object(
+            report_jobs_worker_module.settings,
+            "report_job_listen_enabled",
+            False,
+        ), patch.object(worker, "_process_pending_jobs", new=_count_job_cycle), patch.object(
+            worker,
+            "_process_stalled_users",
+            new=AsyncMock(),
+        ), patch.object(worker, "_process_checkout_value_nudges", new=AsyncMock()):
+            run_task = asyncio.create_task(worker.run(AsyncMock()))
+            failing_task = asyncio.create_task(worker._run_loop(AsyncMock(), loop))
+            await asyncio.sleep(0.1)
+
+            notify_report_job_enqueued()
+            await asyncio.wait_for(job_cycles.get(), timeout=1)
+            await asyncio.wait_for(job_cycles.get(), timeout=1)
+
+            failing_task.cancel()
+            run_task.cancel()
+            await asyncio.gather(failing_task, run_task, return_exceptions=True)
+
+        self.assertGreaterEqual(loop.consecutive_failures, 2)
+        gaps = [later - earlier for earlier, later in zip(failing_calls, failing_calls[1:])]
+        self.assertGreater(gaps[-1], gaps[0])
+
+    def test_next_delay_grows_exponentially_up_to_cap(self) -> None:
+        loop = report_jobs_worker_module.WorkerLoop(
+            name="nudges",
+            handler=AsyncMock(),
+            interval_seconds=60,
+        )
+        self.assertEqual(loop.next_delay(300), 60)
+        loop.consecutive_failures = 1
+        self.assertEqual(loop.next_delay(300), 120)
+        loop.consecutive_failures = 5
+        self.assertEqual(loop.next_delay(300), 300)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,10 +12,14 @@ from sqlalchemy.pool import StaticPool
 from app.bot import report_jobs_worker as worker_module
 from app.core.logging import ExtraFieldsFormatter
 from app.db.base import Base
+from app.services import scheduled_nudges
 from app.db.models import (
     Order,
     OrderStatus,
     PaymentProvider,
+    ScheduledNudge,
+    ScheduledNudgeKind,
+    ScheduledNudgeStatus,
     ScreenStateRecord,
     Tariff,
     User,
@@ -53,6 +57,16 @@ class ReportJobsWorkerNudgeTests(unittest.IsolatedAsyncioTestCase):
         Base.metadata.drop_all(self.engine)
         self.engine.dispose()
 
+    @staticmethod
+    def _due_nudge(telegram_user_id: int, kind: ScheduledNudgeKind) -> ScheduledNudge:
+        return ScheduledNudge(
+            telegram_user_id=telegram_user_id,
+            kind=kind,
+            status=ScheduledNudgeStatus.PENDING,
+            due_at=datetime.now(timezone.utc) - timedelta(minutes=1),
+            attempts=0,
+        )
+
     async def test_send_resume_nudge_once_for_stalled_user(self) -> None:
         with self.SessionLocal() as session:
             user = User(id=1, telegram_user_id=19001, telegram_username="nudge")
@@ -82,6 +96,7 @@ class ReportJobsWorkerNudgeTests(unittest.IsolatedAsyncioTestCase):
                     },
                 )
             )
+            session.add(self._due_nudge(19001, ScheduledNudgeKind.RESUME))
             session.commit()
 
         worker = worker_module.ReportJobWorker()
@@ -138,23 +153,27 @@ class ReportJobsWorkerNudgeTests(unittest.IsolatedAsyncioTestCase):
                     data={"order_id": "777"},
                 )
             )
+            with patch.object(scheduled_nudges.random, "randint", return_value=12):
+                scheduled_nudges.schedule_state_nudges(
+                    session,
+                    telegram_user_id=19002,
+                    screen_id="S2",
+                    state_data={"order_id": "777"},
+                    previous_screen_id="S1",
+                    previous_data={},
+                )
             session.commit()
 
         send_mock = AsyncMock(return_value=type("R", (), {"sent": True, "reason": "sent"})())
         worker = worker_module.ReportJobWorker()
-        with patch.object(worker_module, "send_marketing_message", new=send_mock), patch.object(
-            worker_module.screen_manager,
-            "_record_transition_event",
-            return_value=None,
-        ), patch.object(worker_module.random, "randint", return_value=12):
+        with patch.object(worker_module, "send_marketing_message", new=send_mock):
             await worker._process_checkout_value_nudges(bot=AsyncMock())
+        self.assertEqual(send_mock.await_count, 0)
 
         with self.SessionLocal() as session:
-            row = session.get(ScreenStateRecord, 19002)
-            data = dict(row.data or {})
-            data["checkout_value_nudge_due_at"] = (datetime.now(timezone.utc) - timedelta(minutes=1)).isoformat()
-            row.data = data
-            session.add(row)
+            nudge = session.query(ScheduledNudge).filter_by(telegram_user_id=19002).one()
+            self.assertEqual(nudge.delay_minutes, 12)
+            nudge.due_at = datetime.now(timezone.utc) - timedelta(minutes=1)
             session.commit()
 
         with patch.object(worker_module, "send_marketing_message", new=send_mock), patch.object(
@@ -213,6 +232,7 @@ class ReportJobsWorkerNudgeTests(unittest.IsolatedAsyncioTestCase):
                     },
                 )
             )
+            session.add(self._due_nudge(19003, ScheduledNudgeKind.CHECKOUT_VALUE))
             session.commit()
 
         send_mock = AsyncMock(return_value=type("R", (), {"sent": True, "reason": "sent"})())
@@ -221,6 +241,39 @@ class ReportJobsWorkerNudgeTests(unittest.IsolatedAsyncioTestCase):
             await worker._process_checkout_value_nudges(bot=AsyncMock())
 
         self.assertEqual(send_mock.await_count, 0)
+        with self.SessionLocal() as session:
+            nudge = session.query(ScheduledNudge).filter_by(telegram_user_id=19003).one()
+            self.assertEqual(nudge.status, ScheduledNudgeStatus.CANCELED)
+            self.assertEqual(nudge.last_error, "paid_order")
+
+    async def test_resume_sweep_stops_taking_nudges_after_deadline(self) -> None:
+        with self.SessionLocal() as session:
+            session.add(User(id=7, telegram_user_id=19014, telegram_username="budget"))
+            session.add(
+                ScreenStateRecord(
+                    telegram_user_id=19014,
+                    screen_id="S3",
+                    message_ids=[],
+                    user_message_ids=[],
+                    last_question_message_id=None,
+                    data={
+                        "last_critical_step_at": (datetime.now(timezone.utc) - timedelta(hours=8)).isoformat(),
+                        "last_critical_screen_id": "S3",
+                    },
+                )
+            )
+            session.add(self._due_nudge(19014, ScheduledNudgeKind.RESUME))
+            session.commit()
+
+        send_mock = AsyncMock(return_value=type("R", (), {"sent": True, "reason": "sent"})())
+        worker = worker_module.ReportJobWorker()
+        with patch.object(worker_module, "send_marketing_message", new=send_mock):
+            await worker._process_stalled_users(bot=AsyncMock(), deadline=0)
+
+        self.assertEqual(send_mock.await_count, 0)
+        with self.SessionLocal() as session:
+            nudge = session.query(ScheduledNudge).filter_by(telegram_user_id=19014).one()
+            self.assertEqual(nudge.status, ScheduledNudgeStatus.PENDING)
 
     async def test_resume_nudge_logs_traceback_and_context_on_failure(self) -> None:
         with self.SessionLocal() as session:
@@ -250,6 +303,7 @@ class ReportJobsWorkerNudgeTests(unittest.IsolatedAsyncioTestCase):
                     },
                 )
             )
+            session.add(self._due_nudge(19011, ScheduledNudgeKind.RESUME))
             session.commit()
 
         logger = logging.getLogger(worker_module.__name__)
@@ -306,6 +360,7 @@ class ReportJobsWorkerNudgeTests(unittest.IsolatedAsyncioTestCase):
                     },
                 )
             )
+            session.add(self._due_nudge(19012, ScheduledNudgeKind.CHECKOUT_VALUE))
             session.commit()
 
         logger = logging.getLogger(worker_module.__name__)
@@ -357,6 +412,9 @@ class ReportJobsWorkerNudgeTests(unittest.IsolatedAsyncioTestCase):
                     data="broken-payload",
                 )
             )
+            session.add(self._due_nudge(19020, ScheduledNudgeKind.CHECKOUT_VALUE))
+            session.add(self._due_nudge(19020, ScheduledNudgeKind.RESUME))
+            session.add(self._due_nudge(19021, ScheduledNudgeKind.RESUME))
             session.commit()
 
         logger = logging.getLogger(worker_module.__name__)
@@ -425,6 +483,7 @@ class ReportJobsWorkerNudgeTests(unittest.IsolatedAsyncioTestCase):
                     },
                 )
             )
+            session.add(self._due_nudge(19013, ScheduledNudgeKind.RESUME))
             session.commit()
 
         logger = logging.getLogger(worker_module.__name__)
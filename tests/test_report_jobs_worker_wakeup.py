@@ -0,0 +1,59 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from app.bot import report_jobs_worker as report_jobs_worker_module
+from app.services.report_job_queue import notify_report_job_enqueued
+
+
+class ReportJobsWorkerWakeupTests(unittest.IsolatedAsyncioTestCase):
+    async def test_enqueue_notification_wakes_worker_before_poll_interval(self) -> None:
+        worker = report_jobs_worker_module.ReportJobWorker()
+        cycles = asyncio.Queue()
+
+        async def _count_cycle(_bot) -> None:
+            cycles.put_nowait(True)
+
+        with patch.object(report_jobs_worker_module.settings, "report_job_poll_interval_seconds", 3600), patch.object(
+            report_jobs_worker_module.settings,
+            "report_job_listen_enabled",
+            False,
+        ), patch.object(worker, "_process_pending_jobs", new=_count_cycle), patch.object(
+            worker,
+            "_process_stalled_users",
+            new=AsyncMock(),
+        ), patch.object(worker, "_process_checkout_value_nudges", new=AsyncMock()):
+            run_task = asyncio.create_task(worker.run(AsyncMock()))
+            await asyncio.wait_for(cycles.get(), timeout=1)
+
+            notify_report_job_enqueued()
+            await asyncio.wait_for(cycles.get(), timeout=1)
+
+            run_task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await run_task
+
+    async def test_notification_after_shutdown_is_ignored(self) -> None:
+        worker = report_jobs_worker_module.ReportJobWorker()
+
+        with patch.object(report_jobs_worker_module.settings, "report_job_listen_enabled", False), patch.object(
+            worker,
+            "_process_pending_jobs",
+            new=AsyncMock(),
+        ), patch.object(worker, "_process_stalled_users", new=AsyncMock()), patch.object(
+            worker,
+            "_process_checkout_value_nudges",
+            new=AsyncMock(),
+        ):
+            run_task = asyncio.create_task(worker.run(AsyncMock()))
+            await asyncio.sleep(0)
+            run_task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await run_task
+
+        notify_report_job_enqueued()
+        self.assertFalse(worker._get_wakeup().is_set())
+
+
+if __name__ == "__main__":
+    unittest.main()
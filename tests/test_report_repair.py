@@ -0,0 +1,104 @@
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from app.core import report_service as report_service_module
+from app.core.llm_router import LLMResponse
+from app.core.report_repair import build_repair_plan
+from app.core.report_safety import report_safety
+
+REPORT = (
+    "## Резюме\n"
+    "Спокойный аналитический текст о сильных сторонах.\n"
+    "Ещё одна строка того же абзаца.\n"
+    "\n"
+    "## Сценарии\n"
+    "Первый сценарий описан нейтрально.\n"
+    "\n"
+    "Этот путь точно приведёт к успеху.\n"
+    "\n"
+    "## Итог\n"
+    "Нейтральное завершение отчёта.\n"
+)
+
+
+class ReportRepairPlanTests(unittest.TestCase):
+    def test_plan_targets_violating_paragraph_with_heading(self) -> None:
+        plan = build_repair_plan(REPORT, report_safety.evaluate(REPORT).matches, max_fragments=3)
+
+        self.assertEqual(len(plan.fragments), 1)
+        fragment = plan.fragments[0]
+        self.assertEqual(fragment.text, "Этот путь точно приведёт к успеху.")
+        self.assertEqual(fragment.heading, "## Сценарии")
+        self.assertEqual(fragment.rules, ("certainly",))
+        self.assertEqual(
+            plan.apply("[[1]]\nЭтот путь можно проверить на практике.\n"),
+            REPORT.replace("точно приведёт к успеху", "можно проверить на практике"),
+        )
+
+    def test_unparsed_answer_and_spread_violations_fall_back(self) -> None:
+        plan = build_repair_plan(REPORT, report_safety.evaluate(REPORT).matches, max_fragments=3)
+        self.assertIsNone(plan.apply("Этот путь можно проверить."))
+        self.assertIsNone(plan.apply("[[2]]\nЧужой фрагмент."))
+
+        spread = REPORT.replace("Первый сценарий", "Прогноз: сценарий").replace("Нейтральное", "Гарантированно")
+        self.assertIsNone(build_repair_plan(spread, report_safety.evaluate(spread).matches, max_fragments=2))
+
+
+class ReportServiceRepairTests(unittest.IsolatedAsyncioTestCase):
+    async def _generate(self, *responses: LLMResponse):
+        service = report_service_module.ReportService()
+        agenerate = AsyncMock(side_effect=list(responses))
+        with patch.object(report_service_module.llm_router, "agenerate", new=agenerate), patch.object(
+            report_service_module.settings, "report_safety_enabled", True
+        ), patch.object(report_service_module.settings, "llm_streaming_enabled", False), patch.object(
+            report_service_module.settings, "report_safety_repair_enabled", True
+        ), patch.object(service, "_build_facts_pack", return_value={}), patch.object(
+            service, "_build_system_prompt", return_value="prompt"
+        ), patch.object(service, "_persist_report") as persist:
+            response = await service.generate_report(user_id=1, state={"selected_tariff": "T1"})
+        return response, agenerate, persist
+
+    async def test_violating_paragraph_is_rewritten_and_spliced(self) -> None:
+        response, agenerate, persist = await self._generate(
+            LLMResponse(text=REPORT, provider="gemini", model="flash"),
+            LLMResponse(text="[[1]]\nЭтот путь можно проверить на практике.", provider="gemini", model="flash"),
+        )
+
+        self.assertIn("Этот путь можно проверить на практике.\n\n## Итог", response.text)
+        self.assertEqual(agenerate.await_count, 2)
+        repair_facts, repair_prompt = agenerate.await_args.args
+        self.assertEqual(repair_prompt, report_safety.build_repair_prompt())
+        self.assertEqual(repair_facts["fragments"][0]["section"], "## Сценарии")
+        safety_flags = persist.call_args.kwargs["safety_flags"]
+        self.assertEqual(safety_flags["attempts"], 1)
+        self.assertTrue(safety_flags["violations"][1]["repaired"])
+
+    async def test_unparsed_repair_falls_back_to_full_regeneration(self) -> None:
+        response, agenerate, _ = await self._generate(
+            LLMResponse(text=REPORT, provider="gemini", model="flash"),
+            LLMResponse(text="Не по формату", provider="gemini", model="flash"),
+            LLMResponse(text="## Резюме\nСпокойный текст.", provider="gemini", model="flash"),
+        )
+
+        self.assertEqual(response.text, "## Резюме\nСпокойный текст.")
+        self.assertEqual(agenerate.await_count, 3)
+        self.assertIn("Перепиши отчёт заново", agenerate.await_args.args[1])
+
+    async def test_repair_runs_once_and_keeps_three_llm_calls(self) -> None:
+        _, agenerate, persist = await self._generate(
+            LLMResponse(text=REPORT, provider="gemini", model="flash"),
+            LLMResponse(text="Не по формату", provider="gemini", model="flash"),
+            LLMResponse(text=REPORT, provider="gemini", model="flash"),
+        )
+
+        self.assertEqual(agenerate.await_count, 3)
+        repair_prompts = [
+            call for call in agenerate.await_args_list if call.args[1] == report_safety.build_repair_prompt()
+        ]
+        self.assertEqual(len(repair_prompts), 1)
+        persist.assert_called_once()
+        self.assertEqual(persist.call_args.kwargs["safety_flags"]["attempts"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
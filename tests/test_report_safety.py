@@ -0,0 +1,79 @@
+import re
+import unittest
+
+from app.core.report_safety import (
+    CATEGORY_FORBIDDEN_PATTERN,
+    CATEGORY_FORBIDDEN_WORD,
+    CATEGORY_RED_ZONE,
+    FORBIDDEN_WORDS,
+    GUARANTEE_PATTERNS,
+    RED_ZONE_PATTERNS,
+    _non_capturing,
+    report_safety,
+)
+
+
+def _per_rule_evaluate(text: str) -> tuple[list[str], list[str], list[str]]:
+    def _found(pattern: str) -> bool:
+        return re.search(pattern, text, re.IGNORECASE) is not None
+
+    return (
+        [word for word in FORBIDDEN_WORDS if _found(rf"\b{re.escape(word)}\b")],
+        [name for name, pattern in GUARANTEE_PATTERNS.items() if _found(pattern)],
+        [name for name, pattern in RED_ZONE_PATTERNS.items() if _found(pattern)],
+    )
+
+
+class CompiledSafetyScannerTests(unittest.TestCase):
+    def test_single_pass_matches_per_rule_search(self) -> None:
+        texts = [
+            "Спокойный аналитический текст без нарушений.",
+            "Прогноз: вы точно справитесь, это 100 % результат.",
+            "Карман, кармашек и _прогноз не считаются, а Карма — считается.",
+            "Без  сомнений, лечение и акции здесь ни при чём; секс-услуги тоже.",
+            "## Итог\nСудьба неизбежно гарантирует предсказание 100%",
+        ]
+        for text in texts:
+            evaluation = report_safety.evaluate(text)
+            with self.subTest(text=text):
+                self.assertEqual(
+                    (evaluation.forbidden_words, evaluation.forbidden_patterns, evaluation.red_zones),
+                    _per_rule_evaluate(text),
+                )
+
+    def test_matches_carry_spans_and_categories(self) -> None:
+        text = "Итог. Прогноз: лечение акциями."
+        matches = report_safety.evaluate(text).matches
+
+        self.assertEqual(
+            [(match.category, match.rule, match.text) for match in matches],
+            [
+                (CATEGORY_FORBIDDEN_WORD, "прогноз", "Прогноз"),
+                (CATEGORY_FORBIDDEN_PATTERN, "forecast", "Прогноз"),
+                (CATEGORY_RED_ZONE, "medicine", "лечение"),
+                (CATEGORY_RED_ZONE, "finance", "акциями"),
+            ],
+        )
+        for match in matches:
+            self.assertEqual(text[match.start:match.end], match.text)
+
+    def test_payload_includes_matches(self) -> None:
+        payload = report_safety.evaluation_payload(report_safety.evaluate("Это точно."))
+
+        self.assertEqual(
+            payload["matches"],
+            [{"category": CATEGORY_FORBIDDEN_PATTERN, "rule": "certainly", "start": 4, "end": 9, "text": "точно"}],
+        )
+
+    def test_combined_expression_has_no_capturing_groups(self) -> None:
+        self.assertEqual(report_safety._scanner._combined.groups, 0)
+        self.assertEqual(_non_capturing(r"\b(a|b(c))[(]\(x(?:y)"), r"\b(?:a|b(?:c))[(]\(x(?:y)")
+
+    def test_hard_violation_prefers_red_zone(self) -> None:
+        self.assertEqual(report_safety.find_hard_violation("Карма и лечение"), "medicine")
+        self.assertEqual(report_safety.find_hard_violation("Карма и судьба"), "судьба")
+        self.assertIsNone(report_safety.find_hard_violation("Это точно"))
+
+
+if __name__ == "__main__":
+    unittest.main()
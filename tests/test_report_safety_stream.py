@@ -0,0 +1,70 @@
+import unittest
+from unittest.mock import patch
+
+from app.core import report_service as report_service_module
+from app.core.llm_router import LLMStreamChunk
+from app.core.report_safety import report_safety
+
+
+class StreamSafetyScannerTests(unittest.TestCase):
+    def _feed(self, *chunks: str) -> str | None:
+        scanner = report_safety.stream_scanner()
+        for chunk in chunks:
+            violation = scanner.feed(chunk)
+            if violation:
+                return violation
+        return None
+
+    def test_violation_split_across_chunks_is_detected(self) -> None:
+        self.assertEqual(self._feed("Ваша кар", "ма — это"), "карма")
+        self.assertEqual(self._feed("Лече", "ние не нужно."), "medicine")
+
+    def test_unfinished_word_is_not_flagged(self) -> None:
+        self.assertIsNone(self._feed("Ключи в кар", "ма", "не лежат. "))
+
+    def test_long_clean_stream_keeps_overlap_window(self) -> None:
+        chunks = ["Спокойный аналитический текст. " * 5, "и снова суд", "ьба решает"]
+        self.assertEqual(self._feed(*chunks), "судьба")
+
+
+class ReportServiceStreamAbortTests(unittest.IsolatedAsyncioTestCase):
+    async def test_hard_violation_closes_stream_and_retries_with_corrective_prompt(self) -> None:
+        prompts: list[str] = []
+        closed: list[bool] = []
+        streams = [
+            ["## Резюме\n", "Ваша карма ", "определяет всё.\n", "## Итог\n"],
+            ["## Резюме\n", "Спокойный текст.\n"],
+        ]
+
+        async def _astream(facts_pack, prompt):
+            prompts.append(prompt)
+            chunks = streams[len(prompts) - 1]
+            sent = 0
+            try:
+                for text in chunks:
+                    sent += 1
+                    yield LLMStreamChunk(text=text, provider="gemini", model="flash")
+            finally:
+                closed.append(sent < len(chunks))
+
+        service = report_service_module.ReportService()
+        with patch.object(report_service_module.llm_router, "astream", new=_astream), patch.object(
+            report_service_module.settings, "report_safety_enabled", True
+        ), patch.object(report_service_module.settings, "llm_streaming_enabled", True), patch.object(
+            service, "_build_facts_pack", return_value={}
+        ), patch.object(service, "_build_system_prompt", return_value="prompt"), patch.object(
+            service, "_persist_report"
+        ) as persist:
+            response = await service.generate_report(user_id=1, state={"selected_tariff": "T1"})
+
+        self.assertEqual(response.text, "## Резюме\nСпокойный текст.\n")
+        self.assertEqual(closed, [True, False])
+        self.assertIn("Запрещённые слова: карма", prompts[1])
+        safety_flags = persist.call_args.kwargs["safety_flags"]
+        self.assertEqual(safety_flags["attempts"], 1)
+        self.assertEqual(safety_flags["violations"][0]["stream_aborted"], "карма")
+        self.assertTrue(persist.call_args.kwargs["prompt_version"].startswith(("default:", "admin:", "file:")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import asyncio
+import unittest
+from contextlib import contextmanager
+from unittest.mock import AsyncMock, patch
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.bot import report_jobs_worker as report_jobs_worker_module
+from app.bot import report_worker as report_worker_module
+from app.db.base import Base
+from app.db.models import ReportJob, ReportJobStatus, ServiceHeartbeat, Tariff, User
+
+
+class ReportWorkerEntryPointTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+
+        @contextmanager
+        def _test_get_session():
+            session = self.SessionLocal()
+            try:
+                yield session
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+        self._old_get_session = report_jobs_worker_module.get_session
+        report_jobs_worker_module.get_session = _test_get_session
+
+        with self.SessionLocal() as session:
+            for job_id in (1, 2, 3):
+                session.add(
+                    User(id=job_id, telegram_user_id=40000 + job_id, telegram_username=f"drain{job_id}")
+                )
+                session.add(
+                    ReportJob(
+                        id=job_id,
+                        user_id=job_id,
+                        order_id=None,
+                        tariff=Tariff.T0,
+                        status=ReportJobStatus.PENDING,
+                        attempts=0,
+                        chat_id=40000 + job_id,
+                    )
+                )
+            session.commit()
+
+    def tearDown(self) -> None:
+        report_jobs_worker_module.get_session = self._old_get_session
+        Base.metadata.drop_all(self.engine)
+        self.engine.dispose()
+
+    def _heartbeat_names(self) -> set[str]:
+        with self.SessionLocal() as session:
+            return set(session.execute(select(ServiceHeartbeat.service_name)).scalars().all())
+
+    def test_parse_args_reads_concurrency_and_nudges_flag(self) -> None:
+        args = report_worker_module.parse_args(["--concurrency", "4", "--no-nudges"])
+        self.assertEqual(args.concurrency, 4)
+        self.assertTrue(args.no_nudges)
+        self.assertIsNone(args.drain_timeout)
+        with self.assertRaises(SystemExit):
+            report_worker_module.parse_args(["--concurrency", "0"])
+
+    async def test_stop_drains_in_flight_jobs_without_claiming_new_ones(self) -> None:
+        worker = report_jobs_worker_module.ReportJobWorker(concurrency=2, nudges_enabled=False)
+        started: list[int] = []
+        finished: list[int] = []
+        release = asyncio.Event()
+        stop_event = asyncio.Event()
+
+        async def _slow_handle(_bot, job_id: int, lock_token: str | None = None) -> None:
+            started.append(job_id)
+            await release.wait()
+            finished.append(job_id)
+
+        with patch.object(report_jobs_worker_module.settings, "report_job_listen_enabled", False), patch.object(
+            worker,
+            "_handle_job",
+            new=_slow_handle,
+        ):
+            run_task = asyncio.create_task(
+                worker.run_until_stopped(AsyncMock(), stop_event, drain_timeout_seconds=5)
+            )
+            for _ in range(50):
+                if len(started) == 2:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(sorted(started), [1, 2])
+            self.assertEqual(len(self._heartbeat_names()), 2)
+
+            stop_event.set()
+            await asyncio.sleep(0.05)
+            self.assertFalse(run_task.done())
+            release.set()
+            await asyncio.wait_for(run_task, timeout=1)
+
+        self.assertEqual(sorted(finished), [1, 2])
+        self.assertEqual(sorted(started), [1, 2])
+        # Строка процесса удаляется при остановке, общая строка сервиса остаётся.
+        self.assertEqual(self._heartbeat_names(), {"report_jobs_worker"})
+
+    async def test_drain_timeout_cancels_jobs_and_releases_leases(self) -> None:
+        worker = report_jobs_worker_module.ReportJobWorker(concurrency=1, nudges_enabled=False)
+        stop_event = asyncio.Event()
+        started = asyncio.Event()
+
+        async def _hanging_handle(_bot, job_id: int, lock_token: str | None = None) -> None:
+            started.set()
+            await asyncio.Event().wait()
+
+        with patch.object(report_jobs_worker_module.settings, "report_job_listen_enabled", False), patch.object(
+            worker,
+            "_handle_job",
+            new=_hanging_handle,
+        ):
+            run_task = asyncio.create_task(
+                worker.run_until_stopped(AsyncMock(), stop_event, drain_timeout_seconds=0.05)
+            )
+            await asyncio.wait_for(started.wait(), timeout=1)
+            stop_event.set()
+            await asyncio.wait_for(run_task, timeout=1)
+
+        with self.SessionLocal() as session:
+            job = session.get(ReportJob, 1)
+            self.assertEqual(job.status, ReportJobStatus.IN_PROGRESS)
+            self.assertIsNone(job.lock_token)
+            self.assertIsNone(job.locked_at)
+
+
+if __name__ == "__main__":
+    unittest.main()
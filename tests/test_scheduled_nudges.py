@@ -0,0 +1,199 @@
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.bot.handlers import screen_manager as screen_manager_module
+from app.db.base import Base
+from app.db.models import (
+    Order,
+    OrderStatus,
+    PaymentProvider,
+    ScheduledNudge,
+    ScheduledNudgeKind,
+    ScheduledNudgeStatus,
+    Tariff,
+    User,
+)
+from app.services import scheduled_nudges
+
+
+class ScheduledNudgesTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+
+        @contextmanager
+        def _test_get_session():
+            session = self.SessionLocal()
+            try:
+                yield session
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+        self._old_get_session = screen_manager_module.get_session
+        screen_manager_module.get_session = _test_get_session
+        self.store = screen_manager_module.ScreenStateStore()
+
+    def tearDown(self) -> None:
+        screen_manager_module.get_session = self._old_get_session
+        Base.metadata.drop_all(self.engine)
+        self.engine.dispose()
+
+    def _nudges(self) -> dict[ScheduledNudgeKind, ScheduledNudge]:
+        with self.SessionLocal() as session:
+            nudges = session.execute(select(ScheduledNudge)).scalars().all()
+            for nudge in nudges:
+                session.expunge(nudge)
+            return {nudge.kind: nudge for nudge in nudges}
+
+    def test_critical_step_schedules_and_reschedules_resume_nudge(self) -> None:
+        first_step_at = datetime(2026, 10, 1, 12, 0, tzinfo=timezone.utc)
+        with patch.object(scheduled_nudges.settings, "resume_nudge_delay_hours", 6):
+            self.store.update_data(
+                701,
+                last_critical_step_at=first_step_at.isoformat(),
+                last_critical_screen_id="S3",
+            )
+            self.store.update_data(701, selected_tariff="T1")
+            nudge = self._nudges()[ScheduledNudgeKind.RESUME]
+            self.assertEqual(
+                nudge.due_at.replace(tzinfo=timezone.utc),
+                first_step_at + timedelta(hours=6),
+            )
+            self.assertEqual(nudge.target_screen_id, "S3")
+
+            second_step_at = first_step_at + timedelta(hours=1)
+            self.store.update_data(701, last_critical_step_at=second_step_at.isoformat())
+
+        nudges = self._nudges()
+        self.assertEqual(len(nudges), 1)
+        self.assertEqual(
+            nudges[ScheduledNudgeKind.RESUME].due_at.replace(tzinfo=timezone.utc),
+            second_step_at + timedelta(hours=6),
+        )
+
+    def test_checkout_value_nudge_is_scheduled_once_on_first_s2_entry(self) -> None:
+        with patch.object(scheduled_nudges.random, "randint", return_value=15):
+            self.store.update_screen(702, "S2", [1])
+        first_due_at = self._nudges()[ScheduledNudgeKind.CHECKOUT_VALUE].due_at
+
+        with patch.object(scheduled_nudges.random, "randint", return_value=25):
+            self.store.update_screen(702, "S3", [2])
+            self.store.update_screen(702, "S4", [3])
+
+        nudge = self._nudges()[ScheduledNudgeKind.CHECKOUT_VALUE]
+        self.assertEqual(nudge.due_at, first_due_at)
+        self.assertEqual(nudge.delay_minutes, 15)
+        self.assertEqual(nudge.target_screen_id, "S2")
+
+    def test_sent_nudge_is_revived_after_state_reset(self) -> None:
+        first_step_at = datetime(2026, 10, 1, 12, 0, tzinfo=timezone.utc)
+        self.store.update_data(703, last_critical_step_at=first_step_at.isoformat())
+        with self.SessionLocal() as session:
+            nudge = session.execute(select(ScheduledNudge)).scalar_one()
+            scheduled_nudges.mark_nudge_sent(nudge, now=first_step_at + timedelta(hours=7))
+            nudge.attempts = 2
+            session.commit()
+
+        self.store.clear_state(703)
+        second_step_at = first_step_at + timedelta(days=1)
+        with patch.object(scheduled_nudges.settings, "resume_nudge_delay_hours", 6):
+            self.store.update_data(
+                703,
+                last_critical_step_at=second_step_at.isoformat(),
+                last_critical_screen_id="S5",
+            )
+
+        nudge = self._nudges()[ScheduledNudgeKind.RESUME]
+        self.assertEqual(nudge.status, ScheduledNudgeStatus.PENDING)
+        self.assertEqual((nudge.attempts, nudge.last_error, nudge.sent_at), (0, None, None))
+        self.assertEqual(nudge.due_at.replace(tzinfo=timezone.utc), second_step_at + timedelta(hours=6))
+        self.assertEqual(nudge.target_screen_id, "S5")
+
+    def test_schedule_failure_rolls_back_nudge_but_keeps_state(self) -> None:
+        def _failing_schedule(session, **kwargs) -> None:
+            session.add(
+                ScheduledNudge(
+                    telegram_user_id=kwargs["telegram_user_id"],
+                    kind=ScheduledNudgeKind.RESUME,
+                    status=ScheduledNudgeStatus.PENDING,
+                    due_at=datetime.now(timezone.utc),
+                    attempts=0,
+                )
+            )
+            session.flush()
+            raise RuntimeError("boom")
+
+        with patch.object(screen_manager_module, "schedule_state_nudges", side_effect=_failing_schedule):
+            self.store.update_screen(704, "S2", [1])
+
+        self.assertEqual(self._nudges(), {})
+        self.store._states.clear()
+        self.assertEqual(self.store.get_state(704).screen_id, "S2")
+
+    def test_send_skip_retry_delay_backs_off_to_setting(self) -> None:
+        with patch.object(scheduled_nudges.settings, "nudge_send_skip_retry_max_seconds", 600):
+            delays = [scheduled_nudges.resolve_send_skip_retry_delay(attempts) for attempts in (0, 1, 3, 50)]
+
+        self.assertEqual([delay.total_seconds() for delay in delays], [60, 120, 480, 600])
+
+    def test_fetch_due_nudges_joins_user_and_paid_flag(self) -> None:
+        now = datetime.now(timezone.utc)
+        with self.SessionLocal() as session:
+            session.add(User(id=1, telegram_user_id=801, telegram_username="free"))
+            session.add(User(id=2, telegram_user_id=802, telegram_username="paid"))
+            session.add(
+                Order(
+                    user_id=2,
+                    tariff=Tariff.T1,
+                    amount=560,
+                    currency="RUB",
+                    provider=PaymentProvider.PRODAMUS,
+                    status=OrderStatus.PAID,
+                )
+            )
+            for telegram_user_id, due_at, status in (
+                (801, now - timedelta(minutes=5), ScheduledNudgeStatus.PENDING),
+                (802, now - timedelta(minutes=1), ScheduledNudgeStatus.PENDING),
+                (803, now + timedelta(minutes=5), ScheduledNudgeStatus.PENDING),
+                (804, now - timedelta(minutes=5), ScheduledNudgeStatus.SENT),
+            ):
+                session.add(
+                    ScheduledNudge(
+                        telegram_user_id=telegram_user_id,
+                        kind=ScheduledNudgeKind.RESUME,
+                        status=status,
+                        due_at=due_at,
+                        attempts=0,
+                    )
+                )
+            session.commit()
+
+            due = scheduled_nudges.fetch_due_nudges(
+                session,
+                kind=ScheduledNudgeKind.RESUME,
+                now=now,
+            )
+
+        self.assertEqual([item.nudge.telegram_user_id for item in due], [801, 802])
+        self.assertEqual([item.user_id for item in due], [1, 2])
+        self.assertEqual([item.has_paid_order for item in due], [False, True])
+        self.assertTrue(all(item.state_row is None for item in due))
+
+
+if __name__ == "__main__":
+    unittest.main()